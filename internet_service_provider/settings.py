@@ -60,6 +60,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'inertia.middleware.InertiaMiddleware',
+    'isp.dashboard.middleware.SharedPropsMiddleware',
     'routes.middleware.RouteGeneratorMiddleware'
 ]
 
@@ -210,9 +211,171 @@ MTK_CONFIG = {
     # if DEBUG else "https://isp3.lomtechnology.com",
     ,
     "USERNAME": "f2net_user",
+    # Middleware server info (VPN server IP): fresh for INFO_TTL seconds, then served
+    # stale while refreshing in the background, for at most INFO_STALE_TTL seconds
+    "INFO_TTL": 300,
+    "INFO_STALE_TTL": 7 * 24 * 3600,
 }
+
+# Provisioning tokens in router config URLs (mtk/services/tokens.py)
+MTK_TOKENS = {
+    "CACHE_SIZE": 4096,
+    "CACHE_TTL": 300,
+    # Seconds after which a provisioning URL stops working; None keeps them valid forever
+    "MAX_AGE": None,
+}
+
+# HTTP transport to the Mtk middleware (mtk/services/transport.py)
+MTK_TRANSPORT = {
+    # Read once at startup instead of on every request
+    "API_KEY": config("MTK_API_KEY", default=""),
+    "CONNECT_TIMEOUT": 3.05,
+    "READ_TIMEOUT": 30,
+    "RETRIES": 2,
+    "BACKOFF": 0.5,
+    "BACKOFF_MAX": 5,
+    "POOL_SIZE": 10,
+    "BREAKER_THRESHOLD": 5,
+    "BREAKER_RESET": 30,
+}
+
 FERNET_KEY = config('FERNET_KEY')
 RSC_FILE = config("RSC_FILE", default="f2net.rsc")
+# Rendered router config scripts (isp/services/scripts.py), keyed by a config fingerprint
+RSC_SCRIPTS = {
+    "CACHE_TTL": 24 * 3600,
+}
+
+# Captive-portal pages (isp/services/hotspot.py)
+HOTSPOT_PAGES = {
+    "LOCAL_MAX_ENTRIES": 2048,
+    # Seconds a page is served from process memory before the shared cache is consulted again
+    "LOCAL_TTL": 30,
+    "SHARED_TTL": 24 * 3600,
+}
+
+# RADIUS accounting ingest (isp/services/accounting.py)
+RADIUS_ACCOUNTING = {
+    "SECRET": config("RADIUS_SECRET", default=""),
+    "MAX_BUFFERED": config("RADIUS_MAX_BUFFERED", default=50000, cast=int),
+    "BATCH_SIZE": 2000,
+    "FLUSH_INTERVAL": 1.0,
+    "ENQUEUE_TIMEOUT": 0.5,
+}
+
+# Usage/bandwidth rollups (isp/services/rollups.py)
+USAGE_ROLLUPS = {
+    # Rows younger than this are left for the next run so late commits are not skipped
+    "LAG_SECONDS": 60,
+    "CHUNK_SIZE": 500,
+    "BANDWIDTH_CHUNK_SIZE": 50,
+}
+
+# Dashboard counters (isp/services/stats.py), cached per company and dropped by model signals
+DASHBOARD_STATS = {
+    "CACHE_TTL": 60,
+}
+
+# Inertia shared props (isp/dashboard/props.py): per-user permissions/avatar and per-company badges
+INERTIA_SHARED_PROPS = {
+    "USER_PROPS_TTL": 300,
+    "BADGES_TTL": 30,
+}
+
+# Streaming exports (isp/services/exports.py)
+EXPORTS = {
+    "CHUNK_SIZE": 2000,
+    "BUFFER_SIZE": 64 * 1024,
+    "GZIP_LEVEL": 6,
+}
+
+# Bulk customer/subscription operations (isp/services/bulk.py)
+BULK_OPERATIONS = {
+    "CHUNK_SIZE": 500,
+    # Requests with more ids run as a background BulkJob
+    "ASYNC_THRESHOLD": 500,
+    "MAX_ITEMS": 20000,
+    "WORKERS": 2,
+    # Seconds without progress after which a pending/running job is marked failed
+    "STALE_AFTER": 3600,
+}
+
+ROUTER_PROVISIONING = {
+    "BACKEND": "isp.services.routers.MtkRouterBackend",
+    # Mtk middleware endpoint for subscriber command batches, e.g.
+    # "mikrotik/devices/{identity}/subscribers/batch" (contract on MtkRouterBackend).
+    # Empty: lifecycle changes are saved without being pushed to routers
+    "MTK_BATCH_ENDPOINT": config("MTK_BATCH_ENDPOINT", default=""),
+    # Subscriber commands per call to one router
+    "BATCH_SIZE": 1000,
+    # Routers pushed to in parallel
+    "CONCURRENCY": 8,
+}
+
+# OpenVPN bundles relayed from the Mtk middleware (isp/services/certs.py)
+ROUTER_CERTS = {
+    # Set to a directory to keep bundles on local disk instead of in the cache
+    "DIRECTORY": None,
+    "TTL": 24 * 3600,
+}
+
+# Batch router onboarding (isp/services/provisioning.py)
+ROUTER_ONBOARDING = {
+    # VPN clients created at once; keep it within MTK_TRANSPORT POOL_SIZE
+    "CONCURRENCY": 8,
+    "MAX_ROUTERS": 500,
+}
+
+# RouterOS API access to the routers (isp/services/routeros.py)
+ROUTEROS_API = {
+    "PORT": 8728,
+    "SSL": False,
+    "CONNECT_TIMEOUT": 5,
+    "COMMAND_TIMEOUT": 10,
+}
+
+# Fleet telemetry collected by `manage.py poll_routers` (isp/services/telemetry.py)
+ROUTER_POLLING = {
+    "INTERVAL": 30,
+    # Routers polled at once over their pooled API connections
+    "CONCURRENCY": 200,
+    "SUMMARY_TTL": 300,
+}
+
+# Invoice generation by `manage.py run_billing` (isp/services/billing.py)
+BILLING = {
+    "CHUNK_SIZE": 2000,
+    # Percent of the subtotal added as tax on generated invoices
+    "TAX_RATE": config("BILLING_TAX_RATE", default="0"),
+    "DUE_DAYS": 14,
+    "INVOICE_STATUS": "sent",
+}
+
+# Overdue invoice reminders and suspensions by `manage.py run_dunning` (isp/services/dunning.py)
+DUNNING = {
+    # Stage -> days overdue at which it starts; "suspension" suspends with --suspend
+    "STAGES": {"reminder": 1, "second_reminder": 7, "final_notice": 14, "suspension": 21},
+    "CHANNELS": ["sms", "email"],
+}
+
+# Customer balance ledger (isp/services/ledger.py); snapshot nightly with `manage.py snapshot_balances`
+LEDGER = {
+    "BATCH_SIZE": 2000,
+}
+
+# Payment statement reconciliation (isp/services/payments.py)
+PAYMENT_RECONCILIATION = {
+    # Payment method recorded for statement lines
+    "PAYMENT_METHOD": "mobile_money",
+    "MAX_LINES": 100000,
+}
+
+# Who is online (isp/services/sessions.py), fed by the accounting flush and the router poller
+ACTIVE_SESSIONS = {
+    # "memory" or "redis"; None uses Redis whenever the default cache does
+    "BACKEND": None,
+    "STALE_AFTER": 900,
+}
 
 # Configure cache (required for rate limiting)
 CACHES = {
@@ -3,14 +3,14 @@ ISP Management System - Django Admin Configuration
 Comprehensive admin interface for ISP management
 """
 
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
-from django.db.models import Count, Sum
 from django.utils import timezone
 from datetime import datetime, timedelta
+import uuid
 
 from .models import (
     # Base Models
@@ -38,7 +38,7 @@ from .models import (
     NotificationTemplate, Notification,
 
     # System Logs
-    SystemLog
+    SystemLog, BulkJob, BillingRun, PaymentReview, LedgerEntry, BalanceSnapshot
 )
 
 
@@ -189,7 +189,8 @@ class CustomerAdmin(CompanyFilterMixin, admin.ModelAdmin):
         'user__first_name', 'user__last_name',
         'user__email', 'primary_phone', 'business_name'
     ]
-    readonly_fields = ['created_at', 'updated_at']
+    # Balances change through ledger adjustments (Ledger entries admin)
+    readonly_fields = ['current_balance', 'created_at', 'updated_at']
 
     fieldsets = (
         ('Basic Information', {
@@ -232,20 +233,45 @@ class CustomerAdmin(CompanyFilterMixin, admin.ModelAdmin):
     get_customer_name.short_description = 'Customer Name'
     get_customer_name.admin_order_field = 'user__first_name'
 
-    actions = ['activate_customers', 'suspend_customers']
+    actions = ['activate_customers', 'suspend_customers', 'terminate_customers']
+
+    def _bulk_operation(self, request, queryset, operation, verb):
+        """Run a bulk customer operation per company so subscriptions and the audit log follow"""
+        from isp.services.bulk import BulkError, apply_customer_operation
+
+        by_company = {}
+        for company_id, pk in queryset.values_list('company_id', 'id'):
+            by_company.setdefault(company_id, []).append(pk)
+
+        succeeded = failed = 0
+        for company_id, ids in by_company.items():
+            try:
+                outcome = apply_customer_operation(company_id, ids, operation, user=request.user)
+            except BulkError as e:
+                self.message_user(request, f'Could not {operation} customers: {e}', level=messages.ERROR)
+                failed += len(ids)
+                continue
+            succeeded, failed = succeeded + outcome.succeeded, failed + outcome.failed
+        message = f'{succeeded} customers {verb}.'
+        if failed:
+            message += f' {failed} could not be changed (see the bulk results for why).'
+        self.message_user(request, message)
 
     def activate_customers(self, request, queryset):
-        updated = queryset.update(status='active', activation_date=timezone.now())
-        self.message_user(request, f'{updated} customers activated.')
+        self._bulk_operation(request, queryset, 'activate', 'activated')
 
     activate_customers.short_description = "Activate selected customers"
 
     def suspend_customers(self, request, queryset):
-        updated = queryset.update(status='suspended')
-        self.message_user(request, f'{updated} customers suspended.')
+        self._bulk_operation(request, queryset, 'suspend', 'suspended')
 
     suspend_customers.short_description = "Suspend selected customers"
 
+    def terminate_customers(self, request, queryset):
+        self._bulk_operation(request, queryset, 'terminate', 'terminated')
+
+    terminate_customers.short_description = "Terminate selected customers"
+
 
 # ============================================================================
 # PACKAGE MANAGEMENT ADMINS
@@ -324,7 +350,7 @@ class SubscriptionAdmin(CompanyFilterMixin, admin.ModelAdmin):
         'customer__user__last_name', 'customer__customer_id',
         'assigned_ip', 'username'
     ]
-    readonly_fields = ['subscription_id', 'data_usage_percentage', 'is_expired']
+    readonly_fields = ['subscription_id', 'data_limit_bytes', 'data_usage_percentage', 'is_expired']
 
     fieldsets = (
         ('Subscription Details', {
@@ -334,10 +360,10 @@ class SubscriptionAdmin(CompanyFilterMixin, admin.ModelAdmin):
             'fields': ('start_date', 'end_date', 'next_billing_date', 'last_billing_date')
         }),
         ('Usage Tracking', {
-            'fields': ('data_used', 'time_used', 'data_usage_percentage', 'is_expired')
+            'fields': ('data_used', 'time_used', 'data_limit_bytes', 'data_usage_percentage', 'is_expired')
         }),
         ('Network Configuration', {
-            'fields': ('assigned_ip', 'mac_address', 'username', 'password')
+            'fields': ('router', 'assigned_ip', 'mac_address', 'username', 'password')
         }),
         ('Billing', {
             'fields': ('monthly_fee', 'setup_fee_paid', 'total_paid')
@@ -522,6 +548,9 @@ class TicketAdmin(admin.ModelAdmin):
 
     sla_status.short_description = 'SLA Status'
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_overdue()
+
     actions = ['assign_to_me', 'mark_in_progress', 'mark_resolved']
 
     def assign_to_me(self, request, queryset):
@@ -567,6 +596,9 @@ class InvoiceAdmin(admin.ModelAdmin):
     ]
     readonly_fields = ['invoice_number', 'balance_due', 'is_overdue']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_overdue()
+
     fieldsets = (
         ('Invoice Details', {
             'fields': ('invoice_number', 'customer', 'subscription', 'status')
@@ -591,11 +623,11 @@ class InvoiceAdmin(admin.ModelAdmin):
     actions = ['mark_as_paid', 'send_reminder']
 
     def mark_as_paid(self, request, queryset):
-        updated = queryset.update(
-            status='paid',
-            paid_date=timezone.now().date(),
-            paid_amount=models.F('total_amount')
-        )
+        from isp.services.payments import settle_invoices
+
+        # Records a payment of each balance, so customer balances move with the invoices
+        results = settle_invoices(queryset.select_related('customer'), user=request.user)
+        updated = sum(result.invoices_paid for result in results.values())
         self.message_user(request, f'{updated} invoices marked as paid.')
 
     mark_as_paid.short_description = "Mark as paid"
@@ -690,11 +722,12 @@ class NotificationTemplateAdmin(CompanyFilterMixin, admin.ModelAdmin):
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
     list_display = [
-        'subject', 'recipient', 'channel', 'status',
+        'subject', 'recipient', 'customer', 'channel', 'status',
         'sent_at', 'delivered_at', 'read_at'
     ]
     list_filter = ['channel', 'status', 'sent_at', 'delivered_at']
-    search_fields = ['subject', 'message', 'recipient__username']
+    search_fields = ['subject', 'message', 'recipient__username', 'customer__full_name', 'dedupe_key']
+    raw_id_fields = ['customer']
     readonly_fields = ['sent_at', 'delivered_at', 'read_at']
 
 
@@ -718,6 +751,76 @@ class SystemLogAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
     message_preview.short_description = 'Message Preview'
 
 
+@admin.register(BulkJob)
+class BulkJobAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
+    list_display = [
+        'id', 'company', 'target', 'operation', 'status',
+        'total', 'succeeded', 'failed', 'created_at', 'finished_at'
+    ]
+    list_filter = ['status', 'target', 'operation', 'created_at']
+    search_fields = ['company__name', 'user__username']
+    exclude = ['object_ids']
+
+
+@admin.register(BillingRun)
+class BillingRunAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
+    list_display = [
+        'id', 'as_of', 'status', 'shards', 'shards_done',
+        'subscriptions', 'invoices', 'started_at', 'finished_at'
+    ]
+    list_filter = ['status', 'created_at']
+
+
+@admin.register(PaymentReview)
+class PaymentReviewAdmin(CompanyFilterMixin, admin.ModelAdmin):
+    list_display = [
+        'reference', 'company', 'amount', 'paid_at', 'account',
+        'phone', 'payer_name', 'reason', 'status', 'payment'
+    ]
+    list_filter = ['reason', 'status', 'paid_at']
+    search_fields = ['reference', 'account', 'phone', 'payer_name', 'statement']
+    raw_id_fields = ['payment']
+    readonly_fields = ['created_at', 'updated_at']
+
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    """The ledger is append-only: entries can be added as adjustments, never edited or deleted"""
+    list_display = ['occurred_at', 'customer', 'entry_type', 'amount', 'description', 'created_by']
+    list_filter = ['entry_type', 'occurred_at']
+    search_fields = ['customer__full_name', 'source_key', 'description']
+    raw_id_fields = ['customer']
+    fields = ['customer', 'amount', 'description']
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request).select_related('customer', 'created_by')
+        if not request.user.is_superuser and getattr(request.user, 'company', None):
+            return qs.filter(customer__company=request.user.company)
+        return qs
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def save_model(self, request, obj, form, change):
+        from isp.services.ledger import ADJUSTMENT, post_entries
+
+        obj.entry_type = ADJUSTMENT
+        obj.occurred_at = timezone.now()
+        obj.source_key = f"adjustment:{uuid.uuid4().hex}"
+        obj.created_by = request.user
+        post_entries([obj])
+
+
+@admin.register(BalanceSnapshot)
+class BalanceSnapshotAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
+    list_display = ['customer', 'as_of', 'balance']
+    list_filter = ['as_of']
+    search_fields = ['customer__full_name']
+
+
 # ============================================================================
 # ADMIN SITE CUSTOMIZATION
 # ============================================================================
@@ -732,22 +835,19 @@ def admin_stats_view(request):
     """Custom admin index view with statistics"""
     from django.shortcuts import render
 
-    # Calculate statistics
+    from isp.services.stats import get_stats
+
+    # Calculate statistics (cached; superusers see every company)
+    data = get_stats(None if request.user.is_superuser else request.user.company_id)
     stats = {
-        'total_customers': Customer.objects.count(),
-        'active_customers': Customer.objects.filter(status='active').count(),
-        'total_subscriptions': Subscription.objects.count(),
-        'active_subscriptions': Subscription.objects.filter(status='active').count(),
-        'open_tickets': Ticket.objects.filter(status__in=['open', 'in_progress']).count(),
-        'overdue_tickets': Ticket.objects.filter(
-            status__in=['open', 'in_progress'],
-            sla_resolution_due__lt=timezone.now()
-        ).count(),
-        'monthly_revenue': Invoice.objects.filter(
-            issue_date__month=timezone.now().month,
-            status='paid'
-        ).aggregate(total=Sum('total_amount'))['total'] or 0,
-        'pending_payments': Payment.objects.filter(status='pending').count(),
+        'total_customers': data['customers']['total'],
+        'active_customers': data['customers']['active'],
+        'total_subscriptions': data['subscriptions']['total'],
+        'active_subscriptions': data['subscriptions']['active'],
+        'open_tickets': data['tickets']['open'],
+        'overdue_tickets': data['tickets']['overdue'],
+        'monthly_revenue': data['billing']['monthly_revenue'],
+        'pending_payments': data['billing']['pending_payments'],
     }
 
     return render(request, 'admin/dashboard_stats.html', {'stats': stats})
@@ -755,22 +855,16 @@ def admin_stats_view(request):
 
 # Optional: Custom admin actions
 def export_as_csv(modeladmin, request, queryset):
-    """Export selected objects as CSV"""
-    import csv
-    from django.http import HttpResponse
+    """Export selected objects as CSV, streamed from the database cursor"""
+    from isp.services.exports import streaming_export
 
     meta = modeladmin.model._meta
-    field_names = [field.name for field in meta.fields]
-
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename={meta}.csv'
-    writer = csv.writer(response)
-
-    writer.writerow(field_names)
-    for obj in queryset:
-        writer.writerow([getattr(obj, field) for field in field_names])
-
-    return response
+    return streaming_export(
+        queryset.order_by('pk'),
+        headers=[field.name for field in meta.concrete_fields],
+        lookups=[field.attname for field in meta.concrete_fields],
+        filename=str(meta),
+    )
 
 
 export_as_csv.short_description = "Export Selected as CSV"
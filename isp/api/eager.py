@@ -0,0 +1,219 @@
+import functools
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+@dataclass
+class EagerPlan:
+    """
+    What a serializer will touch: relations to join (`select_related`), relations to
+    fetch in a second query (`prefetch`) and, when every level is known, the columns
+    to load (`only`, None meaning all of them).
+    """
+    select_related: List[str] = field(default_factory=list)
+    prefetch: List[Prefetch] = field(default_factory=list)
+    only: Optional[List[str]] = None
+
+    def apply(self, queryset, narrow: bool = True, keep=()):
+        """`keep`: extra root columns to load, e.g. the pagination ordering"""
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch:
+            queryset = queryset.prefetch_related(*self.prefetch)
+        if narrow and self.only:
+            queryset = queryset.only(*self.only, *keep)
+        return queryset
+
+
+def _meta_option(serializer, name, default=()):
+    return getattr(getattr(serializer, 'Meta', None), name, default)
+
+
+def _custom_representation(serializer) -> bool:
+    return type(serializer).to_representation is not serializers.Serializer.to_representation
+
+
+def _concrete_columns(model) -> Set[str]:
+    return {f.attname for f in model._meta.concrete_fields}
+
+
+class _Planner:
+    """
+    Walks a serializer tree once, mapping nested serializers and related fields onto
+    the model graph. Unknown attributes (properties, methods, `source='*'`) make the
+    columns of that level unknown, so it is loaded in full.
+    """
+
+    def __init__(self, parent_field: Optional[str] = None):
+        # Foreign key to the parent when planning a prefetch: the parent is already loaded
+        self.parent_field = parent_field
+        self.select_related: List[str] = []
+        self.prefetch: List[Prefetch] = []
+        # select_related path ('' for the root) -> (model, columns or None)
+        self.levels: Dict[str, tuple] = {}
+
+    def walk(self, serializer, model, path: str = ''):
+        columns: Optional[Set[str]] = {model._meta.pk.attname}
+        declared = _meta_option(serializer, 'eager_fields', None)
+        if declared is not None:
+            # The serializer lists the columns its methods/properties read
+            columns.update(declared)
+        elif _custom_representation(serializer):
+            columns = None
+
+        for name in _meta_option(serializer, 'eager_select_related'):
+            head = name.split('__')[0]
+            if head not in serializer.fields or (path == '' and head == self.parent_field):
+                continue
+            # Extra joins (e.g. what a related __str__ reads) are loaded in full
+            related, joined = model, path
+            for part in name.split('__'):
+                model_field = related._meta.get_field(part)
+                if related is model and model_field.concrete and columns is not None:
+                    columns.add(model_field.attname)
+                related, joined = model_field.related_model, f'{joined}{part}'
+                self._join(joined)
+                self._level(joined, related, None)
+                joined += '__'
+        for name in _meta_option(serializer, 'eager_prefetch_related'):
+            self.prefetch.append(Prefetch(f'{path}{name}'))
+
+        for serializer_field in serializer.fields.values():
+            if serializer_field.write_only:
+                continue
+            if serializer_field.source == '*':
+                columns = None
+                continue
+            attrs = serializer_field.source_attrs
+            try:
+                model_field = model._meta.get_field(attrs[0])
+            except FieldDoesNotExist:
+                if hasattr(model, attrs[0]) and declared is None:
+                    columns = None
+                # Otherwise the attribute does not exist and DRF skips the field
+                continue
+
+            if not model_field.is_relation:
+                if columns is not None:
+                    columns.add(model_field.attname)
+                continue
+
+            relation_path = f'{path}{model_field.name}'
+            related_model = model_field.related_model
+            if model_field.many_to_one or model_field.one_to_one:
+                if model_field.concrete and columns is not None:
+                    columns.add(model_field.attname)
+                if path == '' and model_field.name == self.parent_field:
+                    continue
+                if isinstance(serializer_field, serializers.PrimaryKeyRelatedField) and len(attrs) == 1:
+                    continue
+                self._join(relation_path)
+                if isinstance(serializer_field, serializers.BaseSerializer):
+                    self.walk(serializer_field, related_model, f'{relation_path}__')
+                elif len(attrs) > 1:
+                    self._dotted(related_model, relation_path, attrs[1:])
+                else:
+                    # Related fields render through __str__, whatever that reads
+                    self._level(relation_path, related_model, None)
+            else:
+                self.prefetch.append(self._prefetch(serializer_field, model_field, relation_path))
+
+        self._level(path[:-2], model, columns)
+
+    def _join(self, relation_path: str):
+        if relation_path not in self.select_related:
+            self.select_related.append(relation_path)
+
+    def _level(self, relation_path: str, model, columns: Optional[Set[str]]):
+        if relation_path in self.levels:
+            known = self.levels[relation_path][1]
+            columns = None if known is None or columns is None else known | columns
+        self.levels[relation_path] = (model, columns)
+
+    def _dotted(self, model, relation_path: str, attrs: List[str]):
+        try:
+            model_field = model._meta.get_field(attrs[0])
+        except FieldDoesNotExist:
+            self._level(relation_path, model, None)
+            return
+        if model_field.is_relation or len(attrs) > 1:
+            self._level(relation_path, model, None)
+            return
+        self._level(relation_path, model, {model._meta.pk.attname, model_field.attname})
+
+    def _prefetch(self, serializer_field, model_field, relation_path: str) -> Prefetch:
+        related_model = model_field.related_model
+        # The foreign key back to the parent is needed to attach the rows
+        parent_columns = [model_field.field.attname] if model_field.one_to_many else []
+        child = getattr(serializer_field, 'child', None)
+        if child is None:
+            if isinstance(getattr(serializer_field, 'child_relation', None), serializers.PrimaryKeyRelatedField):
+                queryset = related_model._default_manager.only(related_model._meta.pk.attname, *parent_columns)
+                return Prefetch(relation_path, queryset=queryset)
+            return Prefetch(relation_path)
+
+        parent_field = model_field.field.name if model_field.one_to_many else None
+        plan = plan_for(child, parent_field)
+        queryset = plan.apply(related_model._default_manager.all(), narrow=False)
+        if plan.only is not None and parent_field:
+            queryset = queryset.only(*plan.only, *parent_columns)
+        return Prefetch(relation_path, queryset=queryset)
+
+    def plan(self) -> EagerPlan:
+        only = None
+        if any(columns is not None for _, columns in self.levels.values()):
+            # only() cannot leave one level unrestricted, so unknown levels list every column
+            only = []
+            for relation_path, (model, columns) in self.levels.items():
+                prefix = f'{relation_path}__' if relation_path else ''
+                names = columns if columns is not None else _concrete_columns(model)
+                only.extend(f'{prefix}{name}' for name in sorted(names))
+        return EagerPlan(self.select_related, self.prefetch, only)
+
+
+@functools.lru_cache(maxsize=256)
+def build_plan(serializer_class, sparse: Optional[tuple] = None, parent_field: Optional[str] = None) -> EagerPlan:
+    """
+    The eager-loading plan of a ModelSerializer class, computed once per class and
+    sparse fieldset (the (fields, expand) trees of SparseFieldsMixin).
+    """
+    if sparse is None:
+        serializer = serializer_class()
+    else:
+        fields, expand = sparse
+        serializer = serializer_class(fields=fields, expand=expand)
+    planner = _Planner(parent_field)
+    planner.walk(serializer, serializer_class.Meta.model)
+    return planner.plan()
+
+
+def plan_for(serializer, parent_field: Optional[str] = None) -> EagerPlan:
+    """The plan of a serializer instance, honouring the fieldset it was configured with"""
+    return build_plan(type(serializer), getattr(serializer, 'sparse_config', None), parent_field)
+
+
+def eager_load(queryset, serializer_class, narrow: bool = True):
+    """
+    `queryset` with the select_related/prefetch_related/only() that `serializer_class`
+    needs, so serializing a page costs a fixed number of queries whatever its size.
+    """
+    return build_plan(serializer_class).apply(queryset, narrow=narrow)
+
+
+class EagerLoadingMixin:
+    """
+    Viewset mixin applying the eager-loading plan of the serializer this request will
+    use, including its ?fields= / ?expand= fieldset. Columns are only narrowed with
+    only() on safe methods; writes load whole rows so save() sees every field.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        narrow = self.request is None or self.request.method in SAFE_METHODS
+        ordering = [name.lstrip('-') for name in getattr(self, 'keyset_ordering', ())]
+        return plan_for(self.get_serializer()).apply(queryset, narrow=narrow, keep=ordering)
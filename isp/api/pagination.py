@@ -0,0 +1,76 @@
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from isp.services.pagination import InvalidCursor, approximate_count, keyset_paginate
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a composite, indexed ordering (`keyset_ordering` on the view,
+    default ('-created_at', '-id')).
+
+    Query parameters: `cursor`, `page_size` (up to `max_page_size`) and `count`:
+    `approx` (default) adds a planner estimate / cached count, `exact` a real COUNT(*),
+    `none` skips counting.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    count_query_param = 'count'
+    page_size = 20
+    max_page_size = 200
+    ordering = ('-created_at', '-id')
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = getattr(view, 'keyset_ordering', self.ordering)
+        try:
+            self.page = keyset_paginate(
+                queryset, ordering, request.query_params.get(self.cursor_query_param),
+                self.get_page_size(request),
+            )
+        except InvalidCursor as e:
+            raise NotFound(str(e))
+
+        mode = request.query_params.get(self.count_query_param, 'approx')
+        if mode == 'exact':
+            self.page.total, self.page.total_is_exact = queryset.count(), True
+        elif mode != 'none':
+            self.page.total, self.page.total_is_exact = approximate_count(queryset)
+        return self.page.items
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self._link(self.page.next_cursor),
+            'previous': self._link(self.page.previous_cursor),
+            'count': self.page.total,
+            'count_is_exact': self.page.total_is_exact,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer', 'nullable': True},
+                'count_is_exact': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,31 @@
+import hmac
+
+from rest_framework.permissions import SAFE_METHODS, BasePermission
+
+
+class SharedSecretPermission(BasePermission):
+    """
+    Allows machine-to-machine callers presenting a shared secret header. Authenticated
+    users are only let through for `user_methods` (read-only by default); writes always
+    need the secret, and are refused while no secret is configured.
+    """
+    header = None
+    user_methods = SAFE_METHODS
+
+    def get_secret(self) -> str:
+        raise NotImplementedError
+
+    def has_permission(self, request, view):
+        secret = self.get_secret()
+        supplied = request.headers.get(self.header, '')
+        if secret and supplied and hmac.compare_digest(supplied, secret):
+            return True
+        return request.method in self.user_methods and bool(request.user and request.user.is_authenticated)
+
+
+class HasRadiusSecret(SharedSecretPermission):
+    header = 'X-Radius-Secret'
+
+    def get_secret(self) -> str:
+        from isp.services.accounting import accounting_settings
+        return accounting_settings()['SECRET']
@@ -18,6 +18,9 @@ router.register(r'tickets', views.TicketViewSet, basename='ticket')
 router.register(r'equipments', views.EquipmentViewSet, basename='equipment')
 router.register(r'invoices', views.InvoiceViewSet, basename='invoice')
 router.register(r'payments', views.PaymentViewSet, basename='payment')
+router.register(r'usage-logs', views.UsageLogViewSet, basename='usage-log')
+router.register(r'bandwidth-logs', views.BandwidthLogViewSet, basename='bandwidth-log')
+router.register(r'system-logs', views.SystemLogViewSet, basename='system-log')
 
 urlpatterns = [
     # DRF Router URLs
@@ -46,6 +49,7 @@ urlpatterns = [
     # Bulk operations
     path('bulk/customers/', views.BulkCustomerOperationsView.as_view(), name='bulk_customers'),
     path('bulk/subscriptions/', views.BulkSubscriptionOperationsView.as_view(), name='bulk_subscriptions'),
+    path('bulk/jobs/<int:pk>/', views.BulkJobStatusView.as_view(), name='bulk_job'),
 
     # Reports and exports
     path('export/customers/', views.ExportCustomersView.as_view(), name='export_customers'),
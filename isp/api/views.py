@@ -1,29 +1,60 @@
+import csv
 import datetime
-import traceback
+import logging
+from decimal import Decimal, InvalidOperation
 
-from django.db import transaction
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404, render
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework import viewsets, views, status
 from rest_framework.decorators import action, authentication_classes, permission_classes, api_view
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView, TokenVerifyView
 
-from internet_service_provider import settings
-from isp.functions import generate_key, get_mode_from_url
-from isp.models import Customer, InternetPackage, User, NetworkEquipment
-from isp.serializers import CustomerSerializer, InternetPackageSerializer, UserSerializer, NetworkEquipmentSerializer
-from mtk.services import Mtk
+from isp.api.eager import EagerLoadingMixin
+from isp.api.pagination import KeysetPagination
+from isp.api.permissions import HasRadiusSecret
+from isp.models import (
+    BandwidthLog, BulkJob, Customer, InternetPackage, Invoice, User, NetworkEquipment, Payment, Subscription, SystemLog,
+    Ticket, UsageLog
+)
+from isp.serializers import (
+    BandwidthLogSerializer, CustomerSerializer, InternetPackageSerializer, InvoiceSerializer,
+    LedgerEntrySerializer, NetworkEquipmentSerializer, PaymentSerializer, SubscriptionSerializer, SystemLogSerializer, TicketSerializer,
+    UsageLogSerializer, UserSerializer
+)
+from isp.services.accounting import AccountingPipeline, AccountingRecord, BufferFull
+from isp.services.bulk import BulkError, fail_stale_jobs, job_status, run_or_queue
+from isp.services.certs import cached_cert, open_cert_stream
+from isp.services.exports import CSV, CUSTOMERS, FORMATS, INVOICES, USAGE, streaming_export
+from isp.services.hotspot import hotspot_page
+from isp.services.ledger import balance_at, post_adjustment
+from isp.services.payments import parse_statement, read_statement_csv, reconcile_payments, reconciliation_settings
+from isp.services.provisioning import PROVISION, provision_routers
+from isp.services.rollups import DAY, HOUR, bandwidth_series, usage_series
+from isp.services.scripts import RouterScript
+from isp.services.sessions import get_table
+from isp.services.stats import get_stats
+from isp.services.telemetry import router_summaries
+from mtk.services import Mtk, NetWokException
 from mtk.services.fn import get_host
 
+logger = logging.getLogger(__name__)
 
-class CustomerViewSet(viewsets.ModelViewSet):
-    queryset = Customer.objects.all()
+
+class CustomerViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     serializer_class = CustomerSerializer
 
-    def filter_queryset(self, queryset): ...
+    def get_queryset(self):
+        queryset = Customer.objects.filter(company=self.request.user.company)
+
+        status_filter = self.request.query_params.get('status')
+        if status_filter:
+            queryset = queryset.filter(status=status_filter)
+        return queryset
 
     def perform_create(self, serializer, **kwargs):
         serializer.save(company=self.request.user.company)
@@ -37,6 +68,48 @@ class CustomerViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(packages, many=True)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get', 'post'])
+    def ledger(self, request, pk=None, **kwargs):
+        """
+        GET: the balance (now, or at ?at=<ISO datetime>) and the latest ?limit= entries up to then.
+        POST {amount, description}: a manual adjustment; positive charges, negative credits.
+        """
+        customer = get_object_or_404(Customer, pk=pk, company=request.user.company)
+
+        if request.method == 'POST':
+            try:
+                amount = Decimal(str(request.data.get('amount', '')))
+            except InvalidOperation:
+                amount = None
+            description = str(request.data.get('description', '')).strip()
+            if not amount or not description:
+                return Response({"ok": False, "error": "A non-zero amount and a description are required."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            entry = post_adjustment(customer, amount, description, user=request.user)
+            return Response({"ok": True, "entry": LedgerEntrySerializer(entry).data,
+                             "balance": str(balance_at(customer.pk))}, status=status.HTTP_201_CREATED)
+
+        at = request.query_params.get('at')
+        when = parse_datetime(at) if at else None
+        try:
+            limit = max(0, min(int(request.query_params.get('limit', 50)), 500))
+        except ValueError:
+            limit = None
+        if (at and when is None) or limit is None:
+            return Response({"ok": False, "error": "at must be an ISO datetime and limit an integer."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if when is not None and timezone.is_naive(when):
+            when = timezone.make_aware(when)
+        entries = customer.ledger_entries.order_by('-occurred_at', '-id')
+        if when is not None:
+            entries = entries.filter(occurred_at__lte=when)
+        return Response({
+            "ok": True,
+            "balance": str(balance_at(customer.pk, when)),
+            "at": when.isoformat() if when else None,
+            "entries": LedgerEntrySerializer(entries[:limit], many=True, context={'request': request}).data,
+        })
+
 
 class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
@@ -73,7 +146,7 @@ class UserViewSet(viewsets.ModelViewSet):
         return queryset.filter(company=user.company)
 
 
-class PackageViewSet(viewsets.ModelViewSet):
+class PackageViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = InternetPackage.objects.all()
     serializer_class = InternetPackageSerializer
 
@@ -119,15 +192,77 @@ class PackageViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class SubscriptionViewSet(viewsets.ModelViewSet):
-    pass
+class SubscriptionViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
+    serializer_class = SubscriptionSerializer
 
+    def get_queryset(self):
+        queryset = Subscription.objects.filter(customer__company=self.request.user.company)
 
-class TicketViewSet(viewsets.ModelViewSet):
-    pass
+        for param in ('status', 'customer'):
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{param: value})
+        return queryset
+
+
+class TicketViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
+    serializer_class = TicketSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-created_at', '-id')
+
+    def get_queryset(self):
+        queryset = Ticket.objects.filter(customer__company=self.request.user.company).with_overdue()
+
+        status_filter = self.request.query_params.get('status')
+        if status_filter:
+            queryset = queryset.filter(status=status_filter)
+        return queryset
+
+
+class UsageLogViewSet(EagerLoadingMixin, viewsets.ReadOnlyModelViewSet):
+    serializer_class = UsageLogSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-session_start', '-id')
+
+    def get_queryset(self):
+        queryset = UsageLog.objects.filter(subscription__customer__company=self.request.user.company)
+
+        subscription = self.request.query_params.get('subscription')
+        if subscription:
+            queryset = queryset.filter(subscription_id=subscription)
+        return queryset
 
 
-class EquipmentViewSet(viewsets.ModelViewSet):
+class BandwidthLogViewSet(EagerLoadingMixin, viewsets.ReadOnlyModelViewSet):
+    serializer_class = BandwidthLogSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-timestamp', '-id')
+
+    def get_queryset(self):
+        queryset = BandwidthLog.objects.filter(subscription__customer__company=self.request.user.company)
+
+        subscription = self.request.query_params.get('subscription')
+        if subscription:
+            queryset = queryset.filter(subscription_id=subscription)
+        return queryset
+
+
+class SystemLogViewSet(EagerLoadingMixin, viewsets.ReadOnlyModelViewSet):
+    serializer_class = SystemLogSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-created_at', '-id')
+
+    def get_queryset(self):
+        queryset = SystemLog.objects.filter(user__company=self.request.user.company)
+
+        for param in ('level', 'action_type'):
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{param: value})
+        return queryset
+
+
+class EquipmentViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     serializer_class = NetworkEquipmentSerializer
     queryset = NetworkEquipment.objects.all()
 
@@ -149,75 +284,107 @@ class EquipmentViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['post'])
     def provision(self, request, **kwargs):
-        """Get available packages for the current user"""
-        user = request.user
+        """Provision one router: create its VPN client and equipment row and return its setup script"""
         router_name = request.data.get('name', 'MTK1')
 
         try:
-            # Create a unique identifier using username and a unique number
-            router_identity = f"{user.company.slug}_{router_name}"
-            existing_router = NetworkEquipment.objects.filter(identity=router_identity).first()
-            if existing_router:
-                return Response({
-                    "ok": False,
-                    "error": f"Router with identity {router_name} already exists."
-                })
-            mtk_info = {
-                "name": router_identity,
-                "password": generate_key(),
-            }
-            auth_code = generate_key(20)
-            res = Mtk.provision(router_identity)
-            if res.error:
-                return Response({
-                    "ok": False,
-                    "error": "Unable to setup device, try again later.."
-                })
-            try:
-                with transaction.atomic():
-                    router = NetworkEquipment.objects.create(
-                        name=router_name,
-                        equipment_type="router",
-                        username=settings.MTK_CONFIG.get("USERNAME"),
-                        password=mtk_info["password"],
-                        location="ss",
-                        auth_code=auth_code,
-                        ip_address="",
-                        company=request.user.company,
-                        identity=router_identity
-                    )
-                    client_info = {
-                        "mtk": router.id,
-                        "auth": auth_code,
-                    }
-                    [script, url, rsc_file] = Mtk.provision_script({
-                        **client_info,
-                        'timestamp': datetime.datetime.utcnow().isoformat()
-                    }, get_host(request))
-                    return Response({
-                        "ok": True,
-                        "script": str(script),
-                        "pvr_url": url,
-                        "rsc_file": rsc_file
-                    })
-            except Exception as e:
-                print("error", e)
-                traceback.print_exc()
-                return Response({
-                    "ok": False,
-                    "error": "Cant process the request right now, try again later. If the problem persists, contact support."
-                })
-        except Exception as e:
-            print("error", e)
-            return Response({})
+            outcome = provision_routers(request.user.company_id, [router_name], params={'host': get_host(request)},
+                                        user=request.user)
+        except Exception:
+            logger.exception("Provisioning router %s failed", router_name)
+            return Response({
+                "ok": False,
+                "error": "Cant process the request right now, try again later. If the problem persists, contact support."
+            })
 
+        result = outcome.results[0]
+        if not result.ok:
+            return Response({"ok": False, "error": result.error})
+        return Response({
+            "ok": True,
+            "script": result.data["script"],
+            "pvr_url": result.data["pvr_url"],
+            "rsc_file": result.data["rsc_file"],
+        })
+
+    @action(detail=False, methods=['post'], url_path='provision/batch')
+    def provision_batch(self, request, **kwargs):
+        """
+        POST {"names": [...], "async": false}: provision many routers at once. Small batches
+        answer with a result (and setup script) per name; larger ones are queued as a job to
+        poll at bulk/jobs/<id>/, which also reports the VPN client latency distribution.
+        """
+        if request.user.company_id is None:
+            return Response({"ok": False, "error": "User is not assigned to a company."},
+                            status=status.HTTP_403_FORBIDDEN)
+        try:
+            outcome, job = run_or_queue(
+                request.user.company_id, request.user, 'equipment', PROVISION, request.data.get('names'),
+                {'host': get_host(request)}, force_async=bool(request.data.get('async')),
+            )
+        except BulkError as e:
+            return Response({"ok": False, "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-class PaymentViewSet(viewsets.ModelViewSet):
-    pass
+        if job is not None:
+            return Response({"ok": True, "job": job_status(job)}, status=status.HTTP_202_ACCEPTED)
+        return Response({"ok": True, **outcome.to_dict()})
 
 
-class InvoiceViewSet(viewsets.ModelViewSet):
-    pass
+class PaymentViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
+    serializer_class = PaymentSerializer
+
+    def get_queryset(self):
+        queryset = Payment.objects.filter(customer__company=self.request.user.company)
+
+        for param in ('status', 'customer', 'invoice'):
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{param: value})
+        return queryset
+
+    @action(detail=False, methods=['post'])
+    def reconcile(self, request, **kwargs):
+        """
+        Record a payment statement: a CSV upload as `file`, or JSON `lines`. Lines are matched to
+        customers and open invoices; unmatched ones go to the payment review queue.
+        """
+        company = request.user.company
+        if company is None:
+            return Response({"ok": False, "error": "User is not assigned to a company."},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        upload = request.FILES.get('file')
+        try:
+            if upload:
+                rows = read_statement_csv(upload.file)
+            else:
+                rows = request.data.get('lines', []) if isinstance(request.data, dict) else None
+        except (UnicodeDecodeError, csv.Error) as e:
+            return Response({"ok": False, "error": f"Unreadable statement: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(rows, list) or not rows:
+            return Response({"ok": False, "error": "Upload a statement file or send a list of lines."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > reconciliation_settings()['MAX_LINES']:
+            return Response({"ok": False, "error": "Statement has too many lines; split it."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        lines, errors = parse_statement(rows, company.timezone)
+        result = reconcile_payments(company.pk, lines, statement=upload.name if upload else 'api', user=request.user)
+        result.errors = errors + result.errors
+        return Response({"ok": True, "result": result.to_dict()})
+
+
+class InvoiceViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
+    serializer_class = InvoiceSerializer
+
+    def get_queryset(self):
+        queryset = Invoice.objects.filter(customer__company=self.request.user.company).with_overdue()
+
+        for param in ('status', 'customer'):
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{param: value})
+        return queryset
 
 
 class CustomTokenObtainPairView(TokenObtainPairView):
@@ -233,11 +400,46 @@ class CustomTokenVerifyView(TokenVerifyView):
 
 
 class DashboardStatsView(APIView):
-    pass
+    """Dashboard counters for the user's company; ?refresh=1 bypasses the cache"""
+
+    def get(self, request):
+        company_id = request.user.company_id
+        if company_id is None and not request.user.is_superuser:
+            return Response({"ok": False, "error": "User is not assigned to a company."},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        refresh = request.query_params.get('refresh') in ('1', 'true')
+        return Response({"ok": True, "stats": get_stats(company_id, refresh=refresh)})
 
 
 class UsageStatsView(APIView):
-    pass
+    """
+    Usage totals per hour/day for the company, or one subscription with ?subscription=<id>.
+    Served from the rollup tables; only the still-open bucket is read from UsageLog.
+    """
+
+    def get(self, request):
+        granularity = request.query_params.get('granularity', DAY)
+        if granularity not in (HOUR, DAY):
+            return Response({"ok": False, "error": "granularity must be 'hour' or 'day'."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            days = min(int(request.query_params.get('days', 7)), 366)
+        except ValueError:
+            return Response({"ok": False, "error": "days must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        subscription_id = None
+        if request.query_params.get('subscription'):
+            subscription_id = get_object_or_404(
+                Subscription, pk=request.query_params['subscription'], customer__company=request.user.company
+            ).pk
+
+        end = timezone.now()
+        series = usage_series(
+            end - datetime.timedelta(days=days), end, granularity,
+            subscription_id=subscription_id, company_id=request.user.company_id,
+        )
+        return Response({"ok": True, "granularity": granularity, "data": series})
 
 
 class RevenueStatsView(APIView):
@@ -245,11 +447,66 @@ class RevenueStatsView(APIView):
 
 
 class ActiveSessionsView(APIView):
-    pass
+    """
+    Sessions online now, from the active session table rather than UsageLog.
+    Filter with ?subscription=<id> or ?nas=<ip>. Counts are always complete; at most ?limit of the
+    matching sessions are listed, taken in no particular order.
+    """
+
+    def get(self, request):
+        company_id = request.user.company_id
+        try:
+            subscription = request.query_params.get('subscription')
+            subscription_id = int(subscription) if subscription else None
+            limit = max(0, min(int(request.query_params.get('limit', 100)), 1000))
+        except ValueError:
+            return Response({"ok": False, "error": "subscription and limit must be integers."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        table = get_table()
+        matched, sessions = table.sessions(company_id, subscription_id=subscription_id,
+                                           nas_ip=request.query_params.get('nas'), limit=limit)
+        by_nas = table.counts(company_id)
+        by_zone = {}
+        if by_nas:
+            zones = dict(
+                NetworkEquipment.objects.filter(company_id=company_id, ip_address__in=list(by_nas))
+                .values_list('ip_address', 'zone__name')
+            )
+            for nas_ip, count in by_nas.items():
+                zone = zones.get(nas_ip) or 'Unassigned'
+                by_zone[zone] = by_zone.get(zone, 0) + count
+
+        sessions.sort(key=lambda session: session.started_at)
+        return Response({
+            "ok": True,
+            "online": sum(by_nas.values()),
+            "matched": matched,
+            "by_nas": by_nas,
+            "by_zone": by_zone,
+            "sessions": [session.as_dict() for session in sessions],
+        })
 
 
 class BandwidthUsageView(APIView):
-    pass
+    """Bandwidth and latency percentiles per bucket for ?subscription=<id> (rollups plus the open bucket)"""
+
+    def get(self, request):
+        subscription = get_object_or_404(
+            Subscription, pk=request.query_params.get('subscription') or 0, customer__company=request.user.company
+        )
+        granularity = request.query_params.get('granularity', HOUR)
+        if granularity not in (HOUR, DAY):
+            return Response({"ok": False, "error": "granularity must be 'hour' or 'day'."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            hours = min(int(request.query_params.get('hours', 24)), 24 * 366)
+        except ValueError:
+            return Response({"ok": False, "error": "hours must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        end = timezone.now()
+        series = bandwidth_series(subscription.pk, end - datetime.timedelta(hours=hours), end, granularity)
+        return Response({"ok": True, "granularity": granularity, "data": series})
 
 
 class SystemAlertsView(APIView):
@@ -257,35 +514,183 @@ class SystemAlertsView(APIView):
 
 
 class RadiusIntegrationView(APIView):
-    pass
+    """
+    RADIUS accounting ingest.
+
+    POST a list of Start/Interim-Update/Stop records (or ``{"records": [...]}``).
+    Records are buffered in memory, coalesced per Acct-Session-Id and written to
+    UsageLog in bulk by a background worker. Answers 503 with Retry-After when the
+    buffer is full so the RADIUS side can back off and resend.
+    """
+    permission_classes = [HasRadiusSecret]
+
+    def get(self, request):
+        pipeline = AccountingPipeline.get()
+        return Response({
+            "ok": True,
+            "buffered": len(pipeline.buffer),
+            "metrics": pipeline.metrics.snapshot(),
+        })
+
+    def post(self, request):
+        rows = request.data.get('records', request.data) if isinstance(request.data, dict) else request.data
+        if isinstance(rows, dict):
+            rows = [rows]
+        if not isinstance(rows, list):
+            return Response({"ok": False, "error": "Expected a list of accounting records."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        records, errors = [], []
+        for index, row in enumerate(rows):
+            try:
+                records.append(AccountingRecord.from_radius(row))
+            except (ValueError, TypeError, AttributeError) as e:
+                errors.append({"index": index, "error": str(e)})
 
+        try:
+            accepted = AccountingPipeline.get().submit(records) if records else 0
+        except BufferFull as e:
+            response = Response({"ok": False, "error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = '1'
+            return response
 
-class MikroTikIntegrationView(APIView):
-    pass
+        return Response({"ok": True, "accepted": accepted, "errors": errors}, status=status.HTTP_202_ACCEPTED)
 
 
-class WebhookView(APIView):
-    pass
+class MikroTikIntegrationView(APIView):
+    """Latest health of the company's routers, as recorded by the poll_routers command"""
+
+    def get(self, request):
+        routers = list(
+            NetworkEquipment.objects.filter(company=request.user.company, equipment_type='router')
+            .order_by('name').values('id', 'name', 'identity', 'ip_address', 'status')
+        )
+        summaries = router_summaries([router['id'] for router in routers])
+        for router in routers:
+            router['telemetry'] = summaries.get(router['id'])
+        return Response({"ok": True, "routers": routers})
 
 
-class BulkCustomerOperationsView(APIView):
+class WebhookView(APIView):
     pass
 
 
-class BulkSubscriptionOperationsView(APIView):
-    pass
+class BulkOperationsView(APIView):
+    """
+    POST {"operation": ..., "<ids_field>": [...], "async": false}. Small requests answer 200
+    with per-item results; larger ones (or "async": true) are queued and answer 202 with a
+    job to poll at bulk/jobs/<id>/.
+    """
+    target = None
+    ids_field = None
+    # Request keys passed through to the operation as params
+    param_fields = ('package_id',)
+
+    def post(self, request):
+        company_id = request.user.company_id
+        if company_id is None:
+            return Response({"ok": False, "error": "User is not assigned to a company."},
+                            status=status.HTTP_403_FORBIDDEN)
+        params = {name: request.data.get(name) for name in self.param_fields if request.data.get(name)}
+        try:
+            outcome, job = run_or_queue(
+                company_id, request.user, self.target, request.data.get('operation'),
+                request.data.get(self.ids_field), params, force_async=bool(request.data.get('async')),
+            )
+        except BulkError as e:
+            return Response({"ok": False, "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if job is not None:
+            return Response({"ok": True, "job": job_status(job)}, status=status.HTTP_202_ACCEPTED)
+        return Response({"ok": True, **outcome.to_dict()})
+
+
+class BulkCustomerOperationsView(BulkOperationsView):
+    """
+    operation: activate|suspend|terminate|change_package (with "package_id") over "customer_ids".
+    Live subscriptions follow their customer and are pushed to their routers.
+    """
+    target = 'customer'
+    ids_field = 'customer_ids'
+
+
+class BulkJobStatusView(APIView):
+    """Progress of a bulk job of the user's company; results once it has completed"""
+
+    def get(self, request, pk):
+        fail_stale_jobs(request.user.company_id)
+        job = get_object_or_404(BulkJob, pk=pk, company=request.user.company)
+        return Response({"ok": True, "job": job_status(job)})
+
+
+class BulkSubscriptionOperationsView(BulkOperationsView):
+    """
+    operation: suspend|reactivate|terminate|change_package (with "package_id") over
+    "subscription_ids"; "reason" (e.g. "non_payment") is recorded in the audit log.
+    Changes are sent to the routers as one batch per router.
+    """
+    target = 'subscription'
+    ids_field = 'subscription_ids'
+    param_fields = ('package_id', 'reason')
+
+
+def _date_param(params, name):
+    """Optional YYYY-MM-DD query parameter; ValueError when malformed"""
+    value = params.get(name)
+    if not value:
+        return None
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(f"{name} is not a date")
+    return parsed
+
+
+class ExportView(APIView):
+    """
+    Streaming download of `export` for the user's company.
+
+    ?fmt=csv|ndjson, ?compress=gzip, ?start= / ?end= (YYYY-MM-DD, inclusive) and the
+    exact-match filters of the export (e.g. ?status=). Rows go from the database cursor to
+    the client in chunks, so memory use does not depend on the size of the export.
+    """
+    export = None
+
+    def get(self, request):
+        company_id = request.user.company_id
+        if company_id is None and not request.user.is_superuser:
+            return Response({"ok": False, "error": "User is not assigned to a company."},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        params = request.query_params
+        fmt = params.get('fmt', CSV)
+        if fmt not in FORMATS:
+            return Response({"ok": False, "error": f"fmt must be one of: {', '.join(FORMATS)}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            start, end = _date_param(params, 'start'), _date_param(params, 'end')
+        except ValueError:
+            return Response({"ok": False, "error": "start and end must be dates (YYYY-MM-DD)."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        filters = {name: params[name] for name in self.export.filters if params.get(name)}
+        queryset = self.export.queryset(company_id, start, end, **filters)
+        return streaming_export(
+            queryset, self.export.headers, self.export.lookups,
+            filename=f"{self.export.name}-{timezone.localdate():%Y%m%d}",
+            fmt=fmt, compress=params.get('compress') == 'gzip',
+        )
 
 
-class ExportCustomersView(APIView):
-    pass
+class ExportCustomersView(ExportView):
+    export = CUSTOMERS
 
 
-class ExportUsageView(APIView):
-    pass
+class ExportUsageView(ExportView):
+    export = USAGE
 
 
-class ExportInvoicesView(APIView):
-    pass
+class ExportInvoicesView(ExportView):
+    export = INVOICES
 
 
 class EquipmentAuthorizeView(APIView):
@@ -307,9 +712,23 @@ class EquipmentCertView(APIView):
     permission_classes = []
 
     def get(self, request, auth_code):
-        router = get_object_or_404(NetworkEquipment, auth_code=auth_code)
-        cert = Mtk.cert(router.identity)
-        response = HttpResponse(cert, content_type="text/plain")
+        router = get_object_or_404(NetworkEquipment.objects.only('id', 'identity'), auth_code=auth_code)
+        bundle = cached_cert(router.identity)
+        if bundle is None:
+            # Relay the middleware's bundle as it arrives; it is stored for the next reconnect
+            try:
+                response = StreamingHttpResponse(open_cert_stream(router.identity), content_type="text/plain")
+            except NetWokException as e:
+                logger.warning("Could not fetch the certificate of %s: %s", router.identity, e)
+                return HttpResponse(':put "Failed to fetch the router certificate"', content_type="text/plain",
+                                    status=status.HTTP_502_BAD_GATEWAY)
+        elif bundle.matches(request.headers.get('If-None-Match')):
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(bundle.body, content_type="text/plain")
+        if bundle is not None:
+            response['ETag'] = bundle.etag
+        response['Cache-Control'] = 'private, no-cache'
         response['Content-Disposition'] = 'attachment; filename=script.rsc'
         return response
 
@@ -321,42 +740,20 @@ class EquipmentConfigView(APIView):
     def get(self, request, encoded_payload=None, version=None):
         try:
             info = Mtk.rsc_config(encoded_payload)
-            router = get_object_or_404(NetworkEquipment, id=info.mtk, auth_code=info.auth)
-            if not router:
-                raise ValueError("No router found")
-
-            # Determine which server IP to use for walled garden
-            server_ip = Mtk.get().config.get("ip", "+6")
-            url = get_host(request)
-
-            config = {
-                "firewall": "10.8.0.1",
-                "secret": router.password,
-                "identity": router.identity,
-                "mtk_user": settings.MTK_CONFIG["USERNAME"],
-                "vpn_url": f"{url}/api/v1/equipments/auth/cert/{info.auth}/",
-                "hs_login_url": f"{url}/api/v1/mikrotik/hotspot/{info.auth}/login.html",
-                "hs_rlogin_url": f"{url}/api/v1/mikrotik/hotspot/{info.auth}/rlogin.html",
-                "walled_garden_host": settings.MTK_CONFIG["URL"],
-                "walled_garden_ip": server_ip,
-            }
-            config["mode"] = get_mode_from_url(config["hs_login_url"])
-
-            # For RouterOS v6, we need additional parameters
-            if version == 6:
-                config.update({
-                    "connect_to": server_ip,
-                    "vpn_pass": router.password,
-                    "client_cert": f"{router.identity}.config_1"
-                })
-
-            file = "vpn_7_config.rsc" if version == 7 else "vpn_6_config.rsc"
-            script_lines = render_to_string(f'rsc_files/{file}', {
-                'config': config
-            })
-
-            response = HttpResponse(script_lines, content_type='text/plain')
-            response['Content-Disposition'] = 'attachment; filename=script.rsc'
+            router = get_object_or_404(
+                NetworkEquipment.objects.only('id', 'identity', 'password', 'auth_code', 'updated_at'),
+                id=info.mtk, auth_code=info.auth,
+            )
+
+            script = RouterScript(router, info.auth, get_host(request), Mtk.server_ip("+6"), version)
+            if script.matches(request.headers.get('If-None-Match')):
+                response = HttpResponse(status=304)
+            else:
+                response = HttpResponse(script.render(), content_type='text/plain')
+                response['Content-Disposition'] = 'attachment; filename=script.rsc'
+            response['ETag'] = script.etag
+            # Routers re-fetch on every boot; let them and proxies revalidate instead of re-downloading
+            response['Cache-Control'] = 'private, no-cache'
             return response
 
         except Exception as e:
@@ -370,23 +767,11 @@ class HotspotView(APIView):
 
     def get(self, request, router_identity, file_name):
         try:
-            router = get_object_or_404(NetworkEquipment, auth_code=router_identity)
-            if file_name == 'login.html':
-                template_name = 'hotspot/login1.html'
-            elif file_name == 'rlogin.html':
-                template_name = 'hotspot/rlogin.html'
-            else:
+            page = hotspot_page(router_identity, file_name, get_host(request))
+            if page is None:
                 return HttpResponse("File not found", status=404)
 
-            # Context data for the template
-            context = {
-                'url': get_host(request) + "/hotspot/packages",
-                'router': router,
-                'isp_name': settings.ISP_NAME,
-                'support_phone': settings.SUPPORT_PHONE,
-                'year': datetime.datetime.now().year
-            }
-            response = HttpResponse(render(request, template_name, context), content_type='text/plain')
+            response = HttpResponse(page, content_type='text/plain')
             response['Content-Disposition'] = 'attachment; filename=script.rsc'
 
             return response
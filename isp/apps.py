@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class IspConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'isp'
+
+    def ready(self):
+        from isp import signals  # noqa: F401
+        from isp.services.hotspot import warm_templates
+
+        # Compile the captive-portal templates now rather than on the first phone to connect
+        warm_templates()
@@ -6,7 +6,7 @@ File: dashboard/helpers.py
 
 from django.urls import reverse
 from django.core.paginator import Paginator
-from django.db.models import Q, Count, Sum, Avg
+from django.db.models import Q, Avg
 from django.utils import timezone
 from datetime import datetime, timedelta
 import json
@@ -17,10 +17,18 @@ from typing import Dict, List, Any, Optional
 # INERTIA VIEW HELPERS
 # =============================================================================
 
-def paginate_for_inertia(queryset, request, per_page=20):
+def paginate_for_inertia(queryset, request, per_page=20, ordering=None, approximate_total=False):
     """
-    Paginate queryset for Inertia.js with search and filtering
+    Paginate queryset for Inertia.js with search and filtering.
+
+    With `ordering` (e.g. ('-created_at', '-id'), matching an index) the page is fetched
+    by keyset instead of OFFSET and addressed by the `cursor` query parameter; the total
+    is then only computed when `approximate_total` is set, from a planner estimate or
+    a cached count.
     """
+    if ordering:
+        return _cursor_paginate_for_inertia(queryset, request, per_page, ordering, approximate_total)
+
     page = request.GET.get('page', 1)
     search = request.GET.get('search', '')
 
@@ -45,6 +53,34 @@ def paginate_for_inertia(queryset, request, per_page=20):
     }
 
 
+def _cursor_paginate_for_inertia(queryset, request, per_page, ordering, approximate_total):
+    from isp.services.pagination import InvalidCursor, approximate_count, keyset_paginate
+
+    try:
+        page = keyset_paginate(queryset, ordering, request.GET.get('cursor'), per_page)
+    except InvalidCursor:
+        page = keyset_paginate(queryset, ordering, None, per_page)
+
+    total, total_is_exact = approximate_count(queryset) if approximate_total else (None, False)
+
+    return {
+        'data': [item.to_dict() if hasattr(item, 'to_dict') else model_to_dict(item) for item in page.items],
+        'pagination': {
+            'mode': 'cursor',
+            'per_page': per_page,
+            'total': total,
+            'total_is_exact': total_is_exact,
+            'has_previous': page.has_previous,
+            'has_next': page.has_next,
+            'previous_cursor': page.previous_cursor,
+            'next_cursor': page.next_cursor,
+        },
+        'filters': {
+            'search': request.GET.get('search', ''),
+        }
+    }
+
+
 def get_breadcrumbs(route_name: str, **kwargs) -> List[Dict[str, str]]:
     """
     Generate breadcrumbs for navigation
@@ -103,9 +139,13 @@ def get_breadcrumbs(route_name: str, **kwargs) -> List[Dict[str, str]]:
 
 def get_sidebar_menu(request) -> List[Dict[str, Any]]:
     """
-    Generate sidebar menu items based on user permissions
+    Generate sidebar menu items based on user permissions.
+    Badge counts are not inlined: `badge_key` points into the optional `badges` prop.
     """
+    from isp.dashboard.props import get_user_permissions
+
     user = request.user
+    permissions = get_user_permissions(request)
 
     menu_items = [
         {
@@ -119,7 +159,7 @@ def get_sidebar_menu(request) -> List[Dict[str, Any]]:
             'icon': 'users',
             'route': 'dashboard:customers.index',
             'active': 'customers' in request.resolver_match.url_name,
-            'badge': get_pending_customers_count() if user.has_perm('customers.view_customer') else None
+            'badge_key': 'customers',
         },
         {
             'label': 'Packages',
@@ -150,7 +190,7 @@ def get_sidebar_menu(request) -> List[Dict[str, Any]]:
             'icon': 'support',
             'route': 'dashboard:tickets.index',
             'active': 'tickets' in request.resolver_match.url_name,
-            'badge': get_open_tickets_count() if user.has_perm('tickets.view_ticket') else None
+            'badge_key': 'tickets',
         },
         {
             'label': 'Billing',
@@ -217,54 +257,20 @@ def get_sidebar_menu(request) -> List[Dict[str, Any]]:
     # Filter menu items based on user permissions
     filtered_menu = []
     for item in menu_items:
-        if user.is_superuser or has_menu_permission(user, item):
+        if user.is_superuser or has_menu_permission(user, item, permissions):
             filtered_menu.append(item)
 
     return filtered_menu
 
 
-def get_dashboard_stats() -> Dict[str, Any]:
+def get_dashboard_stats(company_id: Optional[int] = None) -> Dict[str, Any]:
     """
-    Get key statistics for dashboard overview
+    Get key statistics for dashboard overview, scoped to a company
+    (all companies when company_id is None). Served from the stats cache.
     """
-    from isp.models import Customer, Subscription, Ticket, Invoice
+    from isp.services.stats import get_stats
 
-    today = timezone.now().date()
-    thirty_days_ago = today - timedelta(days=30)
-
-    return {
-        'customers': {
-            'total': Customer.objects.count(),
-            'active': Customer.objects.filter(status='active').count(),
-            'new_this_month': Customer.objects.filter(created_at__gte=thirty_days_ago).count(),
-        },
-        'subscriptions': {
-            'total': Subscription.objects.count(),
-            'active': Subscription.objects.filter(status='active').count(),
-            'revenue_this_month': Subscription.objects.filter(
-                status='active',
-                created_at__gte=thirty_days_ago
-            ).aggregate(total=Sum('monthly_fee'))['total'] or 0,
-        },
-        'tickets': {
-            'total': Ticket.objects.count(),
-            'open': Ticket.objects.filter(status__in=['open', 'in_progress']).count(),
-            'resolved_this_month': Ticket.objects.filter(
-                status='resolved',
-                resolution_date__gte=thirty_days_ago
-            ).count(),
-        },
-        'billing': {
-            'total_revenue': Invoice.objects.filter(status='paid').aggregate(
-                total=Sum('total_amount')
-            )['total'] or 0,
-            'pending_invoices': Invoice.objects.filter(status='sent').count(),
-            'overdue_invoices': Invoice.objects.filter(
-                status='sent',
-                due_date__lt=today
-            ).count(),
-        }
-    }
+    return get_stats(company_id)
 
 
 # =============================================================================
@@ -320,9 +326,10 @@ def get_open_tickets_count():
     return Ticket.objects.filter(status__in=['open', 'in_progress']).count()
 
 
-def has_menu_permission(user, menu_item):
+def has_menu_permission(user, menu_item, permissions=None):
     """
-    Check if user has permission to see menu item
+    Check if user has permission to see menu item.
+    Pass the user's permission set to avoid a permission query per item.
     """
     # Implement your permission logic here
     permission_map = {
@@ -341,6 +348,8 @@ def has_menu_permission(user, menu_item):
 
     required_permission = permission_map.get(menu_item['label'].lower())
     if required_permission:
+        if permissions is not None:
+            return user.is_superuser or required_permission in permissions
         return user.has_perm(required_permission)
 
     return True  # Default allow
@@ -371,27 +380,21 @@ def format_bytes(bytes_value):
 
 
 def get_usage_chart_data(subscription_id: int, days: int = 7):
-    """Get usage data for charts"""
-    from isp.models import UsageLog
+    """Get usage data for charts (daily rollups, raw UsageLog only for the open day)"""
+    from isp.services.rollups import DAY, usage_series
+
+    if not subscription_id:
+        return []
 
     end_date = timezone.now()
     start_date = end_date - timedelta(days=days)
 
-    usage_logs = UsageLog.objects.filter(
-        subscription_id=subscription_id,
-        start_time__gte=start_date,
-        start_time__lte=end_date
-    ).values('start_time__date').annotate(
-        total_bytes=Sum('input_octets') + Sum('output_octets'),
-        session_count=Count('id')
-    ).order_by('start_time__date')
-
     chart_data = []
-    for log in usage_logs:
+    for bucket in usage_series(start_date, end_date, DAY, subscription_id=subscription_id):
         chart_data.append({
-            'date': log['start_time__date'].isoformat(),
-            'usage_mb': round(log['total_bytes'] / (1024 * 1024), 2),
-            'sessions': log['session_count']
+            'date': bucket['bucket_start'].date().isoformat(),
+            'usage_mb': round((bucket['bytes_uploaded'] + bucket['bytes_downloaded']) / (1024 * 1024), 2),
+            'sessions': bucket['sessions']
         })
 
     return chart_data
@@ -405,18 +408,11 @@ def inertia_response_data(request, additional_data=None):
     """
     Common data to include in all Inertia responses
     """
+    from isp.dashboard.props import auth_props
+
+    company = request.user.company
     base_data = {
-        'auth': {
-            'user': {
-                'id': request.user.id,
-                'name': request.user.get_full_name(),
-                'email': request.user.email,
-                'avatar': request.user.profile.avatar.url if hasattr(request.user,
-                                                                     'profile') and request.user.profile.avatar else None,
-                'permissions': list(request.user.get_all_permissions()),
-                'is_superuser': request.user.is_superuser,
-            }
-        },
+        'auth': auth_props(request),
         'navigation': {
             'sidebar': get_sidebar_menu(request),
             'breadcrumbs': [],  # Will be set in individual views
@@ -429,9 +425,9 @@ def inertia_response_data(request, additional_data=None):
         },
         'config': {
             'app_name': 'ISP Management System',
-            'company_name': getattr(request.user, 'company', {}).get('name', 'Your ISP'),
+            'company_name': company.name if company else 'Your ISP',
             'timezone': 'UTC',  # Get from user/company settings
-            'currency': 'USD',  # Get from user/company settings
+            'currency': company.currency if company else 'USD',
         }
     }
 
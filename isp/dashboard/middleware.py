@@ -0,0 +1,21 @@
+"""
+ISP Management System - Dashboard Middleware
+Request hooks for the Inertia dashboard
+File: dashboard/middleware.py
+"""
+
+from isp.dashboard.props import share_props
+
+
+class SharedPropsMiddleware:
+    """
+    Registers the shared props on every request. They are callables, so nothing
+    (not even the session user) is loaded unless an Inertia response is rendered.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        share_props(request)
+        return self.get_response(request)
@@ -0,0 +1,174 @@
+"""
+ISP Management System - Inertia Shared Props
+Per-request memoized, cache-backed props shared with every Inertia page
+File: dashboard/props.py
+"""
+
+import functools
+import logging
+from typing import Dict, FrozenSet, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from inertia import optional, share
+
+logger = logging.getLogger(__name__)
+
+USER_PROPS_KEY = 'isp:user-props:{}'
+BADGES_KEY = 'isp:badges:{}'
+
+
+def props_settings() -> Dict:
+    defaults = {
+        'USER_PROPS_TTL': 300,
+        'BADGES_TTL': 30,
+    }
+    return {**defaults, **getattr(settings, 'INERTIA_SHARED_PROPS', {})}
+
+
+def request_cached(func):
+    """Compute `func(request)` at most once per request, however many helpers ask for it"""
+    @functools.wraps(func)
+    def wrapper(request):
+        memo = request.__dict__.setdefault('_isp_props', {})
+        if func.__name__ not in memo:
+            memo[func.__name__] = func(request)
+        return memo[func.__name__]
+    return wrapper
+
+
+def _cached(key: str, ttl: int, compute):
+    """cache.get_or_set that keeps serving (uncached) when the cache backend is down"""
+    try:
+        value = cache.get(key)
+    except Exception as e:
+        logger.warning("Shared props cache read failed: %s", e)
+        return compute()
+    if value is None:
+        value = compute()
+        try:
+            cache.set(key, value, ttl)
+        except Exception as e:
+            logger.warning("Shared props cache write failed: %s", e)
+    return value
+
+
+def _delete(keys: Iterable[str]) -> None:
+    try:
+        cache.delete_many(list(keys))
+    except Exception as e:
+        logger.warning("Shared props cache invalidation failed: %s", e)
+
+
+# =============================================================================
+# PERMISSIONS
+# =============================================================================
+
+def _user_snapshot(user) -> Dict:
+    profile = getattr(user, 'profile', None)
+    return {
+        'permissions': sorted(user.get_all_permissions()),
+        'avatar': profile.avatar.url if profile and profile.avatar else None,
+    }
+
+
+@request_cached
+def get_user_snapshot(request) -> Dict:
+    """Permission codenames and avatar of the user, cached per user (both cost queries otherwise)"""
+    user = request.user
+    if not user.is_authenticated:
+        return {'permissions': [], 'avatar': None}
+    return _cached(USER_PROPS_KEY.format(user.pk), props_settings()['USER_PROPS_TTL'],
+                   lambda: _user_snapshot(user))
+
+
+@request_cached
+def get_user_permissions(request) -> FrozenSet[str]:
+    """The user's permission codenames (`app_label.codename`)"""
+    return frozenset(get_user_snapshot(request)['permissions'])
+
+
+def user_has_perm(request, permission: str) -> bool:
+    user = request.user
+    return user.is_active and (user.is_superuser or permission in get_user_permissions(request))
+
+
+def invalidate_user_props(user_ids: Iterable[int]) -> None:
+    _delete(USER_PROPS_KEY.format(pk) for pk in user_ids)
+
+
+# =============================================================================
+# SIDEBAR BADGES
+# =============================================================================
+
+def compute_badge_counts(company_id: Optional[int]) -> Dict[str, int]:
+    from isp.models import Customer, Ticket
+
+    customers = Customer.objects.all()
+    tickets = Ticket.objects.all()
+    if company_id is not None:
+        customers = customers.filter(company_id=company_id)
+        tickets = tickets.filter(customer__company_id=company_id)
+
+    return {
+        'customers': customers.filter(status='lead').count(),
+        'tickets': tickets.filter(status__in=['open', 'in_progress']).count(),
+    }
+
+
+@request_cached
+def get_badge_counts(request) -> Dict[str, Optional[int]]:
+    """Sidebar badge counts for the user's company; badges the user may not see are None"""
+    if not request.user.is_authenticated:
+        return {}
+    company_id = request.user.company_id
+    counts = _cached(
+        BADGES_KEY.format(company_id if company_id is not None else 'all'),
+        props_settings()['BADGES_TTL'],
+        lambda: compute_badge_counts(company_id),
+    )
+    return {
+        'customers': counts['customers'] if user_has_perm(request, 'customers.view_customer') else None,
+        'tickets': counts['tickets'] if user_has_perm(request, 'tickets.view_ticket') else None,
+    }
+
+
+def invalidate_badges(company_id: Optional[int]) -> None:
+    keys = [BADGES_KEY.format('all')]
+    if company_id is not None:
+        keys.append(BADGES_KEY.format(company_id))
+    _delete(keys)
+
+
+# =============================================================================
+# SHARING
+# =============================================================================
+
+def auth_props(request) -> Optional[Dict]:
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    return {
+        'user': {
+            'id': user.id,
+            'name': user.get_full_name(),
+            'email': user.email,
+            'avatar': get_user_snapshot(request)['avatar'],
+            'permissions': get_user_snapshot(request)['permissions'],
+            'is_superuser': user.is_superuser,
+        }
+    }
+
+
+def share_props(request) -> None:
+    """
+    Share `auth` with every Inertia page and `badges` as an optional prop: it is left out
+    of normal visits and only computed on a partial reload that asks for it
+    (`router.reload({ only: ['badges'] })`).
+    """
+    share(
+        request,
+        auth=lambda: auth_props(request),
+        badges=optional(lambda: get_badge_counts(request)),
+    )
+
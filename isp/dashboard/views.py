@@ -375,8 +375,12 @@ def payment_record(request):
 @login_required
 @inertia("billing/overdue")
 def billing_overdue(request):
-    """Overdue accounts management"""
-    return {}
+    """Overdue accounts management: invoices bucketed by dunning stage, longest overdue first"""
+    from isp.services.dunning import overdue_summary
+
+    if request.user.company_id is None:
+        return {}
+    return overdue_summary(request.user.company_id)
 
 
 @login_required
@@ -1,5 +1,8 @@
 import random
 import string
+from typing import Dict, List
+
+from django.db import close_old_connections, connections
 
 
 def generate_key(length=16):
@@ -11,3 +14,28 @@ def get_mode_from_url(url):
         return 'https'
     else:
         return 'http'
+
+
+def latency_summary(samples: List[float], digits: int = 1) -> Dict:
+    """Count, mean and percentiles of durations in seconds, reported in milliseconds"""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    pick = lambda fraction: ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, digits),
+        'p50_ms': round(pick(0.50) * 1000, digits),
+        'p95_ms': round(pick(0.95) * 1000, digits),
+        'p99_ms': round(pick(0.99) * 1000, digits),
+        'max_ms': round(ordered[-1] * 1000, digits),
+    }
+
+
+def close_stale_connections():
+    """
+    close_old_connections() for long-running loops and workers, except on connections that
+    hold the caller's open transaction: Django closes those outright, which would abort it.
+    """
+    if not any(conn.in_atomic_block for conn in connections.all(initialized_only=True)):
+        close_old_connections()
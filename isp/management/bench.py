@@ -0,0 +1,102 @@
+"""
+ISP Management System - Benchmark Helpers
+Synthetic tenants and timing utilities shared by the bench_* management commands
+File: management/bench.py
+"""
+
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from typing import Dict, List
+
+from django.utils import timezone
+
+from isp.functions import latency_summary
+
+
+@contextmanager
+def synthetic_company(keep: bool = False, **overrides):
+    """Create a throwaway Company for a benchmark run and delete it (cascading) afterwards"""
+    from isp.models import Company
+
+    slug = f"bench-{uuid.uuid4().hex[:8]}"
+    company = Company.objects.create(**{
+        'name': slug,
+        'slug': slug,
+        'email': f'{slug}@example.com',
+        'phone': '0700000000',
+        'address': 'Benchmark',
+        **overrides,
+    })
+    try:
+        yield company
+    finally:
+        if not keep:
+            company.delete()
+
+
+def create_subscribers(company, count: int, batch_size: int = 2000, **subscription_fields) -> List:
+    """Bulk create `count` customers with one active subscription each; returns the subscriptions"""
+    from isp.models import Customer, InternetPackage, Subscription
+
+    now = timezone.now()
+    package = InternetPackage.objects.create(
+        company=company,
+        name='Bench 10GB',
+        description='Benchmark package',
+        package_type='pppoe',
+        billing_type='data_based',
+        download_speed=10,
+        upload_speed=5,
+        data_limit=10,
+        price=Decimal('1000.00'),
+    )
+    customers = Customer.objects.bulk_create([
+        Customer(
+            company=company,
+            full_name=f'Bench Customer {i}',
+            status='active',
+            primary_phone=f'07{i:08d}',
+            primary_email=f'customer{i}@{company.slug}.example.com',
+        )
+        for i in range(count)
+    ], batch_size=batch_size)
+    subscriptions = [
+        Subscription(**{
+            'customer': customer,
+            'package': package,
+            'subscription_id': f'{company.slug}-{i}',
+            'status': 'active',
+            'start_date': now - timedelta(days=30),
+            'next_billing_date': now,
+            'username': f'{company.slug}-u{i}',
+            'monthly_fee': package.price,
+            'data_limit_bytes': package.data_limit_bytes,
+            **subscription_fields,
+        })
+        for i, customer in enumerate(customers)
+    ]
+    return Subscription.objects.bulk_create(subscriptions, batch_size=batch_size)
+
+
+class Timer:
+    """Collects wall-clock samples and reports simple percentiles"""
+
+    def __init__(self):
+        self.samples: List[float] = []
+
+    @contextmanager
+    def measure(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples.append(time.perf_counter() - started)
+
+    def summary(self) -> Dict[str, float]:
+        summary = latency_summary(self.samples, digits=3)
+        if self.samples:
+            summary['total_s'] = round(sum(self.samples), 3)
+        return summary
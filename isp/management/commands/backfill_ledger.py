@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from isp.services.ledger import backfill_ledger
+
+
+class Command(BaseCommand):
+    help = 'Build the customer ledger from existing invoices and payments, in streaming batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, help='Only this company id')
+        parser.add_argument('--batch-size', type=int, help='Rows read and posted per batch')
+        parser.add_argument('--rebalance', action='store_true',
+                            help='Set current_balance to the ledger total instead of recording the difference '
+                                 'as an opening adjustment')
+
+    def handle(self, *args, **options):
+        def progress(kind, count):
+            if self.verbosity > 1:
+                self.stdout.write(f"  {kind}: {count} posted")
+
+        report = backfill_ledger(company_id=options['company'], rebalance=options['rebalance'],
+                                 batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(
+            f"Ledger backfilled: {report['invoices']} invoices, {report['payments']} payments, "
+            f"{report['adjustments']} opening adjustments, {report['rebalanced']} balances reset, "
+            f"{report['snapshots']} snapshots ({report['seconds']:.2f}s)"
+        )
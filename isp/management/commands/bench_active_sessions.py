@@ -0,0 +1,90 @@
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from isp.api.views import ActiveSessionsView
+from isp.management.bench import Timer, create_subscribers, synthetic_company
+from isp.services.accounting import AccountingRecord, flush_records
+from isp.services.sessions import get_table
+
+
+def nas_ip(index: int) -> str:
+    return f'10.250.{index // 250}.{index % 250 + 1}'
+
+
+class Command(BaseCommand):
+    help = 'Who-is-online queries: UsageLog scans against the active session table and /realtime/sessions/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=20_000)
+        parser.add_argument('--nas', type=int, default=100, help='NAS routers the sessions are spread over')
+        parser.add_argument('--zones', type=int, default=5)
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic tenant afterwards')
+
+    def handle(self, *args, **options):
+        from isp.models import NetworkEquipment, NetworkZone, UsageLog
+
+        with synthetic_company(keep=options['keep']) as company:
+            subscriptions = create_subscribers(company, options['sessions'])
+            zones = [NetworkZone.objects.create(company=company, name=f'Zone {i}', coverage_area='Benchmark')
+                     for i in range(options['zones'])]
+            NetworkEquipment.objects.bulk_create([
+                NetworkEquipment(
+                    company=company, zone=zones[i % len(zones)], name=f'NAS {i}', identity=f'{company.slug}-nas{i}',
+                    equipment_type='router', brand='MikroTik', model='CCR', serial_number=uuid.uuid4().hex,
+                    ip_address=nas_ip(i), location='Benchmark',
+                )
+                for i in range(options['nas'])
+            ])
+
+            now = timezone.now()
+            records = [
+                AccountingRecord('start', f'{company.slug}-s{i}', s.username, now,
+                                 framed_ip='10.0.0.2', nas_ip=nas_ip(i % options['nas']))
+                for i, s in enumerate(subscriptions)
+            ]
+            get_table().clear()
+            started = time.perf_counter()
+            for offset in range(0, len(records), 2000):
+                flush_records(records[offset:offset + 2000])
+            self.stdout.write(self.style.SUCCESS(
+                f"Active sessions benchmark ({len(records)} sessions on {options['nas']} NAS, "
+                f"{type(get_table()).__name__})"
+            ))
+            self.stdout.write(f"  flushed Start records      {time.perf_counter() - started:.2f} s")
+
+            open_logs = UsageLog.objects.filter(subscription__customer__company=company, session_end__isnull=True)
+            target = subscriptions[len(subscriptions) // 2].pk
+            user = get_user_model().objects.create_user(f'{company.slug}-noc', password=uuid.uuid4().hex,
+                                                        company=company)
+            view, factory = ActiveSessionsView.as_view(), APIRequestFactory()
+
+            def fetch():
+                request = factory.get('/api/v1/realtime/sessions/')
+                force_authenticate(request, user=user)
+                return view(request)
+
+            table = get_table()
+            variants = [
+                ('UsageLog: online count per NAS', lambda: list(open_logs.values('nas_ip').annotate(n=Count('id')))),
+                ('UsageLog: is subscriber online', lambda: open_logs.filter(subscription_id=target).exists()),
+                ('table: online count per NAS', lambda: table.counts(company.pk)),
+                ('table: is subscriber online', lambda: table.is_online(target)),
+                ('GET /realtime/sessions/', fetch),
+            ]
+            for label, call in variants:
+                timer = Timer()
+                for _ in range(options['iterations']):
+                    with timer.measure():
+                        call()
+                summary = timer.summary()
+                self.stdout.write(
+                    f"  {label:<32} mean {summary['mean_ms']:>8.3f} ms  p95 {summary['p95_ms']:>8.3f} ms"
+                )
+            get_table().clear()
@@ -0,0 +1,88 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from isp.management.bench import Timer, create_subscribers, synthetic_company
+
+# Everything the serializers nested before relations collapsed to ids
+FULL_EXPAND = {
+    '/api/v1/tickets/': 'customer,category,assigned_to,comments.author',
+    '/api/v1/invoices/': 'customer,subscription.customer,subscription.package.category,'
+                         'payments.customer,payments.processed_by',
+}
+SPARSE_FIELDS = {
+    '/api/v1/tickets/': 'id,ticket_id,subject,status,priority,customer,created_at',
+    '/api/v1/invoices/': 'id,invoice_number,status,total_amount,due_date,customer',
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare payload size and latency of /tickets/ and /invoices/ with full nesting, default and ?fields='
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200, help='Tickets and invoices to create')
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic tenant afterwards')
+
+    def handle(self, *args, **options):
+        from isp.models import User
+
+        with synthetic_company(keep=options['keep']) as company:
+            agent = User.objects.create_user(f'{company.slug}-agent', company=company, user_type='support')
+            self.populate(company, agent, options['rows'])
+            client = APIClient()
+            client.force_authenticate(agent)
+
+            self.stdout.write(self.style.SUCCESS(
+                f"API payload benchmark ({options['rows']} rows, page size {options['page_size']})"
+            ))
+            for url in FULL_EXPAND:
+                variants = [
+                    ('full nesting', {'expand': FULL_EXPAND[url]}),
+                    ('default (ids)', {}),
+                    ('?fields=', {'fields': SPARSE_FIELDS[url]}),
+                ]
+                for label, params in variants:
+                    params = {**params, 'page_size': options['page_size']}
+                    timer, size = Timer(), 0
+                    for _ in range(options['iterations']):
+                        with timer.measure():
+                            response = client.get(url, params)
+                        size = len(response.content)
+                    summary = timer.summary()
+                    self.stdout.write(
+                        f"  {url:<18} {label:<14} {size / 1024:>9.1f} KiB  "
+                        f"mean {summary['mean_ms']:>8.2f} ms  p95 {summary['p95_ms']:>8.2f} ms"
+                    )
+            agent.delete()
+
+    def populate(self, company, agent, rows):
+        from isp.models import Invoice, Payment, Ticket, TicketComment
+
+        subscriptions = create_subscribers(company, rows)
+        today = timezone.now().date()
+        tickets = Ticket.objects.bulk_create([
+            Ticket(ticket_id=f'T{company.pk}-{i}', customer_id=s.customer_id, subject='Slow connection',
+                   description='Speed drops every evening ' * 10, ticket_type='technical', assigned_to=agent)
+            for i, s in enumerate(subscriptions)
+        ])
+        TicketComment.objects.bulk_create([
+            TicketComment(ticket=ticket, author=agent, comment='Checking the line')
+            for ticket in tickets for _ in range(3)
+        ])
+        invoices = Invoice.objects.bulk_create([
+            Invoice(customer_id=s.customer_id, subscription=s, invoice_number=f'B{company.pk}-{i}',
+                    issue_date=today, due_date=today + timedelta(days=14),
+                    subtotal=Decimal('1000'), total_amount=Decimal('1000'))
+            for i, s in enumerate(subscriptions)
+        ])
+        Payment.objects.bulk_create([
+            Payment(customer_id=invoice.customer_id, invoice=invoice, payment_id=f'P{company.pk}-{i}',
+                    amount=Decimal('500'), payment_method='mobile_money', payment_date=timezone.now(),
+                    processed_by=agent)
+            for i, invoice in enumerate(invoices)
+        ])
@@ -0,0 +1,87 @@
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from isp.management.bench import create_subscribers, synthetic_company
+from isp.services.billing import add_months, billing_settings, invoice_number, run_sharded_billing, tax_for
+
+
+class Command(BaseCommand):
+    help = 'Billing run throughput: one invoice at a time, set-based in one process, and sharded over processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscriptions', type=int, default=100_000)
+        parser.add_argument('--companies', type=int, default=10, help='Tenants the subscriptions are spread over')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--shard-size', type=int)
+        parser.add_argument('--baseline', type=int, default=500,
+                            help='Subscriptions billed one at a time first, for comparison')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic tenants afterwards')
+
+    def handle(self, *args, **options):
+        from isp.models import Invoice, Subscription
+
+        as_of = timezone.now()
+        due = as_of - timedelta(days=1)
+        with ExitStack() as stack:
+            started = time.perf_counter()
+            companies = [stack.enter_context(synthetic_company(keep=options['keep'],
+                                                               timezone=['UTC', 'Africa/Nairobi'][i % 2]))
+                         for i in range(options['companies'])]
+            # One large tenant and several small ones
+            sizes = [options['subscriptions'] // 2] + [
+                options['subscriptions'] // 2 // max(options['companies'] - 1, 1)
+            ] * (options['companies'] - 1)
+            subscriptions = []
+            for company, size in zip(companies, sizes):
+                subscriptions += create_subscribers(company, size, next_billing_date=due)
+            ids = [company.pk for company in companies]
+            self.stdout.write(self.style.SUCCESS(
+                f"Billing benchmark ({len(subscriptions)} due subscriptions over {len(companies)} tenants, "
+                f"created in {time.perf_counter() - started:.1f} s)"
+            ))
+
+            # What a per-subscription loop costs: one invoice, its item and the subscription saved each time
+            self.one_at_a_time(subscriptions[:options['baseline']], as_of)
+
+            for workers in (0, options['workers']):
+                Invoice.objects.filter(customer__company_id__in=ids).delete()
+                Subscription.objects.filter(customer__company_id__in=ids).update(
+                    next_billing_date=due, last_billing_date=None
+                )
+                run = run_sharded_billing(as_of=as_of, workers=workers, shard_size=options['shard_size'])
+                slowest = max((entry['seconds'] for entry in run.report['shards']), default=0)
+                label = 'in process' if run.workers <= 1 else f'{run.workers} processes'
+                self.stdout.write(
+                    f"  {label:<14} {run.report['seconds']:>7.1f} s"
+                    f"  {run.invoices} invoices, {run.shards} shards (slowest {slowest:.1f} s), {run.status}"
+                )
+            rerun = run_sharded_billing(as_of=as_of, workers=options['workers'], shard_size=options['shard_size'])
+            self.stdout.write(f"  rerun          {rerun.report['seconds']:>7.1f} s  {rerun.invoices} new invoices")
+
+    def one_at_a_time(self, subscriptions, as_of):
+        from isp.models import Invoice, InvoiceItem
+
+        rate = Decimal(billing_settings()['TAX_RATE'])
+        started = time.perf_counter()
+        for subscription in subscriptions:
+            subtotal = subscription.monthly_fee
+            tax = tax_for(subtotal, rate)
+            invoice = Invoice.objects.create(
+                customer_id=subscription.customer_id, subscription=subscription, status='sent',
+                invoice_number=invoice_number(subscription.pk, subscription.next_billing_date),
+                issue_date=subscription.next_billing_date.date(), due_date=as_of.date() + timedelta(days=14),
+                subtotal=subtotal, tax_rate=rate, tax_amount=tax, total_amount=subtotal + tax,
+            )
+            InvoiceItem(invoice=invoice, description='Service', unit_price=subtotal).save()
+            subscription.last_billing_date = subscription.next_billing_date
+            subscription.next_billing_date = add_months(subscription.next_billing_date, 1)
+            subscription.save(update_fields=['last_billing_date', 'next_billing_date', 'updated_at'])
+        if subscriptions:
+            per_row = (time.perf_counter() - started) / len(subscriptions)
+            self.stdout.write(f"  one at a time  {per_row * 1000:>7.3f} ms/subscription "
+                              f"(~{per_row * 100_000 / 60:.1f} min per 100k)")
@@ -0,0 +1,74 @@
+import time
+import uuid
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+
+from isp.api.views import EquipmentCertView
+from isp.management.bench import Timer, synthetic_company
+from isp.services.certs import forget_cert
+from mtk.services import Mtk
+
+
+class Command(BaseCommand):
+    help = 'Router certificate downloads through EquipmentCertView against a simulated Mtk middleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--latency', type=float, default=0.05, help='Simulated middleware seconds per bundle')
+        parser.add_argument('--size', type=int, default=8 * 1024, help='Bundle size in bytes')
+        parser.add_argument('--directory', help='Store bundles in this directory instead of the cache')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic tenant afterwards')
+
+    def handle(self, *args, **options):
+        from isp.models import NetworkEquipment
+
+        body = b'x' * options['size']
+
+        def cert_stream(identity):
+            time.sleep(options['latency'])
+            return mock.Mock(iter_content=mock.Mock(return_value=iter([body])))
+
+        view = EquipmentCertView.as_view()
+        factory = RequestFactory()
+        certs = {'DIRECTORY': options['directory'], 'TTL': 3600}
+        with synthetic_company(keep=options['keep']) as company, override_settings(ROUTER_CERTS=certs), \
+                mock.patch.object(Mtk, 'cert_stream', side_effect=cert_stream):
+            auth = uuid.uuid4().hex
+            router = NetworkEquipment.objects.create(
+                company=company, name='Bench router', identity=f'{company.slug}-r', auth_code=auth,
+                equipment_type='router', brand='MikroTik', model='hAP', location='Benchmark',
+            )
+
+            def fetch(**headers):
+                response = view(factory.get(f'/api/v1/equipments/auth/cert/{auth}/', **headers), auth_code=auth)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                return response
+
+            def miss():
+                forget_cert(router.identity)
+                return fetch()
+
+            etag = (fetch(), fetch()['ETag'])[1]
+            variants = [
+                ('upstream (miss)', miss),
+                ('stored bundle', fetch),
+                ('304 If-None-Match', lambda: fetch(HTTP_IF_NONE_MATCH=etag)),
+            ]
+            store = f"directory {options['directory']}" if options['directory'] else 'cache'
+            self.stdout.write(self.style.SUCCESS(
+                f"Certificate downloads ({store}, {options['size']} B, {options['latency'] * 1000:.0f} ms upstream, "
+                f"{options['iterations']} requests each)"
+            ))
+            for label, call in variants:
+                timer = Timer()
+                for _ in range(options['iterations']):
+                    with timer.measure():
+                        call()
+                summary = timer.summary()
+                self.stdout.write(
+                    f"  {label:<18} mean {summary['mean_ms']:>8.3f} ms  p95 {summary['p95_ms']:>8.3f} ms  "
+                    f"{summary['count'] / summary['total_s']:>8.0f} req/s"
+                )
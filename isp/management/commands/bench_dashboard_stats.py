@@ -0,0 +1,116 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from isp.management.bench import Timer, create_subscribers, synthetic_company
+from isp.services.stats import compute_stats, get_stats, invalidate_stats
+
+
+def legacy_dashboard_stats():
+    """The pre-engine get_dashboard_stats(): one query per counter, unscoped"""
+    from isp.models import Customer, Invoice, Subscription, Ticket
+
+    today = timezone.now().date()
+    thirty_days_ago = today - timedelta(days=30)
+
+    return {
+        'customers': {
+            'total': Customer.objects.count(),
+            'active': Customer.objects.filter(status='active').count(),
+            'new_this_month': Customer.objects.filter(created_at__gte=thirty_days_ago).count(),
+        },
+        'subscriptions': {
+            'total': Subscription.objects.count(),
+            'active': Subscription.objects.filter(status='active').count(),
+            'revenue_this_month': Subscription.objects.filter(
+                status='active',
+                created_at__gte=thirty_days_ago
+            ).aggregate(total=Sum('monthly_fee'))['total'] or 0,
+        },
+        'tickets': {
+            'total': Ticket.objects.count(),
+            'open': Ticket.objects.filter(status__in=['open', 'in_progress']).count(),
+            'resolved_this_month': Ticket.objects.filter(
+                status='resolved',
+                resolution_date__gte=thirty_days_ago
+            ).count(),
+        },
+        'billing': {
+            'total_revenue': Invoice.objects.filter(status='paid').aggregate(
+                total=Sum('total_amount')
+            )['total'] or 0,
+            'pending_invoices': Invoice.objects.filter(status='sent').count(),
+            'overdue_invoices': Invoice.objects.filter(
+                status='sent',
+                due_date__lt=today
+            ).count(),
+        }
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compare query count and latency of the cached dashboard stats engine against the legacy function'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=20_000, help='Synthetic customers to create')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed calls per variant')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic tenant afterwards')
+
+    def handle(self, *args, **options):
+        with synthetic_company(keep=options['keep']) as company:
+            self.populate(company, options['customers'])
+
+            variants = [
+                ('legacy (unscoped)', legacy_dashboard_stats, None),
+                ('engine uncached', lambda: compute_stats(company.pk), None),
+                ('engine cached', lambda: get_stats(company.pk), lambda: get_stats(company.pk)),
+                ('engine after write', lambda: get_stats(company.pk), lambda: invalidate_stats(company.pk)),
+            ]
+
+            self.stdout.write(self.style.SUCCESS(
+                f"Dashboard stats benchmark ({options['customers']} customers, {options['iterations']} calls)"
+            ))
+            for label, call, before in variants:
+                timer = Timer()
+                queries = 0
+                for _ in range(options['iterations']):
+                    if before:
+                        before()
+                    with CaptureQueriesContext(connection) as captured, timer.measure():
+                        call()
+                    queries += len(captured)
+                summary = timer.summary()
+                self.stdout.write(
+                    f"  {label:<20} queries/call {queries / options['iterations']:>5.1f}  "
+                    f"mean {summary['mean_ms']:>9.3f} ms  p95 {summary['p95_ms']:>9.3f} ms"
+                )
+            invalidate_stats(company.pk)
+
+    def populate(self, company, count):
+        from isp.models import Invoice, Ticket
+
+        subscriptions = create_subscribers(company, count)
+        today = timezone.now().date()
+        Ticket.objects.bulk_create([
+            Ticket(
+                ticket_id=f'T{company.pk}-{i}', customer_id=s.customer_id, subject='Slow link',
+                description='', ticket_type='technical',
+                status=random.choice(['open', 'in_progress', 'resolved', 'closed']),
+            )
+            for i, s in enumerate(subscriptions[::4])
+        ], batch_size=2000)
+        Invoice.objects.bulk_create([
+            Invoice(
+                invoice_number=f'INV{company.pk}-{i}', customer_id=s.customer_id, subscription=s,
+                issue_date=today - timedelta(days=random.randint(0, 60)),
+                due_date=today - timedelta(days=random.randint(-10, 10)), subtotal=Decimal('1000'),
+                total_amount=Decimal('1000'), status=random.choice(['sent', 'paid', 'draft']),
+            )
+            for i, s in enumerate(subscriptions)
+        ], batch_size=2000)
@@ -0,0 +1,68 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from isp.management.bench import Timer, create_subscribers, synthetic_company
+from isp.services.dunning import run_dunning
+
+
+class Command(BaseCommand):
+    help = 'Dunning run and overdue flags: per-row Python checks against the indexed scan and SQL annotation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, default=100_000)
+        parser.add_argument('--overdue', type=float, default=0.2, help='Share of the invoices past their due date')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic tenant afterwards')
+
+    def handle(self, *args, **options):
+        from isp.models import Invoice, Notification
+
+        count = options['invoices']
+        with synthetic_company(keep=options['keep']) as company:
+            started = time.perf_counter()
+            subscriptions = create_subscribers(company, count)
+            today = timezone.now().date()
+            late = int(count * options['overdue'])
+            # The overdue ones are spread over 1-40 days late, the rest are due in the coming weeks
+            Invoice.objects.bulk_create([
+                Invoice(customer_id=s.customer_id, subscription=s, invoice_number=f'{company.slug}-INV{i}',
+                        status='sent', issue_date=today - timedelta(days=45), subtotal=Decimal('1000.00'),
+                        total_amount=Decimal('1000.00'),
+                        due_date=today - timedelta(days=1 + i % 40) if i < late else today + timedelta(days=i % 30))
+                for i, s in enumerate(subscriptions)
+            ], batch_size=2000)
+            self.stdout.write(self.style.SUCCESS(
+                f"Dunning benchmark ({count} invoices, {late} overdue, set up in {time.perf_counter() - started:.1f} s)"
+            ))
+
+            invoices = Invoice.objects.filter(customer__company=company)
+            variants = [
+                ('overdue: is_overdue per row', lambda: sum(1 for invoice in invoices.only('status', 'due_date')
+                                                            if invoice.is_overdue)),
+                ('overdue: indexed scan', lambda: invoices.overdue().count()),
+                ('list page: property', lambda: [i.is_overdue for i in Invoice.objects.order_by('-id')[:100]]),
+                ('list page: with_overdue()', lambda: [i.is_overdue for i in
+                                                       Invoice.objects.with_overdue().order_by('-id')[:100]]),
+            ]
+            for label, call in variants:
+                timer = Timer()
+                for _ in range(options['iterations']):
+                    with timer.measure():
+                        call()
+                summary = timer.summary()
+                self.stdout.write(
+                    f"  {label:<30} mean {summary['mean_ms']:>9.2f} ms  p95 {summary['p95_ms']:>9.2f} ms"
+                )
+
+            for attempt in ('first run', 'rerun'):
+                result = run_dunning(company_id=company.pk)
+                self.stdout.write(
+                    f"  run_dunning ({attempt:<9}) {result.duration:>7.2f} s: {result.overdue} overdue, "
+                    f"{result.marked_overdue} marked, {result.notifications} notifications, "
+                    f"{len(result.suspension_candidates)} to suspend"
+                )
+            Notification.objects.filter(customer__company=company).delete()
@@ -0,0 +1,58 @@
+import tracemalloc
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from isp.management.bench import Timer, create_subscribers, synthetic_company
+from isp.services.exports import CSV, NDJSON, USAGE, render_export
+
+
+class Command(BaseCommand):
+    help = 'Stream UsageLog exports of growing size and report throughput and peak Python memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000],
+                            help='Export sizes to compare (rows are created once, for the largest)')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic tenant afterwards')
+
+    def handle(self, *args, **options):
+        sizes = sorted(options['rows'])
+        with synthetic_company(keep=options['keep']) as company:
+            subscriptions = create_subscribers(company, 100)
+            self.populate(subscriptions, sizes[-1])
+            self.stdout.write(self.style.SUCCESS(f"Export benchmark (UsageLog, up to {sizes[-1]} rows)"))
+
+            for rows in sizes:
+                queryset = USAGE.queryset(company.pk)[:rows]
+                for fmt, compress in ((CSV, False), (NDJSON, False), (CSV, True)):
+                    timer, size = Timer(), 0
+                    tracemalloc.start()
+                    with timer.measure():
+                        for chunk in render_export(queryset, USAGE.headers, USAGE.lookups, fmt, compress):
+                            size += len(chunk)
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                    label = fmt + ('.gz' if compress else '')
+                    seconds = timer.summary()['total_s']
+                    self.stdout.write(
+                        f"  {rows:>9} rows {label:<7} {size / 2 ** 20:>8.1f} MiB  {seconds:>7.2f} s  "
+                        f"{rows / max(seconds, 1e-9):>9.0f} rows/s  peak {peak / 2 ** 20:>6.2f} MiB"
+                    )
+
+    def populate(self, subscriptions, rows, batch_size=5000):
+        from isp.models import UsageLog
+
+        start = timezone.now() - timedelta(seconds=rows)
+        for offset in range(0, rows, batch_size):
+            UsageLog.objects.bulk_create([
+                UsageLog(
+                    subscription=subscriptions[i % len(subscriptions)],
+                    session_start=start + timedelta(seconds=i),
+                    ip_address='10.0.0.2',
+                    session_id=f'bench-{i}',
+                    bytes_uploaded=i,
+                    bytes_downloaded=i * 2,
+                )
+                for i in range(offset, min(offset + batch_size, rows))
+            ])
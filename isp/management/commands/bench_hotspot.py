@@ -0,0 +1,53 @@
+import uuid
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from isp.api.views import HotspotView
+from isp.management.bench import Timer, synthetic_company
+from isp.services.hotspot import page_cache
+
+
+class Command(BaseCommand):
+    help = 'Captive-portal page throughput of HotspotView: rendered, from the shared cache and from memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=5000)
+        parser.add_argument('--file', choices=['login.html', 'rlogin.html'], default='login.html')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic tenant afterwards')
+
+    def handle(self, *args, **options):
+        from isp.models import NetworkEquipment
+
+        view = HotspotView.as_view()
+        factory = RequestFactory()
+        with synthetic_company(keep=options['keep']) as company:
+            auth = uuid.uuid4().hex
+            NetworkEquipment.objects.create(
+                company=company, name='Bench router', identity=f'{company.slug}-r', auth_code=auth,
+                equipment_type='router', brand='MikroTik', model='hAP', serial_number=auth, location='Benchmark',
+            )
+            path = f'/api/v1/mikrotik/hotspot/{auth}/{options["file"]}'
+
+            def fetch():
+                return view(factory.get(path), router_identity=auth, file_name=options['file'])
+
+            variants = [
+                ('rendered (no cache)', lambda: (page_cache.clear(), cache.clear(), fetch())),
+                ('shared cache', lambda: (page_cache.clear(), fetch())),
+                ('process memory', fetch),
+            ]
+            self.stdout.write(self.style.SUCCESS(
+                f"Hotspot page benchmark ({options['file']}, {options['iterations']} requests each)"
+            ))
+            for label, call in variants:
+                timer = Timer()
+                for _ in range(options['iterations']):
+                    with timer.measure():
+                        call()
+                summary = timer.summary()
+                self.stdout.write(
+                    f"  {label:<20} mean {summary['mean_ms']:>7.3f} ms  p95 {summary['p95_ms']:>7.3f} ms  "
+                    f"{summary['count'] / summary['total_s']:>8.0f} req/s"
+                )
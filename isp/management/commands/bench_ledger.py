@@ -0,0 +1,100 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.utils import timezone
+
+from isp.management.bench import Timer, create_subscribers, synthetic_company
+from isp.services.ledger import backfill_ledger, balance_at, balances_at, take_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Customer ledger: streaming backfill, and balances from snapshot plus delta against summing history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=5_000)
+        parser.add_argument('--months', type=int, default=12, help='Months of invoice/payment history per customer')
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic tenant afterwards')
+
+    def handle(self, *args, **options):
+        from isp.models import Customer, Invoice, LedgerEntry, Payment
+
+        count, months = options['customers'], options['months']
+        with synthetic_company(keep=options['keep']) as company:
+            started = time.perf_counter()
+            subscriptions = create_subscribers(company, count)
+            now = timezone.now()
+            for month in range(months):
+                issued = now - timedelta(days=30 * (months - month))
+                invoices = Invoice.objects.bulk_create([
+                    Invoice(customer_id=s.customer_id, subscription=s, invoice_number=f'{company.slug}-{month}-{i}',
+                            status='paid', issue_date=issued.date(), due_date=issued.date(),
+                            subtotal=Decimal('1000.00'), total_amount=Decimal('1000.00'))
+                    for i, s in enumerate(subscriptions)
+                ], batch_size=2000)
+                Invoice.objects.filter(pk__in=[invoice.pk for invoice in invoices]).update(created_at=issued)
+                Payment.objects.bulk_create([
+                    Payment(customer_id=invoice.customer_id, invoice=invoice, payment_id=f'{company.slug}-{invoice.pk}',
+                            amount=Decimal('900.00'), payment_method='cash', status='completed',
+                            payment_date=issued + timedelta(days=3))
+                    for invoice in invoices
+                ], batch_size=2000)
+            self.stdout.write(self.style.SUCCESS(
+                f"Ledger benchmark ({count} customers x {months} months, set up in "
+                f"{time.perf_counter() - started:.1f} s)"
+            ))
+
+            report = backfill_ledger(company_id=company.pk, rebalance=True)
+            self.stdout.write(
+                f"  backfill {report['seconds']:>7.2f} s: {report['invoices']} invoices, {report['payments']} "
+                f"payments, {report['snapshots']} snapshots"
+            )
+            # Month-end snapshots, as the periodic snapshot_balances run would have left them
+            started = time.perf_counter()
+            for month in range(months):
+                take_snapshots(as_of=now - timedelta(days=30 * (months - month) - 20), company_id=company.pk)
+            self.stdout.write(f"  {months} historical snapshot runs in {time.perf_counter() - started:.2f} s")
+
+            customers = list(Customer.objects.filter(company=company).order_by('pk').values_list('pk', flat=True))
+            customer, page = customers[count // 2], customers[:100]
+            when = now - timedelta(days=45)
+
+            def summed(customer_ids, at):
+                """What a point-in-time balance costs without the ledger: invoices minus payments up to then"""
+                invoiced = dict(Invoice.objects.filter(customer_id__in=customer_ids, created_at__lte=at)
+                                .values('customer_id').annotate(total=Sum('total_amount'))
+                                .values_list('customer_id', 'total'))
+                paid = dict(Payment.objects.filter(customer_id__in=customer_ids, payment_date__lte=at,
+                                                   status='completed')
+                            .values('customer_id').annotate(total=Sum('amount')).values_list('customer_id', 'total'))
+                return {pk: (invoiced.get(pk) or 0) - (paid.get(pk) or 0) for pk in customer_ids}
+
+            assert summed([customer], when)[customer] == balance_at(customer, when)
+            assert summed(page, now) == {pk: Customer.objects.get(pk=pk).current_balance for pk in page}
+
+            entries = LedgerEntry.objects.filter(customer_id=customer)
+            variants = [
+                ('now: sum invoices - payments', lambda: summed([customer], now)),
+                ('now: sum ledger entries', lambda: entries.aggregate(total=Sum('amount'))),
+                ('now: current_balance', lambda: balance_at(customer)),
+                ('past: sum invoices - payments', lambda: summed([customer], when)),
+                ('past: snapshot + delta', lambda: balance_at(customer, when)),
+                ('past, 100 customers: sums', lambda: summed(page, when)),
+                ('past, 100 customers: snapshots', lambda: balances_at(page, when)),
+                ('company total: sum entries', lambda: LedgerEntry.objects.filter(customer__company=company)
+                 .aggregate(total=Sum('amount'))),
+                ('company total: current_balance', lambda: Customer.objects.filter(company=company)
+                 .aggregate(total=Sum('current_balance'))),
+            ]
+            for label, call in variants:
+                timer = Timer()
+                for _ in range(options['iterations']):
+                    with timer.measure():
+                        call()
+                summary = timer.summary()
+                self.stdout.write(
+                    f"  {label:<34} mean {summary['mean_ms']:>9.2f} ms  p95 {summary['p95_ms']:>9.2f} ms"
+                )
@@ -0,0 +1,83 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from isp.management.bench import Timer, create_subscribers, synthetic_company
+from isp.services.lifecycle import apply_subscription_operation
+from isp.services.routers import FakeRouterBackend, router_settings
+
+
+class Command(BaseCommand):
+    help = 'Suspend then reactivate N subscribers spread over R routers against a fake router backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=10_000)
+        parser.add_argument('--routers', type=int, default=20)
+        parser.add_argument('--latency', type=float, default=0.05, help='Fake round trip per router call (s)')
+        parser.add_argument('--command-cost', type=float, default=0.0001, help='Fake cost per command (s)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Commands per router call')
+        parser.add_argument('--concurrency', type=int, default=None, help='Routers pushed to in parallel')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic tenant afterwards')
+
+    def handle(self, *args, **options):
+        overrides = {key: options[name] for key, name in (('BATCH_SIZE', 'batch_size'), ('CONCURRENCY', 'concurrency'))
+                     if options[name]}
+        with override_settings(ROUTER_PROVISIONING={**router_settings(), **overrides}), \
+                synthetic_company(keep=options['keep']) as company:
+            subscriptions = self.populate(company, options['subscribers'], options['routers'])
+            ids = [subscription.pk for subscription in subscriptions]
+            settings = router_settings()
+
+            self.stdout.write(self.style.SUCCESS(
+                f"Lifecycle benchmark ({len(ids)} subscribers, {options['routers']} routers, "
+                f"{options['latency'] * 1000:.0f} ms/call, batch {settings['BATCH_SIZE']}, "
+                f"concurrency {settings['CONCURRENCY']})"
+            ))
+            for operation in ('suspend', 'reactivate'):
+                backend = FakeRouterBackend(options['latency'], options['command_cost'])
+                timer = Timer()
+                with timer.measure():
+                    outcome = apply_subscription_operation(
+                        company.pk, ids, operation, {'reason': 'benchmark'}, backend=backend,
+                    )
+                self.report(operation, outcome, backend, timer.summary()['total_s'])
+
+            # Same work as one call per subscriber, with the same parallelism across routers
+            workers = min(settings['CONCURRENCY'], options['routers'])
+            unbatched = len(ids) * (options['latency'] + options['command_cost']) / max(workers, 1)
+            self.stdout.write(f"  one call per subscriber would spend ~{unbatched:.1f} s on router calls")
+
+    def report(self, operation, outcome, backend, seconds):
+        per_router = defaultdict(lambda: [0, 0, 0.0])
+        for router_id, commands, elapsed in backend.calls:
+            per_router[router_id][0] += commands
+            per_router[router_id][1] += 1
+            per_router[router_id][2] += elapsed
+        rates = sorted(commands / max(elapsed, 1e-9) for commands, _, elapsed in per_router.values())
+
+        self.stdout.write(
+            f"  {operation:<10} {outcome.succeeded:>6} ok {outcome.failed:>4} failed  end-to-end {seconds:>7.2f} s  "
+            f"{outcome.succeeded / max(seconds, 1e-9):>8.0f} subs/s  {len(backend.calls)} router calls"
+        )
+        if rates:
+            self.stdout.write(
+                f"  {'':<10} per router: min {rates[0]:>8.0f}  median {rates[len(rates) // 2]:>8.0f}  "
+                f"max {rates[-1]:>8.0f} commands/s"
+            )
+
+    def populate(self, company, subscribers, routers):
+        from isp.models import NetworkEquipment, Subscription
+
+        equipment = NetworkEquipment.objects.bulk_create([
+            NetworkEquipment(
+                company=company, name=f'Router {i}', identity=f'{company.slug}-r{i}', equipment_type='router',
+                brand='MikroTik', model='CCR', serial_number=f'{company.slug}-r{i}', location='Benchmark',
+            )
+            for i in range(routers)
+        ])
+        subscriptions = create_subscribers(company, subscribers)
+        for i, subscription in enumerate(subscriptions):
+            subscription.router = equipment[i % routers]
+        Subscription.objects.bulk_update(subscriptions, ['router'], batch_size=2000)
+        return subscriptions
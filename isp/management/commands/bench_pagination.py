@@ -0,0 +1,77 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.utils import timezone
+
+from isp.management.bench import Timer, create_subscribers, synthetic_company
+from isp.services.pagination import Keyset, approximate_count, keyset_paginate
+
+ORDERING = ('-session_start', '-id')
+
+
+class Command(BaseCommand):
+    help = 'Compare OFFSET (Paginator) and keyset pagination latency on page 1 and a deep page of UsageLog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200_000, help='UsageLog rows to create')
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--page', type=int, default=10_000, help='Deep page number to compare')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--scope', choices=['table', 'company'], default='table',
+                            help='Page the whole table (index order) or only the synthetic company (tenant join)')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic tenant afterwards')
+
+    def handle(self, *args, **options):
+        from isp.models import UsageLog
+
+        size, deep = options['page_size'], options['page']
+        rows = max(options['rows'], size * deep)
+
+        with synthetic_company(keep=options['keep']) as company:
+            subscriptions = create_subscribers(company, 100)
+            self.populate(subscriptions, rows)
+            queryset = UsageLog.objects.all()
+            if options['scope'] == 'company':
+                queryset = queryset.filter(subscription__customer__company=company)
+
+            # Cursor a client would hold after walking to the deep page
+            anchor = queryset.order_by(*ORDERING).values('session_start', 'id')[(deep - 1) * size - 1]
+            cursor = Keyset(UsageLog, ORDERING).encode(anchor)
+
+            variants = [
+                ('offset page 1', lambda: list(Paginator(queryset.order_by(*ORDERING), size).page(1))),
+                (f'offset page {deep}', lambda: list(Paginator(queryset.order_by(*ORDERING), size).page(deep))),
+                ('keyset page 1', lambda: keyset_paginate(queryset, ORDERING, None, size)),
+                (f'keyset page {deep}', lambda: keyset_paginate(queryset, ORDERING, cursor, size)),
+                ('exact COUNT(*)', lambda: queryset.count()),
+                ('approximate count', lambda: approximate_count(queryset)),
+            ]
+
+            self.stdout.write(self.style.SUCCESS(
+                f"Pagination benchmark ({rows} rows, page size {size}, scope {options['scope']})"
+            ))
+            for label, call in variants:
+                timer = Timer()
+                for _ in range(options['iterations']):
+                    with timer.measure():
+                        call()
+                summary = timer.summary()
+                self.stdout.write(
+                    f"  {label:<20} mean {summary['mean_ms']:>9.3f} ms  p95 {summary['p95_ms']:>9.3f} ms"
+                )
+
+    def populate(self, subscriptions, rows, batch_size=5000):
+        from isp.models import UsageLog
+
+        start = timezone.now() - timedelta(seconds=rows)
+        for offset in range(0, rows, batch_size):
+            UsageLog.objects.bulk_create([
+                UsageLog(
+                    subscription=subscriptions[i % len(subscriptions)],
+                    session_start=start + timedelta(seconds=i),
+                    ip_address='10.0.0.2',
+                    session_id=f'bench-{i}',
+                )
+                for i in range(offset, min(offset + batch_size, rows))
+            ])
@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand
+
+from isp.management.bench import create_subscribers, synthetic_company
+from isp.management.routeros_sim import SimulatedFleet, SimulatedRouter
+from isp.services.routeros import RouterOSConnection
+from isp.services.telemetry import POLL_COMMANDS, FleetPoller, RouterTarget
+
+
+class Command(BaseCommand):
+    help = 'Poll a simulated RouterOS fleet: pooled pipelined cycles versus a connection and round trip per command'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--routers', type=int, default=1000)
+        parser.add_argument('--sessions', type=int, default=20, help='Active sessions per router')
+        parser.add_argument('--latency', type=float, default=0.005, help='Simulated seconds per router command')
+        parser.add_argument('--concurrency', type=int, default=200)
+        parser.add_argument('--cycles', type=int, default=3)
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic tenant afterwards')
+
+    def handle(self, *args, **options):
+        with synthetic_company(keep=options['keep']) as company:
+            subscriptions = create_subscribers(company, options['routers'] * options['sessions'])
+            users = [subscription.username for subscription in subscriptions]
+            per_router = options['sessions']
+            routers = [
+                SimulatedRouter(f'r{i}', users[i * per_router:(i + 1) * per_router], latency=options['latency'])
+                for i in range(options['routers'])
+            ]
+            self.stdout.write(self.style.SUCCESS(
+                f"Polling {options['routers']} simulated routers x {per_router} sessions "
+                f"({options['latency'] * 1000:.0f} ms per command, concurrency {options['concurrency']})"
+            ))
+            asyncio.run(self.run(routers, options))
+
+    async def run(self, routers, options):
+        async with SimulatedFleet(routers):
+            targets = [RouterTarget(i, router.identity, '127.0.0.1', router.port, 'admin', 'secret')
+                       for i, router in enumerate(routers)]
+
+            started = time.perf_counter()
+            await self.unpooled(targets, options['concurrency'])
+            self.stdout.write(f"  connect + 4 round trips per router   poll {time.perf_counter() - started:>6.2f} s")
+
+            poller = FleetPoller(concurrency=options['concurrency'])
+            for cycle in range(options['cycles']):
+                result = await poller.run_once(targets)
+                self.stdout.write(
+                    f"  pooled, pipelined (cycle {cycle + 1})       poll {result.poll_seconds:>6.2f} s  "
+                    f"write {result.write_seconds:>5.2f} s  failed {result.failed}  {result.written}"
+                )
+            poller.pool.close()
+
+    async def unpooled(self, targets, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def poll(target):
+            async with semaphore:
+                connection = await RouterOSConnection.open(target.host, target.port, target.username, target.password)
+                for command, attributes in POLL_COMMANDS:
+                    await connection.call(command, attributes)
+                connection.close()
+
+        await asyncio.gather(*(poll(target) for target in targets))
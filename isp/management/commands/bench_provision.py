@@ -0,0 +1,42 @@
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from isp.management.bench import synthetic_company
+from isp.services.provisioning import provision_routers
+from mtk.services import Mtk, MtkResponseObject, ScriptManager
+
+
+class Command(BaseCommand):
+    help = 'Onboard a batch of routers against a simulated Mtk middleware, serially and concurrently'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--routers', type=int, default=200)
+        parser.add_argument('--latency', type=float, default=0.05, help='Simulated seconds per VPN client')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic tenants afterwards')
+
+    def handle(self, *args, **options):
+        def provision(identity):
+            time.sleep(options['latency'])
+            return MtkResponseObject(success=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Provisioning {options['routers']} routers ({options['latency'] * 1000:.0f} ms per VPN client)"
+        ))
+        with mock.patch.object(Mtk, 'instance', mock.Mock(script=ScriptManager())), \
+                mock.patch.object(Mtk, 'provision', side_effect=provision):
+            for concurrency in (1, options['concurrency']):
+                names = [f'R{i}' for i in range(options['routers'])]
+                with synthetic_company(keep=options['keep']) as company, \
+                        override_settings(ROUTER_ONBOARDING={'CONCURRENCY': concurrency, 'MAX_ROUTERS': len(names)}):
+                    started = time.perf_counter()
+                    outcome = provision_routers(company.pk, names, params={'host': 'http://isp.example.com'})
+                    elapsed = time.perf_counter() - started
+                latency = outcome.metrics['vpn_client_latency']
+                self.stdout.write(
+                    f"  concurrency {concurrency:>3}  {elapsed:>7.2f} s  {outcome.succeeded / elapsed:>7.1f} routers/s  "
+                    f"VPN client p50 {latency['p50_ms']} ms  p95 {latency['p95_ms']} ms"
+                )
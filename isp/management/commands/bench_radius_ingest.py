@@ -0,0 +1,98 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from isp.management.bench import create_subscribers, synthetic_company
+from isp.services.accounting import AccountingPipeline, AccountingRecord, BufferFull
+
+
+class Command(BaseCommand):
+    help = 'Replay a synthetic RADIUS accounting log through the ingest pipeline and report throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=100_000, help='Number of sessions to replay')
+        parser.add_argument('--subscribers', type=int, default=2_000, help='Distinct subscriptions')
+        parser.add_argument('--interims', type=int, default=3, help='Interim-Updates per session')
+        parser.add_argument('--concurrency', type=int, default=5_000,
+                            help='Sessions open at the same time in the replay')
+        parser.add_argument('--request-size', type=int, default=500,
+                            help='Records per simulated HTTP request')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic tenant afterwards')
+
+    def handle(self, *args, **options):
+        from isp.models import UsageLog
+
+        with synthetic_company(keep=options['keep']) as company:
+            subscriptions = create_subscribers(company, options['subscribers'])
+            usernames = [s.username for s in subscriptions]
+
+            AccountingPipeline.destroy()
+            pipeline = AccountingPipeline.get()
+            retries = 0
+            sent = 0
+            started = time.perf_counter()
+
+            batch = []
+            for record in self.replay(options, usernames):
+                batch.append(record)
+                if len(batch) >= options['request_size']:
+                    retries += self.submit(pipeline, batch)
+                    sent += len(batch)
+                    batch = []
+            if batch:
+                retries += self.submit(pipeline, batch)
+                sent += len(batch)
+
+            pipeline.stop()
+            elapsed = time.perf_counter() - started
+            rows = UsageLog.objects.filter(subscription__customer__company=company).count()
+            metrics = pipeline.metrics.snapshot()
+            AccountingPipeline.destroy()
+
+        self.stdout.write(self.style.SUCCESS('RADIUS accounting ingest benchmark'))
+        self.stdout.write(f"  records replayed : {sent}")
+        self.stdout.write(f"  usage rows       : {rows}")
+        self.stdout.write(f"  elapsed          : {elapsed:.2f}s ({sent / elapsed:,.0f} records/s)")
+        self.stdout.write(f"  backpressure     : {retries} retried requests")
+        self.stdout.write(f"  flushes          : {metrics['flushes']} (failures: {metrics['failures']})")
+        self.stdout.write(f"  flush latency ms : {metrics['flush_latency_ms']}")
+
+    def submit(self, pipeline, batch):
+        retries = 0
+        while True:
+            try:
+                pipeline.submit(batch)
+                return retries
+            except BufferFull:
+                retries += 1
+                time.sleep(0.05)
+
+    def replay(self, options, usernames):
+        """
+        Yield Start, Interim-Update and Stop packets for `sessions` sessions,
+        interleaved the way a NAS would send them for `concurrency` concurrent users.
+        """
+        now = timezone.now()
+        total, window, interims = options['sessions'], options['concurrency'], options['interims']
+        for offset in range(0, total, window):
+            ids = range(offset, min(offset + window, total))
+            usage = {i: 0 for i in ids}
+            for step in range(interims + 2):
+                status = 'Start' if step == 0 else 'Stop' if step == interims + 1 else 'Interim-Update'
+                for i in ids:
+                    usage[i] += random.randint(0, 50_000_000) if step else 0
+                    yield AccountingRecord.from_radius({
+                        'Acct-Status-Type': status,
+                        'Acct-Session-Id': f'bench-{i:08x}',
+                        'User-Name': usernames[i % len(usernames)],
+                        'Acct-Session-Time': step * 300,
+                        'Acct-Input-Octets': usage[i] // 4,
+                        'Acct-Output-Octets': usage[i],
+                        'Framed-IP-Address': f'10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}',
+                        'NAS-IP-Address': '10.255.0.1',
+                        'Event-Timestamp': now + timedelta(seconds=step * 300),
+                        'Acct-Terminate-Cause': 'User-Request' if status == 'Stop' else '',
+                    })
@@ -0,0 +1,103 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from isp.management.bench import create_subscribers, synthetic_company
+from isp.services.payments import StatementLine, reconcile_payments
+
+
+class Command(BaseCommand):
+    help = 'Payment reconciliation throughput: matching a statement line by line against the in-memory engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=50_000)
+        parser.add_argument('--baseline', type=int, default=500,
+                            help='Lines reconciled one query at a time first, for comparison')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic tenant afterwards')
+
+    def handle(self, *args, **options):
+        from isp.models import Customer, Invoice, Payment
+
+        count = options['lines']
+        with synthetic_company(keep=options['keep']) as company:
+            started = time.perf_counter()
+            subscriptions = create_subscribers(company, count)
+            today = timezone.now().date()
+            invoices = Invoice.objects.bulk_create([
+                Invoice(customer_id=s.customer_id, subscription=s, invoice_number=f'{company.slug}-INV{i}',
+                        status='sent', issue_date=today - timedelta(days=14), due_date=today,
+                        subtotal=Decimal('1000.00'), total_amount=Decimal('1000.00'))
+                for i, s in enumerate(subscriptions)
+            ], batch_size=2000)
+            self.stdout.write(self.style.SUCCESS(
+                f"Reconciliation benchmark ({count} statement lines against {len(invoices)} open invoices, "
+                f"set up in {time.perf_counter() - started:.1f} s)"
+            ))
+
+            # Mostly invoice numbers, some subscription accounts and phones, a few nobody recognises
+            rng = random.Random(7)
+            now = timezone.now()
+            lines = []
+            for i, s in enumerate(subscriptions):
+                kind = rng.random()
+                account = (invoices[i].invoice_number if kind < 0.6 else s.subscription_id if kind < 0.8
+                           else '' if kind < 0.95 else f'UNKNOWN{i}')
+                amount = Decimal(rng.choice(['500.00', '1000.00', '1500.00']))
+                lines.append(StatementLine(reference=f'BQ{i:08d}', amount=amount, paid_at=now, account=account,
+                                           phone=f'07{i:08d}' if 0.8 <= kind < 0.95 else ''))
+
+            baseline = lines[:options['baseline']]
+            started = time.perf_counter()
+            for line in baseline:
+                self.one_line(company, line)
+            per_line = (time.perf_counter() - started) / max(len(baseline), 1)
+            self.stdout.write(f"  line by line    {per_line * 1000:>8.2f} ms/line  "
+                              f"(~{per_line * count:.0f} s for {count} lines)")
+
+            result = reconcile_payments(company.pk, lines[len(baseline):], statement='bench')
+            rate = result.lines / result.duration if result.duration else 0
+            self.stdout.write(
+                f"  engine          {result.duration:>8.2f} s for {result.lines} lines ({rate:.0f} lines/s): "
+                f"{result.payments} payments, {result.invoices_paid} invoices paid, {result.review} to review"
+            )
+
+            again = reconcile_payments(company.pk, lines[len(baseline):], statement='bench')
+            self.stdout.write(f"  re-import       {again.duration:>8.2f} s, {again.duplicates} duplicates skipped")
+
+            balance = sum(Customer.objects.filter(company=company).values_list('current_balance', flat=True))
+            paid = sum(Payment.objects.filter(customer__company=company).values_list('amount', flat=True))
+            self.stdout.write(f"  balances moved by {-balance}, payments recorded {paid}")
+
+    @staticmethod
+    def one_line(company, line):
+        """What a view does per payment: look the line up, then save each row it changes"""
+        from isp.models import Customer, Invoice, Payment, Subscription
+
+        with transaction.atomic():
+            invoice = Invoice.objects.filter(customer__company=company, invoice_number=line.account).first()
+            customer = invoice.customer if invoice else None
+            if customer is None and line.account:
+                subscription = Subscription.objects.filter(customer__company=company,
+                                                           subscription_id=line.account).first()
+                customer = subscription.customer if subscription else None
+            if customer is None and line.phone:
+                customer = Customer.objects.filter(company=company, primary_phone=line.phone).first()
+            if customer is None:
+                return
+            if invoice is None:
+                invoice = customer.invoices.filter(status__in=('sent', 'overdue')).order_by('due_date').first()
+            Payment.objects.create(customer=customer, invoice=invoice, payment_id=f'B-{line.reference}',
+                                   amount=line.amount, payment_method='mobile_money', status='completed',
+                                   transaction_reference=line.reference, payment_date=line.paid_at)
+            if invoice is not None:
+                invoice.paid_amount += min(line.amount, invoice.balance_due)
+                if invoice.paid_amount >= invoice.total_amount:
+                    invoice.status, invoice.paid_date = 'paid', line.paid_at.date()
+                invoice.save()
+            customer.current_balance -= line.amount
+            customer.save()
@@ -0,0 +1,61 @@
+import base64
+import json
+import uuid
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from isp.api.views import EquipmentConfigView
+from isp.management.bench import Timer, synthetic_company
+from mtk.services import Mtk, fernet
+
+
+class Command(BaseCommand):
+    help = 'Per-request cost of EquipmentConfigView: uncached render, cached render and 304 revalidation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000)
+        parser.add_argument('--routeros', type=int, choices=[6, 7], default=7, help='RouterOS version')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic tenant afterwards')
+
+    def handle(self, *args, **options):
+        from isp.models import NetworkEquipment
+
+        view = EquipmentConfigView.as_view()
+        factory = RequestFactory()
+        with synthetic_company(keep=options['keep']) as company, mock.patch.object(Mtk, 'instance', None):
+            auth = uuid.uuid4().hex
+            router = NetworkEquipment.objects.create(
+                company=company, name='Bench router', identity=f'{company.slug}-r', auth_code=auth,
+                password='secret', equipment_type='router', brand='MikroTik', model='hAP', serial_number=auth,
+                location='Benchmark',
+            )
+            payload = json.dumps({'mtk': router.pk, 'auth': auth, 'timestamp': '0'})
+            token = base64.urlsafe_b64encode(fernet.encrypt(payload.encode())).decode()
+            path = f'/api/v1/equipments/auth/config/{token}/ovpn/{options["routeros"]}/'
+
+            def fetch(**headers):
+                return view(factory.get(path, **headers), encoded_payload=token, version=options['routeros'])
+
+            etag = fetch()['ETag']
+            variants = [
+                ('uncached render', lambda: (cache.clear(), fetch())),
+                ('cached render', fetch),
+                ('304 If-None-Match', lambda: fetch(HTTP_IF_NONE_MATCH=etag)),
+            ]
+
+            self.stdout.write(self.style.SUCCESS(
+                f"Config script benchmark (RouterOS v{options['routeros']}, {options['iterations']} requests each)"
+            ))
+            for label, call in variants:
+                timer = Timer()
+                for _ in range(options['iterations']):
+                    with timer.measure():
+                        call()
+                summary = timer.summary()
+                self.stdout.write(
+                    f"  {label:<18} mean {summary['mean_ms']:>7.3f} ms  p95 {summary['p95_ms']:>7.3f} ms  "
+                    f"{summary['count'] / summary['total_s']:>8.0f} req/s"
+                )
@@ -0,0 +1,34 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from isp.services.telemetry import FleetPoller, telemetry_settings
+
+
+class Command(BaseCommand):
+    help = 'Poll every active router over the RouterOS API into UsageLog, BandwidthLog and health summaries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run a single cycle and report it')
+        parser.add_argument('--interval', type=float, help='Seconds between cycles (ROUTER_POLLING INTERVAL)')
+        parser.add_argument('--concurrency', type=int, help='Routers polled at once (ROUTER_POLLING CONCURRENCY)')
+
+    def handle(self, *args, **options):
+        poller = FleetPoller(concurrency=options['concurrency'])
+        if not options['once']:
+            interval = options['interval'] or telemetry_settings()['INTERVAL']
+            self.stdout.write(f"Polling routers every {interval}s")
+            asyncio.run(poller.run_forever(interval))
+            return
+
+        async def once():
+            try:
+                return await poller.run_once()
+            finally:
+                poller.pool.close()
+
+        result = asyncio.run(once())
+        self.stdout.write(self.style.SUCCESS(
+            f"Polled {result.routers} routers ({result.failed} failed, {result.sessions} sessions) "
+            f"in {result.poll_seconds:.2f}s, wrote {result.written} in {result.write_seconds:.2f}s"
+        ))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from isp.services.payments import parse_statement, read_statement_csv, reconcile_payments
+
+
+class Command(BaseCommand):
+    help = 'Record the payments in a CSV statement (e.g. an M-Pesa export) against open invoices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('statement', help='Path to the CSV statement')
+        parser.add_argument('--company', type=int, required=True, help='Company the statement belongs to')
+        parser.add_argument('--method', help='Payment method to record; default PAYMENT_RECONCILIATION setting')
+
+    def handle(self, *args, **options):
+        from isp.models import Company
+
+        company = Company.objects.filter(pk=options['company']).first()
+        if company is None:
+            raise CommandError(f"No company with id {options['company']}")
+        try:
+            rows = read_statement_csv(options['statement'])
+        except (OSError, UnicodeDecodeError) as e:
+            raise CommandError(f"Cannot read {options['statement']}: {e}")
+
+        lines, errors = parse_statement(rows, company.timezone)
+        result = reconcile_payments(company.pk, lines, statement=options['statement'].rsplit('/', 1)[-1],
+                                    payment_method=options['method'])
+        for error in errors:
+            self.stderr.write(f"  {error}")
+        self.stdout.write(
+            f"{result.payments} payments recorded from {len(rows)} lines: {result.allocated} allocated to invoices, "
+            f"{result.credited} held as credit, {result.invoices_paid} invoices paid, {result.review} lines to review, "
+            f"{result.duplicates} already recorded ({result.duration:.2f}s)"
+        )
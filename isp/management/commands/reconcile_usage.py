@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from isp.models import Subscription
+from isp.services.usage import reconcile_usage, refresh_data_limits
+
+
+class Command(BaseCommand):
+    help = 'Recompute Subscription.data_used/time_used from UsageLog and report (or fix) drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Subscriptions per aggregation query')
+        parser.add_argument('--company', type=int, help='Only reconcile subscriptions of this company id')
+        parser.add_argument('--fix', action='store_true', help='Overwrite drifted counters with recomputed values')
+        parser.add_argument('--refresh-limits', action='store_true',
+                            help='Also re-copy package data limits into data_limit_bytes')
+        parser.add_argument('--limit', type=int, default=50, help='Maximum drifted rows to print')
+
+    def handle(self, *args, **options):
+        if options['refresh_limits']:
+            refreshed = refresh_data_limits()
+            self.stdout.write(f"Refreshed data_limit_bytes on {refreshed} subscriptions")
+
+        queryset = Subscription.objects.all()
+        if options['company']:
+            queryset = queryset.filter(customer__company_id=options['company'])
+
+        drifted = total_data = total_time = 0
+        for drift in reconcile_usage(options['chunk_size'], fix=options['fix'], queryset=queryset):
+            drifted += 1
+            total_data += drift.data_drift
+            total_time += drift.time_drift
+            if drifted <= options['limit']:
+                self.stdout.write(
+                    f"  subscription {drift.subscription_id}: "
+                    f"data {drift.data_used} vs {drift.expected_data} ({drift.data_drift:+}), "
+                    f"time {drift.time_used} vs {drift.expected_time} ({drift.time_drift:+})"
+                )
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('All usage counters match UsageLog'))
+            return
+
+        action = 'fixed' if options['fix'] else 'found'
+        self.stdout.write(self.style.WARNING(
+            f"{drifted} drifted subscriptions {action} (net drift: {total_data:+} bytes, {total_time:+} minutes)"
+        ))
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from isp.services.rollups import (
+    BANDWIDTH_WATERMARK, USAGE_WATERMARK, rollup_bandwidth, rollup_usage, watermark_status
+)
+
+
+class Command(BaseCommand):
+    help = 'Fold new UsageLog/BandwidthLog rows into the hourly and daily rollup tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', choices=['usage', 'bandwidth'], help='Run a single rollup')
+        parser.add_argument('--lag', type=int, help='Seconds of recent rows to leave for the next run')
+        parser.add_argument('--loop', type=float, default=0,
+                            help='Keep running, sleeping this many seconds between passes')
+        parser.add_argument('--status', action='store_true', help='Print watermark positions and exit')
+
+    def handle(self, *args, **options):
+        if options['status']:
+            for name in (USAGE_WATERMARK, BANDWIDTH_WATERMARK):
+                status = watermark_status(name)
+                self.stdout.write(
+                    f"  {name}: watermark {status['watermark']}, source rows {status['first']} .. {status['last']}"
+                )
+            return
+
+        jobs = []
+        if options['only'] in (None, 'usage'):
+            jobs.append(rollup_usage)
+        if options['only'] in (None, 'bandwidth'):
+            jobs.append(rollup_bandwidth)
+
+        while True:
+            for job in jobs:
+                started = time.perf_counter()
+                result = job(lag=options['lag'])
+                self.stdout.write(
+                    f"{result.name}: {result.touched_buckets} buckets touched, "
+                    f"{result.hourly} hourly / {result.daily} daily rows written, "
+                    f"watermark {result.watermark} ({time.perf_counter() - started:.2f}s)"
+                )
+            if not options['loop']:
+                break
+            close_old_connections()
+            time.sleep(options['loop'])
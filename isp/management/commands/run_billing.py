@@ -0,0 +1,39 @@
+from datetime import datetime, time as dt_time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from isp.services.billing import run_sharded_billing
+
+
+class Command(BaseCommand):
+    help = 'Invoice every active subscription whose next billing date has come, tenants sharded across processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--as-of', help='Bill periods starting on or before this date (YYYY-MM-DD); default now')
+        parser.add_argument('--company', type=int, help='Only bill this company id')
+        parser.add_argument('--workers', type=int, help='Worker processes; 0 bills every shard in this process')
+        parser.add_argument('--shard-size', type=int, help='Due subscriptions per shard')
+
+    def handle(self, *args, **options):
+        as_of = None
+        if options['as_of']:
+            day = parse_date(options['as_of'])
+            if day is None:
+                raise CommandError("--as-of must be a date such as 2025-07-01")
+            as_of = timezone.make_aware(datetime.combine(day, dt_time.max))
+
+        run = run_sharded_billing(as_of=as_of, workers=options['workers'], company_id=options['company'],
+                                  shard_size=options['shard_size'])
+        for entry in sorted(run.report['shards'], key=lambda entry: -entry.get('seconds', 0)):
+            line = (f"  {entry['key']:<32} {entry.get('billed', 0):>7} billed  {entry.get('invoices', 0):>7} invoices"
+                    f"  {entry.get('seconds', 0):>7.2f}s")
+            self.stdout.write(line + (f"  ERROR {entry['error']}" if entry.get('error') else ''))
+        amounts = ', '.join(f"{amount} {currency}" for currency, amount in run.report.get('amounts', {}).items())
+        self.stdout.write(
+            f"Billing run {run.pk} {run.status}: {run.invoices} invoices for {run.subscriptions} subscriptions "
+            f"in {run.shards} shards ({amounts or 'nothing invoiced'}), {run.report['seconds']:.2f}s"
+        )
+        if run.status == 'failed':
+            raise CommandError(f"Some shards failed; run again to retry them:\n{run.error}")
@@ -0,0 +1,35 @@
+from datetime import datetime, time as dt_time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from isp.services.dunning import run_dunning
+
+
+class Command(BaseCommand):
+    help = 'Mark unpaid invoices past their due date overdue, queue reminders and suspend long-overdue subscriptions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--as-of', help='Count days overdue up to this date (YYYY-MM-DD); default now')
+        parser.add_argument('--company', type=int, help='Only this company id')
+        parser.add_argument('--suspend', action='store_true',
+                            help='Suspend the subscriptions in the suspension stage; otherwise only list them')
+
+    def handle(self, *args, **options):
+        as_of = None
+        if options['as_of']:
+            day = parse_date(options['as_of'])
+            if day is None:
+                raise CommandError("--as-of must be a date such as 2025-07-01")
+            as_of = timezone.make_aware(datetime.combine(day, dt_time(12)))
+
+        result = run_dunning(as_of=as_of, company_id=options['company'], suspend=options['suspend'])
+        for stage, bucket in result.to_dict()['buckets'].items():
+            amounts = ', '.join(f"{amount} {currency}" for currency, amount in bucket['amounts'].items())
+            self.stdout.write(f"  {stage:<16} {bucket['invoices']:>7} invoices  {amounts}")
+        self.stdout.write(
+            f"{result.overdue} overdue invoices, {result.marked_overdue} newly overdue, "
+            f"{result.notifications} notifications queued, {len(result.suspension_candidates)} subscriptions "
+            f"to suspend, {result.suspended} suspended ({result.duration:.2f}s)"
+        )
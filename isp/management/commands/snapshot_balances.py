@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from isp.services.ledger import take_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Snapshot customer balances whose ledger moved since their last snapshot (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, help='Only this company id')
+
+    def handle(self, *args, **options):
+        created = take_snapshots(company_id=options['company'])
+        self.stdout.write(f"{created} balance snapshots taken")
@@ -0,0 +1,170 @@
+"""
+ISP Management System - Simulated RouterOS Fleet
+In-process MikroTik API servers for tests and the bench_poll_routers command
+File: management/routeros_sim.py
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from isp.services.routeros import encode_sentence, read_sentence
+
+
+@dataclass
+class SimulatedRouter:
+    """
+    One router on its own 127.0.0.1 port. Users alternate between PPPoE and hotspot sessions;
+    their byte counters grow at `rate` bytes/second from the moment the router starts.
+    `legacy_login` answers /login with the MD5 challenge of RouterOS before 6.43, and the
+    commands in `disabled` trap as they do when their package is turned off.
+    """
+    identity: str
+    users: List[str]
+    username: str = 'admin'
+    password: str = 'secret'
+    rate: int = 125_000
+    # Seconds before each reply goes out; replies to pipelined commands overlap like network round trips
+    latency: float = 0.0
+    legacy_login: bool = False
+    disabled: frozenset = frozenset()
+    port: int = 0
+    commands: int = 0
+    started_at: float = field(default_factory=time.time)
+    server: Optional[asyncio.AbstractServer] = None
+    writers: set = field(default_factory=set)
+
+    def elapsed(self) -> float:
+        return max(time.time() - self.started_at, 1.0)
+
+    def counters(self, index: int) -> tuple:
+        # (uploaded, downloaded) of user `index`
+        grown = int(self.elapsed() * self.rate)
+        return grown // 4 + index, grown + index
+
+    def reply(self, command: str) -> List[Dict[str, str]]:
+        uptime = f"{int(self.elapsed())}s"
+        if command == '/system/resource/print':
+            return [{
+                'uptime': uptime, 'cpu-load': '7', 'free-memory': '201326592', 'total-memory': '268435456',
+                'version': '7.15 (stable)', 'board-name': 'hAP ac2',
+            }]
+        if command == '/interface/print':
+            rows = [{'name': 'ether1', 'type': 'ether', 'rx-byte': '1000', 'tx-byte': '2000', 'running': 'true'}]
+            for index, user in enumerate(self.users):
+                if index % 2 == 0:
+                    uploaded, downloaded = self.counters(index)
+                    rows.append({'name': f'<pppoe-{user}>', 'type': 'pppoe-in', 'rx-byte': str(uploaded),
+                                 'tx-byte': str(downloaded), 'running': 'true'})
+            return rows
+        if command == '/ppp/active/print':
+            return [
+                {
+                    '.id': f'*{index + 1:X}', 'name': user, 'service': 'pppoe',
+                    'address': f'10.1.{index // 250}.{index % 250 + 2}',
+                    'caller-id': f'AA:BB:CC:00:{index // 256:02X}:{index % 256:02X}', 'uptime': uptime,
+                }
+                for index, user in enumerate(self.users) if index % 2 == 0
+            ]
+        if command == '/ip/hotspot/active/print':
+            rows = []
+            for index, user in enumerate(self.users):
+                if index % 2 == 1:
+                    uploaded, downloaded = self.counters(index)
+                    rows.append({
+                        '.id': f'*{index + 1:X}', 'user': user, 'address': f'10.2.{index // 250}.{index % 250 + 2}',
+                        'mac-address': f'AA:BB:CC:01:{index // 256:02X}:{index % 256:02X}', 'uptime': uptime,
+                        'bytes-in': str(uploaded), 'bytes-out': str(downloaded),
+                    })
+            return rows
+        raise LookupError('no such command prefix')
+
+    def login(self, attributes: Dict[str, str], challenge: bytes) -> tuple:
+        """(logged in, !done attributes) for a /login sentence"""
+        if attributes.get('name') != self.username:
+            return False, []
+        if not self.legacy_login:
+            return attributes.get('password') == self.password, []
+        if 'response' not in attributes:
+            return False, [f'=ret={challenge.hex()}']
+        digest = hashlib.md5(b'\x00' + self.password.encode() + challenge).hexdigest()
+        return attributes['response'] == f'00{digest}', []
+
+    def send(self, writer: asyncio.StreamWriter, data: bytes) -> None:
+        if not self.latency:
+            writer.write(data)
+            return
+
+        def deliver():
+            if not writer.is_closing():
+                writer.write(data)
+
+        asyncio.get_running_loop().call_later(self.latency, deliver)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        logged_in, challenge = False, os.urandom(16)
+        self.writers.add(writer)
+        try:
+            while True:
+                words = await read_sentence(reader)
+                command = words[0] if words else ''
+                tag = next((word for word in words if word.startswith('.tag=')), None)
+                attributes = dict(word[1:].split('=', 1) for word in words[1:] if word.startswith('='))
+                suffix = [tag] if tag else []
+                self.commands += 1
+
+                if command == '/login':
+                    logged_in, done = self.login(attributes, challenge)
+                    out = b''
+                    if not logged_in and not done:
+                        out = encode_sentence(['!trap', '=message=invalid user name or password'] + suffix)
+                    self.send(writer, out + encode_sentence(['!done'] + done + suffix))
+                    continue
+                out = bytearray()
+                try:
+                    if not logged_in:
+                        raise LookupError('not logged in')
+                    if command in self.disabled:
+                        raise LookupError('no such command prefix')
+                    rows = self.reply(command)
+                except LookupError as e:
+                    out += encode_sentence(['!trap', f'=message={e}'] + suffix)
+                    rows = []
+                for row in rows:
+                    out += encode_sentence(['!re'] + [f'={key}={value}' for key, value in row.items()] + suffix)
+                out += encode_sentence(['!done'] + suffix)
+                self.send(writer, bytes(out))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            for writer in list(self.writers):
+                writer.close()
+            await self.server.wait_closed()
+
+
+class SimulatedFleet:
+    """Starts and stops a set of SimulatedRouters; use as `async with SimulatedFleet(routers):`"""
+
+    def __init__(self, routers: List[SimulatedRouter]):
+        self.routers = routers
+
+    async def __aenter__(self) -> "SimulatedFleet":
+        await asyncio.gather(*(router.start() for router in self.routers))
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await asyncio.gather(*(router.stop() for router in self.routers))
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('isp', '0012_networkequipment_auth_code'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usagelog',
+            name='session_time',
+            field=models.PositiveIntegerField(default=0, help_text='Session time in seconds'),
+        ),
+        migrations.AddIndex(
+            model_name='usagelog',
+            index=models.Index(fields=['session_id'], name='isp_usagelo_session_5e81f2_idx'),
+        ),
+    ]
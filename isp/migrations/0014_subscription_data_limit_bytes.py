@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+BYTES_PER_GB = 1024 * 1024 * 1024
+
+
+def backfill_data_limit_bytes(apps, schema_editor):
+    InternetPackage = apps.get_model('isp', 'InternetPackage')
+    Subscription = apps.get_model('isp', 'Subscription')
+    for pk, data_limit in InternetPackage.objects.exclude(data_limit=None).values_list('pk', 'data_limit'):
+        Subscription.objects.filter(package_id=pk).update(data_limit_bytes=data_limit * BYTES_PER_GB)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('isp', '0013_usagelog_session_time_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='data_limit_bytes',
+            field=models.BigIntegerField(blank=True, help_text='Snapshot of the package data limit in bytes, kept in sync with the package', null=True),
+        ),
+        migrations.RunPython(backfill_data_limit_bytes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('isp', '0014_subscription_data_limit_bytes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BandwidthRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=10)),
+                ('bucket_start', models.DateTimeField()),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('avg_download', models.PositiveIntegerField(default=0, help_text='Speed in Kbps')),
+                ('p95_download', models.PositiveIntegerField(default=0, help_text='Speed in Kbps')),
+                ('max_download', models.PositiveIntegerField(default=0, help_text='Speed in Kbps')),
+                ('avg_upload', models.PositiveIntegerField(default=0, help_text='Speed in Kbps')),
+                ('p95_upload', models.PositiveIntegerField(default=0, help_text='Speed in Kbps')),
+                ('max_upload', models.PositiveIntegerField(default=0, help_text='Speed in Kbps')),
+                ('latency_p50', models.PositiveIntegerField(blank=True, help_text='Latency in ms', null=True)),
+                ('latency_p95', models.PositiveIntegerField(blank=True, help_text='Latency in ms', null=True)),
+                ('latency_max', models.PositiveIntegerField(blank=True, help_text='Latency in ms', null=True)),
+                ('avg_packet_loss', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('position', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=10)),
+                ('bucket_start', models.DateTimeField()),
+                ('bytes_uploaded', models.BigIntegerField(default=0)),
+                ('bytes_downloaded', models.BigIntegerField(default=0)),
+                ('sessions', models.PositiveIntegerField(default=0)),
+                ('session_time', models.BigIntegerField(default=0, help_text='Session time in seconds')),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='bandwidthlog',
+            index=models.Index(fields=['created_at'], name='isp_bandwid_created_327ca3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usagelog',
+            index=models.Index(fields=['updated_at'], name='isp_usagelo_updated_858a84_idx'),
+        ),
+        migrations.AddField(
+            model_name='bandwidthrollup',
+            name='subscription',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bandwidth_rollups', to='isp.subscription'),
+        ),
+        migrations.AddField(
+            model_name='usagerollup',
+            name='subscription',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_rollups', to='isp.subscription'),
+        ),
+        migrations.AddIndex(
+            model_name='bandwidthrollup',
+            index=models.Index(fields=['granularity', 'bucket_start'], name='isp_bandwid_granula_62d8b6_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='bandwidthrollup',
+            constraint=models.UniqueConstraint(fields=('subscription', 'granularity', 'bucket_start'), name='unique_bandwidth_rollup_bucket'),
+        ),
+        migrations.AddIndex(
+            model_name='usagerollup',
+            index=models.Index(fields=['granularity', 'bucket_start'], name='isp_usagero_granula_a8216a_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='usagerollup',
+            constraint=models.UniqueConstraint(fields=('subscription', 'granularity', 'bucket_start'), name='unique_usage_rollup_bucket'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.3 on 2026-10-18 16:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('isp', '0015_usage_rollups'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='bandwidthlog',
+            name='isp_bandwid_timesta_e0bd05_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='usagelog',
+            name='isp_usagelo_session_83caec_idx',
+        ),
+        migrations.AddIndex(
+            model_name='bandwidthlog',
+            index=models.Index(fields=['timestamp', 'id'], name='isp_bandwid_timesta_e31ab7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='systemlog',
+            index=models.Index(fields=['created_at', 'id'], name='isp_systeml_created_4c52ce_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['created_at', 'id'], name='isp_ticket_created_52650b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usagelog',
+            index=models.Index(fields=['session_start', 'id'], name='isp_usagelo_session_9d1f37_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.3 on 2026-10-18 16:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_subscription_router(apps, schema_editor):
+    # The router whose address is the NAS-IP-Address of each subscription's newest session
+    NetworkEquipment = apps.get_model('isp', 'NetworkEquipment')
+    Subscription = apps.get_model('isp', 'Subscription')
+    UsageLog = apps.get_model('isp', 'UsageLog')
+    routers = {
+        (company_id, ip_address): pk
+        for pk, company_id, ip_address in NetworkEquipment.objects.filter(equipment_type='router')
+        .exclude(ip_address=None).values_list('pk', 'company_id', 'ip_address')
+    }
+    if not routers:
+        return
+    latest = {}
+    for subscription_id, company_id, nas_ip in (
+        UsageLog.objects.exclude(nas_ip=None).order_by('session_start')
+        .values_list('subscription_id', 'subscription__customer__company_id', 'nas_ip').iterator()
+    ):
+        latest[subscription_id] = routers.get((company_id, nas_ip))
+    grouped = {}
+    for subscription_id, router_id in latest.items():
+        if router_id is not None:
+            grouped.setdefault(router_id, []).append(subscription_id)
+    for router_id, subscription_ids in grouped.items():
+        Subscription.objects.filter(pk__in=subscription_ids).update(router_id=router_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('isp', '0017_bulk_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='router',
+            field=models.ForeignKey(blank=True, help_text='Router (NAS) the subscriber connects through; lifecycle changes are pushed to it', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='subscriptions', to='isp.networkequipment'),
+        ),
+        migrations.RunPython(backfill_subscription_router, migrations.RunPython.noop),
+    ]
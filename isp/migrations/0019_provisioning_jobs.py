@@ -0,0 +1,44 @@
+# Generated by Django 5.2.3 on 2026-10-18 16:54
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rename_duplicate_identities(apps, schema_editor):
+    """
+    The old check-then-create provisioning could create two routers with one identity. The
+    first one created keeps it; the others get a '-dup<pk>' suffix so the unique constraint
+    can be added, and can then be renamed or removed by hand.
+    """
+    NetworkEquipment = apps.get_model('isp', 'NetworkEquipment')
+    duplicated = (NetworkEquipment.objects.values('identity').annotate(rows=Count('id'))
+                  .filter(rows__gt=1).values_list('identity', flat=True))
+    for identity in list(duplicated):
+        for pk in NetworkEquipment.objects.filter(identity=identity).order_by('pk').values_list('pk', flat=True)[1:]:
+            suffix = f'-dup{pk}'
+            NetworkEquipment.objects.filter(pk=pk).update(identity=identity[:200 - len(suffix)] + suffix)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('isp', '0018_subscription_router'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkjob',
+            name='metrics',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='bulkjob',
+            name='target',
+            field=models.CharField(choices=[('customer', 'Customers'), ('subscription', 'Subscriptions'), ('equipment', 'Network equipment')], max_length=20),
+        ),
+        migrations.RunPython(rename_duplicate_identities, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='networkequipment',
+            constraint=models.UniqueConstraint(fields=('identity',), name='unique_equipment_identity'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('isp', '0019_provisioning_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='networkequipment',
+            name='api_port',
+            field=models.PositiveIntegerField(default=8728, help_text='RouterOS API port'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('isp', '0020_networkequipment_api_port'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('as_of', models.DateTimeField(help_text='Periods starting on or before this moment are billed')),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='running', max_length=20)),
+                ('workers', models.PositiveIntegerField(default=0)),
+                ('shards', models.PositiveIntegerField(default=0)),
+                ('shards_done', models.PositiveIntegerField(default=0)),
+                ('subscriptions', models.PositiveIntegerField(default=0)),
+                ('invoices', models.PositiveIntegerField(default=0)),
+                ('report', models.JSONField(blank=True, default=dict)),
+                ('error', models.TextField(blank=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
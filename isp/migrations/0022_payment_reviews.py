@@ -0,0 +1,38 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('isp', '0021_billing_runs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentReview',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('statement', models.CharField(blank=True, help_text='Statement file or batch the line came from', max_length=100)),
+                ('reference', models.CharField(max_length=50)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('paid_at', models.DateTimeField()),
+                ('account', models.CharField(blank=True, max_length=100)),
+                ('phone', models.CharField(blank=True, max_length=20)),
+                ('payer_name', models.CharField(blank=True, max_length=200)),
+                ('reason', models.CharField(choices=[('unmatched', 'No matching customer or invoice'), ('ambiguous', 'Matches more than one customer')], max_length=20)),
+                ('status', models.CharField(choices=[('open', 'Open'), ('resolved', 'Resolved'), ('dismissed', 'Dismissed')], default='open', max_length=20)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_reviews', to='isp.company')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reviews', to='isp.payment')),
+            ],
+            options={
+                'ordering': ['-paid_at'],
+                'indexes': [models.Index(fields=['company', 'status'], name='isp_payment_company_924e7b_idx')],
+                'constraints': [models.UniqueConstraint(fields=('company', 'reference'), name='unique_payment_review_reference')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('isp', '0022_payment_reviews'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='customer',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='isp.customer'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='dedupe_key',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='recipient',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['customer', 'status'], name='isp_notific_custome_e17330_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('isp', '0023_dunning'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateTimeField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='isp.customer')),
+            ],
+            options={
+                'ordering': ['-as_of'],
+                'constraints': [models.UniqueConstraint(fields=('customer', 'as_of'), name='unique_balance_snapshot')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_type', models.CharField(choices=[('invoice', 'Invoice Issued'), ('payment', 'Payment Received'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, help_text='Positive charges the customer, negative credits them', max_digits=10)),
+                ('occurred_at', models.DateTimeField()),
+                ('source_key', models.CharField(help_text='What the entry records (e.g. invoice:12); posting it twice is a no-op', max_length=60, unique=True)),
+                ('description', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='isp.customer')),
+                ('invoice', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='isp.invoice')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='isp.payment')),
+            ],
+            options={
+                'verbose_name_plural': 'ledger entries',
+                'ordering': ['occurred_at', 'id'],
+                'indexes': [models.Index(fields=['customer', 'occurred_at'], name='isp_ledgere_custome_ceec05_idx')],
+            },
+        ),
+    ]
@@ -221,7 +221,7 @@ class Customer(TimeStampedModel):
         ]
 
     def __str__(self):
-        return f"{self.user.get_full_name()}"
+        return self.full_name
 
     def get_absolute_url(self):
         return reverse('customer-detail', kwargs={'pk': self.pk})
@@ -231,6 +231,9 @@ class Customer(TimeStampedModel):
 # INTERNET PACKAGES
 # ============================================================================
 
+BYTES_PER_GB = 1024 * 1024 * 1024
+
+
 class PackageCategory(models.Model):
     """Categories for internet packages"""
     name = models.CharField(max_length=100, unique=True)
@@ -321,6 +324,12 @@ class InternetPackage(TimeStampedModel):
     def subscribers_count(self):
         return self.subscriptions.filter(status='active').count()
 
+    @property
+    def data_limit_bytes(self):
+        if self.data_limit:
+            return self.data_limit * BYTES_PER_GB
+        return None
+
     def can_subscribe(self):
         if self.max_subscribers:
             return self.subscribers_count < self.max_subscribers
@@ -331,6 +340,17 @@ class InternetPackage(TimeStampedModel):
 # SUBSCRIPTIONS
 # ============================================================================
 
+class SubscriptionQuerySet(models.QuerySet):
+    """Custom queryset for subscriptions"""
+
+    def active(self):
+        return self.filter(status='active')
+
+    def over_quota(self):
+        """Subscriptions that have used up their package data allowance (no package join)"""
+        return self.filter(data_limit_bytes__isnull=False, data_used__gte=models.F('data_limit_bytes'))
+
+
 class Subscription(TimeStampedModel):
     """Customer subscription to internet packages"""
 
@@ -358,6 +378,11 @@ class Subscription(TimeStampedModel):
     # Usage Tracking
     data_used = models.BigIntegerField(default=0, help_text="Data used in bytes")
     time_used = models.PositiveIntegerField(default=0, help_text="Time used in minutes")
+    data_limit_bytes = models.BigIntegerField(
+        null=True,
+        blank=True,
+        help_text="Snapshot of the package data limit in bytes, kept in sync with the package"
+    )
 
     # Network Configuration
     assigned_ip = models.GenericIPAddressField(null=True, blank=True)
@@ -368,6 +393,14 @@ class Subscription(TimeStampedModel):
     )
     username = models.CharField(max_length=100, blank=True)
     password = models.CharField(max_length=100, blank=True)
+    router = models.ForeignKey(
+        'NetworkEquipment',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='subscriptions',
+        help_text="Router (NAS) the subscriber connects through; lifecycle changes are pushed to it"
+    )
 
     # Billing
     monthly_fee = models.DecimalField(max_digits=10, decimal_places=2)
@@ -385,6 +418,8 @@ class Subscription(TimeStampedModel):
     )
     installation_notes = models.TextField(blank=True)
 
+    objects = SubscriptionQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
         indexes = [
@@ -394,7 +429,7 @@ class Subscription(TimeStampedModel):
         ]
 
     def __str__(self):
-        return f"{self.subscription_id} - {self.customer.user.get_full_name()}"
+        return f"{self.subscription_id} - {self.customer.full_name}"
 
     @property
     def is_expired(self):
@@ -402,13 +437,21 @@ class Subscription(TimeStampedModel):
             return timezone.now() > self.end_date
         return False
 
+    def save(self, *args, **kwargs):
+        if self.package_id:
+            self.data_limit_bytes = self.package.data_limit_bytes
+        super().save(*args, **kwargs)
+
     @property
     def data_usage_percentage(self):
-        if self.package.data_limit:
-            limit_bytes = self.package.data_limit * 1024 * 1024 * 1024  # Convert GB to bytes
-            return min((self.data_used / limit_bytes) * 100, 100)
+        if self.data_limit_bytes:
+            return min((self.data_used / self.data_limit_bytes) * 100, 100)
         return 0
 
+    @property
+    def is_over_quota(self):
+        return self.data_limit_bytes is not None and self.data_used >= self.data_limit_bytes
+
 
 # ============================================================================
 # NETWORK INFRASTRUCTURE
@@ -476,6 +519,7 @@ class NetworkEquipment(TimeStampedModel):
         validators=[RegexValidator(r'^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$')]
     )
     ip_address = models.GenericIPAddressField(null=True, blank=True)
+    api_port = models.PositiveIntegerField(default=8728, help_text="RouterOS API port")
     firmware_version = models.CharField(max_length=50, blank=True)
     port_count = models.PositiveIntegerField(null=True, blank=True)
 
@@ -501,6 +545,10 @@ class NetworkEquipment(TimeStampedModel):
             models.Index(fields=['equipment_type', 'status']),
             models.Index(fields=['zone', 'status']),
         ]
+        constraints = [
+            # Routers are addressed by identity on the Mtk middleware and in provisioning
+            models.UniqueConstraint(fields=['identity'], name='unique_equipment_identity'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.equipment_type})"
@@ -594,6 +642,19 @@ class TicketCategory(models.Model):
         return self.name
 
 
+class TicketQuerySet(models.QuerySet):
+    """Custom queryset for tickets"""
+
+    def with_overdue(self, now=None):
+        """Annotate is_overdue in SQL, as Ticket.is_overdue computes it per row"""
+        return self.annotate(is_overdue=models.ExpressionWrapper(
+            # IS NOT NULL first, so a ticket without an SLA is False rather than NULL
+            models.Q(sla_resolution_due__isnull=False, sla_resolution_due__lt=now or timezone.now())
+            & ~models.Q(status__in=Ticket.CLOSED_STATUSES),
+            output_field=models.BooleanField(),
+        ))
+
+
 class Ticket(TimeStampedModel):
     """Support tickets for customer issues"""
 
@@ -611,6 +672,7 @@ class Ticket(TimeStampedModel):
         ('resolved', 'Resolved'),
         ('closed', 'Closed'),
     ]
+    CLOSED_STATUSES = ['resolved', 'closed']
 
     TICKET_TYPES = [
         ('technical', 'Technical Issue'),
@@ -656,6 +718,8 @@ class Ticket(TimeStampedModel):
     )
     satisfaction_comment = models.TextField(blank=True)
 
+    objects = TicketQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
         indexes = [
@@ -663,6 +727,7 @@ class Ticket(TimeStampedModel):
             models.Index(fields=['status', 'priority']),
             models.Index(fields=['assigned_to', 'status']),
             models.Index(fields=['customer', 'status']),
+            models.Index(fields=['created_at', 'id']),
         ]
 
     def __str__(self):
@@ -670,10 +735,17 @@ class Ticket(TimeStampedModel):
 
     @property
     def is_overdue(self):
-        if self.sla_resolution_due and self.status not in ['resolved', 'closed']:
+        if '_is_overdue' in self.__dict__:
+            return self._is_overdue
+        if self.sla_resolution_due and self.status not in self.CLOSED_STATUSES:
             return timezone.now() > self.sla_resolution_due
         return False
 
+    @is_overdue.setter
+    def is_overdue(self, value):
+        # Set by Ticket.objects.with_overdue()
+        self._is_overdue = value
+
 
 class TicketComment(TimeStampedModel):
     """Comments on support tickets"""
@@ -694,6 +766,21 @@ class TicketComment(TimeStampedModel):
 # BILLING & PAYMENTS
 # ============================================================================
 
+class InvoiceQuerySet(models.QuerySet):
+    """Custom queryset for invoices"""
+
+    def overdue(self, today=None):
+        """Unpaid invoices past their due date: a range scan on the (due_date, status) index"""
+        return self.filter(due_date__lt=today or timezone.now().date(), status__in=Invoice.UNPAID_STATUSES)
+
+    def with_overdue(self, today=None):
+        """Annotate is_overdue in SQL, as Invoice.is_overdue computes it per row"""
+        return self.annotate(is_overdue=models.ExpressionWrapper(
+            models.Q(due_date__lt=today or timezone.now().date(), status__in=Invoice.UNPAID_STATUSES),
+            output_field=models.BooleanField(),
+        ))
+
+
 class Invoice(TimeStampedModel):
     """Customer invoices"""
 
@@ -704,6 +791,8 @@ class Invoice(TimeStampedModel):
         ('overdue', 'Overdue'),
         ('cancelled', 'Cancelled'),
     ]
+    # Issued and not yet paid; dunning moves 'sent' to 'overdue' after the due date
+    UNPAID_STATUSES = ['sent', 'overdue']
 
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='invoices')
     subscription = models.ForeignKey(
@@ -734,6 +823,8 @@ class Invoice(TimeStampedModel):
     notes = models.TextField(blank=True)
     terms = models.TextField(blank=True)
 
+    objects = InvoiceQuerySet.as_manager()
+
     class Meta:
         ordering = ['-issue_date']
         indexes = [
@@ -743,11 +834,18 @@ class Invoice(TimeStampedModel):
         ]
 
     def __str__(self):
-        return f"{self.invoice_number} - {self.customer.user.get_full_name()}"
+        return f"{self.invoice_number} - {self.customer.full_name}"
 
     @property
     def is_overdue(self):
-        return self.status == 'sent' and timezone.now().date() > self.due_date
+        if '_is_overdue' in self.__dict__:
+            return self._is_overdue
+        return self.status in self.UNPAID_STATUSES and timezone.now().date() > self.due_date
+
+    @is_overdue.setter
+    def is_overdue(self, value):
+        # Set by Invoice.objects.with_overdue()
+        self._is_overdue = value
 
     @property
     def balance_due(self):
@@ -828,7 +926,7 @@ class Payment(TimeStampedModel):
         ]
 
     def __str__(self):
-        return f"{self.payment_id} - {self.amount} - {self.customer.user.get_full_name()}"
+        return f"{self.payment_id} - {self.amount} - {self.customer.full_name}"
 
 
 # ============================================================================
@@ -842,6 +940,7 @@ class UsageLog(TimeStampedModel):
     # Usage Details
     session_start = models.DateTimeField()
     session_end = models.DateTimeField(null=True, blank=True)
+    session_time = models.PositiveIntegerField(default=0, help_text="Session time in seconds")
     bytes_uploaded = models.BigIntegerField(default=0)
     bytes_downloaded = models.BigIntegerField(default=0)
 
@@ -859,7 +958,9 @@ class UsageLog(TimeStampedModel):
         ordering = ['-session_start']
         indexes = [
             models.Index(fields=['subscription', 'session_start']),
-            models.Index(fields=['session_start']),
+            models.Index(fields=['session_start', 'id']),
+            models.Index(fields=['session_id']),
+            models.Index(fields=['updated_at']),
         ]
 
     def __str__(self):
@@ -899,13 +1000,99 @@ class BandwidthLog(TimeStampedModel):
         ordering = ['-timestamp']
         indexes = [
             models.Index(fields=['subscription', 'timestamp']),
-            models.Index(fields=['timestamp']),
+            models.Index(fields=['timestamp', 'id']),
+            models.Index(fields=['created_at']),
         ]
 
     def __str__(self):
         return f"{self.subscription.subscription_id} - {self.timestamp}"
 
 
+# ============================================================================
+# USAGE ROLLUPS
+# ============================================================================
+
+ROLLUP_GRANULARITIES = [
+    ('hour', 'Hourly'),
+    ('day', 'Daily'),
+]
+
+
+class UsageRollup(models.Model):
+    """Pre-aggregated UsageLog totals per subscription and time bucket"""
+    subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE, related_name='usage_rollups')
+    granularity = models.CharField(max_length=10, choices=ROLLUP_GRANULARITIES)
+    bucket_start = models.DateTimeField()
+
+    bytes_uploaded = models.BigIntegerField(default=0)
+    bytes_downloaded = models.BigIntegerField(default=0)
+    sessions = models.PositiveIntegerField(default=0)
+    session_time = models.BigIntegerField(default=0, help_text="Session time in seconds")
+
+    class Meta:
+        ordering = ['bucket_start']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['subscription', 'granularity', 'bucket_start'],
+                name='unique_usage_rollup_bucket',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['granularity', 'bucket_start']),
+        ]
+
+    def __str__(self):
+        return f"{self.subscription_id} - {self.granularity} {self.bucket_start}"
+
+    @property
+    def total_bytes(self):
+        return self.bytes_uploaded + self.bytes_downloaded
+
+
+class BandwidthRollup(models.Model):
+    """Pre-aggregated BandwidthLog statistics per subscription and time bucket"""
+    subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE, related_name='bandwidth_rollups')
+    granularity = models.CharField(max_length=10, choices=ROLLUP_GRANULARITIES)
+    bucket_start = models.DateTimeField()
+
+    samples = models.PositiveIntegerField(default=0)
+    avg_download = models.PositiveIntegerField(default=0, help_text="Speed in Kbps")
+    p95_download = models.PositiveIntegerField(default=0, help_text="Speed in Kbps")
+    max_download = models.PositiveIntegerField(default=0, help_text="Speed in Kbps")
+    avg_upload = models.PositiveIntegerField(default=0, help_text="Speed in Kbps")
+    p95_upload = models.PositiveIntegerField(default=0, help_text="Speed in Kbps")
+    max_upload = models.PositiveIntegerField(default=0, help_text="Speed in Kbps")
+    latency_p50 = models.PositiveIntegerField(null=True, blank=True, help_text="Latency in ms")
+    latency_p95 = models.PositiveIntegerField(null=True, blank=True, help_text="Latency in ms")
+    latency_max = models.PositiveIntegerField(null=True, blank=True, help_text="Latency in ms")
+    avg_packet_loss = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+
+    class Meta:
+        ordering = ['bucket_start']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['subscription', 'granularity', 'bucket_start'],
+                name='unique_bandwidth_rollup_bucket',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['granularity', 'bucket_start']),
+        ]
+
+    def __str__(self):
+        return f"{self.subscription_id} - {self.granularity} {self.bucket_start}"
+
+
+class RollupWatermark(models.Model):
+    """High-water mark of source rows already folded into the rollup tables"""
+    name = models.CharField(max_length=50, unique=True)
+    position = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
 # ============================================================================
 # NOTIFICATIONS
 # ============================================================================
@@ -959,7 +1146,15 @@ class Notification(TimeStampedModel):
         ('failed', 'Failed'),
     ]
 
-    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications', null=True, blank=True)
+    # Customers have no user account; customer notifications go to their phone or email
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.CASCADE,
+        related_name='notifications',
+        null=True,
+        blank=True
+    )
     template = models.ForeignKey(
         NotificationTemplate,
         on_delete=models.SET_NULL,
@@ -980,16 +1175,19 @@ class Notification(TimeStampedModel):
 
     # Additional Data
     metadata = models.JSONField(default=dict, blank=True)
+    # Set for automated notifications (e.g. 'dunning:<invoice>:<stage>:<channel>') so each is created once
+    dedupe_key = models.CharField(max_length=100, unique=True, null=True, blank=True)
 
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['recipient', 'status']),
+            models.Index(fields=['customer', 'status']),
             models.Index(fields=['status', 'sent_at']),
         ]
 
     def __str__(self):
-        return f"{self.subject} - {self.recipient.username}"
+        return f"{self.subject} - {self.recipient.username if self.recipient else self.customer}"
 
 
 # ============================================================================
@@ -1039,7 +1237,187 @@ class SystemLog(TimeStampedModel):
             models.Index(fields=['user', 'created_at']),
             models.Index(fields=['level', 'created_at']),
             models.Index(fields=['action_type', 'created_at']),
+            models.Index(fields=['created_at', 'id']),
         ]
 
     def __str__(self):
         return f"{self.level.upper()}: {self.message[:50]}"
+
+
+# ============================================================================
+# BULK OPERATIONS
+# ============================================================================
+
+class BulkJob(TimeStampedModel):
+    """A bulk operation over many customers/subscriptions, run in the background when large"""
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    TARGET_CHOICES = [
+        ('customer', 'Customers'),
+        ('subscription', 'Subscriptions'),
+        ('equipment', 'Network equipment'),
+    ]
+
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='bulk_jobs')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='bulk_jobs')
+    target = models.CharField(max_length=20, choices=TARGET_CHOICES)
+    operation = models.CharField(max_length=30)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+
+    # Request and outcome
+    object_ids = models.JSONField(default=list)
+    params = models.JSONField(default=dict, blank=True)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    succeeded = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    results = models.JSONField(default=list, blank=True)
+    metrics = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['company', 'created_at']),
+            models.Index(fields=['status']),
+        ]
+
+    def __str__(self):
+        return f"{self.target} {self.operation} ({self.status})"
+
+
+class BillingRun(TimeStampedModel):
+    """One billing run over every tenant, split into shards billed in parallel"""
+
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    as_of = models.DateTimeField(help_text="Periods starting on or before this moment are billed")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    workers = models.PositiveIntegerField(default=0)
+
+    # Progress, updated as shards finish
+    shards = models.PositiveIntegerField(default=0)
+    shards_done = models.PositiveIntegerField(default=0)
+    subscriptions = models.PositiveIntegerField(default=0)
+    invoices = models.PositiveIntegerField(default=0)
+    # Per-shard timing and totals, and the invoiced amount per currency
+    report = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Billing run {self.as_of:%Y-%m-%d} ({self.status})"
+
+
+class PaymentReview(TimeStampedModel):
+    """A statement line reconciliation could not match to a customer, kept for someone to resolve"""
+
+    REASON_CHOICES = [
+        ('unmatched', 'No matching customer or invoice'),
+        ('ambiguous', 'Matches more than one customer'),
+    ]
+
+    STATUS_CHOICES = [
+        ('open', 'Open'),
+        ('resolved', 'Resolved'),
+        ('dismissed', 'Dismissed'),
+    ]
+
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='payment_reviews')
+    statement = models.CharField(max_length=100, blank=True, help_text="Statement file or batch the line came from")
+    reference = models.CharField(max_length=50)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    paid_at = models.DateTimeField()
+    account = models.CharField(max_length=100, blank=True)
+    phone = models.CharField(max_length=20, blank=True)
+    payer_name = models.CharField(max_length=200, blank=True)
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='open')
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='reviews')
+
+    class Meta:
+        ordering = ['-paid_at']
+        indexes = [
+            models.Index(fields=['company', 'status']),
+        ]
+        constraints = [
+            # Re-importing a statement does not queue its lines twice
+            models.UniqueConstraint(fields=['company', 'reference'], name='unique_payment_review_reference'),
+        ]
+
+    def __str__(self):
+        return f"{self.reference} - {self.amount} ({self.get_reason_display()})"
+
+
+# ============================================================================
+# CUSTOMER LEDGER
+# ============================================================================
+
+class LedgerEntry(models.Model):
+    """One movement of a customer's balance. Entries are only ever appended, never changed."""
+
+    ENTRY_TYPES = [
+        ('invoice', 'Invoice Issued'),
+        ('payment', 'Payment Received'),
+        ('adjustment', 'Adjustment'),
+    ]
+
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='ledger_entries')
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPES)
+    amount = models.DecimalField(
+        max_digits=10, decimal_places=2, help_text="Positive charges the customer, negative credits them"
+    )
+    occurred_at = models.DateTimeField()
+    source_key = models.CharField(
+        max_length=60, unique=True, help_text="What the entry records (e.g. invoice:12); posting it twice is a no-op"
+    )
+    invoice = models.ForeignKey(Invoice, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    description = models.CharField(max_length=200, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['occurred_at', 'id']
+        verbose_name_plural = 'ledger entries'
+        indexes = [
+            models.Index(fields=['customer', 'occurred_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.customer} {self.get_entry_type_display()} {self.amount}"
+
+
+class BalanceSnapshot(models.Model):
+    """A customer's balance at a moment: the sum of their ledger entries up to as_of"""
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='balance_snapshots')
+    as_of = models.DateTimeField()
+    balance = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-as_of']
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'as_of'], name='unique_balance_snapshot'),
+        ]
+
+    def __str__(self):
+        return f"{self.customer} {self.balance} @ {self.as_of}"
@@ -1,13 +1,78 @@
+from django.db.models import Count
 from rest_framework import serializers
 from isp.models import (
     Customer, InternetPackage, Subscription, Ticket, Payment, Invoice,
     TicketCategory, TicketComment, PackageCategory, NetworkZone,
     NetworkEquipment, IPAddressPool, IPAddress, UsageLog, BandwidthLog,
-    Company, User, UserProfile
+    Company, User, UserProfile, SystemLog, LedgerEntry
 )
 
 
-class UserSerializer(serializers.ModelSerializer):
+def parse_field_paths(value) -> tuple:
+    """'id,customer.full_name' -> (('customer', (('full_name', ()),)), ('id', ())), hashable and ordered"""
+    tree = {}
+    for path in (value or '').split(','):
+        node = tree
+        for part in filter(None, (p.strip() for p in path.split('.'))):
+            node = node.setdefault(part, {})
+
+    def freeze(node):
+        return tuple(sorted((name, freeze(child)) for name, child in node.items()))
+    return freeze(tree)
+
+
+class SparseFieldsMixin:
+    """
+    Sparse fieldsets for ModelSerializers.
+
+    `?fields=id,status,customer.full_name` limits the output to those fields and
+    `?expand=customer,subscription.package` embeds the named relations; any other nested
+    serializer collapses to the related primary key(s). Serializers built in code take
+    the same trees as `fields=` / `expand=` keyword arguments (see parse_field_paths).
+    """
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._sparse = None if fields is None and expand is None else (fields, expand or ())
+
+    @property
+    def sparse_config(self):
+        """(fields tree or None for all fields, expand tree)"""
+        if self._sparse is None:
+            request = self.context.get('request')
+            params = getattr(request, 'query_params', {})
+            fields = params.get(self.fields_query_param)
+            self._sparse = (parse_field_paths(fields) if fields else None,
+                            parse_field_paths(params.get(self.expand_query_param)))
+        return self._sparse
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested, expand = self.sparse_config
+        requested = dict(requested) if requested is not None else None
+        expand = dict(expand)
+
+        if requested is not None:
+            # Write-only fields stay so input is still validated
+            fields = {name: field for name, field in fields.items() if name in requested or field.write_only}
+
+        for name, field in list(fields.items()):
+            many = isinstance(field, serializers.ListSerializer)
+            nested = field.child if many else field
+            if field.write_only or not isinstance(nested, SparseFieldsMixin):
+                continue
+            subfields = (requested or {}).get(name)
+            if name in expand or subfields:
+                nested._sparse = (subfields or None, expand.get(name, ()))
+            else:
+                options = {'source': field.source} if field.source else {}
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True, many=many, **options)
+        return fields
+
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     full_name = serializers.CharField(source='get_full_name', read_only=True)
 
     class Meta:
@@ -15,6 +80,8 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'full_name',
                   'user_type', 'phone', 'company', 'is_active', 'date_joined']
         read_only_fields = ['date_joined']
+        # Columns read by methods/properties and to_representation(), for eager loading
+        eager_fields = ['first_name', 'last_name', 'salary', 'employee_id', 'hire_date']
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
@@ -42,13 +109,13 @@ class UserSerializer(serializers.ModelSerializer):
         return None
 
 
-class CompanySerializer(serializers.ModelSerializer):
+class CompanySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Company
         fields = '__all__'
 
 
-class CustomerSerializer(serializers.ModelSerializer):
+class CustomerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     # name = serializers.CharField(source='full_name', read_only=True)
     phone = serializers.CharField(source='primary_phone', read_only=True)
@@ -62,48 +129,78 @@ class CustomerSerializer(serializers.ModelSerializer):
                   'state', 'postal_code', 'country', 'business_name', 'activation_date', 'termination_date',
                   'credit_limit', 'current_balance', 'auto_pay_enabled',
                   'email_notifications', 'created_at', 'updated_at']
-        read_only_fields = ['created_at', 'updated_at']
+        # Balances move through the ledger (isp/services/ledger.py), not by editing the customer
+        read_only_fields = ['current_balance', 'created_at', 'updated_at']
 
 
-class PackageCategorySerializer(serializers.ModelSerializer):
+class PackageCategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = PackageCategory
         fields = '__all__'
 
 
-class InternetPackageSerializer(serializers.ModelSerializer):
+class InternetPackageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     category = PackageCategorySerializer(read_only=True)
     category_id = serializers.IntegerField(write_only=True, required=False)
-    subscribers_count = serializers.IntegerField(read_only=True)
-    can_subscribe = serializers.BooleanField(read_only=True)
+    subscribers_count = serializers.SerializerMethodField()
+    can_subscribe = serializers.SerializerMethodField()
 
     class Meta:
         model = InternetPackage
         fields = '__all__'
         read_only_fields = ['current_subscribers', 'company', 'created_at', 'updated_at']
 
+    def _active_subscribers(self, package):
+        # One grouped query per company and response instead of a COUNT per package
+        counts = self.context.setdefault('active_subscribers', {})
+        if package.company_id not in counts:
+            counts[package.company_id] = dict(
+                Subscription.objects.filter(package__company_id=package.company_id, status='active')
+                .order_by().values_list('package_id').annotate(total=Count('id'))
+            )
+        return counts[package.company_id].get(package.pk, 0)
+
+    def get_subscribers_count(self, obj):
+        return self._active_subscribers(obj)
+
+    def get_can_subscribe(self, obj):
+        if obj.max_subscribers:
+            return self._active_subscribers(obj) < obj.max_subscribers
+        return True
+
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     customer = CustomerSerializer(read_only=True)
     package = InternetPackageSerializer(read_only=True)
     customer_id = serializers.IntegerField(write_only=True)
     package_id = serializers.IntegerField(write_only=True)
+    # The NAS lifecycle changes are pushed to; accounting fills it in from the NAS address when left empty
+    router = serializers.PrimaryKeyRelatedField(
+        queryset=NetworkEquipment.objects.filter(equipment_type='router'), required=False, allow_null=True,
+    )
     is_expired = serializers.BooleanField(read_only=True)
     data_usage_percentage = serializers.FloatField(read_only=True)
 
     class Meta:
         model = Subscription
         fields = '__all__'
-        read_only_fields = ['subscription_id', 'created_at', 'updated_at']
+        read_only_fields = ['subscription_id', 'data_limit_bytes', 'created_at', 'updated_at']
+        eager_fields = ['end_date', 'data_limit_bytes', 'data_used']
 
+    def validate_router(self, router):
+        request = self.context.get('request')
+        if router is not None and request is not None and router.company_id != request.user.company_id:
+            raise serializers.ValidationError("Router not found.")
+        return router
 
-class TicketCategorySerializer(serializers.ModelSerializer):
+
+class TicketCategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = TicketCategory
         fields = '__all__'
 
 
-class TicketCommentSerializer(serializers.ModelSerializer):
+class TicketCommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     author_id = serializers.IntegerField(write_only=True)
 
@@ -113,7 +210,7 @@ class TicketCommentSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at']
 
 
-class TicketSerializer(serializers.ModelSerializer):
+class TicketSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     customer = CustomerSerializer(read_only=True)
     category = TicketCategorySerializer(read_only=True)
     assigned_to = UserSerializer(read_only=True)
@@ -127,9 +224,17 @@ class TicketSerializer(serializers.ModelSerializer):
         model = Ticket
         fields = '__all__'
         read_only_fields = ['ticket_id', 'created_at', 'updated_at']
+        eager_fields = ['status', 'sla_resolution_due']
+
+
+class LedgerEntrySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = LedgerEntry
+        fields = ['id', 'entry_type', 'amount', 'occurred_at', 'description', 'invoice', 'payment', 'created_at']
+        read_only_fields = fields
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     customer = CustomerSerializer(read_only=True)
     invoice = serializers.StringRelatedField(read_only=True)
     processed_by = UserSerializer(read_only=True)
@@ -141,9 +246,11 @@ class PaymentSerializer(serializers.ModelSerializer):
         model = Payment
         fields = '__all__'
         read_only_fields = ['payment_id', 'created_at', 'updated_at']
+        # Invoice.__str__ includes the customer name
+        eager_select_related = ['invoice__customer']
 
 
-class InvoiceSerializer(serializers.ModelSerializer):
+class InvoiceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     customer = CustomerSerializer(read_only=True)
     subscription = SubscriptionSerializer(read_only=True)
     payments = PaymentSerializer(many=True, read_only=True)
@@ -156,16 +263,17 @@ class InvoiceSerializer(serializers.ModelSerializer):
         model = Invoice
         fields = '__all__'
         read_only_fields = ['invoice_number', 'created_at', 'updated_at']
+        eager_fields = ['status', 'due_date', 'total_amount', 'paid_amount']
 
 
-class NetworkZoneSerializer(serializers.ModelSerializer):
+class NetworkZoneSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = NetworkZone
         fields = '__all__'
         read_only_fields = ['created_at', 'updated_at']
 
 
-class NetworkEquipmentSerializer(serializers.ModelSerializer):
+class NetworkEquipmentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     zone = NetworkZoneSerializer(read_only=True)
     zone_id = serializers.IntegerField(write_only=True, required=False)
 
@@ -175,14 +283,14 @@ class NetworkEquipmentSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at']
 
 
-class IPAddressPoolSerializer(serializers.ModelSerializer):
+class IPAddressPoolSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = IPAddressPool
         fields = '__all__'
         read_only_fields = ['created_at', 'updated_at']
 
 
-class IPAddressSerializer(serializers.ModelSerializer):
+class IPAddressSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     pool = IPAddressPoolSerializer(read_only=True)
     assigned_to = SubscriptionSerializer(read_only=True)
     pool_id = serializers.IntegerField(write_only=True)
@@ -194,7 +302,7 @@ class IPAddressSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at']
 
 
-class UsageLogSerializer(serializers.ModelSerializer):
+class UsageLogSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     subscription = SubscriptionSerializer(read_only=True)
     subscription_id = serializers.IntegerField(write_only=True)
     total_bytes = serializers.IntegerField(read_only=True)
@@ -204,9 +312,10 @@ class UsageLogSerializer(serializers.ModelSerializer):
         model = UsageLog
         fields = '__all__'
         read_only_fields = ['created_at', 'updated_at']
+        eager_fields = ['bytes_uploaded', 'bytes_downloaded', 'session_start', 'session_end']
 
 
-class BandwidthLogSerializer(serializers.ModelSerializer):
+class BandwidthLogSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     subscription = SubscriptionSerializer(read_only=True)
     subscription_id = serializers.IntegerField(write_only=True)
 
@@ -214,3 +323,12 @@ class BandwidthLogSerializer(serializers.ModelSerializer):
         model = BandwidthLog
         fields = '__all__'
         read_only_fields = ['created_at', 'updated_at']
+
+
+class SystemLogSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    user = serializers.StringRelatedField(read_only=True)
+
+    class Meta:
+        model = SystemLog
+        fields = '__all__'
+        read_only_fields = ['created_at', 'updated_at']
@@ -0,0 +1,582 @@
+"""
+ISP Management System - RADIUS Accounting Ingest
+Buffers Start/Interim-Update/Stop records in memory and flushes them into UsageLog in bulk
+File: services/accounting.py
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from isp.services.sessions import ActiveSession, track_sessions
+from isp.services.updates import update_rows
+from isp.services.usage import UsageDeltas, add_delta, apply_usage_deltas, usage_delta
+
+logger = logging.getLogger(__name__)
+
+STATUS_START = 'start'
+STATUS_INTERIM = 'interim'
+STATUS_STOP = 'stop'
+
+STATUS_ALIASES = {
+    'start': STATUS_START,
+    'interim-update': STATUS_INTERIM,
+    'interim': STATUS_INTERIM,
+    'alive': STATUS_INTERIM,
+    'stop': STATUS_STOP,
+}
+
+# Order in which a coalesced session may move; a late Interim never reopens a Stop.
+STATUS_RANK = {STATUS_START: 0, STATUS_INTERIM: 1, STATUS_STOP: 2}
+
+UNKNOWN_IP = '0.0.0.0'
+
+
+def accounting_settings() -> Dict:
+    defaults = {
+        'SECRET': '',
+        'MAX_BUFFERED': 50000,
+        'BATCH_SIZE': 2000,
+        'FLUSH_INTERVAL': 1.0,
+        'ENQUEUE_TIMEOUT': 0.5,
+    }
+    return {**defaults, **getattr(settings, 'RADIUS_ACCOUNTING', {})}
+
+
+class BufferFull(Exception):
+    """Raised when the ingest buffer cannot take more sessions (backpressure)"""
+    pass
+
+
+# =============================================================================
+# RECORDS
+# =============================================================================
+
+def _first(data: Dict, *keys, default=None):
+    for key in keys:
+        if key in data and data[key] not in (None, ''):
+            return data[key]
+    return default
+
+
+def _as_int(value) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _as_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, (int, float)) or (isinstance(value, str) and value.isdigit()):
+        return datetime.fromtimestamp(int(value), tz=dt_timezone.utc)
+    elif isinstance(value, str):
+        parsed = parse_datetime(value)
+    else:
+        parsed = None
+
+    if parsed is None:
+        return timezone.now()
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+@dataclass
+class AccountingRecord:
+    """A single RADIUS accounting packet, normalised"""
+    status: str
+    session_id: str
+    username: str
+    event_time: datetime
+    session_time: int = 0
+    input_octets: int = 0
+    output_octets: int = 0
+    framed_ip: str = ''
+    calling_station_id: str = ''
+    nas_ip: str = ''
+    nas_port: str = ''
+    terminate_cause: str = ''
+
+    @classmethod
+    def from_radius(cls, data: Dict) -> "AccountingRecord":
+        """
+        Build a record from either raw RADIUS attribute names
+        (``Acct-Status-Type``, ``Acct-Input-Octets`` ...) or their snake_case form.
+        Gigaword counters are folded into the 64-bit octet totals.
+        """
+        status = str(_first(data, 'Acct-Status-Type', 'acct_status_type', 'status', default='')).lower()
+        if status not in STATUS_ALIASES:
+            raise ValueError(f"Unsupported Acct-Status-Type: {status or 'missing'}")
+
+        session_id = str(_first(data, 'Acct-Session-Id', 'acct_session_id', 'session_id', default=''))
+        username = str(_first(data, 'User-Name', 'user_name', 'username', default=''))
+        if not session_id or not username:
+            raise ValueError("Accounting records require Acct-Session-Id and User-Name")
+
+        input_octets = _as_int(_first(data, 'Acct-Input-Octets', 'acct_input_octets', 'input_octets'))
+        input_giga = _as_int(_first(data, 'Acct-Input-Gigawords', 'acct_input_gigawords', 'input_gigawords'))
+        output_octets = _as_int(_first(data, 'Acct-Output-Octets', 'acct_output_octets', 'output_octets'))
+        output_giga = _as_int(_first(data, 'Acct-Output-Gigawords', 'acct_output_gigawords', 'output_gigawords'))
+
+        return cls(
+            status=STATUS_ALIASES[status],
+            session_id=session_id[:100],
+            username=username,
+            event_time=_as_datetime(_first(data, 'Event-Timestamp', 'event_timestamp', 'event_time')),
+            session_time=_as_int(_first(data, 'Acct-Session-Time', 'acct_session_time', 'session_time')),
+            input_octets=(input_giga << 32) + input_octets,
+            output_octets=(output_giga << 32) + output_octets,
+            framed_ip=str(_first(data, 'Framed-IP-Address', 'framed_ip_address', 'framed_ip', default='')),
+            calling_station_id=str(_first(data, 'Calling-Station-Id', 'calling_station_id', default=''))[:17],
+            nas_ip=str(_first(data, 'NAS-IP-Address', 'nas_ip_address', 'nas_ip', default='')),
+            nas_port=str(_first(data, 'NAS-Port-Id', 'NAS-Port', 'nas_port_id', 'nas_port', default=''))[:20],
+            terminate_cause=str(_first(data, 'Acct-Terminate-Cause', 'acct_terminate_cause',
+                                       'terminate_cause', default=''))[:50],
+        )
+
+    @property
+    def session_start(self) -> datetime:
+        return self.event_time - timedelta(seconds=self.session_time)
+
+    def merge(self, newer: "AccountingRecord") -> "AccountingRecord":
+        """
+        Coalesce a later packet for the same session into this one.
+        Counters are monotonic, so the highest value wins even if packets arrive out of order.
+        """
+        keep_newer = STATUS_RANK[newer.status] >= STATUS_RANK[self.status]
+        latest = newer if keep_newer else self
+        return AccountingRecord(
+            status=max(self.status, newer.status, key=STATUS_RANK.get),
+            session_id=self.session_id,
+            username=self.username,
+            event_time=max(self.event_time, newer.event_time),
+            session_time=max(self.session_time, newer.session_time),
+            input_octets=max(self.input_octets, newer.input_octets),
+            output_octets=max(self.output_octets, newer.output_octets),
+            framed_ip=latest.framed_ip or self.framed_ip or newer.framed_ip,
+            calling_station_id=latest.calling_station_id or self.calling_station_id,
+            nas_ip=latest.nas_ip or self.nas_ip or newer.nas_ip,
+            nas_port=latest.nas_port or self.nas_port,
+            terminate_cause=newer.terminate_cause or self.terminate_cause,
+        )
+
+
+# =============================================================================
+# BUFFER
+# =============================================================================
+
+class AccountingBuffer:
+    """
+    Bounded, thread-safe buffer keyed by session id.
+
+    Interim updates for a session that is already buffered are merged in place and do
+    not consume capacity, so an interim-update storm collapses to one row per session.
+    """
+
+    def __init__(self, max_sessions: int):
+        self.max_sessions = max_sessions
+        self._pending: "OrderedDict[str, AccountingRecord]" = OrderedDict()
+        self._lock = threading.Condition()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def put_many(self, records: Iterable[AccountingRecord], timeout: float = 0) -> int:
+        """
+        Add records to the buffer, waiting up to `timeout` seconds for space.
+        Raises BufferFull (and adds nothing) when the batch still does not fit.
+        """
+        records = list(records)
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                new_sessions = {r.session_id for r in records} - self._pending.keys()
+                if len(self._pending) + len(new_sessions) <= self.max_sessions:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise BufferFull(
+                        f"Accounting buffer is full ({len(self._pending)}/{self.max_sessions} sessions)"
+                    )
+                self._lock.wait(remaining)
+
+            for record in records:
+                current = self._pending.get(record.session_id)
+                self._pending[record.session_id] = current.merge(record) if current else record
+            self._lock.notify_all()
+        return len(records)
+
+    def requeue(self, records: List[AccountingRecord]) -> None:
+        """
+        Put records from a failed flush back at the front of the buffer, merged with anything
+        that arrived for the same sessions since. They held capacity before the drain, so
+        they are taken back even when the buffer has filled up in between.
+        """
+        with self._lock:
+            for record in reversed(records):
+                current = self._pending.get(record.session_id)
+                self._pending[record.session_id] = record.merge(current) if current else record
+                self._pending.move_to_end(record.session_id, last=False)
+            self._lock.notify_all()
+
+    def drain(self, max_records: int) -> List[AccountingRecord]:
+        with self._lock:
+            batch = []
+            while self._pending and len(batch) < max_records:
+                batch.append(self._pending.popitem(last=False)[1])
+            if batch:
+                self._lock.notify_all()
+            return batch
+
+    def wait_for(self, count: int, timeout: float) -> None:
+        """Block until at least `count` sessions are buffered or `timeout` elapses"""
+        with self._lock:
+            self._lock.wait_for(lambda: len(self._pending) >= count, timeout)
+
+
+# =============================================================================
+# FLUSH
+# =============================================================================
+
+@dataclass
+class UsageSnapshot:
+    bytes_uploaded: int
+    bytes_downloaded: int
+    session_time: int
+
+
+@dataclass
+class FlushResult:
+    records: int = 0
+    created: int = 0
+    updated: int = 0
+    dropped: int = 0
+    requeued: int = 0
+    duration: float = 0.0
+
+
+def _track(record: AccountingRecord, subscription_id: int, companies: Dict[int, int], ended: bool,
+           online: List[ActiveSession], offline: List[str]) -> None:
+    if ended:
+        offline.append(record.session_id)
+    elif subscription_id in companies:
+        online.append(ActiveSession(
+            session_id=record.session_id,
+            username=record.username,
+            subscription_id=subscription_id,
+            company_id=companies[subscription_id],
+            nas_ip=record.nas_ip,
+            framed_ip=record.framed_ip,
+            mac_address=record.calling_station_id,
+            started_at=record.session_start.timestamp(),
+            session_time=record.session_time,
+            bytes_uploaded=record.input_octets,
+            bytes_downloaded=record.output_octets,
+            seen_at=time.time(),
+        ))
+
+
+def _assign_routers(nas_ips: Dict[int, str], companies: Dict[int, int], routers: Dict[int, Optional[int]]) -> int:
+    """
+    Point each subscription at the router whose address is the NAS-IP-Address of its newest
+    session, so lifecycle changes are pushed to the router the subscriber dials into.
+    One lookup query, and one UPDATE per router whose subscribers moved to it.
+    """
+    from isp.models import NetworkEquipment, Subscription
+
+    if not nas_ips:
+        return 0
+    by_address = {
+        (company_id, ip_address): router_id
+        for router_id, company_id, ip_address in NetworkEquipment.objects.filter(
+            equipment_type='router',
+            company_id__in={companies[pk] for pk in nas_ips},
+            ip_address__in=set(nas_ips.values()),
+        ).values_list('id', 'company_id', 'ip_address')
+    }
+    moved: Dict[int, List[int]] = {}
+    for subscription_id, nas_ip in nas_ips.items():
+        router_id = by_address.get((companies[subscription_id], nas_ip))
+        if router_id is not None and router_id != routers.get(subscription_id):
+            moved.setdefault(router_id, []).append(subscription_id)
+    for router_id, subscription_ids in moved.items():
+        Subscription.objects.filter(pk__in=subscription_ids).update(router_id=router_id)
+    return sum(len(subscription_ids) for subscription_ids in moved.values())
+
+
+def flush_records(records: List[AccountingRecord], batch_size: int = 1000) -> FlushResult:
+    """
+    Write a batch of coalesced records to UsageLog with one lookup query per table,
+    one bulk_create for new sessions and one batched UPDATE for known sessions.
+    The octet/minute growth of every row is applied to Subscription counters in the
+    same transaction, and a new session from a known router's NAS-IP-Address assigns
+    the subscription to that router. Records whose User-Name matches no subscription
+    are dropped. Once committed, the records update the active session table.
+    """
+    from isp.models import Subscription, UsageLog
+
+    started = time.perf_counter()
+    result = FlushResult(records=len(records))
+    if not records:
+        return result
+
+    subscriptions, companies, routers = {}, {}, {}
+    for username, subscription_id, company_id, router_id in (
+        Subscription.objects.filter(username__in={r.username for r in records})
+        .values_list('username', 'id', 'customer__company_id', 'router_id')
+    ):
+        subscriptions[username] = subscription_id
+        companies[subscription_id] = company_id
+        routers[subscription_id] = router_id
+    existing = {
+        log.session_id: log
+        for log in UsageLog.objects.filter(session_id__in=[r.session_id for r in records])
+        .order_by('session_start')
+        .only('id', 'subscription_id', 'session_id', 'session_start', 'session_end',
+              'bytes_uploaded', 'bytes_downloaded', 'session_time', 'termination_cause')
+    }
+
+    now = timezone.now()
+    to_create, to_update = [], []
+    deltas: UsageDeltas = {}
+    online, offline = [], []
+    # Subscription pk -> NAS address of its newest new session
+    nas_ips: Dict[int, str] = {}
+    starts: Dict[int, datetime] = {}
+    for record in records:
+        subscription_id = subscriptions.get(record.username)
+        log = existing.get(record.session_id)
+        if subscription_id is None and log is None:
+            result.dropped += 1
+            continue
+
+        if log is None:
+            to_create.append(UsageLog(
+                subscription_id=subscription_id,
+                session_id=record.session_id,
+                session_start=record.session_start,
+                session_end=record.event_time if record.status == STATUS_STOP else None,
+                session_time=record.session_time,
+                bytes_uploaded=record.input_octets,
+                bytes_downloaded=record.output_octets,
+                ip_address=record.framed_ip or UNKNOWN_IP,
+                mac_address=record.calling_station_id,
+                nas_ip=record.nas_ip or None,
+                nas_port=record.nas_port,
+                termination_cause=record.terminate_cause,
+            ))
+            add_delta(deltas, subscription_id, usage_delta(None, to_create[-1]))
+            if record.nas_ip and record.session_start >= starts.get(subscription_id, record.session_start):
+                nas_ips[subscription_id] = record.nas_ip
+                starts[subscription_id] = record.session_start
+            _track(record, subscription_id, companies, record.status == STATUS_STOP, online, offline)
+            continue
+
+        previous = UsageSnapshot(log.bytes_uploaded, log.bytes_downloaded, log.session_time)
+        log.bytes_uploaded = max(log.bytes_uploaded, record.input_octets)
+        log.bytes_downloaded = max(log.bytes_downloaded, record.output_octets)
+        log.session_time = max(log.session_time, record.session_time)
+        if record.status == STATUS_STOP and log.session_end is None:
+            log.session_end = record.event_time
+            log.termination_cause = record.terminate_cause
+        log.updated_at = now
+        to_update.append(log)
+        add_delta(deltas, log.subscription_id, usage_delta(previous, log))
+        # A late Interim for a session that already stopped leaves it offline
+        _track(record, log.subscription_id, companies, log.session_end is not None, online, offline)
+
+    with transaction.atomic():
+        if to_create:
+            UsageLog.objects.bulk_create(to_create, batch_size=batch_size)
+        if to_update:
+            update_rows(to_update, ['bytes_uploaded', 'bytes_downloaded', 'session_time',
+                                    'session_end', 'termination_cause', 'updated_at'])
+        apply_usage_deltas(deltas)
+        _assign_routers(nas_ips, companies, routers)
+    track_sessions(online, offline)
+
+    result.created = len(to_create)
+    result.updated = len(to_update)
+    result.duration = time.perf_counter() - started
+    return result
+
+
+# =============================================================================
+# METRICS
+# =============================================================================
+
+def _percentile_ms(sorted_seconds: List[float], fraction: float) -> Optional[float]:
+    if not sorted_seconds:
+        return None
+    index = min(len(sorted_seconds) - 1, int(len(sorted_seconds) * fraction))
+    return round(sorted_seconds[index] * 1000, 3)
+
+
+@dataclass
+class FlushMetrics:
+    """Rolling per-flush latency and throughput counters"""
+    window: int = 500
+    flushes: int = 0
+    failures: int = 0
+    records: int = 0
+    created: int = 0
+    updated: int = 0
+    dropped: int = 0
+    requeued: int = 0
+    rejected: int = 0
+    last_flush_at: Optional[datetime] = None
+    _latencies: deque = field(default_factory=deque, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def observe(self, result: FlushResult) -> None:
+        with self._lock:
+            self.flushes += 1
+            self.records += result.records
+            self.created += result.created
+            self.updated += result.updated
+            self.dropped += result.dropped
+            self.last_flush_at = timezone.now()
+            self._latencies.append(result.duration)
+            if len(self._latencies) > self.window:
+                self._latencies.popleft()
+
+    def failed(self, records: int) -> None:
+        with self._lock:
+            self.failures += 1
+            self.requeued += records
+
+    def reject(self, records: int) -> None:
+        with self._lock:
+            self.rejected += records
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+        return {
+            'flushes': self.flushes,
+            'failures': self.failures,
+            'records': self.records,
+            'created': self.created,
+            'updated': self.updated,
+            'dropped': self.dropped,
+            'requeued': self.requeued,
+            'rejected': self.rejected,
+            'last_flush_at': self.last_flush_at.isoformat() if self.last_flush_at else None,
+            'flush_latency_ms': {
+                'p50': _percentile_ms(latencies, 0.50),
+                'p95': _percentile_ms(latencies, 0.95),
+                'max': _percentile_ms(latencies, 1.0),
+            },
+        }
+
+
+# =============================================================================
+# PIPELINE
+# =============================================================================
+
+class AccountingPipeline:
+    """
+    Process-wide ingest pipeline: a bounded buffer plus a daemon thread
+    that flushes it every FLUSH_INTERVAL seconds or as soon as BATCH_SIZE sessions are waiting.
+    """
+    instance: "AccountingPipeline" = None
+
+    def __init__(self, max_sessions: int, batch_size: int, flush_interval: float, enqueue_timeout: float):
+        self.buffer = AccountingBuffer(max_sessions)
+        self.metrics = FlushMetrics()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def get(cls) -> "AccountingPipeline":
+        if cls.instance is None:
+            conf = accounting_settings()
+            cls.instance = cls(
+                max_sessions=conf['MAX_BUFFERED'],
+                batch_size=conf['BATCH_SIZE'],
+                flush_interval=conf['FLUSH_INTERVAL'],
+                enqueue_timeout=conf['ENQUEUE_TIMEOUT'],
+            )
+        return cls.instance
+
+    @classmethod
+    def destroy(cls):
+        if cls.instance is not None:
+            cls.instance.stop()
+        cls.instance = None
+
+    def submit(self, records: List[AccountingRecord]) -> int:
+        """Enqueue records for the background worker; raises BufferFull on backpressure"""
+        self.start()
+        try:
+            return self.buffer.put_many(records, timeout=self.enqueue_timeout)
+        except BufferFull:
+            self.metrics.reject(len(records))
+            raise
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='radius-accounting-flush', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        with self.buffer._lock:
+            self.buffer._lock.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush_all()
+
+    def flush_once(self) -> FlushResult:
+        batch = self.buffer.drain(self.batch_size)
+        if not batch:
+            return FlushResult()
+        try:
+            result = flush_records(batch)
+        except Exception:
+            # Usage is billed from these counters, so a failed batch goes back into the
+            # buffer and is retried on the next flush instead of being lost
+            logger.exception("Failed to flush %s accounting records, requeued", len(batch))
+            self.buffer.requeue(batch)
+            self.metrics.failed(len(batch))
+            return FlushResult(records=len(batch), requeued=len(batch))
+        self.metrics.observe(result)
+        return result
+
+    def flush_all(self) -> None:
+        while len(self.buffer):
+            if self.flush_once().requeued:
+                logger.error("Stopped flushing with %s accounting sessions still buffered", len(self.buffer))
+                return
+
+    def _run(self) -> None:
+        from django.db import close_old_connections
+
+        while not self._stop.is_set():
+            self.buffer.wait_for(self.batch_size, self.flush_interval)
+            close_old_connections()
+            # Drain full batches back to back; after a failure back off for an interval
+            while True:
+                result = self.flush_once()
+                if result.requeued:
+                    self._stop.wait(self.flush_interval)
+                    break
+                if result.records < self.batch_size:
+                    break
@@ -0,0 +1,430 @@
+"""
+ISP Management System - Billing Run
+Invoices every subscription whose next_billing_date has come, a chunk at a time with bulk writes,
+with tenants sharded across a process pool
+File: services/billing.py
+"""
+
+import calendar
+import hashlib
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from isp.functions import close_stale_connections
+from isp.services.ledger import invoice_entry, post_entries
+from isp.services.updates import update_rows
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+
+# Company.billing_cycle -> months per invoice
+CYCLE_MONTHS = {'monthly': 1, 'quarterly': 3, 'yearly': 12}
+
+
+def billing_settings() -> Dict:
+    defaults = {
+        'CHUNK_SIZE': 2000,
+        # Percent added to every invoice
+        'TAX_RATE': Decimal('0'),
+        'DUE_DAYS': 14,
+        'INVOICE_STATUS': 'sent',
+        # Periods billed per subscription in one run when it has fallen behind
+        'MAX_PERIODS': 12,
+        # Processes billing shards in parallel; 0 bills every shard in this process
+        'WORKERS': 4,
+        # Due subscriptions per shard; larger tenants are split by subscription id range
+        'SHARD_SIZE': 20000,
+        # Seconds a shard lock outlives a worker that died holding it (non-PostgreSQL databases)
+        'LOCK_TTL': 3600,
+    }
+    return {**defaults, **getattr(settings, 'BILLING', {})}
+
+
+def add_months(value: datetime, months: int, anchor_day: Optional[int] = None) -> datetime:
+    """`value` moved by whole months, on `anchor_day` or the last day of a shorter month"""
+    month_index = value.month - 1 + months
+    year, month = value.year + month_index // 12, month_index % 12 + 1
+    day = min(anchor_day or value.day, calendar.monthrange(year, month)[1])
+    return value.replace(year=year, month=month, day=day)
+
+
+def invoice_number(subscription_id: int, period_start: datetime) -> str:
+    """The same subscription and period always get the same number, which makes runs idempotent"""
+    return f"INV-{subscription_id}-{period_start:%Y%m%d}"
+
+
+@lru_cache(maxsize=None)
+def company_zone(name: str):
+    try:
+        return ZoneInfo(name or 'UTC')
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo('UTC')
+
+
+def tax_for(subtotal: Decimal, rate: Decimal) -> Decimal:
+    return (subtotal * rate / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+@dataclass
+class BillingResult:
+    subscriptions: int = 0
+    invoices: int = 0
+    items: int = 0
+    # Periods that already had an invoice (an earlier, interrupted run wrote them)
+    existing: int = 0
+    # Currency -> invoiced total
+    amounts: Dict[str, Decimal] = field(default_factory=dict)
+    chunks: int = 0
+    duration: float = 0.0
+    errors: List[str] = field(default_factory=list)
+
+
+@dataclass
+class DraftInvoice:
+    invoice: object
+    items: List[Tuple[str, Decimal, Decimal]]
+
+
+def due_subscriptions(as_of: datetime, company_id: Optional[int] = None, first_pk: Optional[int] = None,
+                      last_pk: Optional[int] = None):
+    from isp.models import Subscription
+
+    queryset = Subscription.objects.filter(status='active', next_billing_date__lte=as_of).filter(
+        Q(end_date__isnull=True) | Q(end_date__gt=F('next_billing_date'))
+    )
+    if company_id:
+        queryset = queryset.filter(customer__company_id=company_id)
+    if first_pk is not None:
+        queryset = queryset.filter(pk__gte=first_pk)
+    if last_pk is not None:
+        queryset = queryset.filter(pk__lte=last_pk)
+    return queryset
+
+
+def _draft(subscription, as_of: datetime, options: Dict) -> Tuple[List[DraftInvoice], datetime, datetime]:
+    """
+    Invoices for every period of `subscription` that started by `as_of`, with the start of the
+    last period billed and the next billing date
+    """
+    from isp.models import Invoice
+
+    package, company = subscription.package, subscription.customer.company
+    months = CYCLE_MONTHS.get(company.billing_cycle, 1)
+    zone = company_zone(company.timezone)
+    anchor = subscription.start_date.day
+    rate = Decimal(options['TAX_RATE'])
+    drafts = []
+    period_start = last_start = subscription.next_billing_date
+    while period_start <= as_of and len(drafts) < options['MAX_PERIODS']:
+        period_end = add_months(period_start, months, anchor)
+        items = [(
+            f"{package.name} ({period_start:%d %b %Y} - {period_end - timedelta(days=1):%d %b %Y})",
+            Decimal(months), subscription.monthly_fee,
+        )]
+        # The first invoice also carries whatever is left of the setup fee
+        if not drafts and subscription.last_billing_date is None and package.setup_fee > subscription.setup_fee_paid:
+            items.append(("Setup fee", Decimal(1), package.setup_fee - subscription.setup_fee_paid))
+
+        subtotal = sum((quantity * unit_price for _, quantity, unit_price in items), Decimal('0'))
+        tax = tax_for(subtotal, rate)
+        # Dates on the invoice are the tenant's local dates
+        issue_date = timezone.localtime(period_start, zone).date()
+        drafts.append(DraftInvoice(Invoice(
+            customer_id=subscription.customer_id,
+            subscription_id=subscription.pk,
+            invoice_number=invoice_number(subscription.pk, period_start),
+            status=options['INVOICE_STATUS'],
+            issue_date=issue_date,
+            due_date=issue_date + timedelta(days=options['DUE_DAYS']),
+            subtotal=subtotal,
+            tax_rate=rate,
+            tax_amount=tax,
+            total_amount=subtotal + tax,
+        ), items))
+        last_start, period_start = period_start, period_end
+    return drafts, last_start, period_start
+
+
+def bill_chunk(subscriptions: List, as_of: datetime, options: Dict, result: BillingResult) -> None:
+    """
+    Write the invoices, items and new billing dates of one chunk in a single transaction. The
+    dates of the whole chunk move with one UPDATE joined to their new values (update_rows).
+    """
+    from isp.models import Invoice, InvoiceItem
+
+    drafts, billed = [], []
+    for subscription in subscriptions:
+        invoices, last_start, next_date = _draft(subscription, as_of, options)
+        drafts += invoices
+        subscription.last_billing_date, subscription.next_billing_date = last_start, next_date
+        billed.append(subscription)
+
+    numbers = [draft.invoice.invoice_number for draft in drafts]
+    existing = set(Invoice.objects.filter(invoice_number__in=numbers).values_list('invoice_number', flat=True))
+    drafts = [draft for draft in drafts if draft.invoice.invoice_number not in existing]
+
+    now = timezone.now()
+    for subscription in billed:
+        subscription.updated_at = now
+
+    with transaction.atomic():
+        invoices = Invoice.objects.bulk_create([draft.invoice for draft in drafts])
+        items = InvoiceItem.objects.bulk_create([
+            # bulk_create skips InvoiceItem.save(), so the line total is set here
+            InvoiceItem(invoice_id=invoice.pk, description=description, quantity=quantity, unit_price=unit_price,
+                        total_price=quantity * unit_price)
+            for invoice, draft in zip(invoices, drafts)
+            for description, quantity, unit_price in draft.items
+        ])
+        if billed:
+            update_rows(billed, ['next_billing_date', 'last_billing_date', 'updated_at'])
+        # Issued invoices charge the customer's balance; drafts wait until they are sent
+        post_entries([invoice_entry(invoice, now) for invoice in invoices if invoice.status != 'draft'])
+
+    result.subscriptions += len(billed)
+    result.invoices += len(invoices)
+    result.items += len(items)
+    result.existing += len(existing)
+    currencies = {s.pk: s.customer.company.currency for s in billed}
+    for invoice in invoices:
+        currency = currencies[invoice.subscription_id]
+        result.amounts[currency] = result.amounts.get(currency, Decimal('0')) + invoice.total_amount
+    result.chunks += 1
+
+
+def run_billing(as_of: Optional[datetime] = None, company_id: Optional[int] = None,
+                chunk_size: Optional[int] = None, first_pk: Optional[int] = None,
+                last_pk: Optional[int] = None) -> BillingResult:
+    """
+    Invoice every due subscription (of one company and id range, when given). Subscriptions
+    are read in primary key order, CHUNK_SIZE at a time, and each chunk commits on its own:
+    an interrupted run leaves whole chunks billed and their dates advanced, so running again
+    picks up where it stopped. Invoice numbers derive from the subscription and period, so a
+    period is never invoiced twice.
+    """
+    options = billing_settings()
+    chunk_size = chunk_size or options['CHUNK_SIZE']
+    as_of = as_of or timezone.now()
+    started = time.perf_counter()
+    result = BillingResult()
+
+    queryset = (
+        due_subscriptions(as_of, company_id, first_pk, last_pk)
+        .select_related('package', 'customer__company')
+        .only('id', 'customer_id', 'start_date', 'next_billing_date', 'last_billing_date', 'monthly_fee',
+              'setup_fee_paid', 'package__name', 'package__setup_fee', 'customer__company__billing_cycle',
+              'customer__company__currency', 'customer__company__timezone')
+        .order_by('pk')
+    )
+    position = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=position)[:chunk_size])
+        if not chunk:
+            break
+        position = chunk[-1].pk
+        try:
+            bill_chunk(chunk, as_of, options, result)
+        except Exception as e:
+            logger.exception("Billing chunk ending at subscription %s failed", position)
+            result.errors.append(f"Subscriptions {chunk[0].pk}-{position}: {e}")
+
+    result.duration = time.perf_counter() - started
+    logger.info("Billing run as of %s: %s invoices for %s subscriptions in %.1fs",
+                as_of.isoformat(), result.invoices, result.subscriptions, result.duration)
+    return result
+
+
+# =============================================================================
+# SHARDED RUNS
+# =============================================================================
+
+@dataclass(frozen=True)
+class BillingShard:
+    company_id: int
+    subscriptions: int
+    # Inclusive subscription id range; None for the whole company
+    first_pk: Optional[int] = None
+    last_pk: Optional[int] = None
+
+    @property
+    def key(self) -> str:
+        if self.first_pk is None:
+            return f"company-{self.company_id}"
+        return f"company-{self.company_id}:{self.first_pk}-{self.last_pk}"
+
+
+def plan_shards(as_of: datetime, company_id: Optional[int] = None, shard_size: Optional[int] = None
+                ) -> List[BillingShard]:
+    """One shard per company with due subscriptions, or several id ranges of SHARD_SIZE for large ones"""
+    shard_size = shard_size or billing_settings()['SHARD_SIZE']
+    due = due_subscriptions(as_of, company_id)
+    counts = due.order_by().values_list('customer__company_id').annotate(count=Count('id'))
+    shards = []
+    for company, count in sorted(counts, key=lambda row: -row[1]):
+        if count <= shard_size:
+            shards.append(BillingShard(company, count))
+            continue
+        pks = list(due.filter(customer__company_id=company).order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(pks), shard_size):
+            block = pks[start:start + shard_size]
+            shards.append(BillingShard(company, len(block), block[0], block[-1]))
+    # Largest first, so the long shards do not start last
+    return sorted(shards, key=lambda shard: -shard.subscriptions)
+
+
+def advisory_lock_id(key: str) -> int:
+    """The PostgreSQL advisory lock id of a billing shard"""
+    return int.from_bytes(hashlib.blake2b(f'billing:{key}'.encode(), digest_size=8).digest(), 'big', signed=True)
+
+
+@contextmanager
+def shard_lock(key: str, ttl: int):
+    """
+    Yields whether this process holds the shard. PostgreSQL advisory locks belong to the
+    connection and go away with a worker that dies; elsewhere a cache entry expiring after
+    `ttl` stands in for them. The unique invoice numbers still stop double billing if the
+    cache is down.
+    """
+    if connection.vendor == 'postgresql':
+        lock_id = advisory_lock_id(key)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [lock_id])
+            acquired = cursor.fetchone()[0]
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", [lock_id])
+        return
+
+    cache_key, token = f'isp:billing:lock:{key}', uuid.uuid4().hex
+    try:
+        acquired = cache.add(cache_key, token, ttl)
+    except Exception as e:
+        logger.warning("Billing shard lock unavailable for %s: %s", key, e)
+        acquired, token = True, None
+    try:
+        yield acquired
+    finally:
+        if acquired and token:
+            try:
+                if cache.get(cache_key) == token:
+                    cache.delete(cache_key)
+            except Exception as e:
+                logger.warning("Could not release billing shard lock %s: %s", key, e)
+
+
+def bill_shard(shard: BillingShard, as_of: datetime) -> Dict:
+    """Bill one shard under its lock; the report entry it returns is plain JSON"""
+    close_stale_connections()
+    started = time.perf_counter()
+    report = {**asdict(shard), 'key': shard.key, 'pid': os.getpid()}
+    try:
+        with shard_lock(shard.key, billing_settings()['LOCK_TTL']) as acquired:
+            if not acquired:
+                return {**report, 'skipped': True, 'error': 'Shard is being billed by another run',
+                        'seconds': round(time.perf_counter() - started, 3)}
+            result = run_billing(as_of, shard.company_id, first_pk=shard.first_pk, last_pk=shard.last_pk)
+    except Exception as e:
+        logger.exception("Billing shard %s failed", shard.key)
+        return {**report, 'error': str(e), 'seconds': round(time.perf_counter() - started, 3)}
+    finally:
+        close_stale_connections()
+    return {
+        **report,
+        'billed': result.subscriptions,
+        'invoices': result.invoices,
+        'items': result.items,
+        'existing': result.existing,
+        'amounts': {currency: str(amount) for currency, amount in result.amounts.items()},
+        'error': '; '.join(result.errors),
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+def _worker_init() -> None:
+    import django
+
+    django.setup()
+
+
+def _record_shard(run, entry: Dict, amounts: Dict[str, Decimal]) -> None:
+    run.report.setdefault('shards', []).append(entry)
+    run.shards_done += 1
+    run.subscriptions += entry.get('billed', 0)
+    run.invoices += entry.get('invoices', 0)
+    for currency, amount in entry.get('amounts', {}).items():
+        amounts[currency] = amounts.get(currency, Decimal('0')) + Decimal(amount)
+    run.report['amounts'] = {currency: str(amount) for currency, amount in amounts.items()}
+    run.save(update_fields=['report', 'shards_done', 'subscriptions', 'invoices', 'updated_at'])
+
+
+def run_sharded_billing(as_of: Optional[datetime] = None, workers: Optional[int] = None,
+                        company_id: Optional[int] = None, shard_size: Optional[int] = None):
+    """
+    Bill every tenant, shard by shard, WORKERS processes at a time (in this process on SQLite).
+    Each worker process opens its own database connection. The BillingRun row is updated as
+    shards finish and ends with a report of per-shard timing and totals per currency.
+    """
+    from isp.models import BillingRun
+
+    options = billing_settings()
+    workers = options['WORKERS'] if workers is None else workers
+    if workers > 1 and connection.vendor == 'sqlite':
+        # One writer at a time: parallel shards would only queue on the database lock
+        logger.info("SQLite database: billing shards in this process instead of %s workers", workers)
+        workers = 0
+    as_of = as_of or timezone.now()
+    started = time.perf_counter()
+    shards = plan_shards(as_of, company_id, shard_size)
+    run = BillingRun.objects.create(as_of=as_of, workers=workers, shards=len(shards), started_at=timezone.now(),
+                                    report={'shards': []})
+    amounts: Dict[str, Decimal] = {}
+
+    if workers <= 1 or len(shards) <= 1:
+        for shard in shards:
+            _record_shard(run, bill_shard(shard, as_of), amounts)
+    else:
+        # Children must not inherit this process's connections
+        connections.close_all()
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards)), mp_context=context,
+                                 initializer=_worker_init) as pool:
+            futures = {pool.submit(bill_shard, shard, as_of): shard for shard in shards}
+            for future in as_completed(futures):
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    shard = futures[future]
+                    logger.exception("Billing worker for shard %s died", shard.key)
+                    entry = {**asdict(shard), 'key': shard.key, 'error': f"Worker failed: {e}"}
+                _record_shard(run, entry, amounts)
+
+    failed = [entry for entry in run.report['shards'] if entry.get('error')]
+    run.status = 'failed' if failed else 'completed'
+    run.error = '\n'.join(f"{entry['key']}: {entry['error']}" for entry in failed)
+    run.report['seconds'] = round(time.perf_counter() - started, 3)
+    run.finished_at = timezone.now()
+    run.save()
+    logger.info("Billing run %s: %s invoices for %s subscriptions in %s shards, %.1fs",
+                run.pk, run.invoices, run.subscriptions, run.shards, run.report['seconds'])
+    return run
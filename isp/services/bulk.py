@@ -0,0 +1,433 @@
+"""
+ISP Management System - Bulk Operations
+Validated, chunked bulk changes with per-item results, router pushes and background jobs
+File: services/bulk.py
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DateTimeField, F, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from isp.functions import close_stale_connections
+from isp.services.routers import DISABLE, ENABLE, REMOVE, SET_PROFILE, push_subscriptions
+
+logger = logging.getLogger(__name__)
+
+
+def bulk_settings() -> Dict:
+    defaults = {
+        # Rows written per transaction
+        'CHUNK_SIZE': 500,
+        # Requests with more ids than this run as a background BulkJob
+        'ASYNC_THRESHOLD': 500,
+        'MAX_ITEMS': 20000,
+        'WORKERS': 2,
+        # Pending/running jobs without progress for this many seconds lost their worker
+        # (e.g. the process restarted) and are marked failed
+        'STALE_AFTER': 3600,
+    }
+    return {**defaults, **getattr(settings, 'BULK_OPERATIONS', {})}
+
+
+class BulkError(ValueError):
+    """The request as a whole is invalid (unknown operation, too many ids, bad package...)"""
+
+
+@dataclass
+class ItemResult:
+    id: int
+    ok: bool
+    error: str = ''
+    # Saved, but something downstream (e.g. the router push) did not go through
+    warning: str = ''
+    # What the operation produced for the item (e.g. a provisioning script)
+    data: Dict = field(default_factory=dict)
+
+    def to_dict(self) -> Dict:
+        data = {'id': self.id, 'ok': self.ok, **self.data}
+        if self.error:
+            data['error'] = self.error
+        if self.warning:
+            data['warning'] = self.warning
+        return data
+
+
+@dataclass
+class BulkOutcome:
+    operation: str
+    results: List[ItemResult] = field(default_factory=list)
+    # Run-wide measurements (e.g. latency distributions), kept on the job
+    metrics: Dict = field(default_factory=dict)
+
+    @property
+    def succeeded(self) -> int:
+        return sum(1 for result in self.results if result.ok)
+
+    @property
+    def failed(self) -> int:
+        return len(self.results) - self.succeeded
+
+    def to_dict(self) -> Dict:
+        return {
+            'operation': self.operation,
+            'total': len(self.results),
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'results': [result.to_dict() for result in self.results],
+            **({'metrics': self.metrics} if self.metrics else {}),
+        }
+
+
+@dataclass(frozen=True)
+class Transition:
+    """Customer statuses an operation applies to and what it does to them and their subscriptions"""
+    allowed_from: FrozenSet[str]
+    status: Optional[str] = None
+    subscriptions_from: FrozenSet[str] = frozenset()
+    subscription_status: Optional[str] = None
+    # What the routers serving the changed subscriptions are told (services/routers.py)
+    router_action: Optional[str] = None
+
+
+CUSTOMER_OPERATIONS = {
+    'activate': Transition(
+        frozenset({'lead', 'suspended'}), 'active', frozenset({'suspended'}), 'active', ENABLE,
+    ),
+    'suspend': Transition(
+        frozenset({'active'}), 'suspended', frozenset({'active'}), 'suspended', DISABLE,
+    ),
+    'terminate': Transition(
+        frozenset({'lead', 'active', 'suspended'}), 'terminated',
+        frozenset({'pending', 'active', 'suspended'}), 'terminated', REMOVE,
+    ),
+    # Moves the customer's live subscriptions to params['package_id']
+    'change_package': Transition(
+        frozenset({'lead', 'active', 'suspended'}), None, frozenset({'pending', 'active', 'suspended'}),
+        router_action=SET_PROFILE,
+    ),
+}
+
+
+def chunks(items: List, size: int) -> Iterable[List]:
+    """Consecutive slices of `items` of at most `size` elements"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def parse_ids(raw_ids) -> List[int]:
+    """Distinct integer ids in request order; BulkError if the list is unusable"""
+    if not isinstance(raw_ids, (list, tuple)) or not raw_ids:
+        raise BulkError("Expected a non-empty list of ids.")
+    limit = bulk_settings()['MAX_ITEMS']
+    if len(raw_ids) > limit:
+        raise BulkError(f"At most {limit} ids per request.")
+    try:
+        return list(dict.fromkeys(int(pk) for pk in raw_ids))
+    except (TypeError, ValueError):
+        raise BulkError("Ids must be integers.")
+
+
+def validate_customer_operation(company_id: int, operation: str, params: Optional[Dict] = None):
+    """The Transition and, for change_package, the target package; BulkError when invalid"""
+    from isp.models import InternetPackage
+
+    transition = CUSTOMER_OPERATIONS.get(operation)
+    if transition is None:
+        raise BulkError(f"Unknown operation '{operation}', expected one of: {', '.join(CUSTOMER_OPERATIONS)}.")
+
+    package = None
+    if operation == 'change_package':
+        package = InternetPackage.objects.filter(
+            pk=(params or {}).get('package_id') or 0, company_id=company_id, is_active=True
+        ).first()
+        if package is None:
+            raise BulkError("package_id must be an active package of your company.")
+    return transition, package
+
+
+# =============================================================================
+# CUSTOMER OPERATIONS
+# =============================================================================
+
+def _apply_customer_chunk(customers: List, transition: Transition, package, now) -> List:
+    """
+    Write one chunk; returns the subscriptions it changed. Every row gets the same values,
+    so each table is one UPDATE ... WHERE id IN rather than bulk_update's CASE per row.
+    """
+    from isp.models import Customer, Subscription
+
+    if transition.status:
+        values = {'status': transition.status, 'updated_at': now}
+        if transition.status == 'active':
+            values['activation_date'] = Coalesce(F('activation_date'), Value(now, output_field=DateTimeField()))
+        elif transition.status == 'terminated':
+            values['termination_date'] = now
+        Customer.objects.filter(pk__in=[customer.pk for customer in customers]).update(**values)
+        for customer in customers:
+            customer.status = transition.status
+
+    subscriptions = list(Subscription.objects.filter(
+        customer_id__in=[customer.pk for customer in customers], status__in=transition.subscriptions_from,
+    ).only('id', 'customer_id', 'status', 'package_id', 'username', 'router_id'))
+    if not subscriptions:
+        return []
+
+    values = {'updated_at': now}
+    if transition.subscription_status:
+        values['status'] = transition.subscription_status
+        if transition.subscription_status == 'terminated':
+            values['end_date'] = now
+    if package is not None:
+        # update() skips Subscription.save(), which normally copies these from the package
+        values.update(package_id=package.pk, monthly_fee=package.price, data_limit_bytes=package.data_limit_bytes)
+    Subscription.objects.filter(pk__in=[subscription.pk for subscription in subscriptions]).update(**values)
+    for subscription in subscriptions:
+        for name, value in values.items():
+            setattr(subscription, name, value)
+    return subscriptions
+
+
+def audit_changes(user, operation: str, objects: List, previous: Dict[int, str], job_id: Optional[int],
+                  label: Callable = str, **metadata) -> None:
+    """One batched SystemLog insert for every object the operation changed"""
+    from isp.models import SystemLog
+
+    SystemLog.objects.bulk_create([
+        SystemLog(
+            user=user,
+            action_type='service_change',
+            message=f"Bulk {operation}: {type(obj).__name__.lower()} {label(obj)}",
+            object_type=type(obj).__name__,
+            object_id=obj.pk,
+            metadata={'operation': operation, 'previous_status': previous[obj.pk], 'job': job_id, **metadata},
+        )
+        for obj in objects
+    ])
+
+
+def apply_customer_operation(company_id: int, customer_ids, operation: str, params: Optional[Dict] = None,
+                             user=None, job_id: Optional[int] = None,
+                             progress: Optional[Callable[[int, int, int], None]] = None,
+                             backend=None) -> BulkOutcome:
+    """
+    Run `operation` on the company's customers `customer_ids`.
+
+    Everything is validated with one query; valid rows are written in CHUNK_SIZE
+    transactions (a failing chunk is reported per item and the rest go on),
+    the changed subscriptions are pushed to their routers in one batch per router, then
+    everything is audited with a single SystemLog insert. A failed router push leaves the
+    customer changed with a `warning`. `progress(processed, succeeded, failed)` is called
+    after every chunk. Raises BulkError when the request itself is invalid.
+    """
+    from isp.dashboard.props import invalidate_badges
+    from isp.models import Customer
+    from isp.services.stats import invalidate_stats
+
+    ids = parse_ids(customer_ids)
+    transition, package = validate_customer_operation(company_id, operation, params)
+    now = timezone.now()
+
+    found = Customer.objects.filter(company_id=company_id, pk__in=ids).only(
+        'id', 'company_id', 'full_name', 'status'
+    ).in_bulk()
+    results: Dict[int, ItemResult] = {}
+    valid = []
+    for pk in ids:
+        customer = found.get(pk)
+        if customer is None:
+            results[pk] = ItemResult(pk, False, 'Customer not found.')
+        elif customer.status not in transition.allowed_from:
+            results[pk] = ItemResult(pk, False, f"Cannot {operation.replace('_', ' ')} a {customer.status} customer.")
+        else:
+            valid.append(customer)
+    previous = {customer.pk: customer.status for customer in valid}
+
+    changed, subscriptions = [], []
+    processed = len(ids) - len(valid)
+    for chunk in chunks(valid, bulk_settings()['CHUNK_SIZE']):
+        try:
+            with transaction.atomic():
+                subscriptions.extend(_apply_customer_chunk(chunk, transition, package, now))
+        except Exception as e:
+            logger.exception("Bulk %s failed for a chunk of %s customers", operation, len(chunk))
+            for customer in chunk:
+                results[customer.pk] = ItemResult(customer.pk, False, f"Write failed: {e}")
+        else:
+            changed.extend(chunk)
+            for customer in chunk:
+                results[customer.pk] = ItemResult(customer.pk, True)
+        processed += len(chunk)
+        if progress:
+            progress(processed, len(changed), processed - len(changed))
+
+    if subscriptions:
+        pushed = push_subscriptions(subscriptions, transition.router_action, package, backend=backend)
+        for subscription in subscriptions:
+            if subscription.pk in pushed.failed:
+                results[subscription.customer_id].warning = f"Router push failed: {pushed.failed[subscription.pk]}"
+
+    if changed:
+        audit_changes(user, operation, changed, previous, job_id)
+        # update() sends no post_save, so the signal-driven caches are dropped here
+        invalidate_stats(company_id)
+        invalidate_badges(company_id)
+
+    return BulkOutcome(operation, [results[pk] for pk in ids])
+
+
+# =============================================================================
+# BACKGROUND JOBS
+# =============================================================================
+
+def get_target(target: str) -> Tuple[Callable, Callable, Callable]:
+    """
+    (runner, validator, parser) of a BulkJob target: runner(company_id, ids, operation, params,
+    user, job_id, progress), validator(company_id, operation, params) and parser(raw_ids),
+    both raising BulkError
+    """
+    from isp.services import lifecycle, provisioning
+
+    targets = {
+        'customer': (apply_customer_operation, validate_customer_operation, parse_ids),
+        'subscription': (lifecycle.apply_subscription_operation, lifecycle.validate_subscription_operation,
+                         parse_ids),
+        'equipment': (provisioning.provision_routers, provisioning.validate_provision_operation,
+                      provisioning.parse_names),
+    }
+    if target not in targets:
+        raise BulkError(f"Unknown bulk target '{target}'.")
+    return targets[target]
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=bulk_settings()['WORKERS'], thread_name_prefix='bulk-job')
+        return _executor
+
+
+def create_job(company_id: int, user, target: str, operation: str, ids: List[int],
+               params: Optional[Dict] = None):
+    from isp.models import BulkJob
+
+    return BulkJob.objects.create(
+        company_id=company_id, user=user, target=target, operation=operation,
+        object_ids=ids, params=params or {}, total=len(ids),
+    )
+
+
+def submit_job(job) -> None:
+    """Run `job` on the bulk worker pool once the current transaction commits"""
+    transaction.on_commit(lambda: _get_executor().submit(run_job, job.pk))
+
+
+def run_job(job_id: int) -> None:
+    from isp.models import BulkJob
+
+    close_stale_connections()
+    try:
+        job = BulkJob.objects.select_related('user').get(pk=job_id)
+        if job.status != 'pending':
+            return
+        job.status, job.started_at = 'running', timezone.now()
+        job.save(update_fields=['status', 'started_at', 'updated_at'])
+
+        def progress(processed, succeeded, failed):
+            BulkJob.objects.filter(pk=job_id).update(
+                processed=processed, succeeded=succeeded, failed=failed, updated_at=timezone.now()
+            )
+
+        try:
+            runner, _, _ = get_target(job.target)
+            outcome = runner(
+                job.company_id, job.object_ids, job.operation, job.params,
+                user=job.user, job_id=job.pk, progress=progress,
+            )
+        except Exception as e:
+            logger.exception("Bulk job %s failed", job_id)
+            job.status, job.error = 'failed', str(e)
+        else:
+            job.status = 'completed'
+            job.processed, job.succeeded, job.failed = len(outcome.results), outcome.succeeded, outcome.failed
+            job.results = [result.to_dict() for result in outcome.results]
+            job.metrics = outcome.metrics
+        job.finished_at = timezone.now()
+        job.save()
+    finally:
+        close_stale_connections()
+
+
+def fail_stale_jobs(company_id: Optional[int] = None) -> int:
+    """
+    Mark jobs stuck in pending/running as failed. Jobs run on an in-process pool, so a
+    restart loses them; progress touches updated_at after every chunk, so a job idle for
+    STALE_AFTER seconds has no worker left. Returns the number of jobs marked.
+    """
+    from isp.models import BulkJob
+
+    now = timezone.now()
+    jobs = BulkJob.objects.filter(
+        status__in=['pending', 'running'], updated_at__lt=now - timedelta(seconds=bulk_settings()['STALE_AFTER']),
+    )
+    if company_id is not None:
+        jobs = jobs.filter(company_id=company_id)
+    count = jobs.update(status='failed', error='Interrupted: the worker running this job stopped.',
+                        finished_at=now, updated_at=now)
+    if count:
+        logger.warning("Marked %s stale bulk jobs as failed", count)
+    return count
+
+
+def job_status(job, include_results: bool = True) -> Dict:
+    data = {
+        'id': job.pk,
+        'target': job.target,
+        'operation': job.operation,
+        'status': job.status,
+        'total': job.total,
+        'processed': job.processed,
+        'succeeded': job.succeeded,
+        'failed': job.failed,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if job.error:
+        data['error'] = job.error
+    if job.metrics:
+        data['metrics'] = job.metrics
+    if include_results and job.status == 'completed':
+        data['results'] = job.results
+    return data
+
+
+def run_or_queue(company_id: int, user, target: str, operation: str, raw_ids, params: Optional[Dict] = None,
+                 force_async: bool = False) -> Tuple[Optional[BulkOutcome], Optional[object]]:
+    """
+    (outcome, None) when the request was small enough to run inline, (None, job) when it
+    was queued as a BulkJob. The request is validated before anything is queued.
+    """
+    runner, validator, parser = get_target(target)
+    ids = parser(raw_ids)
+    validator(company_id, operation, params)
+    if not force_async and len(ids) <= bulk_settings()['ASYNC_THRESHOLD']:
+        return runner(company_id, ids, operation, params, user=user), None
+
+    fail_stale_jobs(company_id)
+    job = create_job(company_id, user, target, operation, ids, params)
+    submit_job(job)
+    return None, job
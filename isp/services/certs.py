@@ -0,0 +1,167 @@
+"""
+ISP Management System - Router Certificates
+Caching proxy for the OpenVPN bundles routers download from the Mtk middleware
+File: services/certs.py
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+def cert_settings() -> Dict:
+    defaults = {
+        # Directory the bundles are kept in; None keeps them in the shared cache
+        'DIRECTORY': None,
+        # Seconds a bundle is served before it is fetched from the middleware again
+        'TTL': 24 * 3600,
+        # Bytes relayed per chunk while streaming from the middleware
+        'CHUNK_SIZE': 64 * 1024,
+        # Larger bundles are relayed but not stored
+        'MAX_SIZE': 1024 * 1024,
+    }
+    return {**defaults, **getattr(settings, 'ROUTER_CERTS', {})}
+
+
+@dataclass
+class CertBundle:
+    body: bytes
+    etag: str
+
+    def matches(self, if_none_match: str) -> bool:
+        tags = {tag.strip().removeprefix('W/') for tag in (if_none_match or '').split(',')}
+        return self.etag in tags or '*' in tags
+
+
+def _etag(body: bytes) -> str:
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+class CacheCertStore:
+    """Bundles in the shared Django cache; fails open like the other caches"""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    @staticmethod
+    def key(identity: str) -> str:
+        return f'isp:cert:{identity}'
+
+    def get(self, identity: str) -> Optional[CertBundle]:
+        try:
+            entry = cache.get(self.key(identity))
+        except Exception as e:
+            logger.warning("Certificate cache read failed: %s", e)
+            return None
+        return CertBundle(*entry) if entry else None
+
+    def put(self, identity: str, body: bytes) -> CertBundle:
+        bundle = CertBundle(body, _etag(body))
+        try:
+            cache.set(self.key(identity), (bundle.body, bundle.etag), self.ttl)
+        except Exception as e:
+            logger.warning("Certificate cache write failed: %s", e)
+        return bundle
+
+    def delete(self, identity: str) -> None:
+        try:
+            cache.delete(self.key(identity))
+        except Exception as e:
+            logger.warning("Certificate cache delete failed: %s", e)
+
+
+class DiskCertStore:
+    """Bundles as files under one directory, written atomically; expiry follows the file's mtime"""
+
+    def __init__(self, directory: str, ttl: int):
+        self.directory = directory
+        self.ttl = ttl
+
+    def path(self, identity: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(identity.encode()).hexdigest() + '.ovpn')
+
+    def get(self, identity: str) -> Optional[CertBundle]:
+        path = self.path(identity)
+        try:
+            if time.time() - os.stat(path).st_mtime > self.ttl:
+                return None
+            with open(path, 'rb') as f:
+                body = f.read()
+        except OSError:
+            return None
+        return CertBundle(body, _etag(body))
+
+    def put(self, identity: str, body: bytes) -> CertBundle:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, self.path(identity))
+        except OSError as e:
+            logger.warning("Could not store the certificate of %s: %s", identity, e)
+        return CertBundle(body, _etag(body))
+
+    def delete(self, identity: str) -> None:
+        try:
+            os.remove(self.path(identity))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Could not remove the certificate of %s: %s", identity, e)
+
+
+def get_store():
+    options = cert_settings()
+    if options['DIRECTORY']:
+        return DiskCertStore(options['DIRECTORY'], options['TTL'])
+    return CacheCertStore(options['TTL'])
+
+
+def cached_cert(identity: str) -> Optional[CertBundle]:
+    return get_store().get(identity)
+
+
+def forget_cert(identity: str) -> None:
+    if identity:
+        get_store().delete(identity)
+
+
+def open_cert_stream(identity: str) -> Iterator[bytes]:
+    """
+    Connect to the middleware and return an iterator relaying the bundle chunk by chunk. The
+    bundle is stored once it has been read to the end. Connection errors and non-2xx answers
+    raise NetWokException here, before anything has been sent to the router.
+    """
+    from mtk.services import Mtk
+
+    upstream = Mtk.cert_stream(identity)
+    options = cert_settings()
+
+    def relay():
+        chunks, size = [], 0
+        try:
+            for chunk in upstream.iter_content(chunk_size=options['CHUNK_SIZE']):
+                if chunks is not None:
+                    size += len(chunk)
+                    if size <= options['MAX_SIZE']:
+                        chunks.append(chunk)
+                    else:
+                        chunks = None
+                yield chunk
+        finally:
+            upstream.close()
+        # Only reached when the whole bundle came through
+        if chunks is not None:
+            get_store().put(identity, b''.join(chunks))
+
+    return relay()
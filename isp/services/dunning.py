@@ -0,0 +1,293 @@
+"""
+ISP Management System - Dunning
+Finds overdue invoices in one indexed scan, buckets them by days overdue, and queues reminders
+and suspensions for the whole batch at once
+File: services/dunning.py
+"""
+
+import logging
+import time
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from isp.services.billing import company_zone
+from isp.services.bulk import chunks
+
+logger = logging.getLogger(__name__)
+
+SUSPENSION = 'suspension'
+
+ZERO = Decimal('0')
+
+DEFAULT_MESSAGES = {
+    'billing_reminder': (
+        "Invoice {invoice_number} is overdue",
+        "Dear {customer_name}, invoice {invoice_number} of {currency} {amount_due} was due on {due_date} "
+        "and is {days_overdue} days overdue. Please pay to avoid interruption of your service.",
+    ),
+    'service_suspension': (
+        "Service suspended for non-payment",
+        "Dear {customer_name}, your service has been suspended because invoice {invoice_number} of "
+        "{currency} {amount_due} is {days_overdue} days overdue. Pay to have it restored.",
+    ),
+}
+
+
+def dunning_settings() -> Dict:
+    defaults = {
+        # Stage -> days overdue at which it starts. Each invoice is in the latest stage it has
+        # reached and gets that stage's notice once; 'suspension' also suspends the subscription.
+        'STAGES': {'reminder': 1, 'second_reminder': 7, 'final_notice': 14, SUSPENSION: 21},
+        'CHANNELS': ['sms', 'email'],
+        'BATCH_SIZE': 2000,
+    }
+    return {**defaults, **getattr(settings, 'DUNNING', {})}
+
+
+def stage_for(days: int, thresholds: List[Tuple[int, str]]) -> Optional[str]:
+    """The latest stage `days` overdue has reached; thresholds sorted by days"""
+    position = bisect_right([days_from for days_from, _ in thresholds], days)
+    return thresholds[position - 1][1] if position else None
+
+
+@dataclass
+class OverdueInvoice:
+    id: int
+    number: str
+    status: str
+    due_date: date
+    balance: Decimal
+    days: int
+    stage: str
+    subscription_id: Optional[int]
+    subscription_status: Optional[str]
+    customer_id: int
+    company_id: int
+    currency: str
+    name: str
+    phone: str
+    email: str
+    sms_ok: bool
+    email_ok: bool
+
+
+@dataclass
+class DunningResult:
+    as_of: datetime
+    overdue: int = 0
+    marked_overdue: int = 0
+    notifications: int = 0
+    # Stage -> {'invoices': n, 'amounts': {currency: total}}
+    buckets: Dict[str, Dict] = field(default_factory=dict)
+    suspension_candidates: List[int] = field(default_factory=list)
+    suspended: int = 0
+    duration: float = 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            'as_of': self.as_of.isoformat(),
+            'overdue': self.overdue,
+            'marked_overdue': self.marked_overdue,
+            'notifications': self.notifications,
+            'buckets': _serialize(self.buckets),
+            'suspension_candidates': len(self.suspension_candidates),
+            'suspended': self.suspended,
+            'duration': round(self.duration, 3),
+        }
+
+
+# =============================================================================
+# SCAN
+# =============================================================================
+
+def scan_overdue(as_of: Optional[datetime] = None, company_id: Optional[int] = None) -> Iterable[OverdueInvoice]:
+    """
+    Unpaid invoices past their due date, with what dunning needs about the customer. One query:
+    a range scan on the (due_date, status) index joined to the customer and company. Days
+    overdue are counted from the company's local date.
+    """
+    from isp.models import Invoice
+
+    as_of = as_of or timezone.now()
+    thresholds = sorted((days, stage) for stage, days in dunning_settings()['STAGES'].items())
+    # No timezone is more than a day ahead of UTC; rows not yet due locally are dropped below
+    bound = as_of.astimezone(dt_timezone.utc).date() + timedelta(days=1)
+    rows = Invoice.objects.overdue(bound).filter(paid_amount__lt=F('total_amount'))
+    if company_id is not None:
+        rows = rows.filter(customer__company_id=company_id)
+    rows = rows.order_by().values_list(
+        'id', 'invoice_number', 'status', 'due_date', 'total_amount', 'paid_amount',
+        'subscription_id', 'subscription__status', 'customer_id', 'customer__company_id',
+        'customer__company__timezone', 'customer__company__currency', 'customer__full_name',
+        'customer__primary_phone', 'customer__primary_email',
+        'customer__sms_notifications', 'customer__email_notifications',
+    )
+
+    local_today: Dict[str, date] = {}
+    for (pk, number, status, due_date, total, paid, subscription_id, subscription_status, customer_id,
+         company, zone, currency, name, phone, email, sms_ok, email_ok) in rows.iterator(chunk_size=5000):
+        if zone not in local_today:
+            local_today[zone] = as_of.astimezone(company_zone(zone)).date()
+        days = (local_today[zone] - due_date).days
+        stage = stage_for(days, thresholds)
+        if stage is None:
+            continue
+        yield OverdueInvoice(
+            pk, number, status, due_date, total - paid, days, stage, subscription_id, subscription_status,
+            customer_id, company, currency, name, phone, email, sms_ok, email_ok,
+        )
+
+
+def overdue_summary(company_id: int, limit: int = 50) -> Dict:
+    """Overdue buckets for one company and its longest-overdue invoices (the dashboard view)"""
+    buckets: Dict[str, Dict] = {}
+    invoices = []
+    for invoice in scan_overdue(company_id=company_id):
+        _count(buckets, invoice)
+        invoices.append(invoice)
+    invoices.sort(key=lambda invoice: (-invoice.days, invoice.id))
+    return {
+        'buckets': _serialize(buckets),
+        'invoices': [{
+            'id': invoice.id, 'invoice_number': invoice.number, 'customer_id': invoice.customer_id,
+            'customer': invoice.name, 'due_date': invoice.due_date.isoformat(), 'days_overdue': invoice.days,
+            'balance': str(invoice.balance), 'stage': invoice.stage,
+        } for invoice in invoices[:limit]],
+    }
+
+
+def _count(buckets: Dict[str, Dict], invoice: OverdueInvoice) -> None:
+    bucket = buckets.setdefault(invoice.stage, {'invoices': 0, 'amounts': {}})
+    bucket['invoices'] += 1
+    bucket['amounts'][invoice.currency] = bucket['amounts'].get(invoice.currency, ZERO) + invoice.balance
+
+
+def _serialize(buckets: Dict[str, Dict]) -> Dict[str, Dict]:
+    return {
+        stage: {'invoices': bucket['invoices'],
+                'amounts': {currency: str(amount) for currency, amount in bucket['amounts'].items()}}
+        for stage, bucket in buckets.items()
+    }
+
+
+# =============================================================================
+# NOTICES
+# =============================================================================
+
+class _Fields(dict):
+    def __missing__(self, key):
+        return '{' + key + '}'
+
+
+def _templates(company_ids) -> Dict[Tuple[int, str, str], object]:
+    from isp.models import NotificationTemplate
+
+    return {
+        (template.company_id, template.notification_type, template.channel): template
+        for template in NotificationTemplate.objects.filter(
+            company_id__in=company_ids, notification_type__in=DEFAULT_MESSAGES, is_active=True,
+        )
+    }
+
+
+def build_notifications(invoices: List[OverdueInvoice], channels: List[str]) -> List:
+    """One unsaved Notification per invoice and channel the customer accepts, from the company's templates"""
+    from isp.models import Notification
+
+    templates = _templates({invoice.company_id for invoice in invoices})
+    notifications = []
+    for invoice in invoices:
+        kind = 'service_suspension' if invoice.stage == SUSPENSION else 'billing_reminder'
+        fields = _Fields(
+            customer_name=invoice.name, invoice_number=invoice.number, amount_due=invoice.balance,
+            currency=invoice.currency, due_date=invoice.due_date.isoformat(), days_overdue=invoice.days,
+        )
+        for channel in channels:
+            if (channel == 'sms' and not (invoice.sms_ok and invoice.phone)) or \
+                    (channel == 'email' and not (invoice.email_ok and invoice.email)):
+                continue
+            template = templates.get((invoice.company_id, kind, channel))
+            subject, message = (template.subject, template.message) if template else DEFAULT_MESSAGES[kind]
+            notifications.append(Notification(
+                customer_id=invoice.customer_id,
+                template=template,
+                subject=subject.format_map(fields)[:200],
+                message=message.format_map(fields),
+                channel=channel,
+                metadata={'invoice_id': invoice.id, 'stage': invoice.stage, 'days_overdue': invoice.days,
+                          'to': invoice.phone if channel == 'sms' else invoice.email},
+                dedupe_key=f"dunning:{invoice.id}:{invoice.stage}:{channel}",
+            ))
+    return notifications
+
+
+# =============================================================================
+# RUN
+# =============================================================================
+
+def run_dunning(as_of: Optional[datetime] = None, company_id: Optional[int] = None, suspend: bool = False,
+                user=None) -> DunningResult:
+    """
+    Move unpaid invoices past their due date to 'overdue', queue the notice of the stage each
+    has reached (once per invoice, stage and channel), and collect the active subscriptions
+    whose invoices reached the suspension stage. With `suspend` those are suspended through
+    the bulk lifecycle path, which also disables them on the routers.
+    """
+    from isp.models import Invoice, Notification
+    from isp.services.lifecycle import apply_subscription_operation
+    from isp.services.stats import invalidate_stats
+
+    started = time.perf_counter()
+    options = dunning_settings()
+    result = DunningResult(as_of=as_of or timezone.now())
+
+    invoices = list(scan_overdue(result.as_of, company_id))
+    result.overdue = len(invoices)
+    candidates: Dict[int, set] = {}
+    for invoice in invoices:
+        _count(result.buckets, invoice)
+        if invoice.stage == SUSPENSION and invoice.subscription_status == 'active':
+            candidates.setdefault(invoice.company_id, set()).add(invoice.subscription_id)
+    result.suspension_candidates = sorted(pk for ids in candidates.values() for pk in ids)
+
+    newly_overdue = [invoice.id for invoice in invoices if invoice.status == 'sent']
+    for chunk in chunks(newly_overdue, options['BATCH_SIZE']):
+        result.marked_overdue += Invoice.objects.filter(pk__in=chunk, status='sent').update(
+            status='overdue', updated_at=timezone.now()
+        )
+    if result.marked_overdue:
+        for company in {invoice.company_id for invoice in invoices if invoice.status == 'sent'}:
+            invalidate_stats(company)
+
+    suspended = set()
+    if suspend:
+        for company, ids in candidates.items():
+            outcome = apply_subscription_operation(company, sorted(ids), 'suspend', {'reason': 'non_payment'},
+                                                   user=user)
+            suspended.update(item.id for item in outcome.results if item.ok)
+        result.suspended = len(suspended)
+
+    # The suspension notice only goes to customers whose service was actually suspended
+    notify = [invoice for invoice in invoices if invoice.stage != SUSPENSION or invoice.subscription_id in suspended]
+    for chunk in chunks(notify, options['BATCH_SIZE']):
+        notifications = build_notifications(chunk, options['CHANNELS'])
+        existing = set(Notification.objects.filter(
+            dedupe_key__in=[notification.dedupe_key for notification in notifications]
+        ).values_list('dedupe_key', flat=True))
+        fresh = [notification for notification in notifications if notification.dedupe_key not in existing]
+        # ignore_conflicts covers a concurrent run creating the same notice in between
+        Notification.objects.bulk_create(fresh, ignore_conflicts=True)
+        result.notifications += len(fresh)
+
+    result.duration = time.perf_counter() - started
+    logger.info("Dunning: %s overdue invoices, %s marked overdue, %s notifications, %s suspension candidates, "
+                "%s suspended (%.2fs)", result.overdue, result.marked_overdue, result.notifications,
+                len(result.suspension_candidates), result.suspended, result.duration)
+    return result
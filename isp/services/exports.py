@@ -0,0 +1,221 @@
+"""
+ISP Management System - Streaming Exports
+Constant-memory CSV/NDJSON (optionally gzipped) exports straight from database cursors
+File: services/exports.py
+"""
+
+import csv
+import json
+import zlib
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db.models import DateTimeField
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+FORMATS = {
+    CSV: ('text/csv; charset=utf-8', 'csv'),
+    NDJSON: ('application/x-ndjson', 'ndjson'),
+}
+
+
+def export_settings() -> Dict:
+    defaults = {
+        # Rows fetched per round trip (server-side cursor on PostgreSQL)
+        'CHUNK_SIZE': 2000,
+        # Bytes of rendered output gathered before a chunk is sent (or compressed)
+        'BUFFER_SIZE': 64 * 1024,
+        'GZIP_LEVEL': 6,
+    }
+    return {**defaults, **getattr(settings, 'EXPORTS', {})}
+
+
+@dataclass(frozen=True)
+class ExportSpec:
+    """
+    One exportable dataset: `columns` are (header, values_list lookup) pairs,
+    `date_field` is what ?start=/?end= filter on and `company_field` scopes it to a tenant.
+    """
+    name: str
+    model: str
+    columns: Tuple[Tuple[str, str], ...]
+    date_field: str
+    company_field: str
+    ordering: Tuple[str, ...] = ('id',)
+    # Exact-match filters accepted as query parameters of the same name
+    filters: Tuple[str, ...] = ()
+
+    @property
+    def headers(self) -> List[str]:
+        return [header for header, _ in self.columns]
+
+    @property
+    def lookups(self) -> List[str]:
+        return [lookup for _, lookup in self.columns]
+
+    def get_model(self):
+        from django.apps import apps
+        return apps.get_model('isp', self.model)
+
+    def queryset(self, company_id: Optional[int] = None, start: Optional[date] = None,
+                 end: Optional[date] = None, **filters):
+        queryset = self.get_model()._default_manager.filter(**filters)
+        if company_id is not None:
+            queryset = queryset.filter(**{self.company_field: company_id})
+        end_lookup = 'lte'
+        if isinstance(self.get_model()._meta.get_field(self.date_field), DateTimeField):
+            # Whole local days: from midnight of `start` to the midnight after `end`
+            start = start and _boundary(start)
+            end, end_lookup = end and _boundary(end, next_day=True), 'lt'
+        if start:
+            queryset = queryset.filter(**{f'{self.date_field}__gte': start})
+        if end:
+            queryset = queryset.filter(**{f'{self.date_field}__{end_lookup}': end})
+        return queryset.order_by(*self.ordering)
+
+
+CUSTOMERS = ExportSpec(
+    name='customers',
+    model='Customer',
+    columns=(
+        ('id', 'id'), ('full_name', 'full_name'), ('customer_type', 'customer_type'), ('status', 'status'),
+        ('primary_phone', 'primary_phone'), ('primary_email', 'primary_email'), ('city', 'city'),
+        ('country', 'country'), ('business_name', 'business_name'), ('activation_date', 'activation_date'),
+        ('credit_limit', 'credit_limit'), ('current_balance', 'current_balance'), ('created_at', 'created_at'),
+    ),
+    date_field='created_at',
+    company_field='company_id',
+    filters=('status', 'customer_type'),
+)
+
+USAGE = ExportSpec(
+    name='usage',
+    model='UsageLog',
+    columns=(
+        ('id', 'id'), ('subscription_id', 'subscription__subscription_id'), ('username', 'subscription__username'),
+        ('session_id', 'session_id'), ('session_start', 'session_start'), ('session_end', 'session_end'),
+        ('bytes_uploaded', 'bytes_uploaded'), ('bytes_downloaded', 'bytes_downloaded'),
+        ('session_time', 'session_time'), ('ip_address', 'ip_address'), ('nas_ip', 'nas_ip'),
+        ('termination_cause', 'termination_cause'),
+    ),
+    date_field='session_start',
+    company_field='subscription__customer__company_id',
+    ordering=('session_start', 'id'),
+    filters=('subscription',),
+)
+
+INVOICES = ExportSpec(
+    name='invoices',
+    model='Invoice',
+    columns=(
+        ('id', 'id'), ('invoice_number', 'invoice_number'), ('customer', 'customer__full_name'),
+        ('subscription_id', 'subscription__subscription_id'), ('status', 'status'), ('issue_date', 'issue_date'),
+        ('due_date', 'due_date'), ('paid_date', 'paid_date'), ('subtotal', 'subtotal'), ('tax_amount', 'tax_amount'),
+        ('total_amount', 'total_amount'), ('paid_amount', 'paid_amount'),
+    ),
+    date_field='issue_date',
+    company_field='customer__company_id',
+    ordering=('issue_date', 'id'),
+    filters=('status', 'customer'),
+)
+
+EXPORTS = {spec.name: spec for spec in (CUSTOMERS, USAGE, INVOICES)}
+
+
+def _boundary(day: date, next_day: bool = False) -> datetime:
+    """Local midnight starting `day` (or the day after, as an exclusive upper bound)"""
+    if next_day:
+        day += timedelta(days=1)
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+# =============================================================================
+# RENDERING
+# =============================================================================
+
+def iter_rows(queryset, lookups: Sequence[str], chunk_size: Optional[int] = None) -> Iterator[tuple]:
+    """
+    Tuples straight off the cursor: values_list() skips model instantiation and
+    iterator() keeps only `chunk_size` rows in memory (server-side cursor on PostgreSQL).
+    """
+    chunk_size = chunk_size or export_settings()['CHUNK_SIZE']
+    return queryset.values_list(*lookups).iterator(chunk_size=chunk_size)
+
+
+class _Line:
+    """File-like target for csv.writer that hands back each rendered line"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(headers: Sequence[str], rows: Iterable[tuple]) -> Iterator[str]:
+    writer = csv.writer(_Line())
+    yield writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _json_default(value):
+    # Dates/times as ISO 8601, Decimals as strings so amounts keep their precision
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def ndjson_lines(headers: Sequence[str], rows: Iterable[tuple]) -> Iterator[str]:
+    encode = json.JSONEncoder(default=_json_default, ensure_ascii=False, separators=(',', ':')).encode
+    for row in rows:
+        yield encode(dict(zip(headers, row))) + '\n'
+
+
+def buffered(lines: Iterable[str], buffer_size: int) -> Iterator[bytes]:
+    """Join lines into ~buffer_size byte chunks so the server does not write one row per syscall"""
+    parts, size = [], 0
+    for line in lines:
+        data = line.encode('utf-8')
+        parts.append(data)
+        size += len(data)
+        if size >= buffer_size:
+            yield b''.join(parts)
+            parts, size = [], 0
+    if parts:
+        yield b''.join(parts)
+
+
+def gzipped(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compress a byte stream incrementally into a single gzip member"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def render_export(queryset, headers: Sequence[str], lookups: Sequence[str], fmt: str = CSV,
+                  compress: bool = False) -> Iterator[bytes]:
+    """The export as a lazy stream of byte chunks"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of {', '.join(FORMATS)}")
+    options = export_settings()
+    lines = (csv_lines if fmt == CSV else ndjson_lines)(headers, iter_rows(queryset, lookups, options['CHUNK_SIZE']))
+    chunks = buffered(lines, options['BUFFER_SIZE'])
+    return gzipped(chunks, options['GZIP_LEVEL']) if compress else chunks
+
+
+def streaming_export(queryset, headers: Sequence[str], lookups: Sequence[str], filename: str,
+                     fmt: str = CSV, compress: bool = False) -> StreamingHttpResponse:
+    """A StreamingHttpResponse download of `queryset`; memory use does not grow with the row count"""
+    content_type, extension = FORMATS.get(fmt, FORMATS[CSV])
+    stream = render_export(queryset, headers, lookups, fmt, compress)
+    if compress:
+        content_type, extension = 'application/gzip', f'{extension}.gz'
+
+    response = StreamingHttpResponse(stream, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{extension}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
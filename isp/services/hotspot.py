@@ -0,0 +1,158 @@
+"""
+ISP Management System - Hotspot Pages
+Captive-portal pages served from process memory, backed by the shared cache
+File: services/hotspot.py
+"""
+
+import datetime
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+
+from isp.services.scripts import template_version
+
+logger = logging.getLogger(__name__)
+
+# Path requested by the router -> template
+HOTSPOT_FILES = {
+    'login.html': 'hotspot/login1.html',
+    'rlogin.html': 'hotspot/rlogin.html',
+}
+
+
+def hotspot_settings() -> Dict:
+    defaults = {
+        # Pages kept per process, and for how long before the shared cache is consulted again.
+        # A router change elsewhere reaches this process within LOCAL_TTL seconds.
+        'LOCAL_MAX_ENTRIES': 2048,
+        'LOCAL_TTL': 30,
+        'SHARED_TTL': 24 * 3600,
+    }
+    return {**defaults, **getattr(settings, 'HOTSPOT_PAGES', {})}
+
+
+class PageCache:
+    """Thread-safe LRU of rendered pages with a per-entry expiry"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Tuple, Tuple[float, bytes]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: Tuple, body: bytes, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, auth_code: str) -> None:
+        """Drop every page of one router (keys start with its auth_code)"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == auth_code]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+page_cache = PageCache(hotspot_settings()['LOCAL_MAX_ENTRIES'])
+_template_versions: Dict[str, str] = {}
+
+
+def warm_templates() -> None:
+    """Compile the hotspot templates into the cached template loader and record their versions"""
+    for name in HOTSPOT_FILES.values():
+        try:
+            _template_versions[name] = template_version(name)
+        except Exception as e:
+            logger.warning("Could not pre-load hotspot template %s: %s", name, e)
+
+
+def _version_key(auth_code: str) -> str:
+    return f'isp:hotspot:v:{auth_code}'
+
+
+def invalidate_router_pages(*auth_codes: str) -> None:
+    """Retire a router's pages: at once in this process and the shared cache, within LOCAL_TTL elsewhere"""
+    ttl = hotspot_settings()['SHARED_TTL']
+    for auth_code in filter(None, auth_codes):
+        page_cache.discard(auth_code)
+        try:
+            # The version only has to outlive the shared pages it retires
+            cache.set(_version_key(auth_code), uuid.uuid4().hex, ttl)
+        except Exception as e:
+            logger.warning("Hotspot page version bump failed: %s", e)
+
+
+def _render(router, template_name: str, host: str, year: int) -> bytes:
+    context = {
+        'url': host + "/hotspot/packages",
+        'router': router,
+        'isp_name': settings.ISP_NAME,
+        'support_phone': settings.SUPPORT_PHONE,
+        'year': year,
+    }
+    return get_template(template_name).render(context).encode()
+
+
+def hotspot_page(auth_code: str, file_name: str, host: str) -> Optional[bytes]:
+    """
+    The rendered page, or None for an unknown file. Served from process memory when possible,
+    then the shared cache; only a miss in both queries the router (Http404 if there is none).
+    """
+    from django.shortcuts import get_object_or_404
+    from isp.models import NetworkEquipment
+
+    template_name = HOTSPOT_FILES.get(file_name)
+    if template_name is None:
+        return None
+    year = datetime.date.today().year
+    local_key = (auth_code, file_name, host, year)
+    body = page_cache.get(local_key)
+    if body is not None:
+        return body
+
+    options = hotspot_settings()
+    if settings.DEBUG or template_name not in _template_versions:
+        _template_versions[template_name] = template_version(template_name)
+    try:
+        version = cache.get(_version_key(auth_code)) or '0'
+        variant = f'{version}|{file_name}|{host}|{year}|{_template_versions[template_name]}'
+        shared_key = f'isp:hotspot:{auth_code}:{hashlib.sha1(variant.encode()).hexdigest()}'
+        body = cache.get(shared_key)
+    except Exception as e:
+        logger.warning("Hotspot page cache read failed: %s", e)
+        shared_key = None
+
+    if body is None:
+        router = get_object_or_404(NetworkEquipment, auth_code=auth_code)
+        body = _render(router, template_name, host, year)
+        if shared_key:
+            try:
+                cache.set(shared_key, body, options['SHARED_TTL'])
+            except Exception as e:
+                logger.warning("Hotspot page cache write failed: %s", e)
+
+    page_cache.set(local_key, body, options['LOCAL_TTL'])
+    return body
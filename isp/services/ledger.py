@@ -0,0 +1,354 @@
+"""
+ISP Management System - Customer Ledger
+Append-only balance movements behind Customer.current_balance, with snapshots so that a past
+balance is a snapshot plus the entries after it
+File: services/ledger.py
+"""
+
+import logging
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from isp.services.bulk import chunks
+from isp.services.updates import update_from_values, update_rows
+
+logger = logging.getLogger(__name__)
+
+INVOICE = 'invoice'
+PAYMENT = 'payment'
+ADJUSTMENT = 'adjustment'
+
+# Invoices that were issued to the customer; drafts and cancelled ones never moved the balance
+POSTED_INVOICE_STATUSES = ('sent', 'paid', 'overdue')
+
+ZERO = Decimal('0')
+CENT = Decimal('0.01')
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MAX_STALE_DAYS = 7
+
+
+def ledger_settings() -> Dict:
+    defaults = {
+        'BATCH_SIZE': 2000,
+    }
+    return {**defaults, **getattr(settings, 'LEDGER', {})}
+
+
+# =============================================================================
+# ENTRIES
+# =============================================================================
+
+def invoice_entry(invoice, occurred_at: Optional[datetime] = None):
+    """The charge an issued invoice puts on the customer's balance"""
+    from isp.models import LedgerEntry
+
+    return LedgerEntry(
+        customer_id=invoice.customer_id, entry_type=INVOICE, amount=invoice.total_amount,
+        occurred_at=occurred_at or invoice.created_at or timezone.now(),
+        source_key=f"invoice:{invoice.invoice_number}", invoice_id=invoice.pk,
+        description=f"Invoice {invoice.invoice_number}",
+    )
+
+
+def payment_entry(payment):
+    """The credit a completed payment gives the customer"""
+    from isp.models import LedgerEntry
+
+    return LedgerEntry(
+        customer_id=payment.customer_id, entry_type=PAYMENT, amount=-payment.amount,
+        occurred_at=payment.payment_date, source_key=f"payment:{payment.payment_id}",
+        payment_id=payment.pk, description=f"Payment {payment.payment_id}", created_by_id=payment.processed_by_id,
+    )
+
+
+def adjustment_entry(customer_id: int, amount: Decimal, description: str, user=None,
+                     occurred_at: Optional[datetime] = None, source_key: Optional[str] = None):
+    from isp.models import LedgerEntry
+
+    return LedgerEntry(
+        customer_id=customer_id, entry_type=ADJUSTMENT, amount=amount, occurred_at=occurred_at or timezone.now(),
+        source_key=source_key or f"adjustment:{uuid.uuid4().hex}", description=description[:200], created_by=user,
+    )
+
+
+def apply_balance_deltas(deltas: Dict[int, Decimal]) -> None:
+    """Move each Customer.current_balance by its delta, with one relative UPDATE per batch"""
+    from isp.models import Customer
+
+    if not deltas:
+        return
+    field = Customer._meta.get_field
+    update_from_values(
+        Customer, {'id': field('id'), 'delta': field('current_balance')}, list(deltas.items()),
+        {'current_balance': '{t.current_balance} + {v.delta}'}, ledger_settings()['BATCH_SIZE'],
+    )
+
+
+def post_entries(entries: List, update_balances: bool = True) -> int:
+    """
+    Append ledger entries and return how many were new. An entry whose source_key is already
+    in the ledger is skipped, so posting the same invoice or payment again changes nothing.
+    Each customer's current_balance moves by the sum of their new entries (a relative
+    UPDATE, safe under concurrent posts), and snapshots at or after a back-dated entry are
+    dropped so balance_at() stays exact. Runs in one transaction.
+    """
+    from isp.models import BalanceSnapshot, LedgerEntry
+
+    if not entries:
+        return 0
+    batch_size = ledger_settings()['BATCH_SIZE']
+    existing = set()
+    for chunk in chunks([entry.source_key for entry in entries], batch_size):
+        existing.update(LedgerEntry.objects.filter(source_key__in=chunk).values_list('source_key', flat=True))
+    fresh = []
+    for entry in entries:
+        if entry.source_key not in existing:
+            existing.add(entry.source_key)
+            fresh.append(entry)
+    if not fresh:
+        return 0
+
+    deltas: Dict[int, Decimal] = defaultdict(Decimal)
+    earliest: Dict[int, datetime] = {}
+    for entry in fresh:
+        deltas[entry.customer_id] += entry.amount
+        if entry.customer_id not in earliest or entry.occurred_at < earliest[entry.customer_id]:
+            earliest[entry.customer_id] = entry.occurred_at
+    # One DELETE per distinct day entries go back to (usually just today); a batch spread over
+    # many days (a backfill) drops everything from its earliest day instead
+    stale: Dict[datetime, List[int]] = defaultdict(list)
+    for customer_id, occurred_at in earliest.items():
+        stale[occurred_at.astimezone(dt_timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)].append(
+            customer_id
+        )
+    if len(stale) > MAX_STALE_DAYS:
+        stale = {min(stale): list(earliest)}
+
+    with transaction.atomic():
+        LedgerEntry.objects.bulk_create(fresh, batch_size=batch_size)
+        if update_balances:
+            apply_balance_deltas(deltas)
+        for since, customer_ids in stale.items():
+            for chunk in chunks(customer_ids, batch_size):
+                BalanceSnapshot.objects.filter(customer_id__in=chunk, as_of__gte=since).delete()
+    return len(fresh)
+
+
+def post_adjustment(customer, amount: Decimal, description: str, user=None):
+    """Change a customer's balance by hand (positive charges, negative credits) and return the entry"""
+    entry = adjustment_entry(customer.pk, amount, description, user=user)
+    post_entries([entry])
+    return entry
+
+
+def _position(obj):
+    """(ledger link field, label, what the invoice or payment should have put on its customer's balance)"""
+    from isp.models import Invoice
+
+    if isinstance(obj, Invoice):
+        amount = obj.total_amount if obj.status in POSTED_INVOICE_STATUSES else ZERO
+        return 'invoice_id', f"Invoice {obj.invoice_number}", amount
+    return 'payment_id', f"Payment {obj.payment_id}", -obj.amount if obj.status == 'completed' else ZERO
+
+
+def sync_entries(obj, created: bool = False) -> int:
+    """
+    Post whatever an invoice or payment saved one at a time (API, admin, status changes) moved
+    on its customer's balance since the ledger last saw it, and return the entries posted.
+    The first posting is the usual invoice or payment entry; later changes of amount, status
+    or customer post adjustments linked to it, so the ledger stays append-only and
+    current_balance always equals the sum of the customer's entries.
+    """
+    from isp.models import LedgerEntry
+
+    link, label, amount = _position(obj)
+    if created and not amount:
+        return 0
+    with transaction.atomic():
+        # Serializes concurrent saves of the same row, so a change is not posted twice
+        type(obj).objects.select_for_update().filter(pk=obj.pk).exists()
+        posted = dict(LedgerEntry.objects.filter(**{link: obj.pk}).order_by().values('customer_id')
+                      .annotate(total=Sum('amount')).values_list('customer_id', 'total'))
+        if not posted:
+            if not amount:
+                return 0
+            first = invoice_entry(obj, timezone.now()) if link == 'invoice_id' else payment_entry(obj)
+            return post_entries([first])
+        target = {obj.customer_id: amount}
+        entries = []
+        for customer_id in sorted(posted.keys() | target.keys()):
+            delta = target.get(customer_id, ZERO) - posted.get(customer_id, ZERO)
+            if delta:
+                entry = adjustment_entry(customer_id, delta, f"{label} changed")
+                setattr(entry, link, obj.pk)
+                entries.append(entry)
+        return post_entries(entries)
+
+
+def reverse_entries(obj) -> int:
+    """Take a deleted invoice's or payment's postings back off its customers' balances"""
+    from isp.models import LedgerEntry
+
+    link, label, _ = _position(obj)
+    posted = (LedgerEntry.objects.filter(**{link: obj.pk}).order_by().values('customer_id')
+              .annotate(total=Sum('amount')).values_list('customer_id', 'total'))
+    return post_entries([
+        adjustment_entry(customer_id, -total, f"{label} deleted") for customer_id, total in posted if total
+    ])
+
+
+# =============================================================================
+# BALANCES
+# =============================================================================
+
+def _balances_query(customer_ids: List[int], when: datetime):
+    """
+    Per customer: the latest snapshot at or before `when` and the sum of entries after it up
+    to `when`. Both are correlated lookups on the (customer, as_of) and (customer, occurred_at)
+    indexes, so the cost depends on entries since the snapshot, not on the customer's history.
+    """
+    from isp.models import BalanceSnapshot, Customer, LedgerEntry
+
+    money = DecimalField(max_digits=10, decimal_places=2)
+    snapshots = BalanceSnapshot.objects.filter(customer=OuterRef('pk'), as_of__lte=when).order_by('-as_of')
+    since = (LedgerEntry.objects
+             .filter(customer=OuterRef('pk'), occurred_at__lte=when, occurred_at__gt=OuterRef('snapshot_at'))
+             .order_by().values('customer').annotate(total=Sum('amount')).values('total'))
+    return (Customer.objects.filter(pk__in=customer_ids)
+            .annotate(snapshot_at=Coalesce(Subquery(snapshots.values('as_of')[:1]), Value(EPOCH)),
+                      snapshot_balance=Subquery(snapshots.values('balance')[:1], output_field=money),
+                      delta=Subquery(since, output_field=money))
+            .values_list('pk', 'snapshot_balance', 'delta'))
+
+
+def balances_at(customer_ids: List[int], when: datetime) -> Dict[int, Decimal]:
+    """Balances of many customers at a past moment, in one query"""
+    # Sums come back at the backend's scale (SQLite drops it); balances are always in cents
+    return {
+        pk: ((snapshot or ZERO) + (delta or ZERO)).quantize(CENT)
+        for pk, snapshot, delta in _balances_query(customer_ids, when)
+    }
+
+
+def balance_at(customer_id: int, when: Optional[datetime] = None) -> Decimal:
+    """A customer's balance now (the maintained column) or at any past moment (snapshot plus delta)"""
+    from isp.models import Customer
+
+    if when is None:
+        return Customer.objects.filter(pk=customer_id).values_list('current_balance', flat=True).get()
+    return balances_at([customer_id], when).get(customer_id, ZERO.quantize(CENT))
+
+
+def take_snapshots(as_of: Optional[datetime] = None, company_id: Optional[int] = None) -> int:
+    """
+    Snapshot the balance of every customer whose ledger moved since their last snapshot,
+    reading customers in primary key batches. Meant to run periodically (e.g. nightly) so
+    point-in-time balances never sum more than one period of entries.
+    """
+    from isp.models import BalanceSnapshot, Customer
+
+    as_of = as_of or timezone.now()
+    batch_size = ledger_settings()['BATCH_SIZE']
+    customers = Customer.objects.order_by('pk')
+    if company_id is not None:
+        customers = customers.filter(company_id=company_id)
+
+    created, last_pk = 0, 0
+    while True:
+        batch = list(customers.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            break
+        last_pk = batch[-1]
+        snapshots = [
+            BalanceSnapshot(customer_id=pk, as_of=as_of, balance=(snapshot or ZERO) + delta)
+            for pk, snapshot, delta in _balances_query(batch, as_of) if delta is not None
+        ]
+        BalanceSnapshot.objects.bulk_create(snapshots, ignore_conflicts=True)
+        created += len(snapshots)
+    return created
+
+
+# =============================================================================
+# BACKFILL
+# =============================================================================
+
+def _stream(queryset, batch_size: int) -> Iterable[List]:
+    """Rows of `queryset` in primary key batches (keyset pagination, no OFFSET)"""
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+        if not batch:
+            return
+        last_pk = batch[-1].pk
+        yield batch
+
+
+def backfill_ledger(company_id: Optional[int] = None, rebalance: bool = False, batch_size: Optional[int] = None,
+                    progress=None) -> Dict:
+    """
+    Build the ledger from existing issued invoices and completed payments, streaming them in
+    primary key batches. Entries already in the ledger are skipped, so it can be re-run or
+    resumed. Balances are then squared with the ledger: by default an adjustment records the
+    difference between each customer's current_balance and the ledger (the balance is kept);
+    with `rebalance` current_balance is set to the ledger's sum instead. Finally every
+    customer's balance is snapshotted.
+    """
+    from isp.models import Customer, Invoice, LedgerEntry, Payment
+
+    batch_size = batch_size or ledger_settings()['BATCH_SIZE']
+    started = time.perf_counter()
+    report = {'invoices': 0, 'payments': 0, 'adjustments': 0, 'rebalanced': 0}
+    scope = {'customer__company_id': company_id} if company_id is not None else {}
+
+    invoices = Invoice.objects.filter(status__in=POSTED_INVOICE_STATUSES, **scope).only(
+        'id', 'customer_id', 'invoice_number', 'total_amount', 'created_at'
+    )
+    for batch in _stream(invoices, batch_size):
+        report['invoices'] += post_entries([invoice_entry(invoice) for invoice in batch], update_balances=False)
+        if progress:
+            progress('invoices', report['invoices'])
+
+    payments = Payment.objects.filter(status='completed', **scope).only(
+        'id', 'customer_id', 'payment_id', 'amount', 'payment_date', 'processed_by_id'
+    )
+    for batch in _stream(payments, batch_size):
+        report['payments'] += post_entries([payment_entry(payment) for payment in batch], update_balances=False)
+        if progress:
+            progress('payments', report['payments'])
+
+    now = timezone.now()
+    customers = Customer.objects.filter(**({'company_id': company_id} if company_id is not None else {})).only(
+        'id', 'current_balance'
+    )
+    for batch in _stream(customers, batch_size):
+        totals = dict(LedgerEntry.objects.filter(customer_id__in=[c.pk for c in batch]).order_by()
+                      .values('customer_id').annotate(total=Sum('amount')).values_list('customer_id', 'total'))
+        if rebalance:
+            changed = [c for c in batch if c.current_balance != totals.get(c.pk, ZERO)]
+            for customer in changed:
+                customer.current_balance = totals.get(customer.pk, ZERO)
+            if changed:
+                update_rows(changed, ['current_balance'])
+            report['rebalanced'] += len(changed)
+        else:
+            report['adjustments'] += post_entries([
+                adjustment_entry(c.pk, c.current_balance - totals.get(c.pk, ZERO),
+                                 "Opening balance: difference to the ledger when it was built", occurred_at=now,
+                                 source_key=f"opening:{c.pk}:{now:%Y%m%d%H%M%S}")
+                for c in batch if c.current_balance != totals.get(c.pk, ZERO)
+            ], update_balances=False)
+
+    report['snapshots'] = take_snapshots(now, company_id)
+    report['seconds'] = round(time.perf_counter() - started, 2)
+    logger.info("Ledger backfill: %s", report)
+    return report
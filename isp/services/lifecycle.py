@@ -0,0 +1,152 @@
+"""
+ISP Management System - Subscription Lifecycle
+Bulk suspend/reactivate/terminate/change-package of subscriptions, pushed to routers in batches
+File: services/lifecycle.py
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, FrozenSet, List, Optional
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from isp.services.bulk import BulkError, BulkOutcome, ItemResult, audit_changes, bulk_settings, chunks, parse_ids
+from isp.services.routers import DISABLE, ENABLE, REMOVE, SET_PROFILE, push_subscriptions
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Lifecycle:
+    """Subscription statuses an operation applies to, the status it sets and the router action"""
+    allowed_from: FrozenSet[str]
+    status: Optional[str]
+    router_action: str
+
+
+SUBSCRIPTION_OPERATIONS = {
+    # params['reason'] (e.g. 'non_payment') is kept in the audit log
+    'suspend': Lifecycle(frozenset({'active'}), 'suspended', DISABLE),
+    'reactivate': Lifecycle(frozenset({'suspended'}), 'active', ENABLE),
+    'terminate': Lifecycle(frozenset({'pending', 'active', 'suspended'}), 'terminated', REMOVE),
+    # Moves the subscriptions to params['package_id'] and reshapes them on the router
+    'change_package': Lifecycle(frozenset({'pending', 'active', 'suspended'}), None, SET_PROFILE),
+}
+
+
+def validate_subscription_operation(company_id: int, operation: str, params: Optional[Dict] = None):
+    """The Lifecycle and, for change_package, the target package; BulkError when invalid"""
+    from isp.models import InternetPackage
+
+    lifecycle = SUBSCRIPTION_OPERATIONS.get(operation)
+    if lifecycle is None:
+        raise BulkError(f"Unknown operation '{operation}', expected one of: {', '.join(SUBSCRIPTION_OPERATIONS)}.")
+
+    package = None
+    if operation == 'change_package':
+        package = InternetPackage.objects.filter(
+            pk=(params or {}).get('package_id') or 0, company_id=company_id, is_active=True
+        ).only('id', 'price', 'data_limit', 'package_type', 'upload_speed', 'download_speed').first()
+        if package is None:
+            raise BulkError("package_id must be an active package of your company.")
+    return lifecycle, package
+
+
+def _apply_chunk(subscriptions: List, lifecycle: Lifecycle, package, now) -> None:
+    """
+    Every row of an operation gets the same values, so a chunk is one UPDATE ... WHERE id IN
+    (bulk_update would build a CASE per column and row). The instances are updated to match.
+    """
+    from isp.models import Subscription
+
+    values = {'updated_at': now}
+    if lifecycle.status:
+        values['status'] = lifecycle.status
+        if lifecycle.status == 'terminated':
+            values['end_date'] = now
+    if package is not None:
+        # update() skips Subscription.save(), which normally copies these from the package
+        values.update(package_id=package.pk, monthly_fee=package.price, data_limit_bytes=package.data_limit_bytes)
+
+    Subscription.objects.filter(pk__in=[subscription.pk for subscription in subscriptions]).update(**values)
+    for subscription in subscriptions:
+        for name, value in values.items():
+            setattr(subscription, name, value)
+
+
+def apply_subscription_operation(company_id: int, subscription_ids, operation: str, params: Optional[Dict] = None,
+                                 user=None, job_id: Optional[int] = None,
+                                 progress: Optional[Callable[[int, int, int], None]] = None,
+                                 backend=None) -> BulkOutcome:
+    """
+    Run `operation` on the company's subscriptions `subscription_ids`.
+
+    Validation is one query and writes are one UPDATE per CHUNK_SIZE transaction, as
+    for customers. The database is the source of truth: once saved, the changes are grouped
+    by the router serving each subscription and sent as one batch per router (see
+    push_subscriptions); subscriptions whose router could not be reached stay changed and
+    carry a `warning`. Raises BulkError when the request itself is invalid.
+    """
+    from isp.dashboard.props import invalidate_badges
+    from isp.models import Subscription
+    from isp.services.stats import invalidate_stats
+
+    ids = parse_ids(subscription_ids)
+    lifecycle, package = validate_subscription_operation(company_id, operation, params)
+    now = timezone.now()
+
+    # The tenant is checked in Python: filtering on customer__company_id lets the planner
+    # drive the join from the company's customers, probing every id for each of them
+    found = Subscription.objects.filter(pk__in=ids).annotate(tenant_id=F('customer__company_id')).only(
+        'id', 'subscription_id', 'status', 'package_id', 'username', 'router_id',
+    ).in_bulk()
+    results: Dict[int, ItemResult] = {}
+    valid = []
+    for pk in ids:
+        subscription = found.get(pk)
+        if subscription is None or subscription.tenant_id != company_id:
+            results[pk] = ItemResult(pk, False, 'Subscription not found.')
+        elif subscription.status not in lifecycle.allowed_from:
+            results[pk] = ItemResult(
+                pk, False, f"Cannot {operation.replace('_', ' ')} a {subscription.status} subscription."
+            )
+        elif package is not None and subscription.package_id == package.pk:
+            results[pk] = ItemResult(pk, False, 'Subscription is already on this package.')
+        else:
+            valid.append(subscription)
+    previous = {subscription.pk: subscription.status for subscription in valid}
+
+    changed = []
+    processed = len(ids) - len(valid)
+    for chunk in chunks(valid, bulk_settings()['CHUNK_SIZE']):
+        try:
+            with transaction.atomic():
+                _apply_chunk(chunk, lifecycle, package, now)
+        except Exception as e:
+            logger.exception("Bulk %s failed for a chunk of %s subscriptions", operation, len(chunk))
+            for subscription in chunk:
+                results[subscription.pk] = ItemResult(subscription.pk, False, f"Write failed: {e}")
+        else:
+            changed.extend(chunk)
+            for subscription in chunk:
+                results[subscription.pk] = ItemResult(subscription.pk, True)
+        processed += len(chunk)
+        if progress:
+            progress(processed, len(changed), processed - len(changed))
+
+    if changed:
+        pushed = push_subscriptions(changed, lifecycle.router_action, package, backend=backend)
+        for pk, error in pushed.failed.items():
+            results[pk].warning = f"Router push failed: {error}"
+
+        reason = (params or {}).get('reason')
+        audit_changes(user, operation, changed, previous, job_id,
+                      label=lambda subscription: subscription.subscription_id,
+                      **({'reason': reason} if reason else {}))
+        # update() sends no post_save, so the signal-driven caches are dropped here
+        invalidate_stats(company_id)
+        invalidate_badges(company_id)
+
+    return BulkOutcome(operation, [results[pk] for pk in ids])
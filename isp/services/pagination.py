@@ -0,0 +1,196 @@
+"""
+ISP Management System - Keyset Pagination
+Cursor (seek) pagination over indexed orderings and cheap approximate row counts
+File: services/pagination.py
+"""
+
+import base64
+import hashlib
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, List, Optional, Sequence, Tuple
+
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+# Below this planner estimate an exact COUNT(*) is cheap and more useful than a guess
+EXACT_COUNT_THRESHOLD = 1000
+COUNT_CACHE_TTL = 300
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+@dataclass
+class KeysetPage:
+    items: List[Any]
+    next_cursor: Optional[str] = None
+    previous_cursor: Optional[str] = None
+    total: Optional[int] = None
+    total_is_exact: bool = False
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+
+class Keyset:
+    """
+    An ordering such as ('-created_at', '-id') used as a seek key.
+
+    The last field must be unique (normally the primary key) so every row has a distinct
+    position; the leading fields should match an index for the seek to be an index range scan.
+    """
+
+    def __init__(self, model, ordering: Sequence[str]):
+        self.model = model
+        self.ordering = tuple(ordering)
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+        self.model_fields = [model._meta.get_field(name) for name, _ in self.fields]
+
+    def order(self, queryset, reverse: bool = False):
+        if reverse:
+            return queryset.order_by(*[name if desc else f'-{name}' for name, desc in self.fields])
+        return queryset.order_by(*self.ordering)
+
+    def position(self, obj) -> List:
+        if isinstance(obj, dict):
+            return [obj[name] for name, _ in self.fields]
+        return [getattr(obj, f.attname) for f in self.model_fields]
+
+    def encode(self, obj, reverse: bool = False) -> str:
+        values = [_json_value(value) for value in self.position(obj)]
+        payload = json.dumps({'p': values, 'r': int(reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode(self, token: str) -> Tuple[List, bool]:
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            values = [f.to_python(v) for f, v in zip(self.model_fields, payload['p'])]
+            if len(values) != len(self.fields):
+                raise ValueError('cursor does not match the ordering')
+            return values, bool(payload.get('r'))
+        except Exception as e:
+            raise InvalidCursor(f'Invalid cursor: {e}') from e
+
+    def after(self, values: Sequence, reverse: bool = False) -> Q:
+        """
+        Rows strictly after `values` in this ordering (before it when `reverse`).
+
+        The OR-expansion alone is not index friendly, so it is ANDed with an inclusive bound
+        on the leading field, which the database can use as an index range.
+        """
+        condition = Q()
+        for i, (name, desc) in enumerate(self.fields):
+            lookup = 'lt' if desc != reverse else 'gt'
+            step = Q(**{f'{name}__{lookup}': values[i]})
+            for j in range(i):
+                step &= Q(**{self.fields[j][0]: values[j]})
+            condition |= step
+        name, desc = self.fields[0]
+        return Q(**{f"{name}__{'lte' if desc != reverse else 'gte'}": values[0]}) & condition
+
+
+def _json_value(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value if isinstance(value, (int, float, str, type(None))) else str(value)
+
+
+def keyset_paginate(queryset, ordering: Sequence[str], cursor: Optional[str] = None,
+                    page_size: int = 20) -> KeysetPage:
+    """
+    One page of `queryset` in `ordering`, starting after `cursor`.
+
+    Fetches page_size + 1 rows with a seek predicate instead of OFFSET, so page 10,000
+    costs the same as page 1. Raises InvalidCursor for a malformed cursor.
+    """
+    keyset = Keyset(queryset.model, ordering)
+    reverse = False
+    if cursor:
+        values, reverse = keyset.decode(cursor)
+        queryset = queryset.filter(keyset.after(values, reverse))
+
+    rows = list(keyset.order(queryset, reverse)[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    if reverse:
+        rows.reverse()
+        page = KeysetPage(rows)
+        page.previous_cursor = keyset.encode(rows[0], reverse=True) if has_more and rows else None
+        page.next_cursor = keyset.encode(rows[-1]) if rows else None
+    else:
+        page = KeysetPage(rows)
+        page.next_cursor = keyset.encode(rows[-1]) if has_more else None
+        page.previous_cursor = keyset.encode(rows[0], reverse=True) if cursor and rows else None
+    return page
+
+
+# =============================================================================
+# COUNTS
+# =============================================================================
+
+def _planner_estimate(queryset) -> Optional[int]:
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            # -1 means the table was never analyzed
+            if row and row[0] >= 0:
+                return int(row[0])
+        sql, params = queryset.order_by().query.sql_with_params()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+def approximate_count(queryset, ttl: int = COUNT_CACHE_TTL) -> Tuple[int, bool]:
+    """
+    (count, is_exact) without a full COUNT(*) on large tables.
+
+    PostgreSQL: pg_class.reltuples for an unfiltered table, the planner's row estimate
+    otherwise; small estimates are replaced by an exact count. Other databases: an exact
+    count cached for `ttl` seconds, reported as inexact since it may be stale.
+    """
+    try:
+        estimate = _planner_estimate(queryset)
+    except Exception as e:
+        logger.warning("Planner row estimate failed, falling back to a cached count: %s", e)
+        estimate = None
+
+    if estimate is not None:
+        if estimate < EXACT_COUNT_THRESHOLD:
+            return queryset.count(), True
+        return estimate, False
+
+    sql, params = queryset.order_by().query.sql_with_params()
+    key = 'isp:count:' + hashlib.sha1(f'{sql}|{params}'.encode()).hexdigest()
+    try:
+        cached = cache.get(key)
+    except Exception:
+        cached = None
+    if cached is not None:
+        return cached, False
+
+    count = queryset.count()
+    try:
+        cache.set(key, count, ttl)
+    except Exception as e:
+        logger.warning("Count cache write failed: %s", e)
+    return count, True
@@ -0,0 +1,400 @@
+"""
+ISP Management System - Payment Reconciliation
+Matches statement lines (e.g. mobile-money statements) to customers and open invoices in memory,
+then writes payments, invoice allocations and ledger entries in bulk
+File: services/payments.py
+"""
+
+import csv
+import hashlib
+import io
+import logging
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from isp.services.billing import company_zone
+from isp.services.ledger import payment_entry, post_entries
+from isp.services.updates import update_from_values
+
+logger = logging.getLogger(__name__)
+
+# Issued invoices; a draft was never charged to the ledger, so paying it would only post the credit
+OPEN_STATUSES = ('sent', 'overdue')
+
+UNMATCHED = 'unmatched'
+AMBIGUOUS = 'ambiguous'
+
+ZERO = Decimal('0')
+
+# PaymentReview.reference; longer references are rejected rather than cut, so two never collide
+REFERENCE_LENGTH = 50
+
+# Column names used by M-Pesa statements, Daraja C2B callbacks and our own CSV exports
+COLUMNS = {
+    'reference': ('reference', 'Receipt No.', 'Receipt No', 'TransID', 'transaction_reference', 'receipt'),
+    'amount': ('amount', 'Paid In', 'TransAmount', 'Amount'),
+    'paid_at': ('paid_at', 'Completion Time', 'TransTime', 'date', 'Date'),
+    'account': ('account', 'A/C No.', 'BillRefNumber', 'Account', 'invoice_number'),
+    'phone': ('phone', 'MSISDN', 'Other Party Info', 'Phone'),
+    'name': ('name', 'FirstName', 'Name', 'payer_name'),
+}
+
+
+def reconciliation_settings() -> Dict:
+    defaults = {
+        'PAYMENT_METHOD': 'mobile_money',
+        # Statement lines per request or command run
+        'MAX_LINES': 100000,
+        'BATCH_SIZE': 2000,
+    }
+    return {**defaults, **getattr(settings, 'PAYMENT_RECONCILIATION', {})}
+
+
+def normalize_phone(value: str) -> str:
+    """The last 9 digits, so 0712345678, +254712345678 and 254712345678 agree"""
+    digits = re.sub(r'\D', '', value or '')
+    return digits[-9:] if len(digits) >= 9 else ''
+
+
+def payment_id(company_id: int, reference: str) -> str:
+    """
+    One statement reference is one payment per company; re-imports find it taken. The id is a
+    digest of the whole reference, which may be longer than the id column.
+    """
+    digest = hashlib.blake2b(f'{company_id}:{reference}'.encode(), digest_size=12).hexdigest()
+    return f"PAY-{digest}"
+
+
+# =============================================================================
+# STATEMENT LINES
+# =============================================================================
+
+@dataclass
+class StatementLine:
+    reference: str
+    amount: Decimal
+    paid_at: datetime
+    account: str = ''
+    phone: str = ''
+    name: str = ''
+
+
+def _column(row: Dict, name: str) -> str:
+    for key in COLUMNS[name]:
+        value = row.get(key)
+        if value not in (None, ''):
+            return str(value).strip()
+    return ''
+
+
+def _parse_time(value: str, zone) -> Optional[datetime]:
+    if re.fullmatch(r'\d{14}', value):
+        parsed = datetime.strptime(value, '%Y%m%d%H%M%S')
+    else:
+        parsed = parse_datetime(value.replace('/', '-'))
+    if parsed is None:
+        return None
+    return timezone.make_aware(parsed, zone) if timezone.is_naive(parsed) else parsed
+
+
+def read_statement_csv(source) -> List[Dict]:
+    """Rows of a CSV statement from a path, text or binary file; M-Pesa exports carry a BOM"""
+    if isinstance(source, str):
+        with open(source, newline='', encoding='utf-8-sig') as handle:
+            return list(csv.DictReader(handle))
+    if isinstance(source.read(0), bytes):
+        source = io.TextIOWrapper(source, encoding='utf-8-sig', newline='')
+    return list(csv.DictReader(source))
+
+
+def parse_statement(rows: Iterable[Dict], zone_name: str = 'UTC') -> Tuple[List[StatementLine], List[str]]:
+    """
+    Statement lines from CSV/JSON rows, and an error per unusable row. Rows that paid nothing in
+    (withdrawals, charges) are skipped. Times without an offset are in the company's timezone.
+    """
+    zone = company_zone(zone_name)
+    lines, errors = [], []
+    for number, row in enumerate(rows, 1):
+        reference = _column(row, 'reference')
+        try:
+            amount = Decimal(_column(row, 'amount').replace(',', '') or '0')
+        except InvalidOperation:
+            errors.append(f"Line {number}: invalid amount")
+            continue
+        if amount <= 0:
+            continue
+        if not reference:
+            errors.append(f"Line {number}: missing reference")
+            continue
+        if len(reference) > REFERENCE_LENGTH:
+            errors.append(f"Line {number}: reference longer than {REFERENCE_LENGTH} characters")
+            continue
+        paid_at = _parse_time(_column(row, 'paid_at'), zone) if _column(row, 'paid_at') else timezone.now()
+        if paid_at is None:
+            errors.append(f"Line {number}: invalid date")
+            continue
+        phone = _column(row, 'phone')
+        lines.append(StatementLine(
+            reference=reference,
+            amount=amount.quantize(Decimal('0.01')),
+            paid_at=paid_at,
+            account=_column(row, 'account')[:100],
+            # 'Other Party Info' reads '254712345678 - JANE DOE'
+            phone=phone.split(' - ')[0][:20],
+            name=_column(row, 'name') or (phone.split(' - ', 1)[1] if ' - ' in phone else ''),
+        ))
+    return lines, errors
+
+
+# =============================================================================
+# MATCHING
+# =============================================================================
+
+@dataclass
+class OpenInvoice:
+    id: int
+    number: str
+    customer_id: int
+    total: Decimal
+    paid: Decimal
+    status: str
+    # What this reconciliation adds
+    allocated: Decimal = ZERO
+    paid_date: Optional[datetime] = None
+
+    @property
+    def balance(self) -> Decimal:
+        return self.total - self.paid - self.allocated
+
+
+@dataclass
+class ReconciliationResult:
+    lines: int = 0
+    payments: int = 0
+    invoices_paid: int = 0
+    allocated: Decimal = ZERO
+    credited: Decimal = ZERO
+    review: int = 0
+    duplicates: int = 0
+    errors: List[str] = field(default_factory=list)
+    duration: float = 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            'lines': self.lines,
+            'payments': self.payments,
+            'invoices_paid': self.invoices_paid,
+            'allocated': str(self.allocated),
+            'credited': str(self.credited),
+            'review': self.review,
+            'duplicates': self.duplicates,
+            'errors': self.errors,
+            'duration': round(self.duration, 3),
+        }
+
+
+class MatchIndex:
+    """Hash indexes over a company's customers and open invoices, each built from one query"""
+
+    def __init__(self, company_id: int):
+        from isp.models import Customer, Invoice, Subscription
+
+        self.invoices: Dict[str, OpenInvoice] = {}
+        self.by_customer: Dict[int, List[OpenInvoice]] = {}
+        rows = (Invoice.objects
+                .filter(customer__company_id=company_id, status__in=OPEN_STATUSES, paid_amount__lt=F('total_amount'))
+                .order_by('due_date', 'id')
+                .values_list('id', 'invoice_number', 'customer_id', 'total_amount', 'paid_amount', 'status'))
+        for pk, number, customer_id, total, paid, status in rows:
+            invoice = OpenInvoice(pk, number, customer_id, total, paid, status)
+            self.invoices[number.upper()] = invoice
+            self.by_customer.setdefault(customer_id, []).append(invoice)
+
+        # Account numbers customers pay to: subscription ids and usernames
+        self.accounts: Dict[str, int] = {}
+        for subscription_id, username, customer_id in (
+            Subscription.objects.filter(customer__company_id=company_id)
+            .values_list('subscription_id', 'username', 'customer_id')
+        ):
+            for key in (subscription_id, username):
+                if key:
+                    self.accounts[key.upper()] = customer_id
+
+        self.phones: Dict[str, set] = {}
+        for customer_id, primary, secondary in (
+            Customer.objects.filter(company_id=company_id).values_list('id', 'primary_phone', 'secondary_phone')
+        ):
+            for phone in (primary, secondary):
+                if normalize_phone(phone):
+                    self.phones.setdefault(normalize_phone(phone), set()).add(customer_id)
+
+    def match(self, line: StatementLine) -> Tuple[Optional[int], Optional[OpenInvoice], str]:
+        """(customer id, invoice named by the line, review reason when there is no customer)"""
+        account = line.account.upper()
+        invoice = self.invoices.get(account)
+        if invoice is not None:
+            return invoice.customer_id, invoice, ''
+        if account in self.accounts:
+            return self.accounts[account], None, ''
+        for phone in (normalize_phone(line.account), normalize_phone(line.phone)):
+            customers = self.phones.get(phone) if phone else None
+            if customers:
+                if len(customers) > 1:
+                    return None, None, AMBIGUOUS
+                return next(iter(customers)), None, ''
+        return None, None, UNMATCHED
+
+    def allocate(self, customer_id: int, invoice: Optional[OpenInvoice], amount: Decimal,
+                 paid_at: datetime) -> Tuple[List[Tuple[OpenInvoice, Decimal]], Decimal]:
+        """Spread `amount` over the named invoice, then the customer's oldest open ones; returns the credit left"""
+        targets = [invoice] if invoice is not None else []
+        targets += [other for other in self.by_customer.get(customer_id, []) if other is not invoice]
+        allocations, remaining = [], amount
+        for target in targets:
+            if remaining <= 0:
+                break
+            share = min(target.balance, remaining)
+            if share <= 0:
+                continue
+            target.allocated += share
+            remaining -= share
+            if target.balance <= 0:
+                target.paid_date = paid_at
+            allocations.append((target, share))
+        return allocations, remaining
+
+
+# =============================================================================
+# WRITING
+# =============================================================================
+
+def apply_invoice_allocations(invoices: List[OpenInvoice], now: datetime) -> None:
+    """
+    Add each invoice's allocation to paid_amount, with one UPDATE per batch. The increment is
+    relative, so a payment recorded meanwhile by someone else is kept, and the status and
+    paid date follow from the new total in the same statement.
+    """
+    from isp.models import Invoice
+
+    field = Invoice._meta.get_field
+    paid = '{t.paid_amount} + {v.amount} >= {t.total_amount}'
+    update_from_values(
+        Invoice,
+        {'id': field('id'), 'amount': field('paid_amount'), 'paid_date': field('paid_date'),
+         'updated_at': field('updated_at')},
+        [[invoice.id, invoice.allocated, (invoice.paid_date or now).date(), now] for invoice in invoices],
+        {
+            'status': f"CASE WHEN {paid} THEN 'paid' ELSE {{t.status}} END",
+            'paid_date': f"CASE WHEN {paid} THEN {{v.paid_date}} ELSE {{t.paid_date}} END",
+            'paid_amount': '{t.paid_amount} + {v.amount}',
+            'updated_at': '{v.updated_at}',
+        },
+        reconciliation_settings()['BATCH_SIZE'],
+    )
+
+
+def reconcile_payments(company_id: int, lines: List[StatementLine], statement: str = '', user=None,
+                       payment_method: Optional[str] = None) -> ReconciliationResult:
+    """
+    Record a batch of incoming payments. Each line is matched in memory (invoice number, then
+    subscription account, then phone) and allocated to the named invoice and then the
+    customer's oldest open invoices; what is left is credit. Lines already recorded are
+    skipped, and lines that match no customer go to the PaymentReview queue. Everything is
+    written in one transaction with bulk statements.
+    """
+    from isp.models import Payment, PaymentReview
+
+    started = time.perf_counter()
+    options = reconciliation_settings()
+    result = ReconciliationResult(lines=len(lines))
+    payment_method = payment_method or options['PAYMENT_METHOD']
+
+    ids = [payment_id(company_id, line.reference) for line in lines]
+    seen = set(Payment.objects.filter(payment_id__in=ids).values_list('payment_id', flat=True))
+    seen |= {payment_id(company_id, reference) for reference in PaymentReview.objects.filter(
+        company_id=company_id, reference__in=[line.reference for line in lines]).values_list('reference', flat=True)}
+
+    index = MatchIndex(company_id)
+    payments, reviews, touched = [], [], {}
+    for line, pid in zip(lines, ids):
+        if pid in seen:
+            result.duplicates += 1
+            continue
+        seen.add(pid)
+
+        customer_id, invoice, reason = index.match(line)
+        if customer_id is None:
+            reviews.append(PaymentReview(
+                company_id=company_id, statement=statement[:100], reference=line.reference, amount=line.amount,
+                paid_at=line.paid_at, account=line.account, phone=line.phone, payer_name=line.name[:200],
+                reason=reason,
+            ))
+            continue
+
+        allocations, credit = index.allocate(customer_id, invoice, line.amount, line.paid_at)
+        for target, share in allocations:
+            touched[target.id] = target
+            result.allocated += share
+        result.credited += credit
+        notes = ', '.join(f"{target.number}: {share}" for target, share in allocations)
+        primary = invoice or (allocations[0][0] if allocations else None)
+        payments.append(Payment(
+            customer_id=customer_id,
+            invoice_id=primary.id if primary else None,
+            payment_id=pid,
+            amount=line.amount,
+            payment_method=payment_method,
+            status='completed',
+            transaction_reference=line.reference,
+            payment_date=line.paid_at,
+            processed_by=user,
+            receipt_number=line.reference[:50],
+            notes=(f"Allocated {notes}" if notes else "Held as credit") + (f" ({statement})" if statement else ''),
+        ))
+
+    with transaction.atomic():
+        Payment.objects.bulk_create(payments, batch_size=options['BATCH_SIZE'])
+        if touched:
+            apply_invoice_allocations(list(touched.values()), timezone.now())
+        # Each payment is a ledger entry, which also moves Customer.current_balance
+        post_entries([payment_entry(payment) for payment in payments])
+        PaymentReview.objects.bulk_create(reviews, batch_size=options['BATCH_SIZE'], ignore_conflicts=True)
+
+    result.payments = len(payments)
+    result.invoices_paid = sum(1 for invoice in touched.values() if invoice.balance <= 0)
+    result.review = len(reviews)
+    result.duration = time.perf_counter() - started
+    logger.info("Reconciled %s statement lines for company %s: %s payments, %s to review, %s duplicates (%.2fs)",
+                result.lines, company_id, result.payments, result.review, result.duplicates, result.duration)
+    return result
+
+
+def settle_invoices(invoices: Iterable, user=None, payment_method: str = 'cash') -> Dict[int, ReconciliationResult]:
+    """
+    Record a payment of the outstanding balance of each invoice (the admin "mark as paid"),
+    through the same path as statement lines so balances and payments stay consistent.
+    """
+    stamp = timezone.now()
+    by_company: Dict[int, List[StatementLine]] = {}
+    for invoice in invoices:
+        balance = invoice.total_amount - invoice.paid_amount
+        if balance <= 0 or invoice.status not in OPEN_STATUSES:
+            continue
+        by_company.setdefault(invoice.customer.company_id, []).append(StatementLine(
+            reference=f"ADM{invoice.pk}-{stamp:%y%m%d%H%M%S}", amount=balance, paid_at=stamp,
+            account=invoice.invoice_number,
+        ))
+    return {
+        company_id: reconcile_payments(company_id, lines, statement='admin', user=user, payment_method=payment_method)
+        for company_id, lines in by_company.items()
+    }
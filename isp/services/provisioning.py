@@ -0,0 +1,184 @@
+"""
+ISP Management System - Router Provisioning
+Onboards batches of routers: VPN clients created concurrently, equipment rows in bulk
+File: services/provisioning.py
+"""
+
+import datetime
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from isp.functions import generate_key, latency_summary
+from isp.services.bulk import BulkError, BulkOutcome, ItemResult
+
+logger = logging.getLogger(__name__)
+
+PROVISION = 'provision'
+
+
+def provisioning_settings() -> Dict:
+    defaults = {
+        # VPN clients created at once; keep it within MTK_TRANSPORT POOL_SIZE
+        'CONCURRENCY': 8,
+        'MAX_ROUTERS': 500,
+    }
+    return {**defaults, **getattr(settings, 'ROUTER_ONBOARDING', {})}
+
+
+def router_identity(company, name: str) -> str:
+    return f"{company.slug}_{name}"
+
+
+def parse_names(raw_names) -> List[str]:
+    """Distinct router names in request order; BulkError if the list is unusable"""
+    if not isinstance(raw_names, (list, tuple)) or not raw_names:
+        raise BulkError("Expected a non-empty list of router names.")
+    limit = provisioning_settings()['MAX_ROUTERS']
+    if len(raw_names) > limit:
+        raise BulkError(f"At most {limit} routers per request.")
+    names = [str(name).strip() for name in raw_names]
+    if not all(names):
+        raise BulkError("Router names must not be empty.")
+    return list(dict.fromkeys(names))
+
+
+def validate_provision_operation(company_id: int, operation: str, params: Optional[Dict] = None):
+    if operation != PROVISION:
+        raise BulkError(f"Unknown operation '{operation}', expected: {PROVISION}.")
+    if not (params or {}).get('host'):
+        raise BulkError("The provisioning host is required.")
+
+
+def _create_vpn_client(identity: str):
+    """(error, seconds) of creating the router's VPN client on the Mtk middleware"""
+    from mtk.services import Mtk
+
+    started = time.perf_counter()
+    try:
+        res = Mtk.provision(identity)
+        error = "Unable to setup device, try again later.." if res.error else ''
+    except Exception as e:
+        logger.warning("VPN client creation failed for %s: %s", identity, e)
+        error = "Unable to setup device, try again later.."
+    return error, time.perf_counter() - started
+
+
+def _insert(routers: List) -> Dict[str, str]:
+    """bulk_create `routers`; identity -> error for those that lost a race to a concurrent request"""
+    from isp.models import NetworkEquipment
+
+    try:
+        with transaction.atomic():
+            NetworkEquipment.objects.bulk_create(routers)
+        return {}
+    except IntegrityError:
+        pass
+
+    # Someone else took an identity in the meantime: find which, row by row
+    failed = {}
+    for router in routers:
+        try:
+            with transaction.atomic():
+                router.save(force_insert=True)
+        except IntegrityError:
+            router.pk = None
+            failed[router.identity] = f"Router with identity {router.name} already exists."
+            # Its VPN client was created before the race was lost and stays on the middleware
+            logger.warning("Router %s lost its identity to a concurrent request; VPN client %s needs removing "
+                           "from the Mtk middleware", router.name, router.identity)
+    return failed
+
+
+def provision_routers(company_id: int, names, operation: str = PROVISION, params: Optional[Dict] = None,
+                      user=None, job_id: Optional[int] = None,
+                      progress: Optional[Callable[[int, int, int], None]] = None) -> BulkOutcome:
+    """
+    Provision routers named `names` for the company: an identity pre-check in one query, the
+    VPN clients created CONCURRENCY at a time, then the NetworkEquipment rows in one
+    bulk_create. Results are keyed by name and carry the router's provisioning script.
+    """
+    from isp.models import Company, NetworkEquipment, SystemLog
+    from mtk.services import Mtk
+
+    host = (params or {}).get('host')
+    company = Company.objects.get(pk=company_id)
+    identities = {name: router_identity(company, name) for name in names}
+    results: Dict[str, ItemResult] = {}
+
+    taken = set(NetworkEquipment.objects.filter(identity__in=identities.values()).values_list('identity', flat=True))
+    pending = []
+    for name in names:
+        if identities[name] in taken:
+            results[name] = ItemResult(name, False, f"Router with identity {name} already exists.")
+        else:
+            pending.append(name)
+    if progress:
+        progress(len(results), 0, len(results))
+
+    latencies, created = [], []
+    options = provisioning_settings()
+    with ThreadPoolExecutor(max_workers=max(1, min(options['CONCURRENCY'], len(pending) or 1)),
+                            thread_name_prefix='provision') as pool:
+        outcomes = pool.map(_create_vpn_client, [identities[name] for name in pending])
+        for done, (name, (error, seconds)) in enumerate(zip(pending, outcomes), 1):
+            latencies.append(seconds)
+            if error:
+                results[name] = ItemResult(name, False, error)
+            else:
+                created.append(name)
+            if progress and (done % 50 == 0 or done == len(pending)):
+                progress(len(results) + len(created), len(created), len(results))
+
+    routers = [
+        NetworkEquipment(
+            company_id=company_id,
+            name=name,
+            identity=identities[name],
+            equipment_type="router",
+            username=settings.MTK_CONFIG.get("USERNAME"),
+            password=generate_key(),
+            auth_code=generate_key(20),
+            location="ss",
+        )
+        for name in created
+    ]
+    lost = _insert(routers) if routers else {}
+
+    timestamp = datetime.datetime.utcnow().isoformat()
+    saved = []
+    for router in routers:
+        if router.identity in lost:
+            results[router.name] = ItemResult(router.name, False, lost[router.identity])
+            continue
+        saved.append(router)
+        script, url, rsc_file = Mtk.provision_script(
+            {'mtk': router.pk, 'auth': router.auth_code, 'timestamp': timestamp}, host
+        )
+        results[router.name] = ItemResult(router.name, True, data={
+            'router_id': router.pk, 'script': str(script), 'pvr_url': url, 'rsc_file': rsc_file,
+        })
+
+    if saved:
+        SystemLog.objects.bulk_create([
+            SystemLog(
+                user=user,
+                action_type='create',
+                message=f"Provisioned router {router.identity}",
+                object_type='NetworkEquipment',
+                object_id=router.pk,
+                metadata={'operation': operation, 'job': job_id},
+            )
+            for router in saved
+        ])
+
+    outcome = BulkOutcome(operation, [results[name] for name in names], metrics={
+        'vpn_client_latency': latency_summary(latencies),
+    })
+    logger.info("Provisioned %s/%s routers for company %s (VPN client latency %s)",
+                outcome.succeeded, len(names), company_id, outcome.metrics['vpn_client_latency'])
+    return outcome
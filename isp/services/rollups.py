@@ -0,0 +1,402 @@
+"""
+ISP Management System - Usage Rollups
+Incremental hourly/daily rollups of UsageLog and BandwidthLog, and the chart queries that read them
+File: services/rollups.py
+"""
+
+import logging
+import math
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from typing import Dict, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+HOUR = 'hour'
+DAY = 'day'
+BUCKET_SPAN = {HOUR: timedelta(hours=1), DAY: timedelta(days=1)}
+
+USAGE_WATERMARK = 'usage_log'
+BANDWIDTH_WATERMARK = 'bandwidth_log'
+
+USAGE_FIELDS = ['bytes_uploaded', 'bytes_downloaded', 'sessions', 'session_time']
+BANDWIDTH_FIELDS = [
+    'samples', 'avg_download', 'p95_download', 'max_download', 'avg_upload', 'p95_upload',
+    'max_upload', 'latency_p50', 'latency_p95', 'latency_max', 'avg_packet_loss',
+]
+ROLLUP_KEY = ['subscription', 'granularity', 'bucket_start']
+
+# Aggregates are aliased sum_<field> since Django rejects annotations named like model fields
+_RAW_USAGE_TOTALS = {
+    'sum_bytes_uploaded': Sum('bytes_uploaded'),
+    'sum_bytes_downloaded': Sum('bytes_downloaded'),
+    'sum_sessions': Count('id'),
+    'sum_session_time': Sum('session_time'),
+}
+_ROLLUP_USAGE_TOTALS = {f'sum_{name}': Sum(name) for name in USAGE_FIELDS}
+
+# subscription id -> hour buckets whose source rows changed
+Touched = Dict[int, Set[datetime]]
+
+
+def rollup_settings() -> Dict:
+    defaults = {
+        'LAG_SECONDS': 60,
+        'CHUNK_SIZE': 500,
+        'BANDWIDTH_CHUNK_SIZE': 50,
+    }
+    return {**defaults, **getattr(settings, 'USAGE_ROLLUPS', {})}
+
+
+def bucket_start(value: datetime, granularity: str = HOUR) -> datetime:
+    """Start of the UTC hour/day bucket containing `value`"""
+    value = value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0) if granularity == DAY else value
+
+
+def _trunc(field: str, granularity: str):
+    trunc = TruncDay if granularity == DAY else TruncHour
+    return trunc(field, tzinfo=dt_timezone.utc)
+
+
+def _chunks(items: List, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _bucket_filter(touched: Touched, subscription_ids, field: str) -> Q:
+    """OR of per-subscription [first day, last day] ranges covering the touched buckets"""
+    condition = Q()
+    for pk in subscription_ids:
+        hours = touched[pk]
+        condition |= Q(
+            subscription_id=pk,
+            **{f'{field}__gte': bucket_start(min(hours), DAY),
+               f'{field}__lt': bucket_start(max(hours), DAY) + BUCKET_SPAN[DAY]},
+        )
+    return condition
+
+
+def _upsert(model, rows: List, fields: List[str]) -> int:
+    if rows:
+        model.objects.bulk_create(
+            rows, batch_size=1000, update_conflicts=True,
+            unique_fields=ROLLUP_KEY, update_fields=fields,
+        )
+    return len(rows)
+
+
+# =============================================================================
+# WATERMARKS
+# =============================================================================
+
+@dataclass
+class RollupResult:
+    name: str
+    touched_buckets: int = 0
+    hourly: int = 0
+    daily: int = 0
+    watermark: Optional[datetime] = None
+
+
+def _advance(name: str, model, timestamp_field: str, touched_buckets, recompute,
+             now: Optional[datetime] = None, lag: Optional[int] = None) -> RollupResult:
+    """
+    Fold source rows with `timestamp_field` in (watermark, now - lag] into the rollups.
+
+    The watermark row is locked for the duration so two runs never interleave, and it moves
+    in the same transaction as the rollup writes: a failed run leaves both untouched.
+    """
+    from isp.models import RollupWatermark
+
+    lag = rollup_settings()['LAG_SECONDS'] if lag is None else lag
+    upper = (now or timezone.now()) - timedelta(seconds=lag)
+    result = RollupResult(name)
+
+    RollupWatermark.objects.get_or_create(name=name)
+    with transaction.atomic():
+        mark = RollupWatermark.objects.select_for_update().get(name=name)
+        if mark.position is not None and mark.position >= upper:
+            result.watermark = mark.position
+            return result
+
+        rows = model.objects.filter(**{f'{timestamp_field}__lte': upper})
+        if mark.position is not None:
+            rows = rows.filter(**{f'{timestamp_field}__gt': mark.position})
+
+        touched: Touched = defaultdict(set)
+        for subscription_id, hour in touched_buckets(rows):
+            touched[subscription_id].add(hour)
+
+        result.touched_buckets = sum(len(hours) for hours in touched.values())
+        if touched:
+            result.hourly, result.daily = recompute(touched)
+
+        mark.position = upper
+        mark.save(update_fields=['position', 'updated_at'])
+        result.watermark = upper
+
+    logger.info("Rollup %s: %s buckets touched, %s hourly / %s daily rows written",
+                name, result.touched_buckets, result.hourly, result.daily)
+    return result
+
+
+def closed_until(name: str, granularity: str) -> Optional[datetime]:
+    """Buckets starting before this instant are complete in the rollup tables"""
+    from isp.models import RollupWatermark
+
+    position = RollupWatermark.objects.filter(name=name).values_list('position', flat=True).first()
+    return bucket_start(position, granularity) if position else None
+
+
+# =============================================================================
+# USAGE ROLLUPS
+# =============================================================================
+
+def _usage_touched(rows):
+    return (
+        rows.order_by()
+        .annotate(bucket=_trunc('session_start', HOUR))
+        .values_list('subscription_id', 'bucket')
+        .distinct()
+        .iterator()
+    )
+
+
+def _recompute_usage(touched: Touched) -> Tuple[int, int]:
+    from isp.models import UsageLog, UsageRollup
+
+    hourly = daily = 0
+    for chunk in _chunks(sorted(touched), rollup_settings()['CHUNK_SIZE']):
+        totals = (
+            UsageLog.objects.filter(_bucket_filter(touched, chunk, 'session_start'))
+            .order_by()
+            .annotate(bucket=_trunc('session_start', HOUR))
+            .values('subscription_id', 'bucket')
+            .annotate(**_RAW_USAGE_TOTALS)
+        )
+        rows = {
+            (pk, hour): UsageRollup(subscription_id=pk, granularity=HOUR, bucket_start=hour)
+            for pk in chunk for hour in touched[pk]
+        }
+        for row in totals:
+            rollup = rows.get((row['subscription_id'], row['bucket']))
+            if rollup is not None:
+                for name in USAGE_FIELDS:
+                    setattr(rollup, name, row[f'sum_{name}'] or 0)
+        hourly += _upsert(UsageRollup, list(rows.values()), USAGE_FIELDS)
+
+        # Days are re-summed from the hourly rollups, never from the raw table
+        days = {(pk, bucket_start(hour, DAY)) for pk, hour in rows}
+        totals = (
+            UsageRollup.objects.filter(_bucket_filter(touched, chunk, 'bucket_start'), granularity=HOUR)
+            .order_by()
+            .annotate(bucket=_trunc('bucket_start', DAY))
+            .values('subscription_id', 'bucket')
+            .annotate(**_ROLLUP_USAGE_TOTALS)
+        )
+        daily += _upsert(UsageRollup, [
+            UsageRollup(subscription_id=row['subscription_id'], granularity=DAY, bucket_start=row['bucket'],
+                        **{name: row[f'sum_{name}'] for name in USAGE_FIELDS})
+            for row in totals if (row['subscription_id'], row['bucket']) in days
+        ], USAGE_FIELDS)
+    return hourly, daily
+
+
+def rollup_usage(now: Optional[datetime] = None, lag: Optional[int] = None) -> RollupResult:
+    """
+    Bring UsageRollup up to date.
+
+    UsageLog rows are rewritten by every Interim-Update, so new work is found by
+    `updated_at`; each touched (subscription, hour) bucket is recomputed in full.
+    """
+    from isp.models import UsageLog
+
+    return _advance(USAGE_WATERMARK, UsageLog, 'updated_at', _usage_touched, _recompute_usage, now, lag)
+
+
+# =============================================================================
+# BANDWIDTH ROLLUPS
+# =============================================================================
+
+def _percentile(ordered: List, pct: float):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def bandwidth_stats(samples: List[Tuple]) -> Dict:
+    """Rollup columns for (download, upload, latency, packet_loss) samples"""
+    downloads = sorted(s[0] for s in samples)
+    uploads = sorted(s[1] for s in samples)
+    latencies = sorted(s[2] for s in samples if s[2] is not None)
+    losses = [s[3] for s in samples if s[3] is not None]
+    return {
+        'samples': len(samples),
+        'avg_download': round(sum(downloads) / len(downloads)),
+        'p95_download': _percentile(downloads, 95),
+        'max_download': downloads[-1],
+        'avg_upload': round(sum(uploads) / len(uploads)),
+        'p95_upload': _percentile(uploads, 95),
+        'max_upload': uploads[-1],
+        'latency_p50': _percentile(latencies, 50),
+        'latency_p95': _percentile(latencies, 95),
+        'latency_max': latencies[-1] if latencies else None,
+        'avg_packet_loss': (
+            (sum(losses, Decimal(0)) / len(losses)).quantize(Decimal('0.01')) if losses else None
+        ),
+    }
+
+
+def _bandwidth_touched(rows):
+    return (
+        rows.order_by()
+        .annotate(bucket=_trunc('timestamp', HOUR))
+        .values_list('subscription_id', 'bucket')
+        .distinct()
+        .iterator()
+    )
+
+
+def _recompute_bandwidth(touched: Touched) -> Tuple[int, int]:
+    """
+    Percentiles cannot be merged from smaller buckets, so both the hour and the day
+    buckets are computed from one scan of the raw samples of each touched day.
+    """
+    from isp.models import BandwidthLog, BandwidthRollup
+
+    hourly = daily = 0
+    for chunk in _chunks(sorted(touched), rollup_settings()['BANDWIDTH_CHUNK_SIZE']):
+        days = {(pk, bucket_start(hour, DAY)) for pk in chunk for hour in touched[pk]}
+        samples = defaultdict(list)
+        for pk, ts, down, up, latency, loss in (
+            BandwidthLog.objects.filter(_bucket_filter(touched, chunk, 'timestamp'))
+            .order_by()
+            .values_list('subscription_id', 'timestamp', 'download_speed', 'upload_speed',
+                         'latency', 'packet_loss')
+            .iterator(chunk_size=5000)
+        ):
+            hour = bucket_start(ts)
+            sample = (down, up, latency, loss)
+            if hour in touched[pk]:
+                samples[(pk, HOUR, hour)].append(sample)
+            if (pk, hour.replace(hour=0)) in days:
+                samples[(pk, DAY, hour.replace(hour=0))].append(sample)
+
+        rows = {HOUR: [], DAY: []}
+        for (pk, granularity, start), bucket in samples.items():
+            rows[granularity].append(BandwidthRollup(
+                subscription_id=pk, granularity=granularity, bucket_start=start, **bandwidth_stats(bucket)
+            ))
+        hourly += _upsert(BandwidthRollup, rows[HOUR], BANDWIDTH_FIELDS)
+        daily += _upsert(BandwidthRollup, rows[DAY], BANDWIDTH_FIELDS)
+    return hourly, daily
+
+
+def rollup_bandwidth(now: Optional[datetime] = None, lag: Optional[int] = None) -> RollupResult:
+    """Bring BandwidthRollup up to date; BandwidthLog is append-only so `created_at` is the cursor"""
+    from isp.models import BandwidthLog
+
+    return _advance(BANDWIDTH_WATERMARK, BandwidthLog, 'created_at', _bandwidth_touched,
+                    _recompute_bandwidth, now, lag)
+
+
+def run_rollups(now: Optional[datetime] = None, lag: Optional[int] = None) -> List[RollupResult]:
+    return [rollup_usage(now, lag), rollup_bandwidth(now, lag)]
+
+
+# =============================================================================
+# QUERIES
+# =============================================================================
+
+def usage_series(start: datetime, end: datetime, granularity: str = DAY,
+                 subscription_id: Optional[int] = None, company_id: Optional[int] = None) -> List[Dict]:
+    """
+    Usage totals per bucket between `start` and `end`, for one subscription or a whole company.
+
+    Closed buckets come from UsageRollup; buckets the rollup job has not sealed yet
+    (normally only the current one) are aggregated from UsageLog on the fly.
+    """
+    from isp.models import UsageLog, UsageRollup
+
+    scope = {}
+    if subscription_id is not None:
+        scope['subscription_id'] = subscription_id
+    if company_id is not None:
+        scope['subscription__customer__company_id'] = company_id
+
+    start = bucket_start(start, granularity)
+    boundary = closed_until(USAGE_WATERMARK, granularity)
+    boundary = min(max(boundary or start, start), end)
+
+    series = {
+        row['bucket_start']: row
+        for row in UsageRollup.objects.filter(
+            granularity=granularity, bucket_start__gte=start, bucket_start__lt=boundary, **scope
+        ).order_by().values('bucket_start').annotate(**_ROLLUP_USAGE_TOTALS)
+    }
+    if boundary < end:
+        for row in (
+            UsageLog.objects.filter(session_start__gte=boundary, session_start__lt=end, **scope)
+            .order_by()
+            .annotate(bucket_start=_trunc('session_start', granularity))
+            .values('bucket_start')
+            .annotate(**_RAW_USAGE_TOTALS)
+        ):
+            current = series.setdefault(row['bucket_start'], {'bucket_start': row['bucket_start']})
+            for name in USAGE_FIELDS:
+                current[f'sum_{name}'] = (current.get(f'sum_{name}') or 0) + (row[f'sum_{name}'] or 0)
+
+    return [
+        {'bucket_start': key, **{name: series[key].get(f'sum_{name}') or 0 for name in USAGE_FIELDS}}
+        for key in sorted(series)
+    ]
+
+
+def bandwidth_series(subscription_id: int, start: datetime, end: datetime,
+                     granularity: str = HOUR) -> List[Dict]:
+    """Bandwidth/latency statistics per bucket for one subscription, rollups first then raw samples"""
+    from isp.models import BandwidthLog, BandwidthRollup
+
+    start = bucket_start(start, granularity)
+    boundary = closed_until(BANDWIDTH_WATERMARK, granularity)
+    boundary = min(max(boundary or start, start), end)
+
+    series = {
+        row['bucket_start']: row
+        for row in BandwidthRollup.objects.filter(
+            subscription_id=subscription_id, granularity=granularity,
+            bucket_start__gte=start, bucket_start__lt=boundary,
+        ).values('bucket_start', *BANDWIDTH_FIELDS)
+    }
+    if boundary < end:
+        samples = defaultdict(list)
+        for ts, down, up, latency, loss in (
+            BandwidthLog.objects.filter(subscription_id=subscription_id, timestamp__gte=boundary, timestamp__lt=end)
+            .order_by()
+            .values_list('timestamp', 'download_speed', 'upload_speed', 'latency', 'packet_loss')
+        ):
+            samples[bucket_start(ts, granularity)].append((down, up, latency, loss))
+        for key, bucket in samples.items():
+            series[key] = {'bucket_start': key, **bandwidth_stats(bucket)}
+
+    return [series[key] for key in sorted(series)]
+
+
+def watermark_status(name: str) -> Dict:
+    """Source-table span versus the rollup watermark, for monitoring lag"""
+    from isp.models import BandwidthLog, RollupWatermark, UsageLog
+
+    model, field = (UsageLog, 'updated_at') if name == USAGE_WATERMARK else (BandwidthLog, 'created_at')
+    span = model.objects.aggregate(first=Min(field), last=Max(field))
+    position = RollupWatermark.objects.filter(name=name).values_list('position', flat=True).first()
+    return {'name': name, 'watermark': position, **span}
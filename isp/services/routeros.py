@@ -0,0 +1,296 @@
+"""
+ISP Management System - RouterOS API Client
+asyncio client for the MikroTik API (port 8728): one persistent connection per router,
+with commands pipelined over it using tags
+File: services/routeros.py
+"""
+
+import asyncio
+import hashlib
+import itertools
+import logging
+import ssl
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# A command and its attributes, e.g. ('/interface/print', {'.proplist': 'name,rx-byte'})
+Command = Tuple[str, Dict[str, str]]
+
+
+def routeros_settings() -> Dict:
+    defaults = {
+        'PORT': 8728,
+        'SSL': False,
+        # Seconds allowed for connecting and logging in, and for each command
+        'CONNECT_TIMEOUT': 5,
+        'COMMAND_TIMEOUT': 10,
+    }
+    return {**defaults, **getattr(settings, 'ROUTEROS_API', {})}
+
+
+class RouterOSError(Exception):
+    """The router could not be reached or the connection broke"""
+
+
+class RouterOSTrap(RouterOSError):
+    """The router rejected a command (!trap); the connection stays usable"""
+
+
+# =============================================================================
+# WIRE FORMAT
+# =============================================================================
+
+def encode_length(length: int) -> bytes:
+    if length < 0x80:
+        return bytes([length])
+    if length < 0x4000:
+        return (length | 0x8000).to_bytes(2, 'big')
+    if length < 0x200000:
+        return (length | 0xC00000).to_bytes(3, 'big')
+    if length < 0x10000000:
+        return (length | 0xE0000000).to_bytes(4, 'big')
+    return b'\xf0' + length.to_bytes(4, 'big')
+
+
+def encode_sentence(words: Sequence[str]) -> bytes:
+    out = bytearray()
+    for word in words:
+        data = word.encode()
+        out += encode_length(len(data)) + data
+    out += b'\x00'
+    return bytes(out)
+
+
+def command_words(command: str, attributes: Optional[Dict[str, str]] = None, tag: Optional[str] = None) -> List[str]:
+    words = [command]
+    for key, value in (attributes or {}).items():
+        # Query words ('?name=x') pass through; everything else is an attribute
+        words.append(key if key.startswith('?') else f'={key}={value}')
+    if tag is not None:
+        words.append(f'.tag={tag}')
+    return words
+
+
+async def read_length(reader: asyncio.StreamReader) -> int:
+    first = (await reader.readexactly(1))[0]
+    if first < 0x80:
+        return first
+    if first < 0xC0:
+        return ((first & 0x3F) << 8) + (await reader.readexactly(1))[0]
+    if first < 0xE0:
+        return ((first & 0x1F) << 16) + int.from_bytes(await reader.readexactly(2), 'big')
+    if first < 0xF0:
+        return ((first & 0x0F) << 24) + int.from_bytes(await reader.readexactly(3), 'big')
+    return int.from_bytes(await reader.readexactly(4), 'big')
+
+
+async def read_sentence(reader: asyncio.StreamReader) -> List[str]:
+    words = []
+    while True:
+        length = await read_length(reader)
+        if length == 0:
+            return words
+        words.append((await reader.readexactly(length)).decode(errors='replace'))
+
+
+def parse_reply(words: List[str]) -> Tuple[str, Optional[str], Dict[str, str]]:
+    """(reply type, tag, attributes) of a sentence such as ['!re', '=name=ether1', '.tag=3']"""
+    kind, tag, attributes = words[0] if words else '', None, {}
+    for word in words[1:]:
+        if word.startswith('.tag='):
+            tag = word[5:]
+        elif word.startswith('='):
+            key, _, value = word[1:].partition('=')
+            attributes[key] = value
+    return kind, tag, attributes
+
+
+# =============================================================================
+# CONNECTION
+# =============================================================================
+
+class RouterOSConnection:
+    """
+    One API session. Every command carries a tag, so any number can be in flight at once:
+    `pipeline` writes a batch in one go and the reader task hands each reply to its caller.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, command_timeout: float):
+        self.reader, self.writer = reader, writer
+        self.command_timeout = command_timeout
+        self.closed = False
+        self._tags = itertools.count(1)
+        # tag -> (future, rows, trap message)
+        self._pending: Dict[str, list] = {}
+        self._read_task = asyncio.get_running_loop().create_task(self._read_loop())
+
+    @classmethod
+    async def open(cls, host: str, port: int, username: str, password: str,
+                   connect_timeout: float = 5, command_timeout: float = 10, use_ssl: bool = False):
+        context = None
+        if use_ssl:
+            # RouterOS api-ssl ships a self-signed certificate by default
+            context = ssl.create_default_context()
+            context.check_hostname, context.verify_mode = False, ssl.CERT_NONE
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=context),
+                                                    connect_timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise RouterOSError(f"Cannot connect to {host}:{port}: {e or 'timed out'}") from e
+
+        connection = cls(reader, writer, command_timeout)
+        try:
+            await asyncio.wait_for(connection.login(username, password), connect_timeout)
+        except (RouterOSError, asyncio.TimeoutError) as e:
+            connection.close()
+            raise RouterOSError(f"Login to {host}:{port} failed: {e or 'timed out'}") from e
+        return connection
+
+    async def login(self, username: str, password: str) -> None:
+        reply = await self.call('/login', {'name': username, 'password': password})
+        # Before 6.43 the router ignores the password and answers `!done =ret=<challenge>`
+        challenge = reply[-1].get('ret') if reply else None
+        if challenge:
+            # RouterOS before 6.43: MD5 challenge-response
+            digest = hashlib.md5(b'\x00' + password.encode() + bytes.fromhex(challenge)).hexdigest()
+            await self.call('/login', {'name': username, 'response': f'00{digest}'})
+
+    async def _read_loop(self) -> None:
+        error: Exception = RouterOSError("Connection closed by the router")
+        try:
+            while True:
+                kind, tag, attributes = parse_reply(await read_sentence(self.reader))
+                if kind == '!fatal':
+                    error = RouterOSError(f"Router closed the session: {attributes or 'fatal'}")
+                    break
+                entry = self._pending.get(tag)
+                if entry is None:
+                    continue
+                if kind == '!re':
+                    entry[1].append(attributes)
+                elif kind == '!trap':
+                    entry[2] = attributes.get('message', 'Command failed')
+                elif kind in ('!done', '!empty'):
+                    del self._pending[tag]
+                    if attributes:
+                        entry[1].append(attributes)
+                    if not entry[0].done():
+                        if entry[2] is not None:
+                            entry[0].set_exception(RouterOSTrap(entry[2]))
+                        else:
+                            entry[0].set_result(entry[1])
+        except (asyncio.IncompleteReadError, OSError) as e:
+            error = RouterOSError(f"Connection lost: {e}")
+        except asyncio.CancelledError:
+            error = RouterOSError("Connection closed")
+        finally:
+            self._fail_pending(error)
+            self.close()
+
+    def _fail_pending(self, error: Exception) -> None:
+        pending, self._pending = self._pending, {}
+        for future, _, _ in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def _submit(self, command: str, attributes: Optional[Dict[str, str]]) -> asyncio.Future:
+        if self.closed:
+            raise RouterOSError("Connection is closed")
+        tag = str(next(self._tags))
+        future = asyncio.get_running_loop().create_future()
+        self._pending[tag] = [future, [], None]
+        self.writer.write(encode_sentence(command_words(command, attributes, tag)))
+        return future
+
+    async def _collect(self, futures: List[asyncio.Future]) -> List:
+        try:
+            await asyncio.wait_for(self.writer.drain(), self.command_timeout)
+            results = await asyncio.wait_for(asyncio.gather(*futures, return_exceptions=True), self.command_timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            # A router that stopped answering is not reused
+            self.close()
+            raise RouterOSError(f"Router did not answer: {e or 'timed out'}") from e
+        for result in results:
+            # Traps belong to their command; anything else means the connection broke
+            if isinstance(result, RouterOSError) and not isinstance(result, RouterOSTrap):
+                raise result
+        return results
+
+    async def call(self, command: str, attributes: Optional[Dict[str, str]] = None) -> List[Dict[str, str]]:
+        """
+        The !re rows of one command, followed by the attributes of its !done when it carries
+        any (such as =ret=); RouterOSTrap when the router rejects it
+        """
+        result = (await self._collect([self._submit(command, attributes)]))[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def pipeline(self, commands: Sequence[Command]) -> List:
+        """
+        Send every command before reading any reply: one round trip for the batch. Returns,
+        in order, each command's rows (as call() returns them) or the RouterOSTrap it failed with.
+        """
+        return await self._collect([self._submit(command, attributes) for command, attributes in commands])
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.close()
+        if self._read_task is not asyncio.current_task():
+            self._read_task.cancel()
+
+
+# =============================================================================
+# POOL
+# =============================================================================
+
+class RouterOSPool:
+    """Persistent connections keyed by (host, port, username), opened on first use and reopened when broken"""
+
+    def __init__(self, **options):
+        self.options = {**routeros_settings(), **options}
+        self._connections: Dict[Tuple, RouterOSConnection] = {}
+        self._locks: Dict[Tuple, asyncio.Lock] = {}
+
+    def __len__(self):
+        return sum(1 for connection in self._connections.values() if not connection.closed)
+
+    async def connection(self, host: str, username: str, password: str, port: Optional[int] = None):
+        key = (host, port or self.options['PORT'], username)
+        connection = self._connections.get(key)
+        if connection is not None and not connection.closed:
+            return connection
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            connection = self._connections.get(key)
+            if connection is None or connection.closed:
+                connection = await RouterOSConnection.open(
+                    key[0], key[1], username, password,
+                    connect_timeout=self.options['CONNECT_TIMEOUT'],
+                    command_timeout=self.options['COMMAND_TIMEOUT'],
+                    use_ssl=self.options['SSL'],
+                )
+                self._connections[key] = connection
+            return connection
+
+    async def pipeline(self, host: str, username: str, password: str, commands: Sequence[Command],
+                       port: Optional[int] = None) -> List:
+        """pipeline() on the router's pooled connection, reconnecting once if it had gone stale"""
+        for attempt in range(2):
+            connection = await self.connection(host, username, password, port)
+            try:
+                return await connection.pipeline(commands)
+            except RouterOSError:
+                if attempt:
+                    raise
+                logger.info("Reconnecting to router %s:%s", host, port or self.options['PORT'])
+
+    def close(self) -> None:
+        for connection in self._connections.values():
+            connection.close()
+        self._connections.clear()
@@ -0,0 +1,255 @@
+"""
+ISP Management System - Router Provisioning
+Subscriber commands grouped per router (NAS) and pushed as one batch per router
+File: services/routers.py
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Router-side actions on a subscriber's PPPoE secret / hotspot user
+DISABLE = 'disable'
+ENABLE = 'enable'
+REMOVE = 'remove'
+SET_PROFILE = 'set-profile'
+
+
+def router_settings() -> Dict:
+    defaults = {
+        'BACKEND': 'isp.services.routers.MtkRouterBackend',
+        # MtkRouterBackend: middleware endpoint taking a batch of subscriber commands for the
+        # router `{identity}` (contract on MtkRouterBackend). Empty until the middleware has it,
+        # and while it is empty lifecycle changes are saved without being pushed.
+        'MTK_BATCH_ENDPOINT': '',
+        # Commands sent to one router per call
+        'BATCH_SIZE': 1000,
+        # Routers pushed to in parallel
+        'CONCURRENCY': 8,
+        # FakeRouterBackend: seconds per call and per command
+        'FAKE_LATENCY': 0.05,
+        'FAKE_COMMAND_COST': 0.0001,
+    }
+    return {**defaults, **getattr(settings, 'ROUTER_PROVISIONING', {})}
+
+
+class RouterError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class RouterCommand:
+    action: str
+    username: str
+    service: str = 'pppoe'
+    # MikroTik rate-limit (rx/tx as seen by the router), for SET_PROFILE/ENABLE
+    rate_limit: str = ''
+
+    def to_dict(self) -> Dict:
+        data = {'action': self.action, 'username': self.username, 'service': self.service}
+        if self.rate_limit:
+            data['rate_limit'] = self.rate_limit
+        return data
+
+
+@dataclass
+class PushResult:
+    router_id: int
+    commands: int
+    calls: int = 0
+    seconds: float = 0.0
+    error: str = ''
+
+    @property
+    def ok(self) -> bool:
+        return not self.error
+
+
+@dataclass
+class RouterPush:
+    """Outcome of pushing a set of subscription changes: per router, and the subscriptions that failed"""
+    routers: List[PushResult] = field(default_factory=list)
+    # Subscription pk -> error, for subscriptions whose router rejected or missed the batch
+    failed: Dict[int, str] = field(default_factory=dict)
+    # Subscriptions with no router or username, or not pushed because the backend is not configured
+    skipped: int = 0
+
+
+# =============================================================================
+# BACKENDS
+# =============================================================================
+
+class RouterBackend:
+    """Sends one batch of subscriber commands to a router; raises RouterError when it fails"""
+
+    @property
+    def configured(self) -> bool:
+        """False when the backend has nowhere to send to, so pushes are skipped rather than failed"""
+        return True
+
+    def send(self, router, commands: List[RouterCommand]) -> None:
+        raise NotImplementedError
+
+
+class MtkRouterBackend(RouterBackend):
+    """
+    Pushes batches through the Mtk middleware, which applies them on the MikroTik over the VPN.
+
+    The endpoint is ROUTER_PROVISIONING['MTK_BATCH_ENDPOINT'] (e.g.
+    "mikrotik/devices/{identity}/subscribers/batch"). The middleware contract:
+    POST {"commands": [{"action": "disable|enable|remove|set-profile", "username": ...,
+    "service": "pppoe|hotspot", "rate_limit": "5M/10M" (optional)}, ...]} and answer
+    {"success": true} once every command is applied, or {"success": false, "error": ...}.
+    Commands must be idempotent (disabling a disabled secret is a no-op), since a batch
+    that fails is reported and may be sent again. While no endpoint is configured the
+    backend is not `configured` and push_subscriptions skips it.
+    """
+
+    @property
+    def configured(self) -> bool:
+        return bool(router_settings()['MTK_BATCH_ENDPOINT'])
+
+    def send(self, router, commands: List[RouterCommand]) -> None:
+        from mtk.services import Mtk, NetWokException
+
+        endpoint = router_settings()['MTK_BATCH_ENDPOINT']
+        if not endpoint:
+            raise RouterError("No router push endpoint configured (ROUTER_PROVISIONING['MTK_BATCH_ENDPOINT'])")
+        if Mtk.get() is None:
+            raise RouterError("Mtk middleware is not initialised")
+        try:
+            res = Mtk.instance.net.dispatch(
+                endpoint.format(identity=router.identity),
+                commands=[command.to_dict() for command in commands],
+            )
+        except NetWokException as e:
+            raise RouterError(str(e))
+        if not isinstance(res, dict):
+            raise RouterError("Invalid response from the Mtk middleware")
+        if not res.get('success'):
+            raise RouterError(res.get('error') or "Router rejected the batch")
+
+
+class FakeRouterBackend(RouterBackend):
+    """
+    In-process backend for tests and benchmarks: every call costs a fixed round trip
+    plus a small per-command cost, and is recorded in `calls` as (router pk, commands, seconds).
+    """
+
+    def __init__(self, latency: Optional[float] = None, command_cost: Optional[float] = None,
+                 failing: Iterable[int] = ()):
+        options = router_settings()
+        self.latency = options['FAKE_LATENCY'] if latency is None else latency
+        self.command_cost = options['FAKE_COMMAND_COST'] if command_cost is None else command_cost
+        # Router pks whose calls fail
+        self.failing = set(failing)
+        self.calls: List[tuple] = []
+        self._lock = threading.Lock()
+
+    def send(self, router, commands: List[RouterCommand]) -> None:
+        started = time.perf_counter()
+        time.sleep(self.latency + self.command_cost * len(commands))
+        with self._lock:
+            self.calls.append((router.pk, len(commands), time.perf_counter() - started))
+        if router.pk in self.failing:
+            raise RouterError(f"{router.identity} unreachable")
+
+
+def get_backend() -> RouterBackend:
+    return import_string(router_settings()['BACKEND'])()
+
+
+# =============================================================================
+# PUSH
+# =============================================================================
+
+def rate_limit(package) -> str:
+    return f"{package.upload_speed}M/{package.download_speed}M"
+
+
+def _push_router(backend: RouterBackend, router, commands: List[RouterCommand], batch_size: int) -> PushResult:
+    result = PushResult(router.pk, len(commands))
+    started = time.perf_counter()
+    try:
+        for start in range(0, len(commands), batch_size):
+            backend.send(router, commands[start:start + batch_size])
+            result.calls += 1
+    except Exception as e:
+        logger.warning("Router push to %s failed after %s calls: %s", router.identity, result.calls, e)
+        result.error = str(e) or type(e).__name__
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def push_subscriptions(subscriptions: List, action: str, package=None,
+                       backend: Optional[RouterBackend] = None) -> RouterPush:
+    """
+    Send `action` for every subscription to the router serving it.
+
+    Subscriptions are grouped by router_id so each router receives its commands in
+    BATCH_SIZE calls instead of one call per subscriber; routers are pushed to in
+    parallel. `package` is the new package for SET_PROFILE, otherwise each
+    subscription's own package supplies the service type and rate limit. With a
+    backend that is not configured nothing is sent and every subscription is skipped.
+    """
+    from isp.models import InternetPackage, NetworkEquipment
+
+    outcome = RouterPush()
+    grouped: Dict[int, List] = {}
+    for subscription in subscriptions:
+        if subscription.router_id and subscription.username:
+            grouped.setdefault(subscription.router_id, []).append(subscription)
+        else:
+            outcome.skipped += 1
+    if not grouped:
+        return outcome
+
+    backend = backend or get_backend()
+    if not backend.configured:
+        count = sum(len(members) for members in grouped.values())
+        logger.info("Router push is not configured; %s subscription changes were saved without a push", count)
+        outcome.skipped += count
+        return outcome
+
+    routers = NetworkEquipment.objects.only('id', 'identity', 'name').in_bulk(list(grouped))
+    packages = {package.pk: package} if package is not None else InternetPackage.objects.only(
+        'id', 'package_type', 'upload_speed', 'download_speed',
+    ).in_bulk({subscription.package_id for members in grouped.values() for subscription in members})
+
+    batches = []
+    for router_id, members in grouped.items():
+        router = routers.get(router_id)
+        if router is None:
+            outcome.skipped += len(members)
+            continue
+        commands = []
+        for subscription in members:
+            plan = packages.get(subscription.package_id)
+            commands.append(RouterCommand(
+                action=action,
+                username=subscription.username,
+                service=plan.package_type if plan else 'pppoe',
+                rate_limit=rate_limit(plan) if plan and action in (SET_PROFILE, ENABLE) else '',
+            ))
+        batches.append((router, commands))
+
+    options = router_settings()
+    workers = max(1, min(options['CONCURRENCY'], len(batches)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='router-push') as executor:
+        outcome.routers = list(executor.map(
+            lambda batch: _push_router(backend, batch[0], batch[1], options['BATCH_SIZE']), batches,
+        ))
+
+    for result in outcome.routers:
+        if not result.ok:
+            for subscription in grouped[result.router_id]:
+                outcome.failed[subscription.pk] = result.error
+    return outcome
@@ -0,0 +1,122 @@
+"""
+ISP Management System - Router Config Scripts
+RouterOS provisioning scripts rendered once per router, RouterOS version and config fingerprint
+File: services/scripts.py
+"""
+
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Dict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+
+from isp.functions import get_mode_from_url
+
+logger = logging.getLogger(__name__)
+
+
+def script_settings() -> Dict:
+    defaults = {
+        # Entries are keyed by their fingerprint, so this only bounds how long unused ones linger
+        'CACHE_TTL': 24 * 3600,
+    }
+    return {**defaults, **getattr(settings, 'RSC_SCRIPTS', {})}
+
+
+def template_name(version: int) -> str:
+    return f"rsc_files/{'vpn_7_config.rsc' if version == 7 else 'vpn_6_config.rsc'}"
+
+
+def template_version(name: str) -> str:
+    """Changes whenever the template file is edited or redeployed"""
+    origin = get_template(name).origin.name
+    try:
+        stat = os.stat(origin)
+    except OSError:
+        return origin
+    return f"{origin}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+@dataclass
+class RouterScript:
+    """
+    The OpenVPN/hotspot config script of one router. Everything the rendered text depends
+    on is part of `fingerprint`, which doubles as the ETag: editing the NetworkEquipment row
+    (updated_at), MTK_CONFIG, the server IP, the host or the template yields a new one.
+    """
+    router: object
+    auth: str
+    host: str
+    server_ip: str
+    version: int
+
+    @cached_property
+    def fingerprint(self) -> str:
+        router = self.router
+        inputs = [
+            router.pk, router.updated_at.isoformat() if router.updated_at else None, router.identity,
+            router.password, self.auth, self.host, self.server_ip, self.version,
+            settings.MTK_CONFIG.get('URL'), settings.MTK_CONFIG.get('USERNAME'),
+            template_version(template_name(self.version)),
+        ]
+        return hashlib.sha256(json.dumps(inputs, default=str).encode()).hexdigest()[:32]
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.fingerprint}"'
+
+    @property
+    def cache_key(self) -> str:
+        return f'isp:rsc:{self.router.pk}:{self.version}:{self.fingerprint}'
+
+    def context(self) -> Dict:
+        router, url = self.router, self.host
+        config = {
+            "firewall": "10.8.0.1",
+            "secret": router.password,
+            "identity": router.identity,
+            "mtk_user": settings.MTK_CONFIG["USERNAME"],
+            "vpn_url": f"{url}/api/v1/equipments/auth/cert/{self.auth}/",
+            "hs_login_url": f"{url}/api/v1/mikrotik/hotspot/{self.auth}/login.html",
+            "hs_rlogin_url": f"{url}/api/v1/mikrotik/hotspot/{self.auth}/rlogin.html",
+            "walled_garden_host": settings.MTK_CONFIG["URL"],
+            "walled_garden_ip": self.server_ip,
+        }
+        config["mode"] = get_mode_from_url(config["hs_login_url"])
+
+        # For RouterOS v6, we need additional parameters
+        if self.version == 6:
+            config.update({
+                "connect_to": self.server_ip,
+                "vpn_pass": router.password,
+                "client_cert": f"{router.identity}.config_1"
+            })
+        return {'config': config}
+
+    def render(self) -> str:
+        """The script text, from the shared cache when this fingerprint was rendered before"""
+        try:
+            body = cache.get(self.cache_key)
+        except Exception as e:
+            logger.warning("Config script cache read failed: %s", e)
+            body = None
+        if body is not None:
+            return body
+
+        body = get_template(template_name(self.version)).render(self.context())
+        try:
+            cache.set(self.cache_key, body, script_settings()['CACHE_TTL'])
+        except Exception as e:
+            logger.warning("Config script cache write failed: %s", e)
+        return body
+
+    def matches(self, if_none_match: str) -> bool:
+        """Whether an If-None-Match header already names this version of the script"""
+        tags = {tag.strip().removeprefix('W/') for tag in (if_none_match or '').split(',')}
+        return self.etag in tags or '*' in tags
@@ -0,0 +1,340 @@
+"""
+ISP Management System - Active Sessions
+Who is online right now: a session table fed by accounting, indexed by subscription, NAS and company
+File: services/sessions.py
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MEMORY = 'memory'
+REDIS = 'redis'
+
+
+def session_settings() -> Dict:
+    defaults = {
+        # 'memory' keeps the table in this process; 'redis' shares it between processes.
+        # None picks redis when the default cache is Redis.
+        'BACKEND': None,
+        'LOCATION': None,
+        # Seconds without an accounting update after which a session no longer counts as online
+        # (a few interim intervals: the NAS may have rebooted without sending Stop)
+        'STALE_AFTER': 900,
+        'KEY_PREFIX': 'isp:sessions',
+    }
+    return {**defaults, **getattr(settings, 'ACTIVE_SESSIONS', {})}
+
+
+@dataclass
+class ActiveSession:
+    session_id: str
+    username: str
+    subscription_id: int
+    company_id: int
+    nas_ip: str = ''
+    framed_ip: str = ''
+    mac_address: str = ''
+    started_at: float = 0.0
+    session_time: int = 0
+    bytes_uploaded: int = 0
+    bytes_downloaded: int = 0
+    # When accounting last reported the session (time.time())
+    seen_at: float = 0.0
+
+    def as_dict(self) -> Dict:
+        return asdict(self)
+
+    @classmethod
+    def from_json(cls, raw) -> "ActiveSession":
+        return cls(**json.loads(raw))
+
+
+# =============================================================================
+# IN-PROCESS TABLE
+# =============================================================================
+
+class MemorySessionTable:
+    """
+    Sessions in a dict ordered by last update, with set indexes kept alongside. Updates and
+    lookups are O(1); expiry pops from the old end only, so it costs one step per expired session.
+    """
+
+    def __init__(self, stale_after: float):
+        self.stale_after = stale_after
+        self._sessions: 'OrderedDict[str, ActiveSession]' = OrderedDict()
+        self._by_subscription: Dict[int, set] = {}
+        self._by_company: Dict[int, set] = {}
+        self._by_nas: Dict[Tuple[int, str], set] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            self._expire()
+            return len(self._sessions)
+
+    def _index(self, session: ActiveSession) -> None:
+        self._by_subscription.setdefault(session.subscription_id, set()).add(session.session_id)
+        self._by_company.setdefault(session.company_id, set()).add(session.session_id)
+        self._by_nas.setdefault((session.company_id, session.nas_ip), set()).add(session.session_id)
+
+    def _unindex(self, session: ActiveSession) -> None:
+        for index, key in ((self._by_subscription, session.subscription_id),
+                           (self._by_company, session.company_id),
+                           (self._by_nas, (session.company_id, session.nas_ip))):
+            members = index.get(key)
+            if members is not None:
+                members.discard(session.session_id)
+                if not members:
+                    del index[key]
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.stale_after
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.seen_at >= cutoff:
+                break
+            self._sessions.popitem(last=False)
+            self._unindex(session)
+
+    def apply(self, updates: Iterable[ActiveSession], stops: Iterable[str] = ()) -> None:
+        with self._lock:
+            for session in updates:
+                previous = self._sessions.pop(session.session_id, None)
+                if previous is not None:
+                    self._unindex(previous)
+                self._sessions[session.session_id] = session
+                self._index(session)
+            for session_id in stops:
+                previous = self._sessions.pop(session_id, None)
+                if previous is not None:
+                    self._unindex(previous)
+            self._expire()
+
+    def get(self, session_id: str) -> Optional[ActiveSession]:
+        with self._lock:
+            self._expire()
+            return self._sessions.get(session_id)
+
+    def is_online(self, subscription_id: int) -> bool:
+        with self._lock:
+            self._expire()
+            return subscription_id in self._by_subscription
+
+    def sessions(self, company_id: int, subscription_id: Optional[int] = None, nas_ip: Optional[str] = None,
+                 limit: Optional[int] = None) -> Tuple[int, List[ActiveSession]]:
+        """(number of matching sessions, up to `limit` of them)"""
+        with self._lock:
+            self._expire()
+            if subscription_id is not None:
+                ids = {i for i in self._by_subscription.get(subscription_id, ())
+                       if self._sessions[i].company_id == company_id}
+            elif nas_ip is not None:
+                ids = self._by_nas.get((company_id, nas_ip), set())
+            else:
+                ids = self._by_company.get(company_id, set())
+            return len(ids), [self._sessions[session_id] for session_id in islice(ids, limit)]
+
+    def counts(self, company_id: int) -> Dict[str, int]:
+        """NAS IP -> sessions online through it"""
+        with self._lock:
+            self._expire()
+            return {nas_ip: len(ids) for (company, nas_ip), ids in self._by_nas.items() if company == company_id}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._sessions.clear()
+            self._by_subscription.clear()
+            self._by_company.clear()
+            self._by_nas.clear()
+
+
+# =============================================================================
+# REDIS TABLE
+# =============================================================================
+
+class RedisSessionTable:
+    """
+    The same table in Redis, so that every web worker sees what the accounting flush and the
+    router poller recorded. Sessions are JSON in one hash, last updates in a sorted set,
+    and each index is a set of session ids; a set per company names the NAS it has indexes
+    for, so counts never scan the keyspace. Reads that count index sets expire stale sessions
+    first, so a count never includes a session that has stopped reporting.
+    """
+
+    def __init__(self, location: str, stale_after: float, prefix: str):
+        import redis
+
+        self.client = redis.Redis.from_url(location)
+        self.stale_after = stale_after
+        self.prefix = prefix
+
+    def _key(self, *parts) -> str:
+        return ':'.join([self.prefix, *map(str, parts)])
+
+    def _index_keys(self, session: ActiveSession) -> List[str]:
+        return [
+            self._key('subscription', session.subscription_id),
+            self._key('company', session.company_id),
+            self._key('nas', session.company_id, session.nas_ip),
+        ]
+
+    def _load(self, session_ids: List) -> List[ActiveSession]:
+        if not session_ids:
+            return []
+        cutoff = time.time() - self.stale_after
+        rows = self.client.hmget(self._key('data'), session_ids)
+        found = [ActiveSession.from_json(raw) for raw in rows if raw]
+        return [session for session in found if session.seen_at >= cutoff]
+
+    def _nas_key(self, company_id: int) -> str:
+        return self._key('nases', company_id)
+
+    def _drop(self, pipe, sessions: Iterable[ActiveSession]) -> None:
+        for session in sessions:
+            pipe.hdel(self._key('data'), session.session_id)
+            pipe.zrem(self._key('seen'), session.session_id)
+            for key in self._index_keys(session):
+                pipe.srem(key, session.session_id)
+
+    def _expire(self, pipe) -> bool:
+        expired = self.client.zrangebyscore(self._key('seen'), '-inf', time.time() - self.stale_after)
+        if expired:
+            rows = self.client.hmget(self._key('data'), expired)
+            self._drop(pipe, [ActiveSession.from_json(raw) for raw in rows if raw])
+            pipe.zrem(self._key('seen'), *expired)
+        return bool(expired)
+
+    def _expire_now(self) -> None:
+        """Drop stale sessions before an index is counted; one round trip when none are stale"""
+        pipe = self.client.pipeline(transaction=False)
+        if self._expire(pipe):
+            pipe.execute()
+
+    def apply(self, updates: Iterable[ActiveSession], stops: Iterable[str] = ()) -> None:
+        updates, stops = list(updates), list(stops)
+        touched = [session.session_id for session in updates] + stops
+        previous = {}
+        if touched:
+            for raw in self.client.hmget(self._key('data'), touched):
+                if raw:
+                    session = ActiveSession.from_json(raw)
+                    previous[session.session_id] = session
+
+        moved = [
+            previous[session.session_id] for session in updates
+            if session.session_id in previous
+            and self._index_keys(previous[session.session_id]) != self._index_keys(session)
+        ]
+        pipe = self.client.pipeline(transaction=False)
+        # Stale index entries go first, for stopped sessions and any whose NAS or subscription changed
+        self._drop(pipe, moved + [previous[session_id] for session_id in stops if session_id in previous])
+        if updates:
+            pipe.hset(self._key('data'), mapping={s.session_id: json.dumps(s.as_dict()) for s in updates})
+            pipe.zadd(self._key('seen'), {s.session_id: s.seen_at for s in updates})
+            for session in updates:
+                for key in self._index_keys(session):
+                    pipe.sadd(key, session.session_id)
+                pipe.sadd(self._nas_key(session.company_id), session.nas_ip)
+        self._expire(pipe)
+        pipe.execute()
+
+    def get(self, session_id: str) -> Optional[ActiveSession]:
+        found = self._load([session_id])
+        return found[0] if found else None
+
+    def is_online(self, subscription_id: int) -> bool:
+        return bool(self._load(list(self.client.smembers(self._key('subscription', subscription_id)))))
+
+    def sessions(self, company_id: int, subscription_id: Optional[int] = None, nas_ip: Optional[str] = None,
+                 limit: Optional[int] = None) -> Tuple[int, List[ActiveSession]]:
+        if subscription_id is not None:
+            found = [s for s in self._load(list(self.client.smembers(self._key('subscription', subscription_id))))
+                     if s.company_id == company_id]
+            return len(found), found[:limit]
+        key = self._key('nas', company_id, nas_ip) if nas_ip is not None else self._key('company', company_id)
+        self._expire_now()
+        pipe = self.client.pipeline(transaction=False)
+        pipe.scard(key)
+        pipe.srandmember(key, limit) if limit is not None else pipe.smembers(key)
+        count, ids = pipe.execute()
+        return count, self._load(list(ids))
+
+    def counts(self, company_id: int) -> Dict[str, int]:
+        self._expire_now()
+        nases = sorted(nas_ip.decode() for nas_ip in self.client.smembers(self._nas_key(company_id)))
+        if not nases:
+            return {}
+        pipe = self.client.pipeline(transaction=False)
+        for nas_ip in nases:
+            pipe.scard(self._key('nas', company_id, nas_ip))
+        counts = dict(zip(nases, pipe.execute()))
+        idle = [nas_ip for nas_ip, count in counts.items() if not count]
+        if idle:
+            # A NAS whose last session ended; the next update through it adds it back
+            self.client.srem(self._nas_key(company_id), *idle)
+        return {nas_ip: count for nas_ip, count in counts.items() if count}
+
+    def clear(self) -> None:
+        keys = list(self.client.scan_iter(match=f'{self.prefix}:*', count=1000))
+        if keys:
+            self.client.delete(*keys)
+
+
+# =============================================================================
+# ACCESS
+# =============================================================================
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def _backend(options: Dict) -> Tuple[str, Optional[str]]:
+    cache = settings.CACHES.get('default', {})
+    if options['BACKEND'] is None and not cache.get('BACKEND', '').endswith('RedisCache'):
+        return MEMORY, None
+    if options['BACKEND'] in (None, REDIS):
+        location = options['LOCATION'] or cache.get('LOCATION')
+        return REDIS, location[0] if isinstance(location, (list, tuple)) else location
+    return MEMORY, None
+
+
+def get_table():
+    """The process-wide session table"""
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                options = session_settings()
+                backend, location = _backend(options)
+                if backend == REDIS:
+                    _table = RedisSessionTable(location, options['STALE_AFTER'], options['KEY_PREFIX'])
+                else:
+                    _table = MemorySessionTable(options['STALE_AFTER'])
+    return _table
+
+
+def reset_table() -> None:
+    """Forget the table so the next get_table() builds it from the current settings"""
+    global _table
+    with _table_lock:
+        _table = None
+
+
+def track_sessions(updates: List[ActiveSession], stops: List[str]) -> None:
+    """Apply accounting results to the table; the table is best-effort and never fails a flush"""
+    if not updates and not stops:
+        return
+    try:
+        get_table().apply(updates, stops)
+    except Exception as e:
+        logger.warning("Active session table update failed: %s", e)
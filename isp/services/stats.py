@@ -0,0 +1,137 @@
+"""
+ISP Management System - Dashboard Statistics
+Per-company dashboard counters from a handful of conditional aggregates, cached and signal-invalidated
+File: services/stats.py
+"""
+
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY = 'isp:dashboard-stats:{}'
+ALL_COMPANIES = 'all'
+
+OPEN_TICKET_STATUSES = ['open', 'in_progress']
+
+
+def stats_settings() -> Dict:
+    defaults = {
+        'CACHE_TTL': 60,
+    }
+    return {**defaults, **getattr(settings, 'DASHBOARD_STATS', {})}
+
+
+def _cache_key(company_id: Optional[int]) -> str:
+    return CACHE_KEY.format(company_id if company_id is not None else ALL_COMPANIES)
+
+
+def compute_stats(company_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    All dashboard counters for one company (or every company when `company_id` is None).
+
+    One aggregate query per table: each counter is a Count/Sum with a filter, so
+    adding a counter adds a column to an existing query rather than a new round trip.
+    """
+    from isp.models import Customer, Invoice, Payment, Subscription, Ticket
+
+    now = timezone.now()
+    today = now.date()
+    thirty_days_ago = now - timedelta(days=30)
+    month_start = today.replace(day=1)
+
+    scope = {} if company_id is None else {'company_id': company_id}
+    related_scope = {} if company_id is None else {'customer__company_id': company_id}
+
+    customers = Customer.objects.filter(**scope).aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(status='active')),
+        pending=Count('id', filter=Q(status='lead')),
+        suspended=Count('id', filter=Q(status='suspended')),
+        new_this_month=Count('id', filter=Q(created_at__gte=thirty_days_ago)),
+    )
+    subscriptions = Subscription.objects.filter(**related_scope).aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(status='active')),
+        suspended=Count('id', filter=Q(status='suspended')),
+        monthly_recurring=Sum('monthly_fee', filter=Q(status='active')),
+        revenue_this_month=Sum('monthly_fee', filter=Q(status='active', created_at__gte=thirty_days_ago)),
+    )
+    tickets = Ticket.objects.filter(**related_scope).aggregate(
+        total=Count('id'),
+        open=Count('id', filter=Q(status__in=OPEN_TICKET_STATUSES)),
+        overdue=Count('id', filter=Q(status__in=OPEN_TICKET_STATUSES, sla_resolution_due__lt=now)),
+        resolved_this_month=Count('id', filter=Q(status='resolved', resolution_date__gte=thirty_days_ago)),
+    )
+    billing = Invoice.objects.filter(**related_scope).aggregate(
+        total_revenue=Sum('total_amount', filter=Q(status='paid')),
+        monthly_revenue=Sum('total_amount', filter=Q(status='paid', issue_date__gte=month_start)),
+        # Dunning moves unpaid invoices from 'sent' to 'overdue'; both are still pending
+        pending_invoices=Count('id', filter=Q(status__in=Invoice.UNPAID_STATUSES)),
+        overdue_invoices=Count('id', filter=Q(status__in=Invoice.UNPAID_STATUSES, due_date__lt=today)),
+    )
+    billing['pending_payments'] = Payment.objects.filter(**related_scope, status='pending').count()
+
+    # Sums over empty sets come back as None
+    for group in (subscriptions, billing):
+        for name, value in group.items():
+            if value is None:
+                group[name] = Decimal('0')
+
+    return {
+        'customers': customers,
+        'subscriptions': subscriptions,
+        'tickets': tickets,
+        'billing': billing,
+        'generated_at': now.isoformat(),
+    }
+
+
+def get_stats(company_id: Optional[int] = None, refresh: bool = False) -> Dict[str, Any]:
+    """Cached `compute_stats`; a cache outage degrades to computing on every call"""
+    key = _cache_key(company_id)
+    if not refresh:
+        try:
+            cached = cache.get(key)
+        except Exception as e:
+            logger.warning("Dashboard stats cache read failed: %s", e)
+            cached = None
+        if cached is not None:
+            return cached
+
+    stats = compute_stats(company_id)
+    try:
+        cache.set(key, stats, stats_settings()['CACHE_TTL'])
+    except Exception as e:
+        logger.warning("Dashboard stats cache write failed: %s", e)
+    return stats
+
+
+def invalidate_stats(company_id: Optional[int]) -> None:
+    """Drop the cached stats of a company and the cross-company totals"""
+    keys = [_cache_key(None)]
+    if company_id is not None:
+        keys.append(_cache_key(company_id))
+    try:
+        cache.delete_many(keys)
+    except Exception as e:
+        logger.warning("Dashboard stats cache invalidation failed: %s", e)
+
+
+def company_of(instance) -> Optional[int]:
+    """Company id of a Customer or of any model with a `customer` foreign key"""
+    from isp.models import Customer
+
+    if isinstance(instance, Customer):
+        return instance.company_id
+    customer = instance._state.fields_cache.get('customer')
+    if customer is not None:
+        return customer.company_id
+    return Customer.objects.filter(pk=instance.customer_id).values_list('company_id', flat=True).first()
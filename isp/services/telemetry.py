@@ -0,0 +1,427 @@
+"""
+ISP Management System - Router Telemetry
+Polls the router fleet over the RouterOS API and records sessions, bandwidth and router health
+File: services/telemetry.py
+"""
+
+import asyncio
+import logging
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from isp.functions import close_stale_connections
+from isp.services.accounting import STATUS_INTERIM, STATUS_STOP, AccountingRecord, flush_records
+from isp.services.routeros import RouterOSError, RouterOSPool, RouterOSTrap
+
+logger = logging.getLogger(__name__)
+
+# Sent to every router as one pipelined batch; .proplist keeps replies to what is used
+POLL_COMMANDS = [
+    ('/system/resource/print', {'.proplist': 'uptime,cpu-load,free-memory,total-memory,version,board-name'}),
+    ('/interface/print', {'.proplist': 'name,type,rx-byte,tx-byte,running'}),
+    ('/ppp/active/print', {'.proplist': '.id,name,address,caller-id,uptime'}),
+    ('/ip/hotspot/active/print', {'.proplist': '.id,user,address,mac-address,uptime,bytes-in,bytes-out'}),
+]
+RESOURCE_COMMAND, INTERFACE_COMMAND, PPP_COMMAND, HOTSPOT_COMMAND = (command for command, _ in POLL_COMMANDS)
+
+PPP = 'ppp'
+HOTSPOT = 'hotspot'
+
+_DURATION = re.compile(r'(\d+)([wdhms])')
+_DURATION_SECONDS = {'w': 604800, 'd': 86400, 'h': 3600, 'm': 60, 's': 1}
+
+
+def telemetry_settings() -> Dict:
+    defaults = {
+        'INTERVAL': 30,
+        # Routers polled at once
+        'CONCURRENCY': 200,
+        # Seconds the last health summary of a router is kept for the integration view
+        'SUMMARY_TTL': 300,
+    }
+    return {**defaults, **getattr(settings, 'ROUTER_POLLING', {})}
+
+
+def parse_duration(value: str) -> int:
+    """Seconds in a RouterOS duration: '1w2d3h4m5s' or the older '1d02:03:04'"""
+    value = value or ''
+    if ':' in value:
+        days, _, clock = value.rpartition('d')
+        hours, minutes, seconds = (int(part) for part in clock.split(':'))
+        return (int(days) if days else 0) * 86400 + hours * 3600 + minutes * 60 + seconds
+    return sum(int(number) * _DURATION_SECONDS[unit] for number, unit in _DURATION.findall(value))
+
+
+def _int(value) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def summary_key(router_id: int) -> str:
+    return f'isp:router:telemetry:{router_id}'
+
+
+# =============================================================================
+# SNAPSHOTS
+# =============================================================================
+
+@dataclass(frozen=True)
+class RouterTarget:
+    """What polling needs of a NetworkEquipment row, loaded before the event loop uses it"""
+    pk: int
+    identity: str
+    host: str
+    port: int
+    username: str
+    password: str
+
+
+@dataclass
+class SessionSample:
+    kind: str
+    entry_id: str
+    username: str
+    uploaded: int
+    downloaded: int
+    session_time: int
+    address: str = ''
+    mac_address: str = ''
+
+
+@dataclass
+class RouterSnapshot:
+    router: RouterTarget
+    polled_at: datetime
+    duration: float = 0.0
+    resource: Dict = field(default_factory=dict)
+    interfaces: List[Dict] = field(default_factory=list)
+    sessions: List[SessionSample] = field(default_factory=list)
+    error: str = ''
+    # command -> trap message, for poll commands the router rejected
+    traps: Dict[str, str] = field(default_factory=dict)
+    # Session kinds the snapshot could not see: their sessions are neither counted nor closed
+    unavailable: FrozenSet[str] = frozenset()
+
+    def summary(self) -> Dict:
+        data = {'polled_at': self.polled_at.isoformat(), 'duration_ms': round(self.duration * 1000, 1)}
+        if self.error:
+            return {**data, 'ok': False, 'error': self.error}
+        resource = RESOURCE_COMMAND not in self.traps
+        summary = {
+            **data,
+            # Parts of the poll that trapped are unknown (None), never reported as empty
+            'ok': not self.traps,
+            'uptime': parse_duration(self.resource.get('uptime')) if resource else None,
+            'cpu_load': _int(self.resource.get('cpu-load')) if resource else None,
+            'free_memory': _int(self.resource.get('free-memory')) if resource else None,
+            'total_memory': _int(self.resource.get('total-memory')) if resource else None,
+            'version': self.resource.get('version', '') if resource else None,
+            'board': self.resource.get('board-name', '') if resource else None,
+            'interfaces': len(self.interfaces) if INTERFACE_COMMAND not in self.traps else None,
+            'ppp_sessions': self._count(PPP),
+            'hotspot_sessions': self._count(HOTSPOT),
+        }
+        if self.traps:
+            summary['error'] = '; '.join(f"{command}: {message}" for command, message in self.traps.items())
+        return summary
+
+    def _count(self, kind: str) -> Optional[int]:
+        if kind in self.unavailable:
+            return None
+        return sum(1 for session in self.sessions if session.kind == kind)
+
+
+def build_snapshot(router: RouterTarget, polled_at: datetime, replies: List) -> RouterSnapshot:
+    """
+    A snapshot from the pipelined POLL_COMMANDS replies. A trapped command is recorded in
+    `traps`, and the session kinds it hides (PPP needs the interface counters too) in
+    `unavailable`, so that they are not mistaken for a router with no sessions.
+    """
+    traps = {command: str(reply) for (command, _), reply in zip(POLL_COMMANDS, replies)
+             if isinstance(reply, RouterOSTrap)}
+    resource, interfaces, ppp, hotspot = [reply if isinstance(reply, list) else [] for reply in replies]
+    unavailable = set()
+    if INTERFACE_COMMAND in traps or PPP_COMMAND in traps:
+        unavailable.add(PPP)
+    if HOTSPOT_COMMAND in traps:
+        unavailable.add(HOTSPOT)
+    snapshot = RouterSnapshot(router, polled_at, resource=resource[0] if resource else {}, interfaces=interfaces,
+                              traps=traps, unavailable=frozenset(unavailable))
+    if PPP in unavailable:
+        ppp = []
+
+    # PPPoE byte counters live on the dynamic <pppoe-user> interfaces
+    counters = {row.get('name'): row for row in interfaces if row.get('type') == 'pppoe-in'}
+    for row in ppp:
+        interface = counters.get(f"<pppoe-{row.get('name')}>", {})
+        snapshot.sessions.append(SessionSample(
+            PPP, row.get('.id', ''), row.get('name', ''),
+            uploaded=_int(interface.get('rx-byte')), downloaded=_int(interface.get('tx-byte')),
+            session_time=parse_duration(row.get('uptime')), address=row.get('address', ''),
+            mac_address=row.get('caller-id', ''),
+        ))
+    for row in hotspot:
+        snapshot.sessions.append(SessionSample(
+            HOTSPOT, row.get('.id', ''), row.get('user', ''),
+            uploaded=_int(row.get('bytes-in')), downloaded=_int(row.get('bytes-out')),
+            session_time=parse_duration(row.get('uptime')), address=row.get('address', ''),
+            mac_address=row.get('mac-address', ''),
+        ))
+    return snapshot
+
+
+# =============================================================================
+# SESSION TRACKING
+# =============================================================================
+
+@dataclass
+class TrackedSession:
+    session_id: str
+    username: str
+    session_time: int
+    uploaded: int
+    downloaded: int
+    polled_at: datetime
+    address: str
+    mac_address: str
+
+
+@dataclass
+class BandwidthSample:
+    username: str
+    timestamp: datetime
+    download_kbps: int
+    upload_kbps: int
+
+
+class SessionTracker:
+    """
+    Turns successive snapshots into accounting records and bandwidth samples. A session keeps
+    its id while its router entry keeps the same user and a growing uptime; entries that
+    disappear are closed with a Stop record. Sessions of a kind the snapshot could not see
+    (its poll command trapped) are carried over untouched.
+    """
+
+    def __init__(self):
+        # router pk -> (kind, entry id) -> session
+        self._sessions: Dict[int, Dict[Tuple[str, str], TrackedSession]] = {}
+
+    def update(self, snapshot: RouterSnapshot) -> Tuple[List[AccountingRecord], List[BandwidthSample]]:
+        if snapshot.error:
+            return [], []
+        router, now = snapshot.router, snapshot.polled_at
+        previous = self._sessions.get(router.pk, {})
+        current: Dict[Tuple[str, str], TrackedSession] = {}
+        records, samples = [], []
+
+        for sample in snapshot.sessions:
+            key = (sample.kind, sample.entry_id)
+            known = previous.pop(key, None)
+            if known and known.username == sample.username and sample.session_time >= known.session_time:
+                session_id = known.session_id
+                elapsed = (now - known.polled_at).total_seconds()
+                if elapsed > 0:
+                    samples.append(BandwidthSample(
+                        sample.username, now,
+                        download_kbps=int(max(sample.downloaded - known.downloaded, 0) * 8 / 1000 / elapsed),
+                        upload_kbps=int(max(sample.uploaded - known.uploaded, 0) * 8 / 1000 / elapsed),
+                    ))
+            else:
+                if known:
+                    # The router reused the entry for a new session
+                    records.append(self._record(STATUS_STOP, router, known, now, 'Lost-Service'))
+                # Minute resolution keeps the id stable when a restarted poller meets the session again
+                started = int(now.timestamp() - sample.session_time) // 60
+                session_id = f"{router.identity}:{sample.kind}{sample.entry_id}:{started}"
+
+            current[key] = TrackedSession(session_id, sample.username, sample.session_time, sample.uploaded,
+                                          sample.downloaded, now, sample.address, sample.mac_address)
+            records.append(self._record(STATUS_INTERIM, router, current[key]))
+
+        for key, session in previous.items():
+            if key[0] in snapshot.unavailable:
+                current[key] = session
+            else:
+                records.append(self._record(STATUS_STOP, router, session, now, 'Lost-Service'))
+        self._sessions[router.pk] = current
+        return records, samples
+
+    @staticmethod
+    def _record(status: str, router: RouterTarget, session: TrackedSession, event_time: Optional[datetime] = None,
+                terminate_cause: str = '') -> AccountingRecord:
+        return AccountingRecord(
+            status=status,
+            session_id=session.session_id[:100],
+            username=session.username,
+            event_time=event_time or session.polled_at,
+            session_time=session.session_time,
+            input_octets=session.uploaded,
+            output_octets=session.downloaded,
+            framed_ip=session.address,
+            calling_station_id=session.mac_address[:17],
+            nas_ip=router.host,
+            nas_port=router.identity[:20],
+            terminate_cause=terminate_cause,
+        )
+
+
+# =============================================================================
+# STORAGE
+# =============================================================================
+
+def load_targets() -> List[RouterTarget]:
+    """Active routers with an API address"""
+    from isp.models import NetworkEquipment
+
+    close_stale_connections()
+    rows = (NetworkEquipment.objects
+            .filter(equipment_type='router', status='active', ip_address__isnull=False)
+            .values_list('pk', 'identity', 'ip_address', 'api_port', 'username', 'password'))
+    default_user = settings.MTK_CONFIG.get('USERNAME')
+    return [
+        RouterTarget(pk, identity, host, port, username or default_user, password or '')
+        for pk, identity, host, port, username, password in rows
+    ]
+
+
+def write_telemetry(snapshots: List[RouterSnapshot], records: List[AccountingRecord],
+                    samples: List[BandwidthSample]) -> Dict:
+    """UsageLog through the accounting flush, BandwidthLog in one bulk insert, summaries in the cache"""
+    from isp.models import BandwidthLog, Subscription
+
+    close_stale_connections()
+    flushed = flush_records(records)
+    subscriptions = dict(
+        Subscription.objects.filter(username__in={sample.username for sample in samples})
+        .values_list('username', 'id')
+    ) if samples else {}
+    logs = BandwidthLog.objects.bulk_create([
+        BandwidthLog(
+            subscription_id=subscriptions[sample.username],
+            timestamp=sample.timestamp,
+            download_speed=sample.download_kbps,
+            upload_speed=sample.upload_kbps,
+        )
+        for sample in samples if sample.username in subscriptions
+    ], batch_size=2000)
+
+    try:
+        cache.set_many({summary_key(s.router.pk): s.summary() for s in snapshots},
+                       telemetry_settings()['SUMMARY_TTL'])
+    except Exception as e:
+        logger.warning("Router telemetry cache write failed: %s", e)
+    return {'usage_created': flushed.created, 'usage_updated': flushed.updated, 'bandwidth': len(logs)}
+
+
+def router_summaries(router_ids: List[int]) -> Dict[int, Dict]:
+    """router pk -> last health summary, for the routers polled recently"""
+    try:
+        found = cache.get_many([summary_key(pk) for pk in router_ids])
+    except Exception as e:
+        logger.warning("Router telemetry cache read failed: %s", e)
+        return {}
+    return {pk: found[summary_key(pk)] for pk in router_ids if summary_key(pk) in found}
+
+
+# =============================================================================
+# POLLER
+# =============================================================================
+
+@dataclass
+class PollResult:
+    routers: int = 0
+    failed: int = 0
+    sessions: int = 0
+    poll_seconds: float = 0.0
+    write_seconds: float = 0.0
+    written: Dict = field(default_factory=dict)
+
+
+class FleetPoller:
+    """
+    Polls every router CONCURRENCY at a time over pooled API connections, then writes the
+    cycle's results in bulk off the event loop. Keep one instance for the process: the pool
+    and the session tracker carry over from one cycle to the next.
+    """
+
+    def __init__(self, pool: Optional[RouterOSPool] = None, concurrency: Optional[int] = None):
+        self.pool = pool or RouterOSPool()
+        self.concurrency = concurrency or telemetry_settings()['CONCURRENCY']
+        self.tracker = SessionTracker()
+
+    async def poll_router(self, router: RouterTarget) -> RouterSnapshot:
+        polled_at, started = timezone.now(), time.perf_counter()
+        try:
+            replies = await self.pool.pipeline(router.host, router.username, router.password, POLL_COMMANDS,
+                                               port=router.port)
+        except RouterOSError as e:
+            return RouterSnapshot(router, polled_at, time.perf_counter() - started, error=str(e))
+        snapshot = build_snapshot(router, polled_at, replies)
+        snapshot.duration = time.perf_counter() - started
+        return snapshot
+
+    async def poll_fleet(self, routers: List[RouterTarget]) -> List[RouterSnapshot]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(router):
+            async with semaphore:
+                return await self.poll_router(router)
+
+        return await asyncio.gather(*(bounded(router) for router in routers))
+
+    def record(self, snapshots: List[RouterSnapshot], result: Optional[PollResult] = None) -> PollResult:
+        """Write a cycle's snapshots (synchronous: it uses the ORM)"""
+        result = result or PollResult(routers=len(snapshots))
+        records, samples = [], []
+        for snapshot in snapshots:
+            if snapshot.error or snapshot.traps:
+                result.failed += 1
+                logger.info("Polling router %s failed: %s", snapshot.router.identity,
+                            snapshot.error or snapshot.summary()['error'])
+            result.sessions += len(snapshot.sessions)
+            more_records, more_samples = self.tracker.update(snapshot)
+            records += more_records
+            samples += more_samples
+
+        started = time.perf_counter()
+        result.written = write_telemetry(snapshots, records, samples)
+        result.write_seconds = time.perf_counter() - started
+        return result
+
+    async def run_once(self, routers: Optional[List[RouterTarget]] = None) -> PollResult:
+        if routers is None:
+            routers = await asyncio.to_thread(load_targets)
+        started = time.perf_counter()
+        snapshots = await self.poll_fleet(routers)
+        result = PollResult(routers=len(routers), poll_seconds=time.perf_counter() - started)
+        # The ORM work runs off the event loop, which keeps the connections to the routers
+        return await asyncio.to_thread(self.record, snapshots, result)
+
+    async def run_forever(self, interval: Optional[float] = None, cycles: Optional[int] = None) -> None:
+        interval = interval or telemetry_settings()['INTERVAL']
+        cycle = 0
+        try:
+            while cycles is None or cycle < cycles:
+                started = time.monotonic()
+                try:
+                    result = await self.run_once()
+                    logger.info("Polled %s routers (%s failed, %s sessions) in %.2fs + %.2fs write",
+                                result.routers, result.failed, result.sessions,
+                                result.poll_seconds, result.write_seconds)
+                except Exception:
+                    logger.exception("Router polling cycle failed")
+                cycle += 1
+                if cycles is not None and cycle >= cycles:
+                    break
+                await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+        finally:
+            self.pool.close()
@@ -0,0 +1,112 @@
+"""
+ISP Management System - Batched Row Updates
+Per-row values written to many rows with one UPDATE joined to a VALUES list per batch
+File: services/updates.py
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+from django.db import connections, router
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class _Columns:
+    """Renders {t.name}/{v.name} in assignment templates; in `placeholders` mode {v.name} becomes %s"""
+
+    def __init__(self, prefix: str, quote, placeholders: Optional[List[str]] = None):
+        self.prefix = prefix
+        self.quote = quote
+        self.placeholders = placeholders
+
+    def __getattr__(self, name: str) -> str:
+        if self.placeholders is not None:
+            self.placeholders.append(name)
+            return '%s'
+        return f'{self.prefix}.{self.quote(name)}'
+
+
+def _supports_values_join(connection) -> bool:
+    if connection.vendor == 'postgresql':
+        return True
+    # UPDATE ... FROM arrived in SQLite 3.33
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 33)
+
+
+def update_from_values(model, columns: Dict[str, object], rows: Sequence[Sequence], assignments: Dict[str, str],
+                       batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    Update many rows of `model`, each with its own values, and return how many were updated.
+
+    `columns` maps the name of each value in a row to the model field whose type it has; the
+    first value is the primary key. `assignments` maps columns of the table to SQL templates
+    where {t.<column>} is the row's current value and {v.<name>} the value passed for it, e.g.
+    {'balance': '{t.balance} + {v.delta}'}, so relative updates stay atomic.
+
+    On PostgreSQL and SQLite each batch is one `UPDATE ... FROM (VALUES ...) AS v`;
+    other backends run the same assignments as one UPDATE per row.
+    """
+    if not rows:
+        return 0
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    names, fields = list(columns), list(columns.values())
+    key = quote(model._meta.pk.column)
+    prepared = [
+        [field.get_db_prep_save(value, connection) for field, value in zip(fields, row)]
+        for row in rows
+    ]
+
+    updated = 0
+    with connection.cursor() as cursor:
+        if not _supports_values_join(connection):
+            order: List[str] = []
+            template = _Columns(table, quote)
+            values = _Columns('', quote, placeholders=order)
+            sets = ', '.join(f'{quote(column)} = {expression.format(t=template, v=values)}'
+                             for column, expression in assignments.items())
+            positions = [names.index(name) for name in order]
+            for row in prepared:
+                cursor.execute(f'UPDATE {table} SET {sets} WHERE {key} = %s', [row[i] for i in positions] + [row[0]])
+                updated += cursor.rowcount
+            return updated
+
+        template, values = _Columns(table, quote), _Columns('v', quote)
+        sets = ', '.join(f'{quote(column)} = {expression.format(t=template, v=values)}'
+                         for column, expression in assignments.items())
+        if connection.vendor == 'postgresql':
+            # VALUES columns take their type from the rows, and an all-NULL column would be text
+            placeholder = '(' + ', '.join(f'CAST(%s AS {field.cast_db_type(connection)})' for field in fields) + ')'
+            source = '(VALUES {}) AS v (' + ', '.join(quote(name) for name in names) + ')'
+        else:
+            # SQLite names VALUES columns column1, column2...
+            placeholder = '(' + ', '.join(['%s'] * len(fields)) + ')'
+            source = '(SELECT ' + ', '.join(
+                f'column{position} AS {quote(name)}' for position, name in enumerate(names, 1)
+            ) + ' FROM (VALUES {})) AS v'
+        size = max(1, min(batch_size, connection.ops.bulk_batch_size(fields, prepared)))
+        for start in range(0, len(prepared), size):
+            batch = prepared[start:start + size]
+            cursor.execute(
+                f"UPDATE {table} SET {sets} FROM {source.format(', '.join([placeholder] * len(batch)))} "
+                f"WHERE {table}.{key} = v.{quote(names[0])}",
+                [value for row in batch for value in row],
+            )
+            updated += cursor.rowcount
+    return updated
+
+
+def update_rows(objects: List, field_names: List[str], batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Save `field_names` of many model instances, as bulk_update would, with one statement per batch"""
+    if not objects:
+        return 0
+    model = type(objects[0])
+    pk = model._meta.pk
+    columns = {pk.column: pk, **{name: model._meta.get_field(name) for name in field_names}}
+    return update_from_values(
+        model, columns,
+        [[obj.pk] + [getattr(obj, model._meta.get_field(name).attname) for name in field_names] for obj in objects],
+        {model._meta.get_field(name).column: f'{{v.{name}}}' for name in field_names},
+        batch_size,
+    )
@@ -0,0 +1,147 @@
+"""
+ISP Management System - Usage Accounting
+Incremental Subscription.data_used / time_used counters and their reconciliation
+File: services/usage.py
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+
+from isp.services.updates import update_from_values
+
+# subscription id -> (bytes, minutes)
+UsageDeltas = Dict[int, Tuple[int, int]]
+
+
+def session_minutes(session_time: int) -> int:
+    """Whole minutes charged for a session; always derived from the cumulative session time"""
+    return (session_time or 0) // 60
+
+
+def usage_delta(previous, current) -> Tuple[int, int]:
+    """
+    Octet/minute delta between two snapshots of the same UsageLog row.
+    `previous` is None for a row that did not exist before.
+    """
+    if previous is None:
+        return current.bytes_uploaded + current.bytes_downloaded, session_minutes(current.session_time)
+    return (
+        (current.bytes_uploaded + current.bytes_downloaded)
+        - (previous.bytes_uploaded + previous.bytes_downloaded),
+        session_minutes(current.session_time) - session_minutes(previous.session_time),
+    )
+
+
+def add_delta(deltas: UsageDeltas, subscription_id: int, delta: Tuple[int, int]) -> None:
+    data, minutes = deltas.get(subscription_id, (0, 0))
+    deltas[subscription_id] = (data + delta[0], minutes + delta[1])
+
+
+def apply_usage_deltas(deltas: UsageDeltas) -> int:
+    """
+    Add accumulated deltas to Subscription counters and return how many rows were updated.
+
+    A relative UPDATE (counter = counter + delta) joined to the deltas, one statement per
+    batch, so concurrent writers never lose increments and there is no read-modify-write
+    round trip per subscription. A CASE over the batch's ids grew too slow with tens of
+    thousands of rows.
+    """
+    from isp.models import Subscription
+
+    pending = [(pk, data, minutes) for pk, (data, minutes) in deltas.items() if data or minutes]
+    meta = Subscription._meta
+    return update_from_values(
+        Subscription,
+        {'id': meta.pk, 'data': meta.get_field('data_used'), 'minutes': meta.get_field('time_used')},
+        pending,
+        {'data_used': '{t.data_used} + {v.data}', 'time_used': '{t.time_used} + {v.minutes}'},
+    )
+
+
+# =============================================================================
+# RECONCILIATION
+# =============================================================================
+
+@dataclass
+class UsageDrift:
+    subscription_id: int
+    data_used: int
+    expected_data: int
+    time_used: int
+    expected_time: int
+
+    @property
+    def data_drift(self) -> int:
+        return self.data_used - self.expected_data
+
+    @property
+    def time_drift(self) -> int:
+        return self.time_used - self.expected_time
+
+
+def _subscription_chunks(queryset, chunk_size: int) -> Iterator[List[Tuple[int, int, int]]]:
+    """Keyset-paginate (id, data_used, time_used) so memory stays flat on large tables"""
+    last_id = 0
+    while True:
+        chunk = list(
+            queryset.filter(pk__gt=last_id).order_by('pk')
+            .values_list('pk', 'data_used', 'time_used')[:chunk_size]
+        )
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1][0]
+
+
+def reconcile_usage(chunk_size: int = 1000, fix: bool = False, queryset=None) -> Iterable[UsageDrift]:
+    """
+    Recompute counters from UsageLog one chunk of subscriptions at a time and yield every
+    subscription whose stored counters disagree. With `fix` the stored values are overwritten.
+    """
+    from isp.models import Subscription, UsageLog
+
+    queryset = queryset if queryset is not None else Subscription.objects.all()
+    for chunk in _subscription_chunks(queryset, chunk_size):
+        expected = {
+            row['subscription_id']: row
+            for row in UsageLog.objects.filter(subscription_id__in=[pk for pk, _, _ in chunk])
+            .order_by()
+            .values('subscription_id')
+            .annotate(
+                data=Coalesce(Sum('bytes_uploaded'), 0) + Coalesce(Sum('bytes_downloaded'), 0),
+                minutes=Coalesce(Sum(F('session_time') / 60), 0),
+            )
+        }
+
+        drifted = []
+        for pk, data_used, time_used in chunk:
+            row = expected.get(pk, {'data': 0, 'minutes': 0})
+            if data_used != row['data'] or time_used != row['minutes']:
+                drifted.append(UsageDrift(pk, data_used, row['data'], time_used, row['minutes']))
+
+        if fix and drifted:
+            Subscription.objects.bulk_update(
+                [Subscription(pk=d.subscription_id, data_used=d.expected_data, time_used=d.expected_time)
+                 for d in drifted],
+                ['data_used', 'time_used'],
+            )
+        yield from drifted
+
+
+def refresh_data_limits(package_id=None) -> int:
+    """Re-copy InternetPackage.data_limit into every subscription's data_limit_bytes snapshot"""
+    from isp.models import BYTES_PER_GB, InternetPackage, Subscription
+
+    packages = InternetPackage.objects.all()
+    if package_id is not None:
+        packages = packages.filter(pk=package_id)
+
+    updated = 0
+    for pk, data_limit in packages.values_list('pk', 'data_limit'):
+        updated += Subscription.objects.filter(package_id=pk).update(
+            data_limit_bytes=data_limit * BYTES_PER_GB if data_limit else None
+        )
+    return updated
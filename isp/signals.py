@@ -0,0 +1,137 @@
+"""
+ISP Management System - Model Signals
+Keeps denormalized counters and caches in step with the models they mirror
+File: signals.py
+"""
+
+from django.contrib.auth.models import Group
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from isp.models import (
+    Customer, InternetPackage, Invoice, NetworkEquipment, Payment, Subscription, Ticket, User, UserProfile
+)
+
+
+@receiver(post_save, sender=InternetPackage)
+def sync_subscription_data_limits(sender, instance, created, **kwargs):
+    """Push the package data limit into the Subscription.data_limit_bytes snapshot"""
+    if created:
+        return
+    from isp.services.usage import refresh_data_limits
+    refresh_data_limits(instance.pk)
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+@receiver(post_save, sender=Ticket)
+@receiver(post_delete, sender=Ticket)
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def invalidate_dashboard_stats(sender, instance, **kwargs):
+    """Drop the cached dashboard counters of the company the row belongs to"""
+    from isp.services.stats import company_of, invalidate_stats
+    invalidate_stats(company_of(instance))
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_save, sender=Payment)
+def post_to_ledger(sender, instance, created, raw=False, **kwargs):
+    """Post what an invoice or payment saved one at a time moved on Customer.current_balance"""
+    if raw:
+        return
+    from isp.services.ledger import sync_entries
+    sync_entries(instance, created)
+
+
+@receiver(pre_delete, sender=Invoice)
+@receiver(pre_delete, sender=Payment)
+def reverse_ledger_postings(sender, instance, origin=None, **kwargs):
+    """
+    Reverse a deleted invoice's or payment's postings, when the delete started from an invoice
+    or payment. Deleting a customer takes its entries with it, and new ones would point at
+    the deleted row.
+    """
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if model not in (Invoice, Payment):
+        return
+    from isp.services.ledger import reverse_entries
+    reverse_entries(instance)
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+@receiver(post_save, sender=Ticket)
+@receiver(post_delete, sender=Ticket)
+def invalidate_sidebar_badges(sender, instance, **kwargs):
+    from isp.dashboard.props import invalidate_badges
+    from isp.services.stats import company_of
+    invalidate_badges(company_of(instance))
+
+
+@receiver(pre_save, sender=NetworkEquipment)
+def remember_router_keys(sender, instance, **kwargs):
+    """Keep the stored auth_code and identity so what was cached under them can be retired if they change"""
+    instance._previous_auth_code = instance._previous_identity = None
+    if instance.pk:
+        instance._previous_auth_code, instance._previous_identity = sender.objects.filter(
+            pk=instance.pk).values_list('auth_code', 'identity').first() or (None, None)
+
+
+@receiver(post_save, sender=NetworkEquipment)
+@receiver(post_delete, sender=NetworkEquipment)
+def invalidate_hotspot_pages(sender, instance, **kwargs):
+    from isp.services.hotspot import invalidate_router_pages
+    invalidate_router_pages(instance.auth_code, getattr(instance, '_previous_auth_code', None))
+
+
+@receiver(post_save, sender=NetworkEquipment)
+@receiver(post_delete, sender=NetworkEquipment)
+def invalidate_router_cert(sender, instance, **kwargs):
+    """A deleted router's identity may be provisioned again with a new bundle"""
+    from isp.services.certs import forget_cert
+
+    previous = getattr(instance, '_previous_identity', None)
+    if kwargs['signal'] is post_delete:
+        forget_cert(instance.identity)
+    elif previous and previous != instance.identity:
+        forget_cert(previous)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=UserProfile)
+def invalidate_user_props_on_save(sender, instance, **kwargs):
+    from isp.dashboard.props import invalidate_user_props
+    invalidate_user_props([instance.pk if sender is User else instance.user_id])
+
+
+def _users_of_groups(group_ids):
+    return User.objects.filter(groups__in=group_ids).values_list('pk', flat=True).distinct()
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_user_props_on_permission_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Drop cached permission sets touched by a permission/group change. Clears are handled
+    on pre_clear, the last point at which the affected rows can still be queried.
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    from isp.dashboard.props import invalidate_user_props
+
+    if sender is Group.permissions.through:
+        group_ids = pk_set if reverse and pk_set is not None else (
+            instance.group_set.values_list('pk', flat=True) if reverse else [instance.pk]
+        )
+        invalidate_user_props(_users_of_groups(group_ids))
+    elif not reverse:
+        invalidate_user_props([instance.pk])
+    else:
+        invalidate_user_props(pk_set if pk_set is not None else instance.user_set.values_list('pk', flat=True))
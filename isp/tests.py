@@ -1,3 +1,1349 @@
-from django.test import TestCase
+import asyncio
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import base64
+import json
+from importlib import import_module
+
+from django.apps import apps
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.db.models import Sum
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from inertia import render as inertia_render
+
+from isp.dashboard.props import get_badge_counts, get_user_permissions, share_props
+from isp.management.routeros_sim import SimulatedFleet, SimulatedRouter
+
+from isp.models import (
+    BYTES_PER_GB, BalanceSnapshot, BandwidthLog, BandwidthRollup, BulkJob, Company, Customer, InternetPackage,
+    Invoice, InvoiceItem, LedgerEntry, NetworkEquipment, Notification, NotificationTemplate, NetworkZone, Payment,
+    PaymentReview, Subscription, SystemLog, Ticket, TicketComment, UsageLog, UsageRollup, User,
+)
+from isp.services.accounting import AccountingBuffer, AccountingPipeline, AccountingRecord, BufferFull, flush_records
+from isp.services.billing import (
+    BillingShard, add_months, advisory_lock_id, invoice_number, plan_shards, run_billing, run_sharded_billing
+)
+from isp.services.bulk import run_job
+from isp.services.certs import cached_cert
+from isp.services.dunning import run_dunning
+from isp.services.hotspot import page_cache
+from isp.services.ledger import (
+    adjustment_entry, backfill_ledger, balance_at, invoice_entry, post_entries, take_snapshots
+)
+from isp.services.lifecycle import apply_subscription_operation
+from isp.services.payments import StatementLine, parse_statement, reconcile_payments, settle_invoices
+from isp.services.pagination import keyset_paginate
+from isp.services.provisioning import provision_routers
+from isp.services.rollups import DAY, HOUR, rollup_bandwidth, rollup_usage, usage_series
+from isp.services.routeros import encode_length, read_length
+from isp.services.routers import (
+    DISABLE, FakeRouterBackend, MtkRouterBackend, RouterCommand, RouterError, push_subscriptions,
+)
+from isp.services.sessions import ActiveSession, MemorySessionTable, get_table, reset_table
+from isp.services.stats import get_stats
+from isp.services.telemetry import FleetPoller, RouterTarget, router_summaries
+from isp.services.updates import update_rows
+from isp.services.usage import apply_usage_deltas, reconcile_usage
+from mtk.services import Mtk, MtkResponseObject, ScriptManager, fernet
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ISPTestCase(TestCase):
+    """Runs against a local-memory cache so tests do not need Redis"""
+
+    def setUp(self):
+        cache.clear()
+        reset_table()
+
+    def assertQueryBudget(self, url, max_queries, **params):
+        """GET `url` and fail when it runs more than `max_queries` queries; returns the response"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content[:500])
+        self.assertLessEqual(len(queries), max_queries,
+                             '\n'.join(query['sql'] for query in queries.captured_queries))
+        return response
+
+
+def make_subscription(company=None, username='user1', **fields):
+    company = company or Company.objects.create(
+        name='Test ISP', slug='test-isp', email='isp@example.com', phone='0700000000', address='Nairobi'
+    )
+    package = InternetPackage.objects.create(
+        company=company, name='Home 10GB', description='', package_type='pppoe',
+        billing_type='data_based', download_speed=10, upload_speed=5, data_limit=10, price=Decimal('1000'),
+    )
+    customer = Customer.objects.create(
+        company=company, full_name='Jane Doe', status='active',
+        primary_phone='0711000000', primary_email='jane@example.com',
+    )
+    return Subscription.objects.create(**{
+        'customer': customer,
+        'package': package,
+        'subscription_id': f'SUB-{username}',
+        'status': 'active',
+        'start_date': timezone.now() - timedelta(days=10),
+        'next_billing_date': timezone.now() + timedelta(days=20),
+        'username': username,
+        'monthly_fee': Decimal('1000'),
+        **fields,
+    })
+
+
+def accounting_record(status, session_id='s1', username='user1', octets=0, session_time=0, nas_ip=''):
+    return AccountingRecord.from_radius({
+        'NAS-IP-Address': nas_ip,
+        'Acct-Status-Type': status,
+        'Acct-Session-Id': session_id,
+        'User-Name': username,
+        'Acct-Input-Octets': octets,
+        'Acct-Output-Octets': octets * 2,
+        'Acct-Session-Time': session_time,
+        'Framed-IP-Address': '10.0.0.2',
+    })
+
+
+class AccountingIngestTests(ISPTestCase):
+    def test_interim_updates_coalesce_per_session(self):
+        buffer = AccountingBuffer(max_sessions=10)
+        buffer.put_many([
+            accounting_record('Start'),
+            accounting_record('Interim-Update', octets=100, session_time=60),
+            accounting_record('Interim-Update', octets=300, session_time=120),
+        ])
+
+        batch = buffer.drain(100)
+        self.assertEqual(len(batch), 1)
+        self.assertEqual(batch[0].status, 'interim')
+        self.assertEqual(batch[0].input_octets, 300)
+
+    def test_full_buffer_applies_backpressure(self):
+        buffer = AccountingBuffer(max_sessions=1)
+        buffer.put_many([accounting_record('Start', session_id='a')])
+        with self.assertRaises(BufferFull):
+            buffer.put_many([accounting_record('Start', session_id='b')])
+        # Updates for an already buffered session still fit
+        buffer.put_many([accounting_record('Interim-Update', session_id='a', octets=5)])
+
+    def test_flush_creates_then_updates_usage_log(self):
+        subscription = make_subscription()
+
+        flush_records([accounting_record('Start')])
+        result = flush_records([
+            accounting_record('Stop', octets=1000, session_time=600),
+            accounting_record('Start', session_id='orphan', username='nobody'),
+        ])
+
+        self.assertEqual((result.updated, result.dropped), (1, 1))
+        log = UsageLog.objects.get(session_id='s1')
+        self.assertEqual(log.subscription, subscription)
+        self.assertEqual((log.bytes_uploaded, log.bytes_downloaded, log.session_time), (1000, 2000, 600))
+        self.assertIsNotNone(log.session_end)
+
+    def test_failed_flush_requeues_records(self):
+        make_subscription()
+        pipeline = AccountingPipeline(max_sessions=10, batch_size=10, flush_interval=1, enqueue_timeout=0)
+        pipeline.buffer.put_many([accounting_record('Start', octets=10)])
+        with mock.patch('isp.services.accounting.flush_records', side_effect=RuntimeError('db down')):
+            self.assertEqual(pipeline.flush_once().requeued, 1)
+        pipeline.buffer.put_many([accounting_record('Interim-Update', octets=50, session_time=60)])
+
+        self.assertEqual(pipeline.flush_once().created, 1)
+        self.assertEqual(UsageLog.objects.get().bytes_uploaded, 50)
+        self.assertEqual(pipeline.metrics.snapshot()['requeued'], 1)
+
+    @override_settings(RADIUS_ACCOUNTING={'SECRET': 's3cret'})
+    def test_posting_records_requires_the_shared_secret(self):
+        company = make_subscription().customer.company
+        self.client.force_login(User.objects.create_user('noc', password='x', company=company))
+        record = {'Acct-Status-Type': 'Start', 'Acct-Session-Id': 's1', 'User-Name': 'user1'}
+        url = '/api/v1/integration/radius/'
+
+        self.assertEqual(self.client.post(url, [record], content_type='application/json').status_code, 403)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with mock.patch.object(AccountingPipeline, 'submit', return_value=1) as submit:
+            response = self.client.post(url, [record], content_type='application/json',
+                                        headers={'X-Radius-Secret': 's3cret'})
+        self.assertEqual(response.status_code, 202, response.content)
+        submit.assert_called_once()
+
+
+class ActiveSessionTests(ISPTestCase):
+    def test_accounting_feeds_the_session_table(self):
+        subscription = make_subscription()
+        company = subscription.customer.company
+        zone = NetworkZone.objects.create(company=company, name='North', coverage_area='North')
+        NetworkEquipment.objects.create(
+            company=company, zone=zone, name='NAS', identity='test-isp_nas', equipment_type='router',
+            brand='MikroTik', model='CCR', serial_number='nas-1', ip_address='10.9.0.1', location='North',
+        )
+        make_subscription(company=company, username='user2')
+        started = [accounting_record('Start', session_id=f's{i}', username=f'user{i}') for i in (1, 2)]
+        for record in started:
+            record.nas_ip = '10.9.0.1'
+        flush_records(started)
+
+        table = get_table()
+        self.assertTrue(table.is_online(subscription.pk))
+        self.assertEqual(table.counts(company.pk), {'10.9.0.1': 2})
+
+        flush_records([accounting_record('Stop', session_id='s2', username='user2', octets=10)])
+        # A late Interim for the stopped session does not bring it back
+        flush_records([accounting_record('Interim-Update', session_id='s2', username='user2', octets=5)])
+        self.assertIsNone(table.get('s2'))
+
+        self.client.force_login(User.objects.create_user('noc', password='x', company=company))
+        data = self.assertQueryBudget('/api/v1/realtime/sessions/', 3).json()
+        self.assertEqual((data['online'], data['by_zone']), (1, {'North': 1}))
+        self.assertEqual([row['session_id'] for row in data['sessions']], ['s1'])
+        data = self.client.get('/api/v1/realtime/sessions/', {'subscription': subscription.pk + 1}).json()
+        self.assertEqual((data['online'], data['matched']), (1, 0))
+
+    def test_stale_sessions_expire_from_every_index(self):
+        table = MemorySessionTable(stale_after=60)
+        now = timezone.now().timestamp()
+        table.apply([
+            ActiveSession('old', 'user1', 1, 1, nas_ip='10.9.0.1', seen_at=now - 120),
+            ActiveSession('new', 'user2', 2, 1, nas_ip='10.9.0.1', seen_at=now),
+        ])
+
+        self.assertEqual(len(table), 1)
+        self.assertFalse(table.is_online(1))
+        self.assertEqual(table.counts(1), {'10.9.0.1': 1})
+        count, found = table.sessions(1, nas_ip='10.9.0.1')
+        self.assertEqual((count, [s.session_id for s in found]), (1, ['new']))
+
+
+class BillingRunTests(ISPTestCase):
+    def setUp(self):
+        super().setUp()
+        self.as_of = timezone.now()
+        self.subscription = make_subscription(next_billing_date=self.as_of - timedelta(days=1))
+        self.subscription.package.setup_fee = Decimal('500')
+        self.subscription.package.save()
+
+    @override_settings(BILLING={'TAX_RATE': '16', 'CHUNK_SIZE': 1})
+    def test_due_subscriptions_are_invoiced_once(self):
+        company = self.subscription.customer.company
+        later = make_subscription(company=company, username='user2', next_billing_date=self.as_of + timedelta(days=3))
+
+        result = run_billing(as_of=self.as_of)
+        self.assertEqual((result.subscriptions, result.invoices, result.items), (1, 1, 2))
+        invoice = Invoice.objects.get(subscription=self.subscription)
+        self.assertEqual((invoice.subtotal, invoice.tax_amount, invoice.total_amount),
+                         (Decimal('1500.00'), Decimal('240.00'), Decimal('1740.00')))
+        self.assertEqual(sorted(InvoiceItem.objects.values_list('total_price', flat=True)),
+                         [Decimal('500.00'), Decimal('1000.00')])
+
+        self.subscription.refresh_from_db()
+        previous = self.as_of - timedelta(days=1)
+        self.assertEqual(self.subscription.last_billing_date, previous)
+        self.assertEqual(self.subscription.next_billing_date, add_months(previous, 1, self.subscription.start_date.day))
+        self.assertFalse(later.invoices.exists())
+        self.assertEqual(run_billing(as_of=self.as_of).invoices, 0)
+
+    def test_a_chunk_moves_its_billing_dates_in_one_statement(self):
+        company = self.subscription.customer.company
+        for i in range(2, 5):
+            make_subscription(company=company, username=f'user{i}', next_billing_date=self.as_of - timedelta(days=1))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(run_billing(as_of=self.as_of).subscriptions, 4)
+        updates = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "isp_subscription"')]
+        self.assertEqual(len(updates), 1, updates)
+        self.assertFalse(Subscription.objects.filter(next_billing_date__lte=self.as_of).exists())
+
+    def test_rerun_after_interruption_does_not_duplicate(self):
+        # An earlier run wrote the invoice but stopped before moving the billing date
+        due = self.subscription.next_billing_date
+        Invoice.objects.create(
+            customer=self.subscription.customer, subscription=self.subscription,
+            invoice_number=invoice_number(self.subscription.pk, due), issue_date=due.date(), due_date=due.date(),
+            subtotal=Decimal('1000'), total_amount=Decimal('1000'),
+        )
+
+        result = run_billing(as_of=self.as_of)
+        self.assertEqual((result.subscriptions, result.invoices, result.existing), (1, 0, 1))
+        self.assertEqual(Invoice.objects.count(), 1)
+        self.subscription.refresh_from_db()
+        self.assertGreater(self.subscription.next_billing_date, self.as_of)
+
+    def test_sharded_run_bills_each_tenant_in_its_currency(self):
+        due = self.as_of - timedelta(days=1)
+        make_subscription(company=self.subscription.customer.company, username='user2', next_billing_date=due)
+        other = Company.objects.create(name='Other ISP', slug='other-isp', email='o@example.com', phone='0700000001',
+                                       address='Kampala', currency='UGX', timezone='Africa/Kampala')
+        make_subscription(company=other, username='user3', next_billing_date=due)
+
+        shards = plan_shards(self.as_of, shard_size=1)
+        self.assertEqual(len(shards), 3)
+        self.assertEqual(sum(shard.first_pk is not None for shard in shards), 2)
+
+        run = run_sharded_billing(as_of=self.as_of, workers=0, shard_size=1)
+        self.assertEqual((run.status, run.shards_done, run.subscriptions, run.invoices), ('completed', 3, 3, 3))
+        self.assertEqual(run.report['amounts'], {'USD': '2500.00', 'UGX': '1000.00'})
+        self.assertTrue(all('seconds' in entry for entry in run.report['shards']))
+
+    def test_locked_shard_is_left_to_its_holder(self):
+        key = BillingShard(self.subscription.customer.company_id, 1).key
+        holder = None
+        if connection.vendor == 'postgresql':
+            # Advisory locks are per session, so the other run needs its own connection
+            holder = connections.create_connection('default')
+            with holder.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_lock(%s)", [advisory_lock_id(key)])
+        else:
+            cache.add(f'isp:billing:lock:{key}', 'other-run', 60)
+
+        run = run_sharded_billing(as_of=self.as_of, workers=0)
+        self.assertEqual((run.status, run.invoices), ('failed', 0))
+        self.assertIn('another run', run.error)
+
+        if holder:
+            holder.close()
+        cache.delete(f'isp:billing:lock:{key}')
+        self.assertEqual(run_sharded_billing(as_of=self.as_of, workers=0).invoices, 1)
+
+    def test_months_keep_the_anchor_day(self):
+        start = timezone.now().replace(year=2025, month=1, day=31)
+        self.assertEqual(add_months(start, 1, 31).date().isoformat(), '2025-02-28')
+        self.assertEqual(add_months(add_months(start, 1, 31), 1, 31).date().isoformat(), '2025-03-31')
+        self.assertEqual(add_months(start, 12).date().isoformat(), '2026-01-31')
+
+
+class ReconciliationTests(ISPTestCase):
+    def setUp(self):
+        super().setUp()
+        self.subscription = make_subscription()
+        self.company = self.subscription.customer.company
+        self.customer = self.subscription.customer
+        today = timezone.now().date()
+        self.older, self.newer = [
+            Invoice.objects.create(
+                customer=self.customer, subscription=self.subscription, invoice_number=f'INV-{n}', status='sent',
+                issue_date=today - timedelta(days=40 - n), due_date=today - timedelta(days=30 - n),
+                subtotal=Decimal('1000'), total_amount=Decimal('1000'),
+            )
+            for n in (1, 2)
+        ]
+
+    def line(self, reference, amount, account='', phone=''):
+        return StatementLine(reference, Decimal(amount), timezone.now(), account=account, phone=phone)
+
+    def test_lines_are_allocated_to_invoices_and_balances(self):
+        lines = [
+            # Names the newer invoice and overpays: the rest goes to the older one
+            self.line('QA1', '1200', account='inv-2'),
+            # Pays to the subscription account: the oldest open invoice first
+            self.line('QA2', '900', account='SUB-user1'),
+            self.line('QA3', '50', account='nobody', phone='0799999999'),
+        ]
+        with self.assertNumQueries(16):
+            result = reconcile_payments(self.company.pk, lines, statement='may.csv')
+        self.assertEqual((result.payments, result.review, result.invoices_paid), (2, 1, 2))
+        self.assertEqual((result.allocated, result.credited), (Decimal('2000.00'), Decimal('100.00')))
+
+        self.newer.refresh_from_db()
+        self.older.refresh_from_db()
+        self.assertEqual((self.newer.status, self.newer.paid_amount), ('paid', Decimal('1000.00')))
+        self.assertEqual((self.older.status, self.older.paid_amount), ('paid', Decimal('1000.00')))
+        self.assertIsNotNone(self.older.paid_date)
+        # Both invoices were charged when they were created as sent; 100 is left over as credit
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.current_balance, Decimal('-100.00'))
+
+        review = PaymentReview.objects.get()
+        self.assertEqual((review.reference, review.reason, review.statement), ('QA3', 'unmatched', 'may.csv'))
+
+        # Importing the same statement again records nothing
+        again = reconcile_payments(self.company.pk, lines)
+        self.assertEqual((again.payments, again.review, again.duplicates), (0, 0, 3))
+        self.assertEqual(Payment.objects.count(), 2)
+
+    def test_shared_phone_is_ambiguous(self):
+        make_subscription(company=self.company, username='user2')
+        result = reconcile_payments(self.company.pk, [self.line('QB1', '500', phone='254711000000')])
+        self.assertEqual((result.payments, result.review), (0, 1))
+        self.assertEqual(PaymentReview.objects.get().reason, 'ambiguous')
+
+        result = reconcile_payments(self.company.pk, [self.line('QB2', '500', account='SUB-user2')])
+        self.assertEqual((result.payments, result.credited), (1, Decimal('500.00')))
+
+    def test_draft_invoices_take_no_payments(self):
+        draft = Invoice.objects.create(
+            customer=self.customer, subscription=self.subscription, invoice_number='INV-DRAFT', status='draft',
+            issue_date=timezone.now().date(), due_date=timezone.now().date(), subtotal=Decimal('500'),
+            total_amount=Decimal('500'),
+        )
+        result = reconcile_payments(self.company.pk, [self.line('QE1', '500', account='INV-DRAFT')])
+        self.assertEqual((result.payments, result.review), (0, 1))
+        self.assertEqual(settle_invoices([draft]), {})
+
+        draft.refresh_from_db()
+        self.assertEqual((draft.status, draft.paid_amount), ('draft', Decimal('0.00')))
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.current_balance, LedgerEntry.objects.aggregate(total=Sum('amount'))['total'])
+
+    def test_references_sharing_a_prefix_are_separate_payments(self):
+        lines = [self.line(f'BANK-TRANSFER-2026-10-18-{n:06d}', '100', account='SUB-user1') for n in (1, 2)]
+        result = reconcile_payments(self.company.pk, lines)
+        self.assertEqual((result.payments, result.duplicates), (2, 0))
+        self.assertEqual(sorted(Payment.objects.values_list('transaction_reference', flat=True)),
+                         [line.reference for line in lines])
+
+        _, errors = parse_statement([{'reference': 'X' * 51, 'amount': '100'}])
+        self.assertEqual(errors, ['Line 1: reference longer than 50 characters'])
+
+        self.client.force_login(User.objects.create_user('cashier', password='x', company=self.company))
+        response = self.client.post('/api/v1/payments/reconcile/', [{'reference': 'QD1', 'amount': '100'}],
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_statement_rows_and_admin_settlement(self):
+        lines, errors = parse_statement([
+            {'Receipt No.': 'QC1', 'Completion Time': '2025-07-01 10:30:00', 'Paid In': '1,000.00',
+             'A/C No.': 'INV-1', 'Other Party Info': '254711000000 - JANE DOE'},
+            {'Receipt No.': 'QC2', 'Completion Time': '2025-07-01 11:00:00', 'Paid In': '', 'Withdrawn': '200'},
+            {'TransID': 'QC3', 'TransTime': '20250701120000', 'TransAmount': '300', 'BillRefNumber': 'SUB-user1',
+             'MSISDN': '254711000000', 'FirstName': 'JANE'},
+            {'TransID': '', 'TransAmount': '300'},
+        ], 'Africa/Nairobi')
+        self.assertEqual(errors, ['Line 4: missing reference'])
+        self.assertEqual([(line.reference, line.amount, line.phone, line.name) for line in lines], [
+            ('QC1', Decimal('1000.00'), '254711000000', 'JANE DOE'),
+            ('QC3', Decimal('300.00'), '254711000000', 'JANE'),
+        ])
+        self.assertEqual(lines[1].paid_at.isoformat(), '2025-07-01T12:00:00+03:00')
+
+        self.client.force_login(User.objects.create_user('cashier', password='x', company=self.company))
+        upload = SimpleUploadedFile('june.csv', '\ufeffReceipt No.,Completion Time,Paid In,A/C No.\n'
+                                                'QC4,2025-06-30 09:00:00,400,INV-1\n'.encode())
+        data = self.client.post('/api/v1/payments/reconcile/', {'file': upload}).json()
+        self.assertEqual((data['result']['payments'], data['result']['allocated']), (1, '400.00'))
+        self.assertEqual(Payment.objects.get().notes, 'Allocated INV-1: 400.00 (june.csv)')
+
+        settled = settle_invoices(Invoice.objects.select_related('customer'))
+        self.assertEqual(settled[self.company.pk].invoices_paid, 2)
+        self.assertFalse(Invoice.objects.exclude(status='paid').exists())
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.current_balance, Decimal('0.00'))
+
+
+class DunningTests(ISPTestCase):
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.now().date()
+        self.subscriptions = {}
+        company = None
+        # Days overdue for each subscription's invoice; negative ones are not due yet
+        for username, days in (('late', 3), ('later', 9), ('latest', 25), ('early', -5), ('paid', 30)):
+            subscription = make_subscription(company=company, username=username)
+            company = subscription.customer.company
+            Invoice.objects.create(
+                customer=subscription.customer, subscription=subscription, invoice_number=f'INV-{username}',
+                status='paid' if username == 'paid' else 'sent', issue_date=self.today - timedelta(days=40),
+                due_date=self.today - timedelta(days=days), subtotal=Decimal('1000'), total_amount=Decimal('1000'),
+            )
+            self.subscriptions[username] = subscription
+        self.company = company
+        NotificationTemplate.objects.create(
+            company=company, name='Reminder', notification_type='billing_reminder', channel='sms',
+            message='{customer_name}: pay {invoice_number} ({days_overdue} days late)',
+        )
+
+    def test_overdue_invoices_are_bucketed_and_reminded_once(self):
+        result = run_dunning()
+        self.assertEqual((result.overdue, result.marked_overdue), (3, 3))
+        self.assertEqual({stage: bucket['invoices'] for stage, bucket in result.buckets.items()},
+                         {'reminder': 1, 'second_reminder': 1, 'suspension': 1})
+        self.assertEqual(result.to_dict()['buckets']['reminder']['amounts'], {'USD': '1000.00'})
+        self.assertEqual(result.suspension_candidates, [self.subscriptions['latest'].pk])
+        self.assertEqual(set(Invoice.objects.values_list('invoice_number', 'status')), {
+            ('INV-late', 'overdue'), ('INV-later', 'overdue'), ('INV-latest', 'overdue'),
+            ('INV-early', 'sent'), ('INV-paid', 'paid'),
+        })
+
+        # sms and email for the two reminder stages; no suspension notice without a suspension
+        self.assertEqual(result.notifications, 4)
+        sms = Notification.objects.get(channel='sms', metadata__stage='reminder')
+        self.assertEqual(sms.message, 'Jane Doe: pay INV-late (3 days late)')
+        self.assertEqual(sms.customer, self.subscriptions['late'].customer)
+
+        again = run_dunning()
+        self.assertEqual((again.overdue, again.marked_overdue, again.notifications), (3, 0, 0))
+
+        suspended = run_dunning(suspend=True)
+        self.assertEqual((suspended.suspended, suspended.notifications), (1, 2))
+        self.subscriptions['latest'].refresh_from_db()
+        self.assertEqual(self.subscriptions['latest'].status, 'suspended')
+        self.assertEqual(Notification.objects.filter(metadata__stage='suspension').count(), 2)
+
+    def test_is_overdue_is_annotated_in_sql(self):
+        invoices = Invoice.objects.with_overdue().order_by('invoice_number')
+        flags = {invoice.invoice_number: invoice.is_overdue for invoice in invoices}
+        self.assertEqual(flags, {invoice.invoice_number: Invoice.objects.get(pk=invoice.pk).is_overdue
+                                 for invoice in invoices})
+        self.assertEqual(sorted(number for number, late in flags.items() if late),
+                         ['INV-late', 'INV-later', 'INV-latest'])
+        self.assertEqual(Invoice.objects.overdue().count(), 3)
+
+        ticket = Ticket.objects.create(
+            customer=self.subscriptions['late'].customer, subject='Down', description='No link',
+            sla_resolution_due=timezone.now() - timedelta(hours=1),
+        )
+        self.assertTrue(Ticket.objects.with_overdue().get(pk=ticket.pk).is_overdue)
+        ticket.status = 'resolved'
+        ticket.save()
+        self.assertFalse(Ticket.objects.with_overdue().get(pk=ticket.pk).is_overdue)
+
+        no_sla = Ticket.objects.create(ticket_id='TKT-2', customer=ticket.customer, subject='Slow',
+                                       description='Evenings')
+        self.assertIs(Ticket.objects.with_overdue().get(pk=no_sla.pk).is_overdue, False)
+        self.assertEqual(Ticket.objects.with_overdue().filter(is_overdue=False).count(), 2)
+
+
+class LedgerTests(ISPTestCase):
+    def setUp(self):
+        super().setUp()
+        self.subscription = make_subscription(next_billing_date=timezone.now() - timedelta(days=1))
+        self.customer = self.subscription.customer
+
+    def balance(self):
+        self.customer.refresh_from_db()
+        return self.customer.current_balance
+
+    def test_postings_move_the_balance_and_answer_past_balances(self):
+        before = timezone.now()
+        run_billing()
+        invoice = Invoice.objects.get()
+        self.assertEqual(self.balance(), invoice.total_amount)
+        reconcile_payments(self.customer.company_id, [
+            StatementLine('QL1', Decimal('400'), timezone.now(), account=invoice.invoice_number),
+        ])
+        self.assertEqual(self.balance(), invoice.total_amount - 400)
+        self.assertEqual(post_entries([invoice_entry(invoice)]), 0)
+        self.assertEqual(LedgerEntry.objects.count(), 2)
+
+        self.assertEqual(balance_at(self.customer.pk, before), 0)
+        snapshot_at = timezone.now()
+        self.assertEqual(take_snapshots(snapshot_at), 1)
+        self.assertEqual(take_snapshots(snapshot_at), 0)
+        later = snapshot_at + timedelta(days=1)
+        post_entries([adjustment_entry(self.customer.pk, Decimal('-50'), 'Goodwill', occurred_at=later)])
+        with self.assertNumQueries(1):
+            self.assertEqual(balance_at(self.customer.pk, later), invoice.total_amount - 450)
+        self.assertEqual(balance_at(self.customer.pk, snapshot_at), invoice.total_amount - 400)
+
+        # A back-dated entry drops the snapshots it would change
+        post_entries([adjustment_entry(self.customer.pk, Decimal('10'), 'Late fee', occurred_at=before)])
+        self.assertFalse(BalanceSnapshot.objects.exists())
+        self.assertEqual(balance_at(self.customer.pk, snapshot_at), invoice.total_amount - 390)
+        self.assertEqual(balance_at(self.customer.pk), self.balance())
+
+        self.client.force_login(User.objects.create_user('accounts', password='x', company=self.customer.company))
+        url = f'/api/v1/customers/{self.customer.pk}/ledger/'
+        response = self.client.post(url, {'amount': '-20', 'description': 'Outage credit'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.balance(), invoice.total_amount - 460)
+        data = self.client.get(url, {'at': snapshot_at.isoformat()}).json()
+        self.assertEqual((data['balance'], len(data['entries'])), (str(invoice.total_amount - 390), 3))
+
+    def test_invoices_and_payments_edited_through_the_api_keep_the_balance_on_the_ledger(self):
+        self.client.force_login(User.objects.create_user('accounts', password='x', company=self.customer.company))
+        today = timezone.now().date().isoformat()
+
+        def balance_matches_ledger(expected):
+            self.assertEqual(self.balance(), Decimal(expected))
+            self.assertEqual(LedgerEntry.objects.filter(customer=self.customer).aggregate(total=Sum('amount'))['total']
+                             or 0, Decimal(expected))
+
+        invoice = self.client.post('/api/v1/invoices/', {
+            'customer_id': self.customer.pk, 'status': 'draft', 'issue_date': today, 'due_date': today,
+            'subtotal': '1000', 'total_amount': '1000',
+        }, content_type='application/json').json()['id']
+        balance_matches_ledger('0')
+        url = f'/api/v1/invoices/{invoice}/'
+        self.client.patch(url, {'status': 'sent'}, content_type='application/json')
+        balance_matches_ledger('1000')
+        self.client.patch(url, {'total_amount': '1200'}, content_type='application/json')
+        balance_matches_ledger('1200')
+
+        payment = self.client.post('/api/v1/payments/', {
+            'customer_id': self.customer.pk, 'invoice_id': invoice, 'amount': '500', 'payment_method': 'cash',
+            'status': 'completed', 'payment_date': timezone.now().isoformat(),
+        }, content_type='application/json').json()['id']
+        balance_matches_ledger('700')
+        self.client.patch(f'/api/v1/payments/{payment}/', {'amount': '400'}, content_type='application/json')
+        balance_matches_ledger('800')
+        self.client.delete(f'/api/v1/payments/{payment}/')
+        balance_matches_ledger('1200')
+        self.client.patch(url, {'status': 'cancelled'}, content_type='application/json')
+        balance_matches_ledger('0')
+        self.assertEqual(LedgerEntry.objects.filter(entry_type='adjustment').count(), 4)
+
+        entries = self.client.get(f'/api/v1/customers/{self.customer.pk}/ledger/', {'fields': 'amount'}).json()
+        self.assertEqual(set(entries['entries'][0]), {'amount'})
+
+    def test_backfill_builds_the_ledger_from_invoices_and_payments(self):
+        now = timezone.now()
+        # Rows from before the ledger: bulk_create skips the signals that post them
+        invoice, _ = Invoice.objects.bulk_create([
+            Invoice(customer=self.customer, subscription=self.subscription, invoice_number='INV-OLD', status='paid',
+                    issue_date=now.date(), due_date=now.date(), subtotal=Decimal('1000'),
+                    total_amount=Decimal('1000')),
+            Invoice(customer=self.customer, subscription=self.subscription, invoice_number='INV-DRAFT',
+                    status='draft', issue_date=now.date(), due_date=now.date(), subtotal=Decimal('700'),
+                    total_amount=Decimal('700')),
+        ])
+        Payment.objects.bulk_create([Payment(customer=self.customer, invoice=invoice, payment_id='PAY-OLD',
+                                             amount=Decimal('600'), payment_method='cash', status='completed',
+                                             payment_date=now)])
+        Customer.objects.filter(pk=self.customer.pk).update(current_balance=Decimal('150'))
+
+        report = backfill_ledger(rebalance=True, batch_size=1)
+        self.assertEqual((report['invoices'], report['payments'], report['rebalanced']), (1, 1, 1))
+        self.assertEqual(self.balance(), Decimal('400'))
+        self.assertEqual(report['snapshots'], 1)
+
+        # Balances edited outside the ledger get an opening adjustment rather than a silent change
+        Customer.objects.filter(pk=self.customer.pk).update(current_balance=Decimal('450'))
+        report = backfill_ledger()
+        self.assertEqual((report['invoices'], report['payments'], report['adjustments']), (0, 0, 1))
+        self.assertEqual(LedgerEntry.objects.get(entry_type='adjustment').amount, Decimal('50'))
+        self.assertEqual(balance_at(self.customer.pk, timezone.now()), self.balance())
+
+
+class UsageCounterTests(ISPTestCase):
+    def test_accounting_flush_increments_subscription_counters(self):
+        subscription = make_subscription()
+
+        flush_records([accounting_record('Start')])
+        flush_records([accounting_record('Interim-Update', octets=100, session_time=125)])
+        flush_records([accounting_record('Stop', octets=400, session_time=300)])
+
+        subscription.refresh_from_db()
+        self.assertEqual(subscription.data_used, 1200)
+        self.assertEqual(subscription.time_used, 5)
+        self.assertEqual(list(reconcile_usage()), [])
+
+    def test_reconcile_reports_and_fixes_drift(self):
+        subscription = make_subscription()
+        flush_records([accounting_record('Stop', octets=10, session_time=60)])
+        Subscription.objects.filter(pk=subscription.pk).update(data_used=999)
+
+        drift, = reconcile_usage(fix=True)
+
+        self.assertEqual((drift.data_used, drift.expected_data), (999, 30))
+        subscription.refresh_from_db()
+        self.assertEqual(subscription.data_used, 30)
+
+    def test_data_limit_snapshot_follows_package(self):
+        subscription = make_subscription()
+        self.assertEqual(subscription.data_limit_bytes, 10 * BYTES_PER_GB)
+
+        subscription.package.data_limit = 20
+        subscription.package.save()
+
+        subscription.refresh_from_db()
+        self.assertEqual(subscription.data_limit_bytes, 20 * BYTES_PER_GB)
+        self.assertFalse(Subscription.objects.over_quota().exists())
+
+    def test_batched_updates_apply_relative_and_absolute_values(self):
+        subscription = make_subscription()
+        other = make_subscription(subscription.customer.company, username='user2')
+        now = timezone.now()
+        for joined in (True, False):
+            with self.subTest(values_join=joined), \
+                    mock.patch('isp.services.updates._supports_values_join', return_value=joined):
+                Subscription.objects.update(data_used=0, time_used=0, last_billing_date=None)
+                # A missing row is not counted; one statement per batch when the backend can join VALUES
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertEqual(apply_usage_deltas({subscription.pk: (10, 1), other.pk: (5, 0), 0: (1, 1)}), 2)
+                self.assertEqual(len(queries), 1 if joined else 3)
+                apply_usage_deltas({subscription.pk: (10, 2)})
+
+                subscription.last_billing_date, other.last_billing_date = now, None
+                self.assertEqual(update_rows([subscription, other], ['last_billing_date']), 2)
+                rows = Subscription.objects.order_by('pk').values_list('data_used', 'time_used', 'last_billing_date')
+                self.assertEqual(list(rows), [(20, 3, now), (5, 0, None)])
+
+
+class RollupTests(ISPTestCase):
+    def log_usage(self, subscription, session_start, octets):
+        return UsageLog.objects.create(
+            subscription=subscription, session_start=session_start, bytes_uploaded=octets,
+            bytes_downloaded=octets, ip_address='10.0.0.2', session_id=f'{session_start:%H%M%S}',
+        )
+
+    def test_rollup_processes_only_rows_past_the_watermark(self):
+        subscription = make_subscription()
+        day = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=2)
+        self.log_usage(subscription, day + timedelta(hours=1), 100)
+        self.log_usage(subscription, day + timedelta(hours=1, minutes=30), 50)
+        self.log_usage(subscription, day + timedelta(hours=5), 10)
+
+        first = rollup_usage(lag=0)
+        self.assertEqual((first.touched_buckets, first.daily), (2, 1))
+        self.assertEqual(rollup_usage(lag=0).touched_buckets, 0)
+
+        hour = UsageRollup.objects.get(granularity=HOUR, bucket_start=day + timedelta(hours=1))
+        self.assertEqual((hour.bytes_uploaded, hour.sessions), (150, 2))
+
+        self.log_usage(subscription, day + timedelta(hours=5, minutes=10), 5)
+        self.assertEqual(rollup_usage(lag=0).touched_buckets, 1)
+        daily = UsageRollup.objects.get(granularity=DAY, bucket_start=day)
+        self.assertEqual((daily.bytes_downloaded, daily.sessions), (165, 4))
+
+    def test_series_reads_rollups_and_raw_open_bucket(self):
+        subscription = make_subscription()
+        now = timezone.now()
+        self.log_usage(subscription, now - timedelta(days=3), 100)
+        rollup_usage(lag=0)
+        # Written after the rollup ran, so only visible through the raw fallback
+        self.log_usage(subscription, now, 7)
+        UsageRollup.objects.filter(granularity=DAY).update(bytes_uploaded=1000)
+
+        series = usage_series(now - timedelta(days=7), now + timedelta(seconds=1), DAY,
+                              subscription_id=subscription.pk)
+
+        self.assertEqual([b['bytes_uploaded'] for b in series], [1000, 7])
+
+    def test_bandwidth_rollup_percentiles(self):
+        subscription = make_subscription()
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+        BandwidthLog.objects.bulk_create([
+            BandwidthLog(subscription=subscription, timestamp=hour + timedelta(minutes=i),
+                         download_speed=(i + 1) * 100, upload_speed=10, latency=i + 1)
+            for i in range(20)
+        ])
+
+        rollup_bandwidth(lag=0)
+
+        rollup = BandwidthRollup.objects.get(granularity=HOUR)
+        self.assertEqual((rollup.samples, rollup.p95_download, rollup.max_download), (20, 1900, 2000))
+        self.assertEqual((rollup.latency_p50, rollup.latency_p95), (10, 19))
+
+
+class DashboardStatsTests(ISPTestCase):
+    def test_stats_are_scoped_per_company(self):
+        subscription = make_subscription()
+        other = Company.objects.create(name='Other', slug='other', email='o@example.com', phone='1', address='x')
+        make_subscription(company=other, username='user2')
+
+        stats = get_stats(subscription.customer.company_id)
+
+        self.assertEqual(stats['customers']['total'], 1)
+        self.assertEqual(stats['subscriptions']['active'], 1)
+        self.assertEqual(get_stats()['customers']['total'], 2)
+
+    def test_model_changes_invalidate_cached_stats(self):
+        subscription = make_subscription()
+        company_id = subscription.customer.company_id
+        self.assertEqual(get_stats(company_id)['subscriptions']['suspended'], 0)
+
+        with self.assertNumQueries(0):
+            get_stats(company_id)
+
+        subscription.status = 'suspended'
+        subscription.save()
+        self.assertEqual(get_stats(company_id)['subscriptions']['suspended'], 1)
+
+
+class SharedPropsTests(ISPTestCase):
+    def setUp(self):
+        super().setUp()
+        self.subscription = make_subscription()
+        self.user = User.objects.create_user(
+            'agent', password='x', company=self.subscription.customer.company, is_superuser=True
+        )
+
+    def request(self, **headers):
+        request = RequestFactory().get('/dashboard/', headers=headers)
+        # A fresh instance, as in a real request (ModelBackend memoizes permissions on the object)
+        request.user = User.objects.get(pk=self.user.pk)
+        request.session = {}
+        return request
+
+    def test_permissions_are_memoized_per_request_and_cached_per_user(self):
+        self.user.is_superuser = False
+        self.user.save()
+        request = self.request()
+        self.assertNotIn('isp.view_ticket', get_user_permissions(request))
+        with self.assertNumQueries(0):
+            get_user_permissions(request)
+        second = self.request()
+        with self.assertNumQueries(0):
+            get_user_permissions(second)
+
+        group = Group.objects.create(name='support')
+        group.permissions.add(Permission.objects.get(codename='view_ticket'))
+        self.user.groups.add(group)
+        self.assertIn('isp.view_ticket', get_user_permissions(self.request()))
+
+    def test_badges_are_an_optional_prop_invalidated_by_signals(self):
+        request = self.request(X_Inertia='true')
+        share_props(request)
+        props = json.loads(inertia_render(request, 'Dashboard').content)['props']
+        self.assertNotIn('badges', props)
+
+        request = self.request(X_Inertia='true', X_Inertia_Partial_Data='badges',
+                               X_Inertia_Partial_Component='Dashboard')
+        share_props(request)
+        props = json.loads(inertia_render(request, 'Dashboard').content)['props']
+        self.assertEqual(props['badges'], {'customers': 0, 'tickets': 0})
+
+        Ticket.objects.create(ticket_id='T1', customer=self.subscription.customer, subject='Down',
+                              description='', ticket_type='technical')
+        self.assertEqual(get_badge_counts(self.request())['tickets'], 1)
+
+
+class KeysetPaginationTests(ISPTestCase):
+    def test_walks_forward_and_back_across_tied_timestamps(self):
+        subscription = make_subscription()
+        start = timezone.now()
+        UsageLog.objects.bulk_create([
+            UsageLog(subscription=subscription, session_start=start + timedelta(minutes=i // 3),
+                     ip_address='10.0.0.2', session_id=f's{i}')
+            for i in range(10)
+        ])
+        ordering = ('-session_start', '-id')
+        expected = list(UsageLog.objects.order_by(*ordering).values_list('id', flat=True))
+
+        seen, cursor, pages = [], None, []
+        while True:
+            page = keyset_paginate(UsageLog.objects.all(), ordering, cursor, page_size=4)
+            pages.append(page)
+            seen += [log.id for log in page.items]
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+
+        self.assertEqual(seen, expected)
+        back = keyset_paginate(UsageLog.objects.all(), ordering, pages[-1].previous_cursor, page_size=4)
+        self.assertEqual([log.id for log in back.items], expected[4:8])
+        self.assertTrue(back.has_previous)
+
+    def test_system_log_api_returns_cursor_links(self):
+        company = Company.objects.create(name='ISP', slug='isp', email='a@b.c', phone='1', address='x')
+        user = User.objects.create_user('ops', password='x', company=company)
+        SystemLog.objects.bulk_create([
+            SystemLog(user=user, action_type='login', message=f'login {i}') for i in range(3)
+        ])
+        self.client.force_login(user)
+
+        first = self.client.get('/api/v1/system-logs/', {'page_size': 2}).json()
+        self.assertEqual((len(first['results']), first['count']), (2, 3))
+        second = self.client.get(first['next']).json()
+        self.assertEqual([r['message'] for r in second['results']], ['login 0'])
+        self.assertIsNone(second['next'])
+
+
+class EagerLoadingTests(ISPTestCase):
+    def setUp(self):
+        super().setUp()
+        self.subscription = make_subscription()
+        self.company = self.subscription.customer.company
+        self.user = User.objects.create_user('agent', password='x', company=self.company, user_type='support')
+        self.client.force_login(self.user)
+
+    def add_rows(self, start, count):
+        for i in range(start, start + count):
+            subscription = make_subscription(self.company, username=f'sub{i}')
+            customer = subscription.customer
+            ticket = Ticket.objects.create(
+                ticket_id=f'T-{i}', customer=customer, subject='No link', description='-',
+                ticket_type='technical', assigned_to=self.user,
+            )
+            TicketComment.objects.create(ticket=ticket, author=self.user, comment='Checking')
+            invoice = Invoice.objects.create(
+                customer=customer, subscription=subscription, invoice_number=f'INV-{i}',
+                issue_date=timezone.now().date(), due_date=timezone.now().date(),
+                subtotal=Decimal('1000'), total_amount=Decimal('1000'),
+            )
+            Payment.objects.create(
+                customer=customer, invoice=invoice, payment_id=f'PAY-{i}', amount=Decimal('1000'),
+                payment_method='cash', payment_date=timezone.now(), processed_by=self.user,
+            )
+
+    def test_nested_endpoints_run_a_fixed_number_of_queries(self):
+        expanded = {
+            '/api/v1/tickets/': 'customer,category,assigned_to,comments.author',
+            '/api/v1/invoices/': 'customer,subscription.customer,subscription.package.category,'
+                                 'payments.customer,payments.processed_by',
+            '/api/v1/payments/': 'customer,processed_by',
+            '/api/v1/subscriptions/': 'customer,package.category',
+        }
+        for n, (url, expand) in enumerate(expanded.items()):
+            with self.subTest(url=url):
+                self.add_rows(n * 100, 2)
+                with CaptureQueriesContext(connection) as few:
+                    self.client.get(url, {'expand': expand})
+                self.add_rows(n * 100 + 2, 10)
+                response = self.assertQueryBudget(url, len(few), expand=expand)
+                self.assertTrue(response.json()['results'])
+
+    def test_relations_collapse_to_ids_unless_expanded(self):
+        self.add_rows(0, 1)
+        ticket = self.client.get('/api/v1/tickets/').json()['results'][0]
+        self.assertEqual(ticket['customer'], Ticket.objects.get().customer_id)
+        self.assertEqual(ticket['comments'], [TicketComment.objects.get().pk])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/tickets/', {'fields': 'id,subject,customer.full_name'})
+        self.assertEqual(response.json()['results'][0], {
+            'id': ticket['id'], 'subject': 'No link', 'customer': {'full_name': 'Jane Doe'},
+        })
+        ticket_query = next(q['sql'] for q in queries.captured_queries if 'FROM "isp_ticket"' in q['sql'])
+        self.assertNotIn('"isp_ticket"."description"', ticket_query)
+
+    def test_customer_list_is_scoped_and_narrowed(self):
+        other = Company.objects.create(name='Other', slug='other', email='o@x.y', phone='2', address='y')
+        Customer.objects.create(company=other, full_name='Someone Else', primary_phone='1', primary_email='e@x.y')
+
+        response = self.assertQueryBudget('/api/v1/customers/', 6)
+        self.assertEqual([c['full_name'] for c in response.json()['results']], ['Jane Doe'])
+
+
+class ExportTests(ISPTestCase):
+    def setUp(self):
+        super().setUp()
+        self.subscription = make_subscription()
+        self.user = User.objects.create_user('billing', password='x', company=self.subscription.customer.company)
+        self.client.force_login(self.user)
+        today = timezone.localdate()
+        for i, issued in enumerate([today - timedelta(days=40), today]):
+            Invoice.objects.create(
+                customer=self.subscription.customer, subscription=self.subscription, invoice_number=f'INV-{i}',
+                issue_date=issued, due_date=issued, subtotal=Decimal('10.50'), total_amount=Decimal('10.50'),
+            )
+        other = Company.objects.create(name='Other', slug='other', email='o@x.y', phone='2', address='y')
+        make_subscription(other, username='other').customer.invoices.create(
+            invoice_number='INV-OTHER', issue_date=today, due_date=today,
+            subtotal=Decimal('1'), total_amount=Decimal('1'),
+        )
+
+    def test_csv_export_streams_company_rows_in_date_range(self):
+        start = (timezone.localdate() - timedelta(days=7)).isoformat()
+        response = self.client.get('/api/v1/export/invoices/', {'start': start})
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'invoice_number', 'customer'])
+        self.assertEqual([line.split(',')[1] for line in lines[1:]], ['INV-1'])
+
+    def test_gzipped_ndjson_export(self):
+        import gzip
+
+        response = self.client.get('/api/v1/export/invoices/', {'fmt': 'ndjson', 'compress': 'gzip'})
+        self.assertIn('invoices-', response['Content-Disposition'])
+        self.assertIn('.ndjson.gz', response['Content-Disposition'])
+        rows = [json.loads(line) for line in gzip.decompress(b''.join(response.streaming_content)).splitlines()]
+        self.assertEqual([row['invoice_number'] for row in rows], ['INV-0', 'INV-1'])
+        self.assertEqual(rows[0]['total_amount'], '10.50')
+
+        self.assertEqual(self.client.get('/api/v1/export/invoices/', {'end': '2024-13-01'}).status_code, 400)
+
+
+class BulkCustomerOperationsTests(ISPTestCase):
+    def setUp(self):
+        super().setUp()
+        self.subscription = make_subscription()
+        self.company = self.subscription.customer.company
+        self.second = make_subscription(self.company, username='user2')
+        self.lead = Customer.objects.create(
+            company=self.company, full_name='Lead', status='lead', primary_phone='1', primary_email='l@x.y',
+        )
+        self.user = User.objects.create_user('ops', password='x', company=self.company)
+        self.client.force_login(self.user)
+
+    def test_suspend_reports_per_item_and_cascades_to_subscriptions(self):
+        ids = [self.subscription.customer_id, self.second.customer_id, self.lead.pk, 999999]
+        response = self.client.post('/api/v1/bulk/customers/', {'operation': 'suspend', 'customer_ids': ids},
+                                    content_type='application/json')
+
+        body = response.json()
+        self.assertEqual((body['succeeded'], body['failed']), (2, 2))
+        self.assertEqual([item['ok'] for item in body['results']], [True, True, False, False])
+        self.assertIn('lead', body['results'][2]['error'])
+        self.assertEqual(set(Subscription.objects.values_list('status', flat=True)), {'suspended'})
+        self.assertEqual(SystemLog.objects.filter(action_type='service_change').count(), 2)
+
+    def test_large_requests_run_as_a_pollable_job(self):
+        ids = [self.subscription.customer_id, self.second.customer_id]
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = self.client.post('/api/v1/bulk/customers/',
+                                        {'operation': 'terminate', 'customer_ids': ids, 'async': True},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(callbacks), 1)
+
+        job_id = response.json()['job']['id']
+        run_job(job_id)
+        job = self.client.get(f'/api/v1/bulk/jobs/{job_id}/').json()['job']
+        self.assertEqual((job['status'], job['succeeded']), ('completed', 2))
+        self.assertEqual(Customer.objects.filter(status='terminated').count(), 2)
+
+    def test_jobs_lost_to_a_restart_are_marked_failed(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            response = self.client.post('/api/v1/bulk/customers/',
+                                        {'operation': 'suspend', 'customer_ids': [self.lead.pk], 'async': True},
+                                        content_type='application/json')
+        job_id = response.json()['job']['id']
+        self.assertEqual(self.client.get(f'/api/v1/bulk/jobs/{job_id}/').json()['job']['status'], 'pending')
+
+        BulkJob.objects.filter(pk=job_id).update(updated_at=timezone.now() - timedelta(hours=2))
+        job = self.client.get(f'/api/v1/bulk/jobs/{job_id}/').json()['job']
+        self.assertEqual(job['status'], 'failed')
+        self.assertIn('Interrupted', job['error'])
+
+
+class SubscriptionLifecycleTests(ISPTestCase):
+    def setUp(self):
+        super().setUp()
+        self.subscription = make_subscription()
+        self.company = self.subscription.customer.company
+        self.routers = [
+            NetworkEquipment.objects.create(
+                company=self.company, name=f'R{i}', identity=f'r{i}', equipment_type='router',
+                brand='MikroTik', model='hAP', serial_number=f'SN{i}', location='Nairobi',
+            )
+            for i in range(2)
+        ]
+        self.subscription.router = self.routers[0]
+        self.subscription.save()
+        self.second = make_subscription(self.company, username='user2', router=self.routers[0])
+        self.third = make_subscription(self.company, username='user3', router=self.routers[1])
+        self.unrouted = make_subscription(self.company, username='user4')
+
+    def test_suspend_sends_one_batch_per_router_and_reports_push_failures(self):
+        backend = FakeRouterBackend(latency=0, command_cost=0, failing=[self.routers[1].pk])
+        ids = [self.subscription.pk, self.second.pk, self.third.pk, self.unrouted.pk]
+
+        outcome = apply_subscription_operation(self.company.pk, ids, 'suspend', {'reason': 'non_payment'},
+                                               backend=backend)
+
+        self.assertEqual(sorted(call[:2] for call in backend.calls),
+                         sorted([(self.routers[0].pk, 2), (self.routers[1].pk, 1)]))
+        self.assertEqual(outcome.succeeded, 4)
+        self.assertEqual([bool(result.warning) for result in outcome.results], [False, False, True, False])
+        self.assertEqual(set(Subscription.objects.values_list('status', flat=True)), {'suspended'})
+        self.assertEqual(SystemLog.objects.filter(metadata__reason='non_payment').count(), 4)
+
+    @override_settings(ROUTER_PROVISIONING={'BACKEND': 'isp.services.routers.FakeRouterBackend', 'FAKE_LATENCY': 0})
+    def test_endpoint_validates_transitions(self):
+        self.client.force_login(User.objects.create_user('ops', password='x', company=self.company))
+        Subscription.objects.filter(pk=self.second.pk).update(status='suspended')
+
+        response = self.client.post('/api/v1/bulk/subscriptions/',
+                                    {'operation': 'reactivate', 'subscription_ids': [self.subscription.pk,
+                                                                                     self.second.pk]},
+                                    content_type='application/json')
+
+        body = response.json()
+        self.assertEqual([item['ok'] for item in body['results']], [False, True])
+        self.assertIn('active subscription', body['results'][0]['error'])
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.status, 'active')
+
+    def test_mtk_backend_pushes_only_to_a_configured_endpoint(self):
+        commands = [RouterCommand(DISABLE, 'user1')]
+        with self.assertRaisesMessage(RouterError, 'MTK_BATCH_ENDPOINT'):
+            MtkRouterBackend().send(self.routers[0], commands)
+        pushed = push_subscriptions([self.subscription, self.unrouted], DISABLE, backend=MtkRouterBackend())
+        self.assertEqual((pushed.skipped, pushed.failed, pushed.routers), (2, {}, []))
+
+        net = mock.Mock()
+        net.dispatch.return_value = {'success': True}
+        endpoint = {'MTK_BATCH_ENDPOINT': 'mikrotik/devices/{identity}/subscribers/batch'}
+        with override_settings(ROUTER_PROVISIONING=endpoint), mock.patch.object(Mtk, 'instance', mock.Mock(net=net)):
+            MtkRouterBackend().send(self.routers[0], commands)
+        net.dispatch.assert_called_once_with('mikrotik/devices/r0/subscribers/batch',
+                                             commands=[{'action': 'disable', 'username': 'user1', 'service': 'pppoe'}])
+
+    def test_accounting_assigns_the_router_of_a_new_session(self):
+        NetworkEquipment.objects.filter(pk=self.routers[1].pk).update(ip_address='10.1.0.1')
+        other = Company.objects.create(name='Other', slug='other', email='o@example.com', phone='0', address='x')
+        NetworkEquipment.objects.create(
+            company=other, name='X', identity='x', equipment_type='router', ip_address='10.1.0.2',
+            brand='MikroTik', model='hAP', serial_number='SNX', location='Nairobi',
+        )
+
+        flush_records([accounting_record('Start', nas_ip='10.1.0.1'),
+                       accounting_record('Start', session_id='s4', username='user4', nas_ip='10.1.0.1'),
+                       accounting_record('Start', session_id='s2', username='user2', nas_ip='10.1.0.2')])
+
+        routers = dict(Subscription.objects.values_list('username', 'router'))
+        self.assertEqual(routers, {'user1': self.routers[1].pk, 'user2': self.routers[0].pk,
+                                   'user3': self.routers[1].pk, 'user4': self.routers[1].pk})
+
+    def test_api_only_takes_routers_of_the_users_company(self):
+        other = Company.objects.create(name='Other', slug='other', email='o@example.com', phone='0', address='x')
+        foreign = NetworkEquipment.objects.create(
+            company=other, name='X', identity='x', equipment_type='router',
+            brand='MikroTik', model='hAP', serial_number='SNX', location='Nairobi',
+        )
+        self.client.force_login(User.objects.create_user('ops', password='x', company=self.company))
+        url = f'/api/v1/subscriptions/{self.unrouted.pk}/'
+
+        response = self.client.patch(url, {'router': foreign.pk}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('router', response.json())
+        response = self.client.patch(url, {'router': self.routers[1].pk}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.unrouted.refresh_from_db()
+        self.assertEqual(self.unrouted.router, self.routers[1])
+
+    def test_migration_backfills_the_router_from_the_newest_session(self):
+        backfill = import_module('isp.migrations.0018_subscription_router').backfill_subscription_router
+        NetworkEquipment.objects.filter(pk=self.routers[1].pk).update(ip_address='10.1.0.1')
+        now = timezone.now()
+        for hours, nas_ip in ((2, '10.1.0.1'), (1, '10.9.9.9')):
+            UsageLog.objects.create(subscription=self.unrouted, session_id=f'u{hours}', ip_address='10.0.0.2',
+                                    session_start=now - timedelta(hours=hours), nas_ip=nas_ip)
+        UsageLog.objects.create(subscription=self.second, session_id='s', ip_address='10.0.0.3',
+                                session_start=now, nas_ip='10.1.0.1')
+
+        backfill(apps, None)
+
+        routers = dict(Subscription.objects.values_list('username', 'router'))
+        self.assertEqual(routers['user4'], None)
+        self.assertEqual(routers['user2'], self.routers[1].pk)
+
+
+@mock.patch.object(Mtk, 'instance', None)
+class EquipmentConfigTests(ISPTestCase):
+    def setUp(self):
+        super().setUp()
+        company = Company.objects.create(name='ISP', slug='isp', email='isp@example.com', phone='0', address='x')
+        self.router = NetworkEquipment.objects.create(
+            company=company, name='R1', identity='r1', auth_code='abc', password='secret',
+            equipment_type='router', brand='MikroTik', model='hAP', serial_number='SN1', location='Nairobi',
+        )
+        payload = json.dumps({'mtk': self.router.pk, 'auth': 'abc', 'timestamp': '0'})
+        token = base64.urlsafe_b64encode(fernet.encrypt(payload.encode())).decode()
+        self.url = f'/api/v1/equipments/auth/config/{token}/ovpn/7/'
+
+    def test_script_revalidates_with_etag_until_the_router_changes(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'secret', response.content)
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.content), (304, b''))
+
+        self.router.password = 'rotated'
+        self.router.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn(b'rotated', response.content)
+
+
+class HotspotPageTests(ISPTestCase):
+    def setUp(self):
+        super().setUp()
+        page_cache.clear()
+        company = Company.objects.create(name='ISP', slug='isp', email='isp@example.com', phone='0', address='x')
+        self.router = NetworkEquipment.objects.create(
+            company=company, name='R1', identity='r1', auth_code='abc', equipment_type='router',
+            brand='MikroTik', model='hAP', serial_number='SN1', location='Nairobi',
+        )
+
+    def test_pages_are_served_from_memory_until_the_router_changes(self):
+        url = '/api/v1/mikrotik/hotspot/abc/login.html'
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).content, first.content)
+
+        self.router.auth_code = 'xyz'
+        self.router.save()
+        self.assertIn(b'Failed to serve hotspot files', self.client.get(url).content)
+        self.assertEqual(self.client.get('/api/v1/mikrotik/hotspot/xyz/login.html').content, first.content)
+
+
+class RouterProvisioningTests(ISPTestCase):
+    def setUp(self):
+        super().setUp()
+        self.company = Company.objects.create(
+            name='Test ISP', slug='test-isp', email='isp@example.com', phone='0700000000', address='Nairobi'
+        )
+        NetworkEquipment.objects.create(
+            company=self.company, name='R0', identity='test-isp_R0', equipment_type='router',
+            brand='MikroTik', model='hAP', location='Nairobi',
+        )
+        self.client.force_login(User.objects.create_user('ops', password='x', company=self.company))
+        self.mtk = mock.patch.object(Mtk, 'instance', mock.Mock(script=ScriptManager()))
+        self.mtk.start()
+        self.addCleanup(self.mtk.stop)
+
+    def provision(self, identity):
+        return MtkResponseObject(error='busy' if identity.endswith('R2') else None, success=True)
+
+    def test_batch_reports_existing_and_failed_routers_and_returns_scripts(self):
+        with mock.patch.object(Mtk, 'provision', side_effect=self.provision) as provision:
+            response = self.client.post('/api/v1/equipments/provision/batch/',
+                                        {'names': ['R0', 'R1', 'R2', 'R3', 'R1']}, content_type='application/json')
+
+        body = response.json()
+        self.assertEqual([item['id'] for item in body['results']], ['R0', 'R1', 'R2', 'R3'])
+        self.assertEqual([item['ok'] for item in body['results']], [False, True, False, True])
+        self.assertIn('already exists', body['results'][0]['error'])
+        self.assertIn('/api/v1/equipments/auth/', body['results'][1]['pvr_url'])
+        self.assertEqual(provision.call_count, 3)
+        self.assertEqual(body['metrics']['vpn_client_latency']['count'], 3)
+        self.assertEqual(set(NetworkEquipment.objects.values_list('identity', flat=True)),
+                         {'test-isp_R0', 'test-isp_R1', 'test-isp_R3'})
+
+    def test_identity_taken_by_a_concurrent_request_is_reported(self):
+        def progress(*counts):
+            # Another request creates the same router after the pre-check
+            NetworkEquipment.objects.get_or_create(
+                identity='test-isp_R1',
+                defaults={'company': self.company, 'name': 'R1', 'equipment_type': 'router', 'location': 'x'},
+            )
+
+        with mock.patch.object(Mtk, 'provision', side_effect=self.provision), \
+                self.assertLogs('isp.services.provisioning', 'WARNING') as logs:
+            outcome = provision_routers(self.company.pk, ['R1', 'R3'], params={'host': 'http://isp.example.com'},
+                                        progress=progress)
+
+        # Its VPN client was already created, so it is logged for removal
+        self.assertIn('VPN client test-isp_R1 needs removing', logs.output[0])
+        self.assertEqual([result.ok for result in outcome.results], [False, True])
+        self.assertEqual(outcome.results[0].error, 'Router with identity R1 already exists.')
+        self.assertEqual(NetworkEquipment.objects.filter(identity='test-isp_R1').count(), 1)
+
+
+class EquipmentCertTests(ISPTestCase):
+    def setUp(self):
+        super().setUp()
+        company = Company.objects.create(
+            name='Test ISP', slug='test-isp', email='isp@example.com', phone='0700000000', address='Nairobi'
+        )
+        self.router = NetworkEquipment.objects.create(
+            company=company, name='R1', identity='test-isp_R1', auth_code='abc', equipment_type='router',
+            brand='MikroTik', model='hAP', location='Nairobi',
+        )
+        self.upstream = mock.Mock(iter_content=mock.Mock(return_value=iter([b'client\n', b'<ca>...</ca>\n'])))
+
+    def test_bundle_is_streamed_once_then_served_from_the_cache(self):
+        url = '/api/v1/equipments/auth/cert/abc/'
+        with mock.patch.object(Mtk, 'cert_stream', return_value=self.upstream) as cert_stream:
+            first = self.client.get(url)
+            self.assertTrue(first.streaming)
+            self.assertEqual(b''.join(first.streaming_content), b'client\n<ca>...</ca>\n')
+            self.upstream.close.assert_called_once()
+
+            second = self.client.get(url)
+            self.assertEqual(second.content, b'client\n<ca>...</ca>\n')
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=second['ETag']).status_code, 304)
+            self.assertEqual(cert_stream.call_count, 1)
+
+            self.router.delete()
+            self.assertIsNone(cached_cert('test-isp_R1'))
+
+
+class RouterTelemetryTests(ISPTestCase):
+    def setUp(self):
+        super().setUp()
+        self.subscription = make_subscription(username='user1')
+        make_subscription(self.subscription.customer.company, username='user2')
+        self.router = SimulatedRouter('r1', ['user1', 'user2', 'ghost'])
+        self.locked = SimulatedRouter('r2', ['user3'], password='other')
+
+    def test_length_encoding_round_trips(self):
+        lengths = [0, 0x7F, 0x80, 0x3FFF, 0x4000, 0x1FFFFF, 0x200000, 0xFFFFFFF, 0x10000000]
+
+        async def decode():
+            reader = asyncio.StreamReader()
+            reader.feed_data(b''.join(encode_length(length) for length in lengths))
+            return [await read_length(reader) for _ in lengths]
+
+        self.assertEqual(asyncio.run(decode()), lengths)
+
+    def test_pipelined_polls_record_sessions_bandwidth_and_health(self):
+        poller = FleetPoller(concurrency=10)
+
+        async def poll(rounds):
+            async with SimulatedFleet([self.router, self.locked]):
+                targets = [
+                    RouterTarget(1, 'r1', '127.0.0.1', self.router.port, 'admin', 'secret'),
+                    RouterTarget(2, 'r2', '127.0.0.1', self.locked.port, 'admin', 'secret'),
+                ]
+                cycles = []
+                for users in rounds:
+                    self.router.users = users
+                    cycles.append(await poller.poll_fleet(targets))
+                poller.pool.close()
+                return cycles
+
+        cycles = asyncio.run(poll([['user1', 'user2', 'ghost'], ['user1', 'user2', 'ghost'], ['user1']]))
+        results = [poller.record(snapshots) for snapshots in cycles]
+
+        # One login and one pipelined batch of four commands per cycle, over one connection
+        self.assertEqual(self.router.commands, 1 + 4 * 3)
+        self.assertEqual([(result.failed, result.sessions) for result in results], [(1, 3), (1, 3), (1, 1)])
+        logs = {log.subscription.username: log for log in UsageLog.objects.select_related('subscription')}
+        self.assertEqual(set(logs), {'user1', 'user2'})
+        self.assertIsNone(logs['user1'].session_end)
+        self.assertEqual(logs['user2'].termination_cause, 'Lost-Service')
+        self.assertGreater(logs['user1'].bytes_downloaded, 0)
+        self.assertEqual(BandwidthLog.objects.count(), 3)
+
+        summaries = router_summaries([1, 2])
+        self.assertEqual((summaries[1]['ppp_sessions'], summaries[1]['hotspot_sessions']), (1, 0))
+        self.assertIn('invalid user name or password', summaries[2]['error'])
+
+    def poll_cycles(self, router, rounds):
+        """Snapshots of `router` per round; each round's callable changes the router first"""
+        poller = FleetPoller(concurrency=1)
+
+        async def poll():
+            async with SimulatedFleet([router]):
+                target = RouterTarget(1, router.identity, '127.0.0.1', router.port, 'admin', 'secret')
+                cycles = []
+                for change in rounds:
+                    change()
+                    cycles.append(await poller.poll_fleet([target]))
+                poller.pool.close()
+                return cycles
+
+        return poller, asyncio.run(poll())
+
+    def test_routers_before_6_43_log_in_with_the_md5_challenge(self):
+        router = SimulatedRouter('r1', ['user1', 'user2'], legacy_login=True)
+        poller, cycles = self.poll_cycles(router, [lambda: None])
+        result = poller.record(cycles[0])
+
+        # The challenge request, the response, then the pipelined batch
+        self.assertEqual(router.commands, 2 + 4)
+        self.assertEqual((result.failed, result.sessions), (0, 2))
+        self.assertEqual(router_summaries([1])[1]['ppp_sessions'], 1)
+
+    def test_trapped_poll_commands_neither_empty_nor_close_sessions(self):
+        router = SimulatedRouter('r1', ['user1', 'user2'])
+
+        def disable():
+            router.disabled = frozenset({'/ip/hotspot/active/print'})
+
+        poller, cycles = self.poll_cycles(router, [lambda: None, disable, disable])
+        results = [poller.record(snapshots) for snapshots in cycles]
+
+        self.assertEqual([(result.failed, result.sessions) for result in results], [(0, 2), (1, 1), (1, 1)])
+        summary = router_summaries([1])[1]
+        self.assertEqual((summary['ok'], summary['ppp_sessions'], summary['hotspot_sessions']), (False, 1, None))
+        self.assertIn('/ip/hotspot/active/print: no such command prefix', summary['error'])
+        # user2's hotspot session was hidden by the trap, not ended
+        self.assertFalse(UsageLog.objects.filter(session_end__isnull=False).exists())
@@ -14,8 +14,6 @@ class MtkConfig(AppConfig):
 
         # Check if auto-generation is enabled in settings
         conf = getattr(settings, 'MTK_CONFIG', {})
-        try:
-            # Mtk.init(host=conf.get("URL", ""))
-            pass
-        except:
-            pass
\ No newline at end of file
+        # Cheap: Mtk only builds its connection pool here and fetches server info on first use
+        if conf.get("URL"):
+            Mtk.init(host=conf["URL"])
\ No newline at end of file
@@ -1,48 +1,28 @@
 import base64
-import dataclasses
 import json
 
-import requests
 from cryptography.fernet import Fernet
-from decouple import config
 
 from internet_service_provider import settings
 from mtk.services._types import MtkResponseObject, MtkPayload
+from mtk.services.info import ServerInfo
+from mtk.services.tokens import PayloadValidator, ValidPayload, token_settings
+from mtk.services.transport import AsyncMtkTransport, MtkTransport, NetWokException
 
 fernet = Fernet(settings.FERNET_KEY.encode())
 
 
-@dataclasses.dataclass
-class ValidPayload:
-    mtk: int
-    auth: str
-    timestamp: str
+_token_options = token_settings()
+validator = PayloadValidator(
+    fernet,
+    cache_size=_token_options["CACHE_SIZE"],
+    cache_ttl=_token_options["CACHE_TTL"],
+    max_age=_token_options["MAX_AGE"],
+)
 
 
 def validate(encoded_payload) -> ValidPayload:
-    encrypted_payload = base64.urlsafe_b64decode(encoded_payload).decode()
-    json_payload = fernet.decrypt(encrypted_payload.encode()).decode()
-    payload = json.loads(json_payload)
-    if not isinstance(payload, dict):
-        raise ValueError("Payload is not a valid JSON object.")
-    required_keys = ['mtk', 'auth', 'timestamp']
-    for key in required_keys:
-        if key not in payload:
-            raise ValueError(f"Missing key: {key}")
-
-    info = payload.copy()
-    if not isinstance(info, dict):
-        raise ValueError("`info` must be a dictionary.")
-    if 'mtk' not in info or 'auth' not in info:
-        raise ValueError("Missing `mtk` or `auth` in `info`.")
-
-    if not isinstance(payload['timestamp'], str):
-        raise ValueError("`timestamp` must be a string.")
-    return ValidPayload(**info)
-
-
-class NetWokException(Exception):
-    pass
+    return validator.validate(encoded_payload)
 
 
 class ScriptManager:
@@ -66,42 +46,56 @@ class ScriptManager:
 
 
 class NetworkService:
-    def __init__(self, base_url: str):
+    def __init__(self, base_url: str, transport: MtkTransport = None, response: str = "json"):
         self.base_url = base_url
-        self.config = {"response": "json"}
+        self.transport = transport or MtkTransport(base_url)
+        self.config = {"response": response}
+
+    def _parse(self, res):
+        if self.config["response"] == "json":
+            try:
+                return res.json()
+            except ValueError:
+                raise NetWokException(f"Invalid JSON from Mtk middleware (HTTP {res.status_code})")
+        elif self.config["response"] == "text":
+            return res.text
+        raise ValueError("Invalid response type")
 
     def dispatch(self, endpoint, method="POST", **data):
-        try:
-            res = requests.request(method, f"{self.base_url}/api/{endpoint}",
-                                   headers={"Content-Type": "application/json",
-                                            "User-Agent": "F2Net/1.0 (https://f2net.fronttocodelabs.com)",
-                                            "x-api-key": config("MTK_API_KEY", default="")
-                                            },
-                                   json=data)
-            if self.config["response"] == "json":
-                res = res.json()
-            elif self.config["response"] == "text":
-                res = res.text
-            else:
-                raise ValueError("Invalid response type")
-            return res
-        except:
-            raise NetWokException("Network connection error")
+        """Body of the middleware's response; NetWokException (or a subclass) when it cannot be reached"""
+        return self._parse(self.transport.request(method, endpoint, json=data))
+
+    async def adispatch(self, endpoint, method="POST", **data):
+        """dispatch() for async views"""
+        res = await AsyncMtkTransport(self.transport).request(method, endpoint, json=data)
+        return self._parse(res)
+
+    def stream(self, endpoint, method="GET"):
+        """The upstream response with its body not yet read (the caller closes it); NetWokException unless 2xx"""
+        res = self.transport.request(method, endpoint, stream=True)
+        if not res.ok:
+            res.close()
+            raise NetWokException(f"Mtk middleware answered HTTP {res.status_code} for {endpoint}")
+        return res
 
     @property
     def text(self):
-        self.config["response"] = "text"
-        return self
+        """A view of this service returning response text, sharing its connection pool"""
+        return NetworkService(self.base_url, self.transport, response="text")
 
 
 class Mtk:
     instance: "Mtk" = None
 
     def __init__(self, base_url: str):
+        # No network I/O here: server info is fetched on first use
         self.net = NetworkService(base_url)
         self.script = ScriptManager()
-        self.config = {}
-        self._init_info()
+        self.info = ServerInfo(self.net)
+
+    @property
+    def config(self) -> dict:
+        return self.info.get()
 
     @classmethod
     def init(cls, *, host: str):
@@ -113,6 +107,8 @@ class Mtk:
 
     @classmethod
     def destroy(cls):
+        if Mtk.instance is not None:
+            Mtk.instance.net.transport.close()
         Mtk.instance = None
 
     @classmethod
@@ -177,10 +173,23 @@ class Mtk:
     def rsc_config(cls, encoded_payload):
         return validate(encoded_payload)
 
-    def _init_info(self):
-        res = self.net.dispatch("vpn/server/ip", "GET")
-        self.config["ip"] = res.pop("ip", None)
+    @classmethod
+    def rsc_configs(cls, encoded_payloads):
+        """encoded payload -> ValidPayload or InvalidPayload, for bulk re-provisioning checks"""
+        return validator.validate_many(encoded_payloads)
+
+    @classmethod
+    def server_ip(cls, default=None):
+        """The VPN server IP of the middleware, or `default` while it is unknown"""
+        if cls.instance is None:
+            return default
+        return cls.instance.info.get().get("ip") or default
 
     @classmethod
     def cert(cls, identity):
         return cls.instance.net.text.dispatch(f"mikrotik/devices/{identity}/config", "GET")
+
+    @classmethod
+    def cert_stream(cls, identity):
+        """cert() as a streamed response, for relaying the bundle while it downloads"""
+        return cls.instance.net.stream(f"mikrotik/devices/{identity}/config")
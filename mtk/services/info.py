@@ -0,0 +1,130 @@
+"""
+Server info of the Mtk middleware (VPN server IP...), fetched lazily on first use and
+cached locally and in the shared cache with stale-while-revalidate: once known, it is
+served immediately and refreshed in the background, and kept while the middleware is down.
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from mtk.services.transport import NetWokException
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY = "mtk:server-info"
+REFRESH_LOCK_KEY = "mtk:server-info:refreshing"
+
+
+def info_settings() -> Dict:
+    from django.conf import settings
+
+    defaults = {
+        # Seconds a fetched value is fresh; after that it is served while being refreshed
+        "INFO_TTL": 300,
+        # Seconds a value is kept at all (how long the middleware may be down)
+        "INFO_STALE_TTL": 7 * 24 * 3600,
+        # Seconds to wait before trying again after a failed fetch with nothing to serve
+        "INFO_RETRY_AFTER": 30,
+    }
+    conf = getattr(settings, "MTK_CONFIG", {})
+    return {key: conf.get(key, default) for key, default in defaults.items()}
+
+
+class ServerInfo:
+    def __init__(self, net):
+        self.net = net
+        self.options = info_settings()
+        self._value: Optional[Dict] = None
+        self._fetched_at = 0.0
+        self._failed_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _fresh(self, fetched_at: float) -> bool:
+        return time.time() - fetched_at < self.options["INFO_TTL"]
+
+    def get(self) -> Dict:
+        """The last known server info ({} until a fetch has succeeded); never waits on a refresh"""
+        if self._value is not None and self._fresh(self._fetched_at):
+            return self._value
+
+        shared = self._cache_get()
+        if shared and shared["fetched_at"] > self._fetched_at:
+            self._value, self._fetched_at = shared["value"], shared["fetched_at"]
+            if self._fresh(self._fetched_at):
+                return self._value
+
+        if self._value is not None:
+            self.refresh_async()
+            return self._value
+        # Cold start: nothing to serve, so this caller fetches (unless that just failed)
+        if time.time() - self._failed_at < self.options["INFO_RETRY_AFTER"]:
+            return {}
+        return self.refresh() or {}
+
+    def refresh(self) -> Optional[Dict]:
+        try:
+            res = self.net.dispatch("vpn/server/ip", "GET")
+        except NetWokException as e:
+            logger.warning("Could not fetch Mtk server info: %s", e)
+            self._failed_at = time.time()
+            return None
+        if not isinstance(res, dict) or not res.get("ip"):
+            logger.warning("Unexpected Mtk server info: %r", res)
+            self._failed_at = time.time()
+            return None
+
+        self._value, self._fetched_at = res, time.time()
+        self._cache_set({"value": res, "fetched_at": self._fetched_at})
+        return res
+
+    def refresh_async(self) -> None:
+        """Refresh on a background thread; at most one refresh per process and, through the cache, fleet-wide"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        if not self._cache_add_lock():
+            self._refreshing = False
+            return
+        threading.Thread(target=self._background_refresh, name="mtk-info-refresh", daemon=True).start()
+
+    def _background_refresh(self) -> None:
+        try:
+            self.refresh()
+        finally:
+            self._refreshing = False
+            self._cache_delete_lock()
+
+    # Shared cache access fails open: a cache outage only costs a fetch
+
+    def _cache_get(self) -> Optional[Dict]:
+        from django.core.cache import cache
+        try:
+            return cache.get(CACHE_KEY)
+        except Exception as e:
+            logger.warning("Mtk server info cache read failed: %s", e)
+            return None
+
+    def _cache_set(self, entry: Dict) -> None:
+        from django.core.cache import cache
+        try:
+            cache.set(CACHE_KEY, entry, self.options["INFO_STALE_TTL"])
+        except Exception as e:
+            logger.warning("Mtk server info cache write failed: %s", e)
+
+    def _cache_add_lock(self) -> bool:
+        from django.core.cache import cache
+        try:
+            return cache.add(REFRESH_LOCK_KEY, 1, 30)
+        except Exception:
+            return True
+
+    def _cache_delete_lock(self) -> None:
+        from django.core.cache import cache
+        try:
+            cache.delete(REFRESH_LOCK_KEY)
+        except Exception:
+            pass
@@ -0,0 +1,125 @@
+"""
+Validation of the encrypted provisioning payloads embedded in router config URLs.
+Verified payloads are kept in a bounded LRU keyed by the token digest, so a fleet
+re-fetching the same URLs after a reboot costs one HMAC + AES + JSON decode per token.
+"""
+
+import base64
+import binascii
+import dataclasses
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+from cryptography.fernet import Fernet, InvalidToken
+
+PAYLOAD_KEYS = frozenset({"mtk", "auth", "timestamp"})
+
+
+def token_settings() -> Dict:
+    from django.conf import settings
+
+    defaults = {
+        # Verified payloads kept per process
+        "CACHE_SIZE": 4096,
+        # Seconds a verified payload is trusted without decrypting the token again
+        "CACHE_TTL": 300,
+        # Reject tokens issued more than MAX_AGE seconds ago (None: tokens never expire)
+        "MAX_AGE": None,
+    }
+    return {**defaults, **getattr(settings, "MTK_TOKENS", {})}
+
+
+class InvalidPayload(ValueError):
+    pass
+
+
+@dataclasses.dataclass(frozen=True)
+class ValidPayload:
+    mtk: int
+    auth: str
+    timestamp: str
+
+
+class PayloadValidator:
+    def __init__(self, fernet: Fernet, cache_size: int = 4096, cache_ttl: float = 300,
+                 max_age: Optional[int] = None):
+        self.fernet = fernet
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.max_age = max_age
+        # digest -> (expires at, issued at, payload)
+        self._entries: "OrderedDict[bytes, Tuple[float, int, ValidPayload]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(token: Union[str, bytes]) -> bytes:
+        if isinstance(token, str):
+            token = token.encode()
+        return hashlib.blake2b(token, digest_size=16).digest()
+
+    def validate(self, token: Union[str, bytes]) -> ValidPayload:
+        """The payload of a base64-wrapped Fernet token; raises InvalidPayload"""
+        digest = self._digest(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(digest)
+                else:
+                    del self._entries[digest]
+                    entry = None
+        if entry is not None:
+            self._check_age(entry[1], now)
+            return entry[2]
+
+        issued_at, payload = self._decode(token)
+        self._check_age(issued_at, now)
+        with self._lock:
+            self._entries[digest] = (now + self.cache_ttl, issued_at, payload)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.cache_size:
+                self._entries.popitem(last=False)
+        return payload
+
+    def validate_many(self, tokens: Iterable[Union[str, bytes]]) -> Dict:
+        """token -> ValidPayload, or the InvalidPayload it was rejected with"""
+        results = {}
+        for token in tokens:
+            if token in results:
+                continue
+            try:
+                results[token] = self.validate(token)
+            except InvalidPayload as e:
+                results[token] = e
+        return results
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _check_age(self, issued_at: int, now: float) -> None:
+        if self.max_age is not None and now - issued_at > self.max_age:
+            raise InvalidPayload("Token has expired.")
+
+    def _decode(self, token: Union[str, bytes]) -> Tuple[int, ValidPayload]:
+        try:
+            inner = base64.urlsafe_b64decode(token)
+            payload = json.loads(self.fernet.decrypt(inner))
+            # Authenticated by decrypt(): version byte, then the issue time as a 64-bit big-endian int
+            issued_at = int.from_bytes(base64.urlsafe_b64decode(inner)[1:9], "big")
+        except (InvalidToken, binascii.Error, ValueError, TypeError) as e:
+            raise InvalidPayload(f"Invalid token: {e or type(e).__name__}") from e
+
+        if not isinstance(payload, dict):
+            raise InvalidPayload("Payload is not a valid JSON object.")
+        if payload.keys() != PAYLOAD_KEYS:
+            missing = PAYLOAD_KEYS - payload.keys()
+            raise InvalidPayload(f"Missing key: {min(missing)}" if missing else "Unexpected keys in payload.")
+        if not isinstance(payload["timestamp"], str):
+            raise InvalidPayload("`timestamp` must be a string.")
+        return issued_at, ValidPayload(**payload)
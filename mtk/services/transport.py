@@ -0,0 +1,247 @@
+"""
+HTTP transport to the Mtk middleware: one pooled keep-alive session per base URL,
+connect/read timeouts, bounded retries with jittered backoff and a circuit breaker,
+plus an asyncio variant sharing the same pool and breaker.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+RETRY_STATUSES = frozenset({502, 503, 504})
+
+
+def transport_settings() -> Dict:
+    from django.conf import settings
+
+    defaults = {
+        "API_KEY": "",
+        "CONNECT_TIMEOUT": 3.05,
+        "READ_TIMEOUT": 30,
+        # Extra attempts after the first one
+        "RETRIES": 2,
+        # Full-jitter exponential backoff: uniform(0, min(BACKOFF_MAX, BACKOFF * 2 ** attempt))
+        "BACKOFF": 0.5,
+        "BACKOFF_MAX": 5,
+        # Keep-alive connections kept open to the middleware
+        "POOL_SIZE": 10,
+        # Consecutive failures that open the breaker, and seconds before a trial call
+        "BREAKER_THRESHOLD": 5,
+        "BREAKER_RESET": 30,
+    }
+    return {**defaults, **getattr(settings, "MTK_TRANSPORT", {})}
+
+
+class NetWokException(Exception):
+    """Any failure talking to the Mtk middleware"""
+    # Whether the request may have reached the middleware (and been applied)
+    sent = False
+
+
+class MtkConnectionError(NetWokException):
+    def __init__(self, message: str, sent: bool = True):
+        super().__init__(message)
+        self.sent = sent
+
+
+class MtkTimeout(NetWokException):
+    def __init__(self, message: str, sent: bool = True):
+        super().__init__(message)
+        self.sent = sent
+
+
+class MtkUnavailable(NetWokException):
+    """The circuit breaker is open: the middleware failed repeatedly and is not being called"""
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects calls for `reset_timeout`
+    seconds, then lets a single trial call through (half-open): its success closes the
+    breaker, its failure opens it again.
+    """
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> None:
+        """Raise MtkUnavailable unless a call may go through now"""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half-open" and not self._trial:
+                self._trial = True
+                return
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+            raise MtkUnavailable(f"Mtk middleware unavailable, retrying in {retry_in:.0f}s")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures, self.opened_at, self._trial = 0, None, False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                if self.opened_at is None or self._trial:
+                    logger.warning("Mtk circuit breaker opened after %s failures", self.failures)
+                self.opened_at, self._trial = time.monotonic(), False
+
+
+def never_sent(error: requests.RequestException) -> bool:
+    """
+    Whether `error` happened before a connection was established, so the server cannot have
+    seen the request. A reset, a dropped keep-alive or a truncated body may follow a request
+    the server already applied.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError) or isinstance(error, requests.exceptions.SSLError):
+        return False
+    reason = error.args[0] if error.args else None
+    # requests wraps urllib3's MaxRetryError, whose reason is the underlying failure
+    reason = getattr(reason, "reason", reason)
+    return isinstance(reason, (NewConnectionError, ConnectionRefusedError))
+
+
+class MtkTransport:
+    """
+    Synchronous transport. Retries failures to connect for every method (the request never
+    reached the server), and other connection errors, timeouts or 502/503/504 only for
+    idempotent methods so a POST that may have been applied is not sent twice.
+    """
+
+    def __init__(self, base_url: str, api_key: Optional[str] = None, **options):
+        self.base_url = base_url.rstrip("/")
+        self.options = {**transport_settings(), **options}
+        if api_key is not None:
+            self.options["API_KEY"] = api_key
+        self.breaker = CircuitBreaker(self.options["BREAKER_THRESHOLD"], self.options["BREAKER_RESET"])
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.options["POOL_SIZE"], max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "User-Agent": "F2Net/1.0 (https://f2net.fronttocodelabs.com)",
+            "x-api-key": self.options["API_KEY"],
+        })
+
+    def url(self, endpoint: str) -> str:
+        return f"{self.base_url}/api/{endpoint.lstrip('/')}"
+
+    @property
+    def timeout(self):
+        return self.options["CONNECT_TIMEOUT"], self.options["READ_TIMEOUT"]
+
+    def backoff(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        delay = random.uniform(0, min(self.options["BACKOFF_MAX"], self.options["BACKOFF"] * 2 ** attempt))
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), self.options["BACKOFF_MAX"]))
+        return delay
+
+    def send_once(self, method: str, endpoint: str, **kwargs) -> requests.Response:
+        """
+        One attempt through the breaker. Connection failures and timeouts raise; 5xx responses
+        are returned but count as breaker failures.
+        """
+        self.breaker.allow()
+        try:
+            response = self.session.request(method, self.url(endpoint), timeout=self.timeout, **kwargs)
+        except requests.Timeout as e:
+            self.breaker.record_failure()
+            # A connect timeout means nothing was sent; a read timeout may follow a processed request
+            raise MtkTimeout(f"Mtk middleware timed out: {e}", sent=isinstance(e, requests.ReadTimeout)) from e
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            raise MtkConnectionError(f"Network connection error: {e}", sent=not never_sent(e)) from e
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def should_retry(self, method: str, attempt: int, error: Optional[Exception] = None,
+                     response: Optional[requests.Response] = None) -> bool:
+        if attempt >= self.options["RETRIES"] or isinstance(error, MtkUnavailable):
+            return False
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        if error is not None:
+            return idempotent or not error.sent
+        return idempotent and response.status_code in RETRY_STATUSES
+
+    def request(self, method: str, endpoint: str, **kwargs) -> requests.Response:
+        """The final response (any status); NetWokException subclasses once retries are spent"""
+        attempt = 0
+        while True:
+            try:
+                response = self.send_once(method, endpoint, **kwargs)
+            except NetWokException as e:
+                if not self.should_retry(method, attempt, error=e):
+                    raise
+                delay = self.backoff(attempt)
+            else:
+                if not self.should_retry(method, attempt, response=response):
+                    return response
+                delay = self.backoff(attempt, response)
+                response.close()
+            logger.info("Retrying Mtk %s %s in %.2fs (attempt %s)", method, endpoint, delay, attempt + 2)
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncMtkTransport:
+    """
+    asyncio front of an MtkTransport for ASGI views: attempts run on worker threads over
+    the same keep-alive pool and circuit breaker, and backoff waits with asyncio.sleep so
+    the event loop is never blocked.
+    """
+
+    def __init__(self, transport: MtkTransport):
+        self.transport = transport
+
+    async def request(self, method: str, endpoint: str, **kwargs) -> requests.Response:
+        transport = self.transport
+        attempt = 0
+        while True:
+            try:
+                response = await asyncio.to_thread(transport.send_once, method, endpoint, **kwargs)
+            except NetWokException as e:
+                if not transport.should_retry(method, attempt, error=e):
+                    raise
+                delay = transport.backoff(attempt)
+            else:
+                if not transport.should_retry(method, attempt, response=response):
+                    return response
+                delay = transport.backoff(attempt, response)
+                response.close()
+            await asyncio.sleep(delay)
+            attempt += 1
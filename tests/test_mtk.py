@@ -1,37 +1,326 @@
+import asyncio
+import base64
+import json
+import os
+import socket
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-import requests
-
-from mtk.services import Mtk, MtkResponseObject, MtkPayload
-
-# Mtk.init(host="http://127.0.0.1:5001")
-
-
-# class MTKTests(unittest.TestCase):
-#     def test_provision_success(self):
-#         res: MtkResponseObject[MtkPayload] = Mtk.provision("MTK12")
-#         if res.error:
-#             self.assertFalse(res.success)
-#             self.assertNotIsInstance(res.payload, MtkPayload)
-#             self.assertNotIn("created successfully", res.message or "")
-#         else:
-#             self.assertTrue(res.success)
-#             self.assertIsInstance(res.payload, MtkPayload)
-#             self.assertEqual(res.payload.client_name, "MTK1")
-#             self.assertTrue(res.payload.certificate_created)
-#             self.assertTrue(res.payload.config_file_available)
-#             self.assertIsNotNone(res.payload.created_at)
-#             self.assertIn("created successfully", res.message or "")
-#
-#
-#     def test_provision_failure(self):
-#         res: MtkResponseObject[None] = Mtk.provision("")
-#         self.assertFalse(res.success)
-#         self.assertIsNone(res.payload)
-#         self.assertIsNotNone(res.error)
-
-
-# res = requests.get("http://127.0.0.1:5001/api/mikrotik/devices/MTK12/config", headers={"x-api-key": "your-django-api-key-for-authentication"})
-# print(res.text)
-# if __name__ == '__main__':
-    # unittest.main()
+import django
+from cryptography.fernet import Fernet
+from django.core.cache import cache
+from django.test import override_settings
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "internet_service_provider.settings")
+django.setup()
+
+from mtk.services import Mtk, MtkResponseObject, MtkPayload, NetworkService  # noqa: E402
+from mtk.services.info import ServerInfo  # noqa: E402
+from mtk.services.tokens import InvalidPayload, PayloadValidator  # noqa: E402
+from mtk.services.transport import (  # noqa: E402
+    MtkConnectionError, MtkTimeout, MtkTransport, MtkUnavailable, NetWokException
+)
+
+FAST = {"RETRIES": 2, "BACKOFF": 0, "BACKOFF_MAX": 0, "CONNECT_TIMEOUT": 1, "READ_TIMEOUT": 1}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers from StubServer.routes: (method, path) -> list of (status, body, delay), one per call"""
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"null")
+        key = (self.command, self.path)
+        self.server.hits.append((key, body, self.headers.get("x-api-key")))
+        responses = self.server.routes.get(key) or [(404, {"error": "Not found", "success": False}, 0)]
+        status, payload, delay = responses.pop(0) if len(responses) > 1 else responses[0]
+        if delay:
+            time.sleep(delay)
+        data = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = _respond
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.routes, self.hits, self.connections = {}, [], 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def route(self, method, path, *responses):
+        # (status, body) or (status, body, delay)
+        self.routes[(method, f"/api/{path}")] = [(*response, 0)[:3] for response in responses]
+
+
+class MtkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.transport = MtkTransport(self.server.url, api_key="secret", **FAST)
+        self.net = NetworkService(self.server.url, self.transport)
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TransportTests(MtkTestCase):
+    def test_keep_alive_connection_is_reused(self):
+        self.server.route("GET", "vpn/server/ip", (200, {"ip": "10.8.0.1"}))
+
+        for _ in range(5):
+            self.assertEqual(self.net.dispatch("vpn/server/ip", "GET"), {"ip": "10.8.0.1"})
+
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.server.hits[0][2], "secret")
+
+    def test_idempotent_requests_retry_server_errors(self):
+        self.server.route("GET", "vpn/server/ip", (503, {}), (502, {}), (200, {"ip": "10.8.0.1"}))
+
+        self.assertEqual(self.net.dispatch("vpn/server/ip", "GET"), {"ip": "10.8.0.1"})
+        self.assertEqual(len(self.server.hits), 3)
+
+    def test_posts_are_not_retried_once_sent(self):
+        self.server.route("POST", "vpn/clients/create", (503, {"error": "busy", "success": False}))
+
+        self.assertEqual(self.net.dispatch("vpn/clients/create", client_name="a")["error"], "busy")
+        self.assertEqual(len(self.server.hits), 1)
+
+    def test_read_timeout_raises_after_bounded_retries(self):
+        self.server.route("GET", "slow", (200, {}, 0.5))
+        transport = MtkTransport(self.server.url, **{**FAST, "READ_TIMEOUT": 0.1})
+
+        started = time.monotonic()
+        with self.assertRaises(MtkTimeout):
+            transport.request("GET", "slow")
+        self.assertLess(time.monotonic() - started, 1.2)
+        self.assertEqual(len(self.server.hits), 3)
+        transport.close()
+
+    def test_refused_connections_are_retried_for_posts(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        transport = MtkTransport(f"http://127.0.0.1:{port}", **FAST, BREAKER_THRESHOLD=10)
+
+        with self.assertRaises(MtkConnectionError):
+            transport.request("POST", "vpn/clients/create", json={})
+        self.assertEqual(transport.breaker.failures, 3)
+
+    def test_posts_are_not_retried_after_a_connection_reset(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+
+        def drop():
+            # Accept each connection, read the request, then close without answering
+            while True:
+                try:
+                    conn, _ = listener.accept()
+                except OSError:
+                    return
+                conn.recv(65536)
+                conn.close()
+
+        threading.Thread(target=drop, daemon=True).start()
+        transport = MtkTransport(f"http://127.0.0.1:{listener.getsockname()[1]}", **FAST, BREAKER_THRESHOLD=10)
+        try:
+            with self.assertRaises(MtkConnectionError) as raised:
+                transport.request("POST", "vpn/clients/create", json={})
+            self.assertTrue(raised.exception.sent)
+            self.assertEqual(transport.breaker.failures, 1)
+            with self.assertRaises(MtkConnectionError):
+                transport.request("GET", "vpn/server/ip")
+            self.assertEqual(transport.breaker.failures, 4)
+        finally:
+            transport.close()
+            listener.close()
+
+    def test_circuit_breaker_fails_fast_then_recovers(self):
+        self.server.route("GET", "vpn/server/ip", (500, {}), (500, {}), (200, {"ip": "10.8.0.1"}))
+        transport = MtkTransport(self.server.url, **{**FAST, "RETRIES": 0, "BREAKER_THRESHOLD": 2,
+                                                     "BREAKER_RESET": 0.2})
+
+        transport.request("GET", "vpn/server/ip")
+        transport.request("GET", "vpn/server/ip")
+        with self.assertRaises(MtkUnavailable):
+            transport.request("GET", "vpn/server/ip")
+        self.assertEqual(len(self.server.hits), 2)
+
+        time.sleep(0.25)
+        self.assertEqual(transport.request("GET", "vpn/server/ip").status_code, 200)
+        self.assertEqual(transport.breaker.state, "closed")
+        transport.close()
+
+    def test_async_dispatch(self):
+        self.server.route("GET", "mikrotik/devices/r1/config", (200, "/ip address print"))
+
+        async def fetch():
+            return await asyncio.gather(*(self.net.text.adispatch("mikrotik/devices/r1/config", "GET")
+                                          for _ in range(3)))
+
+        self.assertEqual(asyncio.run(fetch()), ["/ip address print"] * 3)
+        # The text view does not switch the shared service to text responses
+        self.assertEqual(self.net.config["response"], "json")
+
+    def test_stream_relays_the_body_and_rejects_errors(self):
+        self.server.route("GET", "mikrotik/devices/r1/config", (200, "client\n<ca></ca>"))
+
+        res = self.net.stream("mikrotik/devices/r1/config")
+        self.assertEqual(b"".join(res.iter_content(4)), b"client\n<ca></ca>")
+        res.close()
+        with self.assertRaises(NetWokException):
+            self.net.stream("mikrotik/devices/r2/config")
+
+
+class ServerInfoTests(MtkTestCase):
+    def setUp(self):
+        super().setUp()
+        self.override = override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+        self.override.enable()
+        cache.clear()
+
+    def tearDown(self):
+        self.override.disable()
+        super().tearDown()
+
+    def test_init_does_no_network_io_and_first_use_fetches(self):
+        self.server.route("GET", "vpn/server/ip", (200, {"ip": "10.8.0.1"}))
+
+        Mtk.init(host=self.server.url)
+        self.assertEqual(self.server.hits, [])
+        self.assertEqual(Mtk.server_ip(), "10.8.0.1")
+        self.assertEqual(Mtk.server_ip(), "10.8.0.1")
+        self.assertEqual(len(self.server.hits), 1)
+        Mtk.destroy()
+
+    def test_stale_value_is_served_while_refreshing_and_when_upstream_is_down(self):
+        self.server.route("GET", "vpn/server/ip", (200, {"ip": "10.8.0.1"}), (500, {}), (200, {"ip": "10.8.0.2"}))
+        transport = MtkTransport(self.server.url, **{**FAST, "RETRIES": 0})
+        info = ServerInfo(NetworkService(self.server.url, transport))
+        info.options["INFO_TTL"] = 0
+        self.assertEqual(info.get()["ip"], "10.8.0.1")
+
+        # Upstream fails: the last known value keeps being served
+        self.assertEqual(info.get()["ip"], "10.8.0.1")
+        self._wait_for_refresh(info)
+        self.assertEqual(info.get()["ip"], "10.8.0.1")
+        self._wait_for_refresh(info)
+        self.assertEqual(info.get()["ip"], "10.8.0.2")
+        transport.close()
+
+    def test_other_workers_start_from_the_shared_cache(self):
+        self.server.route("GET", "vpn/server/ip", (200, {"ip": "10.8.0.1"}))
+        ServerInfo(self.net).get()
+
+        self.assertEqual(ServerInfo(self.net).get()["ip"], "10.8.0.1")
+        self.assertEqual(len(self.server.hits), 1)
+
+    def _wait_for_refresh(self, info):
+        for _ in range(100):
+            if not info._refreshing:
+                return
+            time.sleep(0.01)
+
+
+class PayloadValidatorTests(unittest.TestCase):
+    def setUp(self):
+        self.fernet = Fernet(Fernet.generate_key())
+        self.validator = PayloadValidator(self.fernet, cache_size=2)
+
+    def token(self, payload, issued_at=None):
+        data = json.dumps(payload).encode()
+        encrypted = self.fernet.encrypt_at_time(data, issued_at) if issued_at else self.fernet.encrypt(data)
+        return base64.urlsafe_b64encode(encrypted).decode()
+
+    def test_verified_payloads_are_cached(self):
+        token = self.token({"mtk": 1, "auth": "abc", "timestamp": "0"})
+
+        first = self.validator.validate(token)
+        self.assertEqual((first.mtk, first.auth), (1, "abc"))
+        self.validator.fernet = None  # a cache hit must not decrypt again
+        self.assertIs(self.validator.validate(token), first)
+
+    def test_invalid_tokens(self):
+        cases = {
+            "not base64!": "Invalid token",
+            base64.urlsafe_b64encode(b"garbage").decode(): "Invalid token",
+            self.token({"mtk": 1, "auth": "abc"}): "Missing key: timestamp",
+            self.token({"mtk": 1, "auth": "abc", "timestamp": 0}): "`timestamp` must be a string.",
+        }
+        for token, message in cases.items():
+            with self.subTest(token=token), self.assertRaisesRegex(InvalidPayload, message):
+                self.validator.validate(token)
+
+    def test_max_age_applies_to_cached_payloads(self):
+        token = self.token({"mtk": 1, "auth": "abc", "timestamp": "0"}, issued_at=int(time.time()) - 60)
+        self.validator.validate(token)
+
+        self.validator.max_age = 30
+        with self.assertRaisesRegex(InvalidPayload, "expired"):
+            self.validator.validate(token)
+
+    def test_validate_many(self):
+        good = self.token({"mtk": 1, "auth": "abc", "timestamp": "0"})
+
+        results = self.validator.validate_many([good, "bad", good])
+        self.assertEqual(results[good].auth, "abc")
+        self.assertIsInstance(results["bad"], InvalidPayload)
+        self.assertEqual(len(results), 2)
+
+
+class MTKTests(MtkTestCase):
+    def setUp(self):
+        super().setUp()
+        Mtk.init(host=self.server.url)
+
+    def tearDown(self):
+        Mtk.destroy()
+        super().tearDown()
+
+    def test_provision_success(self):
+        self.server.route("POST", "vpn/clients/create", (200, {
+            "certificate_created": True, "client_name": "MTK12", "config_file_available": True,
+            "created_at": "2025-06-27T20:19:37.904189", "message": 'VPN client "MTK12" created successfully',
+            "success": True,
+        }))
+
+        res: MtkResponseObject[MtkPayload] = Mtk.provision("MTK12")
+        self.assertTrue(res.success)
+        self.assertIsInstance(res.payload, MtkPayload)
+        self.assertEqual(res.payload.client_name, "MTK12")
+        self.assertTrue(res.payload.certificate_created)
+        self.assertIn("created successfully", res.message or "")
+
+    def test_provision_failure(self):
+        self.server.route("POST", "vpn/clients/create", (500, {"error": "Internal server error", "success": False}))
+
+        res: MtkResponseObject[None] = Mtk.provision("")
+        self.assertFalse(res.success)
+        self.assertIsNone(res.payload)
+        self.assertIsNotNone(res.error)
+
+
+if __name__ == '__main__':
+    unittest.main()